@@ -0,0 +1,569 @@
+"""
+股票提醒规则
+用户规则（如 "NVDA 1h: BullishTrendRating+BullishOscRating > 8 and PMA Strong Bullish"）编译成
+信号字段上的谓词函数，按 (股票代码, 时间框架) 和引用的字段建索引。每条TradingView数据入库时，
+只对输入字段发生变化的规则求值，规则从不满足变为满足时触发一次提醒
+"""
+
+import logging
+import os
+import re
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from alert_subscriptions import ALL_TIMEFRAMES, SYMBOL_PATTERN, normalize_timeframe
+from db_executor import db_executor
+from models import AlertRule, get_db_session
+
+# 可在规则中引用的信号字段（与TradingView数据中的字段名一致，extras中的字段直接使用子字段名）
+SIGNAL_FIELDS = (
+    'BullishOscRating', 'BullishTrendRating', 'BearishOscRating', 'BearishTrendRating',
+    'choppiness', 'adxValue', 'MAtrend', 'MAtrend_timeframe1', 'MAtrend_timeframe2',
+    'TrendTracersignal', 'TrendTracerHTF', 'trend_change_volatility_stop',
+    'pmaText', 'CVDsignal', 'RSIHAsignal', 'BBPsignal', 'SQZsignal', 'MOMOsignal', 'AIbandsignal',
+    'HTFwave_signal', 'Middle_smooth_trend', 'center_trend', 'choppingrange_signal',
+    'ewotrend_state', 'rsi_state_trend', 'wavemarket_state',
+    'action', 'sentiment', 'quantity', 'oscrating', 'trendrating', 'risk', 'indicator'
+)
+# 小写字段名 -> 显示用字段名
+FIELD_NAMES = {name.lower(): name for name in SIGNAL_FIELDS}
+
+# 可以直接写状态值的字段（如 "PMA Strong Bullish" 等价于 pmaText == "PMA Strong Bullish"）
+STATE_PHRASES = {
+    'pmatext': ('PMA Strong Bullish', 'PMA Bullish', 'PMA Trendless', 'PMA Strong Bearish', 'PMA Bearish'),
+    'cvdsignal': ('cvdAboveMA', 'cvdBelowMA'),
+    'rsihasignal': ('BullishHA', 'BearishHA'),
+    'bbpsignal': ('bullpower', 'bearpower'),
+    'momosignal': ('bullishmomo', 'bearishmomo'),
+    'aibandsignal': ('green uptrend', 'red downtrend'),
+}
+_STATE_FIELD = {value.lower(): field for field, values in STATE_PHRASES.items() for value in values}
+# 长的短语优先匹配（"PMA Strong Bullish" 先于 "PMA Bullish"）
+_STATE_PATTERN = re.compile(
+    r'(?<![\w"\'])(' + '|'.join(re.escape(value) for value in sorted(_STATE_FIELD, key=len, reverse=True)) + r')(?![\w"\'])',
+    re.IGNORECASE
+)
+
+MAX_EXPRESSION_LENGTH = 300
+
+_TOKEN_PATTERN = re.compile(r"""
+    \s*(?:
+        (?P<number>\d+(?:\.\d+)?)
+      | (?P<string>"[^"]*"|'[^']*')
+      | (?P<op>>=|<=|==|!=|>|<|=|\+|-|\(|\)|&&|\|\|)
+      | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+    )""", re.VERBOSE)
+
+_COMPARATORS = {
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '==': lambda a, b: a == b,
+    '=': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+}
+
+
+def decode_signal_fields(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    TradingView数据 -> 规则使用的字段值（小写字段名；数值转为float，文本转为小写）
+    extras中的字段（oscrating、trendrating、risk等）展开到顶层
+    """
+    fields = {}
+    sources = [payload]
+    if isinstance(payload.get('extras'), dict):
+        sources.append(payload['extras'])
+    for source in sources:
+        for key, value in source.items():
+            name = key.lower()
+            if name not in FIELD_NAMES or value is None or isinstance(value, (dict, list)):
+                continue
+            if isinstance(value, bool):
+                value = float(value)
+            elif isinstance(value, (int, float)):
+                value = float(value)
+            else:
+                text = str(value).strip()
+                try:
+                    value = float(text)
+                except ValueError:
+                    value = text.lower()
+            fields[name] = value
+    return fields
+
+
+class RuleSyntaxError(ValueError):
+    """规则表达式格式错误"""
+
+
+def tokenize_expression(expression: str) -> List[Tuple[str, str]]:
+    """
+    条件表达式分词（规则和选股共用）
+
+    Returns:
+        [(类型, 值)]，类型为 number/string/op/name；and/or/not 以及 &&/|| 统一为 op 类型的 and/or/not
+    """
+    # 状态短语替换为字段比较
+    expression = _STATE_PATTERN.sub(
+        lambda match: f'{_STATE_FIELD[match.group(1).lower()]} == "{match.group(1)}"', expression
+    )
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = _TOKEN_PATTERN.match(expression, position)
+        if not match:
+            raise RuleSyntaxError(f"无法识别的内容: {expression[position:].strip()[:20]}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'name' and value.lower() in ('and', 'or', 'not'):
+            kind, value = 'op', value.lower()
+        elif kind == 'op':
+            value = {'&&': 'and', '||': 'or'}.get(value, value)
+        tokens.append((kind, value))
+        position = match.end()
+    return tokens
+
+
+class _Parser:
+    """
+    规则表达式解析器，直接生成闭包:
+        expr       := and_expr (('or' | '||') and_expr)*
+        and_expr   := not_expr (('and' | '&&') not_expr)*
+        not_expr   := 'not' not_expr | '(' expr ')' | comparison
+        comparison := sum 比较运算符 (sum | 字符串)
+        sum        := term (('+' | '-') term)*
+        term       := ['-'] 数字 | 字段名
+    """
+
+    def __init__(self, expression: str):
+        self.tokens = tokenize_expression(expression)
+        self.position = 0
+        self.fields: Set[str] = set()
+
+    def parse(self) -> Callable[[Dict[str, Any]], bool]:
+        if not self.tokens:
+            raise RuleSyntaxError("规则条件为空")
+        predicate = self._expr()
+        if self.position < len(self.tokens):
+            raise RuleSyntaxError(f"多余的内容: {self.tokens[self.position][1]}")
+        return predicate
+
+    def _peek(self) -> Optional[Tuple[str, str]]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _accept(self, *values: str) -> Optional[str]:
+        token = self._peek()
+        if token and token[0] == 'op' and token[1] in values:
+            self.position += 1
+            return token[1]
+        return None
+
+    def _expr(self):
+        parts = [self._and_expr()]
+        while self._accept('or'):
+            parts.append(self._and_expr())
+        if len(parts) == 1:
+            return parts[0]
+        return lambda fields: any(part(fields) for part in parts)
+
+    def _and_expr(self):
+        parts = [self._not_expr()]
+        while self._accept('and'):
+            parts.append(self._not_expr())
+        if len(parts) == 1:
+            return parts[0]
+        return lambda fields: all(part(fields) for part in parts)
+
+    def _not_expr(self):
+        if self._accept('not'):
+            inner = self._not_expr()
+            return lambda fields: not inner(fields)
+        if self._accept('('):
+            inner = self._expr()
+            if not self._accept(')'):
+                raise RuleSyntaxError("缺少右括号")
+            return inner
+        return self._comparison()
+
+    def _comparison(self):
+        left = self._sum()
+        operator = self._accept(*_COMPARATORS)
+        if operator is None:
+            token = self._peek()
+            raise RuleSyntaxError(f"缺少比较运算符（> >= < <= == !=）: {token[1] if token else '结尾'}")
+        compare = _COMPARATORS[operator]
+
+        token = self._peek()
+        if token and token[0] == 'string':
+            self.position += 1
+            if operator not in ('==', '=', '!='):
+                raise RuleSyntaxError(f"文本只能用 == 或 != 比较: {token[1]}")
+            text = token[1][1:-1].strip().lower()
+            return lambda fields: (lambda value: value is not None and compare(value, text))(left(fields))
+
+        right = self._sum()
+
+        def comparison(fields):
+            a = left(fields)
+            b = right(fields)
+            if a is None or b is None or isinstance(a, str) != isinstance(b, str):
+                return False
+            return compare(a, b)
+        return comparison
+
+    def _sum(self):
+        terms = [(1, self._term())]
+        while True:
+            operator = self._accept('+', '-')
+            if operator is None:
+                break
+            terms.append((1 if operator == '+' else -1, self._term()))
+        if len(terms) == 1:
+            return terms[0][1]
+
+        def total(fields):
+            result = 0.0
+            for sign, term in terms:
+                value = term(fields)
+                if not isinstance(value, float):
+                    return None
+                result += sign * value
+            return result
+        return total
+
+    def _term(self):
+        token = self._peek()
+        if token is None:
+            raise RuleSyntaxError("条件不完整")
+        kind, value = token
+        self.position += 1
+        if (kind, value) == ('op', '-') and self._peek() and self._peek()[0] == 'number':
+            number = -float(self._peek()[1])
+            self.position += 1
+            return lambda fields: number
+        if kind == 'number':
+            number = float(value)
+            return lambda fields: number
+        if kind == 'name':
+            name = value.lower()
+            if name not in FIELD_NAMES:
+                raise RuleSyntaxError(f"未知字段: {value}")
+            self.fields.add(name)
+            return lambda fields: fields.get(name)
+        raise RuleSyntaxError(f"此处应为字段名或数字: {value}")
+
+
+def compile_rule(expression: str) -> Tuple[Callable[[Dict[str, Any]], bool], Set[str]]:
+    """
+    编译规则表达式
+
+    Returns:
+        (谓词函数, 引用的字段集合)
+
+    Raises:
+        RuleSyntaxError: 表达式格式错误
+    """
+    if len(expression) > MAX_EXPRESSION_LENGTH:
+        raise RuleSyntaxError(f"规则条件过长（最多 {MAX_EXPRESSION_LENGTH} 个字符）")
+    parser = _Parser(expression)
+    predicate = parser.parse()
+    if not parser.fields:
+        raise RuleSyntaxError("规则条件至少需要引用一个信号字段")
+    return predicate, parser.fields
+
+
+def parse_rule_command(text: str) -> Tuple[str, str, str]:
+    """
+    解析规则命令参数: <代码> [时间框架|all][:] <条件>
+    未指定时间框架表示所有时间框架
+
+    Returns:
+        (股票代码, 时间框架, 条件表达式)
+
+    Raises:
+        ValueError: 参数格式错误
+    """
+    head, colon, tail = text.partition(':')
+    tokens = head.split() if colon else text.split()
+    if not tokens:
+        raise ValueError("请指定股票代码")
+    symbol = tokens[0].upper()
+    if not SYMBOL_PATTERN.match(symbol):
+        raise ValueError(f"无效的股票代码: {tokens[0]}")
+
+    timeframe = ALL_TIMEFRAMES
+    rest = tokens[1:]
+    if rest and normalize_timeframe(rest[0]) is not None:
+        timeframe = normalize_timeframe(rest[0])
+        rest = rest[1:]
+    if colon:
+        if rest:
+            raise ValueError(f"无法识别的参数: {' '.join(rest)}")
+        expression = tail.strip()
+    else:
+        expression = ' '.join(rest)
+    if not expression:
+        raise ValueError("请指定规则条件")
+    return symbol, timeframe, expression
+
+
+class CompiledRule:
+    """编译后的规则"""
+
+    __slots__ = ('rule_id', 'user_id', 'symbol', 'timeframe', 'expression', 'predicate', 'fields', 'last_results')
+
+    def __init__(self, rule_id: int, user_id: str, symbol: str, timeframe: str, expression: str):
+        self.rule_id = rule_id
+        self.user_id = user_id
+        self.symbol = symbol
+        self.timeframe = timeframe
+        self.expression = expression
+        self.predicate, self.fields = compile_rule(expression)
+        # 时间框架 -> 上次求值结果（用于只在从不满足变为满足时触发）
+        self.last_results: Dict[str, bool] = {}
+
+
+class RuleEngine:
+    """
+    规则索引和求值（只在事件循环线程中使用）
+    索引: (股票代码, 时间框架) -> 字段名 -> 规则ID集合
+    """
+
+    def __init__(self):
+        self.rules: Dict[int, CompiledRule] = {}
+        self._index: Dict[Tuple[str, str], Dict[str, Set[int]]] = {}
+        self._symbols: Dict[str, int] = {}
+        # (股票代码, 时间框架) -> 最近的字段值（只记录有规则的股票）
+        self._state: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+        # 统计
+        self.alerts_seen = 0
+        self.alerts_indexed = 0
+        self.rules_evaluated = 0
+        self.rules_triggered = 0
+        self.eval_seconds = 0.0
+
+    def add(self, rule: CompiledRule):
+        if rule.rule_id in self.rules:
+            self.remove(rule.rule_id)
+        self.rules[rule.rule_id] = rule
+        by_field = self._index.setdefault((rule.symbol, rule.timeframe), {})
+        for name in rule.fields:
+            by_field.setdefault(name, set()).add(rule.rule_id)
+        self._symbols[rule.symbol] = self._symbols.get(rule.symbol, 0) + 1
+
+    def remove(self, rule_id: int) -> Optional[CompiledRule]:
+        rule = self.rules.pop(rule_id, None)
+        if rule is None:
+            return None
+        key = (rule.symbol, rule.timeframe)
+        by_field = self._index.get(key, {})
+        for name in rule.fields:
+            ids = by_field.get(name)
+            if ids is not None:
+                ids.discard(rule_id)
+                if not ids:
+                    del by_field[name]
+        if not by_field:
+            self._index.pop(key, None)
+        self._symbols[rule.symbol] -= 1
+        if not self._symbols[rule.symbol]:
+            del self._symbols[rule.symbol]
+            for state_key in [k for k in self._state if k[0] == rule.symbol]:
+                del self._state[state_key]
+        return rule
+
+    def evaluate(self, payload: Dict[str, Any], symbol: str, timeframe: str) -> List[Tuple[CompiledRule, Dict[str, Any]]]:
+        """
+        一条数据入库后调用：更新字段值，只对输入发生变化的规则求值
+
+        Returns:
+            [(触发的规则, 当前字段值)]，只包含从不满足变为满足的规则
+        """
+        self.alerts_seen += 1
+        symbol = symbol.upper()
+        if symbol not in self._symbols:
+            return []
+        buckets = [b for b in (self._index.get((symbol, timeframe)), self._index.get((symbol, ALL_TIMEFRAMES))) if b]
+        if not buckets:
+            return []
+
+        started = time.perf_counter()
+        self.alerts_indexed += 1
+        fields = decode_signal_fields(payload)
+        state = self._state.setdefault((symbol, timeframe), {})
+        changed = [name for name, value in fields.items() if state.get(name) != value]
+        if not changed:
+            self.eval_seconds += time.perf_counter() - started
+            return []
+        state.update(fields)
+
+        candidates: Set[int] = set()
+        for by_field in buckets:
+            for name in changed:
+                ids = by_field.get(name)
+                if ids:
+                    candidates.update(ids)
+
+        triggered = []
+        for rule_id in candidates:
+            rule = self.rules[rule_id]
+            result = bool(rule.predicate(state))
+            if result and not rule.last_results.get(timeframe, False):
+                triggered.append((rule, state))
+            rule.last_results[timeframe] = result
+        self.rules_evaluated += len(candidates)
+        self.rules_triggered += len(triggered)
+        self.eval_seconds += time.perf_counter() - started
+        return triggered
+
+    def symbol_count(self) -> int:
+        return len(self._symbols)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'rules': len(self.rules),
+            'symbols': len(self._symbols),
+            'alerts_seen': self.alerts_seen,
+            'alerts_indexed': self.alerts_indexed,
+            'rules_evaluated': self.rules_evaluated,
+            'rules_triggered': self.rules_triggered,
+            'avg_rules_per_alert': round(self.rules_evaluated / self.alerts_indexed, 2) if self.alerts_indexed else 0,
+            'avg_eval_us': round(self.eval_seconds / self.alerts_indexed * 1e6, 1) if self.alerts_indexed else None
+        }
+
+
+class AlertRules:
+    """规则管理：数据库持久化 + 规则引擎"""
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.max_per_user = int(os.getenv('ALERT_MAX_RULES_PER_USER', '10'))
+        self.engine = RuleEngine()
+        self._by_user: Dict[str, Set[int]] = {}
+        self.loaded = False
+
+    # ---- 数据库（在db_executor线程中执行） ----
+
+    def _load_rows(self) -> List[Tuple[int, str, str, str, str]]:
+        db = get_db_session()
+        try:
+            return [tuple(row) for row in db.query(
+                AlertRule.id, AlertRule.user_id, AlertRule.symbol, AlertRule.timeframe, AlertRule.expression
+            ).all()]
+        finally:
+            db.close()
+
+    def _insert_row(self, user_id: str, username: str, symbol: str, timeframe: str, expression: str) -> int:
+        db = get_db_session()
+        try:
+            rule = AlertRule(user_id=user_id, username=username, symbol=symbol,
+                             timeframe=timeframe, expression=expression)
+            db.add(rule)
+            db.commit()
+            return rule.id
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _delete_row(self, user_id: str, rule_id: int) -> int:
+        db = get_db_session()
+        try:
+            deleted = db.query(AlertRule).filter(
+                AlertRule.id == rule_id, AlertRule.user_id == user_id
+            ).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    # ---- 对外接口（事件循环中调用） ----
+
+    async def load(self):
+        """从数据库加载全部规则并编译"""
+        rows = await db_executor.run(self._load_rows)
+        self.engine = RuleEngine()
+        self._by_user = {}
+        for rule_id, user_id, symbol, timeframe, expression in rows:
+            try:
+                self._register(CompiledRule(rule_id, user_id, symbol, timeframe, expression))
+            except RuleSyntaxError as e:
+                self.logger.warning(f"跳过无法编译的规则 #{rule_id}: {e}")
+        self.loaded = True
+        self.logger.info(f"已加载 {len(self.engine.rules)} 条提醒规则，涉及 {self.engine.symbol_count()} 个股票代码")
+
+    def _register(self, rule: CompiledRule):
+        self.engine.add(rule)
+        self._by_user.setdefault(rule.user_id, set()).add(rule.rule_id)
+
+    async def add(self, user_id: str, username: str, symbol: str, timeframe: str,
+                  expression: str) -> Tuple[Optional[CompiledRule], Optional[str]]:
+        """
+        添加规则（先编译校验再写入数据库）
+
+        Returns:
+            (规则, 错误信息)
+        """
+        try:
+            compile_rule(expression)
+        except RuleSyntaxError as e:
+            return None, str(e)
+        existing = self._by_user.get(user_id, set())
+        if len(existing) >= self.max_per_user:
+            return None, f"每位用户最多 {self.max_per_user} 条规则，当前已有 {len(existing)} 条"
+        rule_id = await db_executor.run(self._insert_row, user_id, username, symbol.upper(), timeframe, expression)
+        rule = CompiledRule(rule_id, user_id, symbol.upper(), timeframe, expression)
+        self._register(rule)
+        return rule, None
+
+    async def remove(self, user_id: str, rule_id: int) -> bool:
+        """删除自己的规则"""
+        if rule_id not in self._by_user.get(user_id, set()):
+            return False
+        await db_executor.run(self._delete_row, user_id, rule_id)
+        self.engine.remove(rule_id)
+        ids = self._by_user[user_id]
+        ids.discard(rule_id)
+        if not ids:
+            del self._by_user[user_id]
+        return True
+
+    def list_for_user(self, user_id: str) -> List[CompiledRule]:
+        return [self.engine.rules[rule_id] for rule_id in sorted(self._by_user.get(user_id, set()))]
+
+    def evaluate(self, payload: Dict[str, Any], symbol: str, timeframe: str) -> List[Dict[str, Any]]:
+        """入库路径调用：返回触发的规则对应的提醒事件（含收件人）"""
+        events = []
+        for rule, state in self.engine.evaluate(payload, symbol, timeframe):
+            values = ', '.join(
+                f"{FIELD_NAMES[name]}={format_value(state.get(name))}" for name in sorted(rule.fields)
+            )
+            events.append({
+                'event_type': 'rule',
+                'symbol': rule.symbol,
+                'timeframe': timeframe,
+                'recipients': {rule.user_id},
+                'text': f"📐 **{rule.symbol} {timeframe}** 规则 #{rule.rule_id} 已触发: `{rule.expression}`\n当前值: {values}",
+                'footer': f"使用 `!unrule {rule.rule_id}` 删除规则"
+            })
+        return events
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = self.engine.get_stats()
+        stats.update(loaded=self.loaded, users=len(self._by_user))
+        return stats
+
+
+def format_value(value: Any) -> str:
+    if value is None:
+        return '无'
+    if isinstance(value, float):
+        return f"{value:g}"
+    return str(value)
@@ -0,0 +1,514 @@
+"""
+股票提醒订阅
+用户订阅 (股票代码, 时间框架, 事件类型)，TradingView数据入库后按股票代码查内存索引找到订阅者，
+由后台分发任务限速并发地私信通知。入库路径只做一次字典查找和入队，不等待私信发送
+"""
+
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from db_executor import db_executor
+from models import AlertSubscription, get_db_session, upsert
+
+# 事件类型 -> 显示名称
+EVENT_TYPES = {
+    'trade': '新交易信号',
+    'close': '平仓信号',
+    'pma': 'PMA状态变化',
+    'state': '指标状态变化',
+}
+# 未指定事件类型时订阅的事件（state几乎每条信号都可能触发，需要显式订阅）
+DEFAULT_EVENT_TYPES = ('trade', 'close', 'pma')
+ALL_TIMEFRAMES = '*'
+
+TIMEFRAME_PATTERN = re.compile(r'^\d+[mhdw]$')
+
+
+def normalize_timeframe(value: str) -> Optional[str]:
+    """用户输入的时间框架 -> 与入库数据一致的格式（如 1H -> 1h），all/* 表示所有时间框架"""
+    value = value.strip().lower()
+    if value in ('all', '*', '全部'):
+        return ALL_TIMEFRAMES
+    return value if TIMEFRAME_PATTERN.match(value) else None
+
+
+SYMBOL_PATTERN = re.compile(r'^[A-Z0-9.:\-]{1,20}$')
+
+
+def parse_subscription_args(args: List[str]) -> Tuple[str, str, List[str]]:
+    """
+    解析订阅命令参数: <代码> [时间框架|all] [trade|close|pma|state ...]
+    未指定时间框架表示所有时间框架，未指定事件类型表示DEFAULT_EVENT_TYPES
+
+    Returns:
+        (股票代码, 时间框架, 事件类型列表)
+
+    Raises:
+        ValueError: 参数格式错误
+    """
+    if not args:
+        raise ValueError("请指定股票代码")
+    symbol = args[0].upper()
+    if not SYMBOL_PATTERN.match(symbol):
+        raise ValueError(f"无效的股票代码: {args[0]}")
+
+    timeframe = ALL_TIMEFRAMES
+    event_types = []
+    for token in args[1:]:
+        if token.lower() in EVENT_TYPES:
+            if token.lower() not in event_types:
+                event_types.append(token.lower())
+            continue
+        normalized = normalize_timeframe(token)
+        if normalized is None:
+            raise ValueError(f"无法识别的参数: {token}（时间框架如 15m/1h，事件类型: {'/'.join(EVENT_TYPES)}）")
+        timeframe = normalized
+    return symbol, timeframe, event_types or list(DEFAULT_EVENT_TYPES)
+
+
+class SubscriptionIndex:
+    """订阅索引：股票代码 -> (时间框架, 事件类型) -> 用户ID集合"""
+
+    def __init__(self):
+        self._by_symbol: Dict[str, Dict[Tuple[str, str], Set[str]]] = {}
+        self.size = 0
+
+    def add(self, user_id: str, symbol: str, timeframe: str, event_type: str) -> bool:
+        users = self._by_symbol.setdefault(symbol, {}).setdefault((timeframe, event_type), set())
+        if user_id in users:
+            return False
+        users.add(user_id)
+        self.size += 1
+        return True
+
+    def remove(self, user_id: str, symbol: str, timeframe: str, event_type: str):
+        keys = self._by_symbol.get(symbol)
+        users = keys.get((timeframe, event_type)) if keys else None
+        if users is None or user_id not in users:
+            return
+        users.discard(user_id)
+        self.size -= 1
+        if not users:
+            del keys[(timeframe, event_type)]
+            if not keys:
+                del self._by_symbol[symbol]
+
+    def has_symbol(self, symbol: str) -> bool:
+        return symbol in self._by_symbol
+
+    def resolve(self, symbol: str, timeframe: str, event_type: str) -> Set[str]:
+        """订阅了该事件的用户（精确时间框架 + 所有时间框架）"""
+        keys = self._by_symbol.get(symbol)
+        if not keys:
+            return set()
+        return keys.get((timeframe, event_type), set()) | keys.get((ALL_TIMEFRAMES, event_type), set())
+
+    def symbol_count(self) -> int:
+        return len(self._by_symbol)
+
+
+class AlertSubscriptions:
+    """订阅管理：数据库持久化 + 内存索引（索引只在事件循环线程中修改）"""
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.max_per_user = int(os.getenv('ALERT_MAX_SUBSCRIPTIONS_PER_USER', '20'))
+        self.index = SubscriptionIndex()
+        self._by_user: Dict[str, Set[Tuple[str, str, str]]] = {}
+        self.loaded = False
+
+    # ---- 数据库（在db_executor线程中执行） ----
+
+    def _load_rows(self) -> List[Tuple[str, str, str, str]]:
+        db = get_db_session()
+        try:
+            return [tuple(row) for row in db.query(
+                AlertSubscription.user_id, AlertSubscription.symbol,
+                AlertSubscription.timeframe, AlertSubscription.event_type
+            ).all()]
+        finally:
+            db.close()
+
+    def _insert_rows(self, user_id: str, username: str, keys: List[Tuple[str, str, str]]) -> int:
+        db = get_db_session()
+        try:
+            inserted = 0
+            for symbol, timeframe, event_type in keys:
+                inserted += upsert(db, AlertSubscription, {
+                    'user_id': user_id,
+                    'username': username,
+                    'symbol': symbol,
+                    'timeframe': timeframe,
+                    'event_type': event_type
+                }, conflict_columns=['user_id', 'symbol', 'timeframe', 'event_type'])
+            db.commit()
+            return inserted
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _delete_rows(self, user_id: str, keys: List[Tuple[str, str, str]]) -> int:
+        db = get_db_session()
+        try:
+            deleted = 0
+            for symbol, timeframe, event_type in keys:
+                deleted += db.query(AlertSubscription).filter(
+                    AlertSubscription.user_id == user_id,
+                    AlertSubscription.symbol == symbol,
+                    AlertSubscription.timeframe == timeframe,
+                    AlertSubscription.event_type == event_type
+                ).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    # ---- 对外接口（事件循环中调用） ----
+
+    async def load(self):
+        """从数据库加载全部订阅并构建索引"""
+        rows = await db_executor.run(self._load_rows)
+        self.index = SubscriptionIndex()
+        self._by_user = {}
+        for user_id, symbol, timeframe, event_type in rows:
+            self._index_add(user_id, (symbol, timeframe, event_type))
+        self.loaded = True
+        self.logger.info(f"已加载 {self.index.size} 条提醒订阅，涉及 {self.index.symbol_count()} 个股票代码")
+
+    def _index_add(self, user_id: str, key: Tuple[str, str, str]):
+        if self.index.add(user_id, *key):
+            self._by_user.setdefault(user_id, set()).add(key)
+
+    def _index_remove(self, user_id: str, key: Tuple[str, str, str]):
+        self.index.remove(user_id, *key)
+        keys = self._by_user.get(user_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[user_id]
+
+    async def subscribe(self, user_id: str, username: str, symbol: str, timeframe: str,
+                        event_types: List[str]) -> Tuple[int, Optional[str]]:
+        """
+        添加订阅
+
+        Returns:
+            (新增的订阅数, 错误信息)
+        """
+        existing = self._by_user.get(user_id, set())
+        keys = dict.fromkeys((symbol.upper(), timeframe, event_type) for event_type in event_types)
+        new_keys = [key for key in keys if key not in existing]
+        if len(existing) + len(new_keys) > self.max_per_user:
+            return 0, f"每位用户最多 {self.max_per_user} 条订阅，当前已有 {len(existing)} 条"
+        if new_keys:
+            await db_executor.run(self._insert_rows, user_id, username, new_keys)
+            for key in new_keys:
+                self._index_add(user_id, key)
+        return len(new_keys), None
+
+    async def unsubscribe(self, user_id: str, symbol: Optional[str] = None, timeframe: Optional[str] = None,
+                          event_types: Optional[List[str]] = None) -> int:
+        """取消订阅，未指定的条件表示全部；返回取消的订阅数"""
+        keys = [
+            key for key in self._by_user.get(user_id, set())
+            if (symbol is None or key[0] == symbol.upper())
+            and (timeframe is None or key[1] == timeframe)
+            and (event_types is None or key[2] in event_types)
+        ]
+        if keys:
+            await db_executor.run(self._delete_rows, user_id, keys)
+            for key in keys:
+                self._index_remove(user_id, key)
+        return len(keys)
+
+    def list_for_user(self, user_id: str) -> List[Tuple[str, str, str]]:
+        return sorted(self._by_user.get(user_id, set()))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'loaded': self.loaded,
+            'subscriptions': self.index.size,
+            'symbols': self.index.symbol_count(),
+            'users': len(self._by_user)
+        }
+
+
+def format_changes(changes: Dict[str, Tuple[Any, Any]], limit: int = 6) -> str:
+    """变化字段 -> 一行文字（用于私信）"""
+    parts = [f"{key}: {old if old is not None else '无'} → {new if new is not None else '无'}"
+             for key, (old, new) in list(changes.items())[:limit]]
+    if len(changes) > limit:
+        parts.append(f"等{len(changes)}项")
+    return '；'.join(parts)
+
+
+class PMAStateTracker:
+    """记录每个 (股票代码, 时间框架) 最近的PMA状态，用于检测状态变化"""
+
+    def __init__(self):
+        self._states: Dict[Tuple[str, str], str] = {}
+
+    def update(self, symbol: str, timeframe: str, state: Optional[str]) -> Optional[str]:
+        """
+        更新状态
+
+        Returns:
+            状态变化时返回之前的状态；首次出现或未变化时返回None
+        """
+        if not state:
+            return None
+        key = (symbol, timeframe)
+        previous = self._states.get(key)
+        self._states[key] = state
+        if previous is not None and previous != state:
+            return previous
+        return None
+
+
+class AlertFanout:
+    """提醒分发：入库路径入队，后台任务解析订阅者并限速并发私信"""
+
+    def __init__(self, subscriptions: AlertSubscriptions, send_dm: Callable[[str, str], Awaitable[None]],
+                 rules=None):
+        """
+        Args:
+            subscriptions: 订阅管理
+            send_dm: 私信发送函数 (用户ID, 内容)
+            rules: 提醒规则（alert_rules.AlertRules），触发的规则事件自带收件人
+        """
+        self.subscriptions = subscriptions
+        self.rules = rules
+        self.send_dm = send_dm
+        self.logger = logging.getLogger(__name__)
+        self.pma_tracker = PMAStateTracker()
+
+        self.concurrency = int(os.getenv('ALERT_DM_CONCURRENCY', '5'))
+        # Discord全局限制约50次请求/秒，私信分发只占用其中一部分
+        self.rate_per_second = float(os.getenv('ALERT_DM_PER_SECOND', '10'))
+        self.max_active_events = int(os.getenv('ALERT_MAX_ACTIVE_EVENTS', '4'))
+        self.queue_size = int(os.getenv('ALERT_QUEUE_SIZE', '1000'))
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._dispatcher = None
+        self._active: Set[asyncio.Task] = set()
+        self._dm_semaphore = None
+        self._event_semaphore = None
+        self._tokens = float(self.concurrency)
+        self._tokens_updated = time.monotonic()
+
+        # 统计
+        self.events_published = 0
+        self.events_dropped = 0
+        self.events_completed = 0
+        self.dms_sent = 0
+        self.dms_failed = 0
+        self.recent_events = deque(maxlen=50)
+
+    # ---- 入库路径 ----
+
+    def extract_events(self, payload: Dict[str, Any], data_type: str, symbol: str,
+                       timeframe: str, changes: Optional[Dict[str, Tuple[Any, Any]]] = None) -> List[Dict[str, Any]]:
+        """
+        从TradingView数据中提取可订阅的事件
+
+        Args:
+            changes: 信号相对上一条信号变化的分类字段（入库时由signal_deltas计算）
+        """
+        symbol = symbol.upper()
+        events = []
+        if data_type == 'trade':
+            action = str(payload.get('action', '')).upper()
+            details = []
+            take_profit = payload['takeProfit'].get('limitPrice') if isinstance(payload.get('takeProfit'), dict) else None
+            stop_loss = payload['stopLoss'].get('stopPrice') if isinstance(payload.get('stopLoss'), dict) else None
+            if take_profit is not None:
+                details.append(f"止盈 {take_profit}")
+            if stop_loss is not None:
+                details.append(f"止损 {stop_loss}")
+            text = f"🔔 **{symbol} {timeframe}** {EVENT_TYPES['trade']}: {action}"
+            if details:
+                text += f"（{'，'.join(details)}）"
+            events.append({'event_type': 'trade', 'text': text})
+        elif data_type == 'close':
+            action = str(payload.get('action', '')).upper()
+            events.append({'event_type': 'close', 'text': f"🔔 **{symbol} {timeframe}** {EVENT_TYPES['close']}: {action}"})
+        else:
+            state = payload.get('pmaText')
+            previous = self.pma_tracker.update(symbol, timeframe, state)
+            if previous is not None:
+                events.append({
+                    'event_type': 'pma',
+                    'text': f"🔔 **{symbol} {timeframe}** {EVENT_TYPES['pma']}: {previous} → {state}"
+                })
+            if changes:
+                events.append({
+                    'event_type': 'state',
+                    'text': f"🔔 **{symbol} {timeframe}** {EVENT_TYPES['state']}: {format_changes(changes)}"
+                })
+
+        for event in events:
+            event.update(symbol=symbol, timeframe=timeframe)
+        return events
+
+    def publish(self, payload: Dict[str, Any], data_type: str, symbol: str, timeframe: str,
+                changes: Optional[Dict[str, Tuple[Any, Any]]] = None) -> int:
+        """
+        入库后调用：提取事件并入队，立即返回（不等待私信）
+
+        Returns:
+            入队的事件数
+        """
+        if not symbol:
+            return 0
+        events = self.extract_events(payload, data_type, symbol, timeframe, changes)
+        if self.rules is not None:
+            events.extend(self.rules.evaluate(payload, symbol, timeframe))
+        queued = 0
+        for event in events:
+            if 'recipients' not in event and not self.subscriptions.index.has_symbol(event['symbol']):
+                continue
+            if self._queue is None:
+                continue
+            event['received_at'] = time.monotonic()
+            try:
+                self._queue.put_nowait(event)
+                self.events_published += 1
+                queued += 1
+            except asyncio.QueueFull:
+                self.events_dropped += 1
+                self.logger.warning(f"提醒队列已满，丢弃事件: {event['symbol']} {event['event_type']}")
+        return queued
+
+    # ---- 分发 ----
+
+    async def start(self):
+        """启动分发任务"""
+        if self._dispatcher is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._dm_semaphore = asyncio.Semaphore(self.concurrency)
+        self._event_semaphore = asyncio.Semaphore(self.max_active_events)
+        self._dispatcher = asyncio.create_task(self._dispatch_loop())
+        self.logger.info(f"提醒分发已启动: 并发 {self.concurrency}, 每秒最多 {self.rate_per_second:g} 条私信")
+
+    async def stop(self):
+        """停止分发任务"""
+        tasks = list(self._active)
+        if self._dispatcher is not None:
+            tasks.append(self._dispatcher)
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._dispatcher = None
+        self._active.clear()
+
+    async def _dispatch_loop(self):
+        """取出事件，每个事件一个分发任务（同时进行的事件数有上限）"""
+        while True:
+            try:
+                event = await self._queue.get()
+                await self._event_semaphore.acquire()
+                task = asyncio.create_task(self._fan_out(event))
+                self._active.add(task)
+                task.add_done_callback(self._on_event_done)
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                self.logger.error(f"提醒分发任务发生错误: {e}")
+
+    def _on_event_done(self, task: asyncio.Task):
+        self._active.discard(task)
+        self._event_semaphore.release()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(float(self.concurrency), self._tokens + (now - self._tokens_updated) * self.rate_per_second)
+        self._tokens_updated = now
+
+    async def _acquire_token(self):
+        """按每秒额度获取一次私信发送令牌"""
+        while True:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            await asyncio.sleep((1 - self._tokens) / self.rate_per_second)
+
+    async def _send_one(self, user_id: str, text: str, event: Dict[str, Any], record: Dict[str, Any]):
+        async with self._dm_semaphore:
+            await self._acquire_token()
+            try:
+                await self.send_dm(user_id, text)
+                self.dms_sent += 1
+                record['sent'] += 1
+                lag_ms = round((time.monotonic() - event['received_at']) * 1000, 1)
+                if record['first_dm_lag_ms'] is None:
+                    record['first_dm_lag_ms'] = lag_ms
+                record['last_dm_lag_ms'] = lag_ms
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.dms_failed += 1
+                record['failed'] += 1
+                self.logger.debug(f"提醒私信发送失败 {user_id}: {e}")
+
+    async def _fan_out(self, event: Dict[str, Any]):
+        """把一个事件私信给所有订阅者，记录分发延迟"""
+        recipients = event.get('recipients')
+        if recipients is None:
+            recipients = self.subscriptions.index.resolve(event['symbol'], event['timeframe'], event['event_type'])
+        record = {
+            'symbol': event['symbol'],
+            'timeframe': event['timeframe'],
+            'event_type': event['event_type'],
+            'recipients': len(recipients),
+            'sent': 0,
+            'failed': 0,
+            'queue_wait_ms': round((time.monotonic() - event['received_at']) * 1000, 1),
+            'first_dm_lag_ms': None,
+            'last_dm_lag_ms': None
+        }
+        text = event['text'] + "\n" + event.get('footer', "使用 `!unsubscribe` 取消订阅")
+        await asyncio.gather(*(self._send_one(user_id, text, event, record) for user_id in recipients))
+
+        self.events_completed += 1
+        self.recent_events.append(record)
+        self.logger.info(
+            f"📣 提醒分发完成: {event['symbol']} {event['timeframe']} {event['event_type']}, "
+            f"{record['sent']}/{len(recipients)} 条私信, 分发延迟 {record['last_dm_lag_ms']}ms"
+        )
+
+    # ---- 统计 ----
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取分发统计（含每个事件的分发延迟）"""
+        lags = sorted(record['last_dm_lag_ms'] for record in self.recent_events if record['last_dm_lag_ms'] is not None)
+        return {
+            'running': self._dispatcher is not None,
+            'subscriptions': self.subscriptions.get_stats(),
+            'rules': self.rules.get_stats() if self.rules is not None else None,
+            'queue_depth': self._queue.qsize() if self._queue else 0,
+            'active_events': len(self._active),
+            'events_published': self.events_published,
+            'events_dropped': self.events_dropped,
+            'events_completed': self.events_completed,
+            'dms_sent': self.dms_sent,
+            'dms_failed': self.dms_failed,
+            'fanout_lag_p50_ms': lags[len(lags) // 2] if lags else None,
+            'fanout_lag_max_ms': lags[-1] if lags else None,
+            'recent_events': list(self.recent_events)[-10:]
+        }
@@ -8,11 +8,20 @@ import asyncio
 import logging
 import json
 import aiohttp
-from aiohttp import web, ClientSession
+from aiohttp import web
 import discord
 from datetime import datetime
 import base64
 import io
+from db_executor import db_executor
+from http_client import http_client
+from image_pipeline import image_pipeline
+from loop_watchdog import loop_watchdog
+from screener import screener
+from alert_rules import RuleSyntaxError
+from signal_deltas import TRANSITION_FIELDS, get_signal_changes, signal_deltas
+from indicator_codes import get_state_distribution, get_state_history
+from ingest_spool import SpoolFull, ingest_spool
 
 class DiscordAPIServer:
     """Discord机器人API服务器"""
@@ -32,6 +41,11 @@ class DiscordAPIServer:
         self.app.router.add_post('/webhook-test/TV', self.tradingview_webhook_handler)
         self.app.router.add_post('/webhook/tradingview', self.tradingview_webhook_handler)
         self.app.router.add_get('/api/health', self.health_check)
+        self.app.router.add_get('/api/metrics', self.metrics_handler)
+        self.app.router.add_get('/api/screen', self.screen_handler)
+        self.app.router.add_get('/api/signals/changes', self.signal_changes_handler)
+        self.app.router.add_get('/api/signals/states', self.signal_states_handler)
+        self.app.router.add_get('/api/signals/states/distribution', self.state_distribution_handler)
         self.app.router.add_get('/', self.api_docs)
         
     async def api_docs(self, request):
@@ -66,6 +80,11 @@ class DiscordAPIServer:
 <ul>
 <li><code>GET /</code> - This API documentation</li>
 <li><code>GET /api/health</code> - Health check endpoint</li>
+<li><code>GET /api/metrics</code> - Runtime metrics (DB pool, DB executor)</li>
+<li><code>GET /api/screen?q=...&amp;timeframe=1h&amp;sort=BullishTrendRating</code> - Screen symbols by latest indicator states</li>
+<li><code>GET /api/signals/changes?symbol=NVDA&amp;timeframe=1h</code> - Indicator state transitions for a symbol/timeframe</li>
+<li><code>GET /api/signals/states?symbol=NVDA&amp;timeframe=1h&amp;columns=pma_state,ma_trend</code> - Indicator state history for a symbol/timeframe</li>
+<li><code>GET /api/signals/states/distribution?column=pma_state&amp;timeframe=1h</code> - Signal counts per indicator state</li>
 <li><code>POST /api/send-message</code> - Send channel message</li>
 <li><code>POST /api/send-dm</code> - Send direct message</li>
 <li><code>POST /api/send-chart</code> - Send stock chart (n8n workflow)</li>
@@ -124,12 +143,17 @@ class DiscordAPIServer:
                 self.logger.debug(f"Bot status check error during health check: {bot_error}")
                 bot_info['status'] = 'starting'
             
+            # 数据库状态（握手在后台进行，未就绪不影响健康检查结果）
+            from models import get_db_status
+            
             # 总是返回200状态，确保部署健康检查通过
             health_data = {
                 'status': 'healthy',
                 'service': 'discord-bot-api',
                 'api_server': 'running',
                 'bot': bot_info,
+                'database': get_db_status(),
+                'ingest_spool': ingest_spool.get_health(),
                 'port': 5000,
                 'timestamp': datetime.now().isoformat(),
                 'deployment': 'ok'
@@ -150,6 +174,145 @@ class DiscordAPIServer:
             }
             return web.json_response(fallback_response, status=200)
         
+    async def metrics_handler(self, request):
+        """运行时指标端点 - 连接池和数据库线程池状态"""
+        try:
+            from models import get_pool_metrics
+            
+            metrics = {
+                'db_pool': get_pool_metrics(),
+                'db_executor': db_executor.get_stats(),
+                'http_client': http_client.get_stats(),
+                'chart_cache': self.bot.chart_service.chart_cache.get_stats() if self.bot else None,
+                'chart_fetch': self.bot.chart_service.get_fetch_stats() if self.bot else None,
+                'chart_queue': self.bot.chart_service.render_queue.get_stats() if self.bot else None,
+                'chart_prefetch': self.bot.chart_prefetcher.get_stats() if self.bot else None,
+                'image_pipeline': image_pipeline.get_stats(),
+                'event_loop': loop_watchdog.get_stats(),
+                'guild_snapshots': self.bot.guild_snapshots.get_stats() if self.bot else None,
+                'webhook_outbox': self.bot.webhook_handler.outbox.get_stats() if self.bot else None,
+                'alert_fanout': self.bot.alert_fanout.get_stats() if self.bot else None,
+                'screener': screener.get_stats(),
+                'signal_deltas': signal_deltas.get_stats(),
+                'ingest_spool': ingest_spool.get_stats(),
+                'exchange_registry': self.bot.chart_service.exchange_registry.get_stats() if self.bot else None,
+                'timestamp': datetime.now().isoformat()
+            }
+            return web.json_response(metrics)
+            
+        except Exception as e:
+            self.logger.error(f'获取运行时指标失败: {e}')
+            return web.json_response({
+                'error': str(e)
+            }, status=500)
+        
+    async def screen_handler(self, request):
+        """
+        选股端点
+        参数: q=筛选条件, timeframe=时间框架, sort=排序字段（可用+连接）, order=asc/desc, limit=条数
+        """
+        try:
+            limit = min(int(request.query.get('limit', '50')), 500)
+            result = screener.screen(
+                request.query.get('q', ''),
+                timeframe=request.query.get('timeframe') or None,
+                sort_by=request.query.get('sort') or None,
+                ascending=request.query.get('order', 'desc').lower() == 'asc',
+                limit=limit
+            )
+            return web.json_response(result)
+        except (RuleSyntaxError, ValueError) as e:
+            return web.json_response({'error': str(e)}, status=400)
+        except Exception as e:
+            self.logger.error(f'选股查询失败: {e}')
+            return web.json_response({'error': str(e)}, status=500)
+    
+    async def signal_changes_handler(self, request):
+        """
+        信号状态变化历史
+        参数: symbol, timeframe, limit=最近的信号条数, fields=逗号分隔的字段（all表示所有字段，默认分类指标字段）
+        """
+        symbol = request.query.get('symbol')
+        timeframe = request.query.get('timeframe')
+        if not symbol or not timeframe:
+            return web.json_response({'error': 'Missing required parameters: symbol, timeframe'}, status=400)
+        try:
+            limit = min(int(request.query.get('limit', '200')), 2000)
+            fields = request.query.get('fields')
+            if fields == 'all':
+                fields = None
+            elif fields:
+                fields = [field.strip() for field in fields.split(',') if field.strip()]
+            else:
+                fields = TRANSITION_FIELDS
+            changes = await db_executor.run(get_signal_changes, symbol, timeframe, limit=limit, fields=fields)
+            return web.json_response({'symbol': symbol.upper(), 'timeframe': timeframe, 'changes': changes})
+        except ValueError as e:
+            return web.json_response({'error': str(e)}, status=400)
+        except Exception as e:
+            self.logger.error(f'查询信号变化失败: {e}')
+            return web.json_response({'error': str(e)}, status=500)
+    
+    @staticmethod
+    def _parse_since(value):
+        """since参数：ISO时间，带时区时转换为本地时间（与received_at一致）"""
+        if not value:
+            return None
+        since = datetime.fromisoformat(value)
+        if since.tzinfo:
+            since = since.astimezone().replace(tzinfo=None)
+        return since
+    
+    async def signal_states_handler(self, request):
+        """
+        指标状态历史（数据库端只读取状态列）
+        参数: symbol, timeframe, columns=逗号分隔的状态列（默认全部）, since=ISO时间, limit=最近的信号条数
+        """
+        symbol = request.query.get('symbol')
+        timeframe = request.query.get('timeframe')
+        if not symbol or not timeframe:
+            return web.json_response({'error': 'Missing required parameters: symbol, timeframe'}, status=400)
+        try:
+            limit = min(int(request.query.get('limit', '500')), 2000)
+            columns = [column.strip() for column in request.query.get('columns', '').split(',') if column.strip()]
+            since = self._parse_since(request.query.get('since'))
+            history = await db_executor.run(get_state_history, symbol, timeframe, columns=columns or None,
+                                            since=since, limit=limit)
+            return web.json_response({'symbol': symbol.upper(), 'timeframe': timeframe, 'history': history})
+        except ValueError as e:
+            return web.json_response({'error': str(e)}, status=400)
+        except Exception as e:
+            self.logger.error(f'查询指标状态历史失败: {e}')
+            return web.json_response({'error': str(e)}, status=500)
+    
+    async def state_distribution_handler(self, request):
+        """
+        指标状态分布（数据库端GROUP BY）
+        参数: column=状态列, timeframe, symbol, since=ISO时间（均可选，column除外）
+        """
+        column = request.query.get('column')
+        if not column:
+            return web.json_response({'error': 'Missing required parameter: column'}, status=400)
+        try:
+            timeframe = request.query.get('timeframe') or None
+            symbol = request.query.get('symbol') or None
+            since = self._parse_since(request.query.get('since'))
+            counts = await db_executor.run(get_state_distribution, column, timeframe=timeframe, since=since,
+                                           symbol=symbol)
+            distribution = [{'value': value, 'count': count}
+                            for value, count in sorted(counts.items(), key=lambda item: -item[1])]
+            return web.json_response({
+                'column': column,
+                'timeframe': timeframe,
+                'symbol': symbol.upper() if symbol else None,
+                'distribution': distribution
+            })
+        except ValueError as e:
+            return web.json_response({'error': str(e)}, status=400)
+        except Exception as e:
+            self.logger.error(f'查询指标状态分布失败: {e}')
+            return web.json_response({'error': str(e)}, status=500)
+    
     async def send_message_handler(self, request):
         """发送消息到指定频道"""
         try:
@@ -284,11 +447,11 @@ class DiscordAPIServer:
                             files.append(discord.File(io.BytesIO(image_data), filename=filename))
                         else:
                             # 从URL下载图片
-                            async with ClientSession() as session:
-                                async with session.get(url) as resp:
-                                    if resp.status == 200:
-                                        image_data = await resp.read()
-                                        files.append(discord.File(io.BytesIO(image_data), filename=filename))
+                            session = http_client.get_session()
+                            async with session.get(url, timeout=http_client.timeout('download')) as resp:
+                                if resp.status == 200:
+                                    image_data = await resp.read()
+                                    files.append(discord.File(io.BytesIO(image_data), filename=filename))
             
             # 发送消息
             if files:
@@ -315,6 +478,31 @@ class DiscordAPIServer:
                 'error': str(e)
             }, status=500)
     
+    async def process_tradingview_data(self, data) -> bool:
+        """把一条TradingView数据写入数据库，并更新选股索引、通知订阅者（直接入库和spool回放共用）"""
+        from tradingview_handler import TradingViewHandler
+        
+        tv_handler = TradingViewHandler()
+        success = await db_executor.run(tv_handler.store_enhanced_data, data)
+        if not success:
+            return False
+        
+        # 数据已入库：后续步骤失败只记录日志，不能让spool把已入库的数据移入死信（重放会重复写入）
+        try:
+            data_type = tv_handler._detect_data_type(data)
+            symbol, timeframe = tv_handler._extract_basic_info(data, data_type)
+            
+            # 更新选股索引（只有信号数据带指标状态，交易/平仓数据不建立选股行）
+            if data_type == 'signal':
+                screener.update(symbol, timeframe, data)
+            
+            # 通知订阅者（只入队，由后台任务私信）
+            if self.bot:
+                self.bot.alert_fanout.publish(data, data_type, symbol, timeframe, tv_handler.last_changes)
+        except Exception as e:
+            self.logger.error(f'TradingView数据已入库，但更新选股索引或通知订阅者失败: {e}')
+        return True
+    
     async def tradingview_webhook_handler(self, request):
         """处理TradingView webhook数据"""
         try:
@@ -325,15 +513,44 @@ class DiscordAPIServer:
             data = await request.json()
             self.logger.info(f"收到TradingView webhook数据: {data}")
             
-            # 创建处理器并使用增强版存储
+            # 校验数据（无效数据直接返回400，不写入spool）
             tv_handler = TradingViewHandler()
-            success = tv_handler.store_enhanced_data(data)
+            error = tv_handler.validate_payload(data)
+            if error:
+                return web.json_response({
+                    'status': 'error',
+                    'message': error,
+                    'timestamp': datetime.now().isoformat()
+                }, status=400)
+            
+            # 检测数据类型
+            data_type = tv_handler._detect_data_type(data)
+            symbol, timeframe = tv_handler._extract_basic_info(data, data_type)
+            
+            if ingest_spool.running:
+                # 写入本地spool（fsync）后立即响应，由回放任务按顺序入库
+                try:
+                    seq = await ingest_spool.append(data)
+                except SpoolFull as e:
+                    self.logger.warning(f"入库spool已满，拒绝TradingView数据: {e}")
+                    return web.json_response({
+                        'status': 'error',
+                        'message': str(e),
+                        'timestamp': datetime.now().isoformat()
+                    }, status=503)
+                return web.json_response({
+                    'status': 'success',
+                    'message': f'TradingView {data_type} 数据已接收，等待入库',
+                    'data_type': data_type,
+                    'symbol': symbol,
+                    'timeframe': timeframe,
+                    'spool_seq': seq,
+                    'timestamp': datetime.now().isoformat()
+                })
+            
+            success = await self.process_tradingview_data(data)
             
             if success:
-                # 检测数据类型并提供详细响应
-                data_type = tv_handler._detect_data_type(data)
-                symbol, timeframe = tv_handler._extract_basic_info(data, data_type)
-                
                 return web.json_response({
                     'status': 'success',
                     'message': f'TradingView {data_type} 数据已成功处理和存储',
@@ -359,6 +576,14 @@ class DiscordAPIServer:
             
     async def start_server(self, host='0.0.0.0', port=5000):
         """启动服务器"""
+        # 先打开入库spool（继续回放上次未入库的数据），打开失败时webhook直接写数据库
+        if ingest_spool.enabled:
+            from models import is_transient_db_error
+            try:
+                await ingest_spool.start(self.process_tradingview_data, is_transient=is_transient_db_error)
+            except Exception as e:
+                self.logger.error(f'入库spool启动失败，TradingView数据将直接写入数据库: {e}')
+        
         runner = web.AppRunner(self.app)
         await runner.setup()
         
@@ -371,5 +596,6 @@ class DiscordAPIServer:
         self.logger.info(f'  POST /api/send-dm - 发送私信')
         self.logger.info(f'  POST /api/send-chart - 发送图表 (n8n工作流)')
         self.logger.info(f'  GET  /api/health - 健康检查')
+        self.logger.info('  GET  /api/metrics - 运行时指标')
         
         return runner
\ No newline at end of file
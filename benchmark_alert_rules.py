@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+提醒规则引擎基准测试
+生成大量用户规则（默认10万条，分布在500个股票代码和多个时间框架上），模拟收盘时集中到达的
+TradingView信号（评级小幅变化、PMA状态偶尔变化、ADX/Choppiness每根K线都变），对比:
+  - 全量扫描: 每条数据对所有规则求值
+  - 按股票索引: 只对该股票/时间框架的规则求值
+  - 按字段索引（RuleEngine）: 只对输入字段发生变化的规则求值
+
+用法:
+    python benchmark_alert_rules.py [--rules 100000] [--symbols 500] [--alerts 20000]
+"""
+
+import argparse
+import random
+import time
+
+from alert_rules import CompiledRule, RuleEngine, decode_signal_fields
+
+TIMEFRAMES = ('15m', '1h', '4h')
+PMA_STATES = ('PMA Strong Bullish', 'PMA Bullish', 'PMA Trendless', 'PMA Bearish', 'PMA Strong Bearish')
+RULE_TEMPLATES = (
+    lambda r: f"BullishTrendRating+BullishOscRating > {r.randint(5, 9)} and PMA Strong Bullish",
+    lambda r: f"BearishTrendRating+BearishOscRating >= {r.randint(5, 9)}",
+    lambda r: f"PMA Strong Bearish or BearishOscRating > {r.randint(3, 5)}",
+    lambda r: f"BullishTrendRating >= {r.randint(3, 5)} and cvdAboveMA",
+    lambda r: "RSIHAsignal == 'BearishHA' and BBPsignal == 'bearpower'",
+    lambda r: f"adxValue > {r.randint(25, 50)} and BullishTrendRating > {r.randint(2, 4)}",
+    lambda r: f"choppiness < {r.randint(30, 40)}",
+)
+
+
+def make_rules(count: int, symbols, rng):
+    rules = []
+    for rule_id in range(1, count + 1):
+        symbol = rng.choice(symbols)
+        timeframe = rng.choice(TIMEFRAMES + ('*',))
+        expression = rng.choice(RULE_TEMPLATES)(rng)
+        rules.append(CompiledRule(rule_id, str(rule_id % 20000), symbol, timeframe, expression))
+    return rules
+
+
+def make_alerts(count: int, symbols, rng):
+    """每个 (股票, 时间框架) 的信号按随机游走变化"""
+    state = {}
+    alerts = []
+    for _ in range(count):
+        symbol, timeframe = rng.choice(symbols), rng.choice(TIMEFRAMES)
+        previous = state.get((symbol, timeframe))
+        if previous is None:
+            payload = {
+                'symbol': symbol, 'BullishOscRating': rng.randint(0, 5), 'BullishTrendRating': rng.randint(0, 5),
+                'BearishOscRating': rng.randint(0, 5), 'BearishTrendRating': rng.randint(0, 5),
+                'pmaText': rng.choice(PMA_STATES), 'CVDsignal': 'cvdAboveMA', 'RSIHAsignal': 'BullishHA',
+                'BBPsignal': 'bullpower'
+            }
+        else:
+            payload = dict(previous)
+            # 大多数K线评级不变或只变一项
+            if rng.random() < 0.4:
+                key = rng.choice(('BullishOscRating', 'BullishTrendRating', 'BearishOscRating', 'BearishTrendRating'))
+                payload[key] = min(5, max(0, payload[key] + rng.choice((-1, 1))))
+            if rng.random() < 0.1:
+                payload['pmaText'] = rng.choice(PMA_STATES)
+            if rng.random() < 0.1:
+                payload['CVDsignal'] = rng.choice(('cvdAboveMA', 'cvdBelowMA'))
+            if rng.random() < 0.1:
+                payload['RSIHAsignal'] = rng.choice(('BullishHA', 'BearishHA'))
+        payload['adxValue'] = f"{rng.uniform(10, 60):.2f}"
+        payload['choppiness'] = f"{rng.uniform(20, 80):.2f}"
+        state[(symbol, timeframe)] = payload
+        alerts.append((payload, symbol, timeframe))
+    return alerts
+
+
+def run_full_scan(rules, alerts):
+    """每条数据对所有规则求值（只测一小部分数据）"""
+    started = time.perf_counter()
+    for payload, symbol, timeframe in alerts:
+        fields = decode_signal_fields(payload)
+        for rule in rules:
+            if rule.symbol == symbol and rule.timeframe in (timeframe, '*'):
+                rule.predicate(fields)
+    return (time.perf_counter() - started) / len(alerts)
+
+
+def run_symbol_index(rules, alerts):
+    """按 (股票, 时间框架) 分组，每条数据对该组全部规则求值"""
+    groups = {}
+    for rule in rules:
+        groups.setdefault((rule.symbol, rule.timeframe), []).append(rule)
+    evaluated = 0
+    started = time.perf_counter()
+    for payload, symbol, timeframe in alerts:
+        fields = decode_signal_fields(payload)
+        for key in ((symbol, timeframe), (symbol, '*')):
+            for rule in groups.get(key, ()):
+                rule.predicate(fields)
+                evaluated += 1
+    return (time.perf_counter() - started) / len(alerts), evaluated / len(alerts)
+
+
+def run_engine(rules, alerts):
+    engine = RuleEngine()
+    started = time.perf_counter()
+    for rule in rules:
+        engine.add(rule)
+    index_seconds = time.perf_counter() - started
+
+    latencies = []
+    for payload, symbol, timeframe in alerts:
+        started = time.perf_counter()
+        engine.evaluate(payload, symbol, timeframe)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return engine, index_seconds, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="提醒规则引擎基准测试")
+    parser.add_argument('--rules', type=int, default=100000, help="规则数")
+    parser.add_argument('--symbols', type=int, default=500, help="股票代码数")
+    parser.add_argument('--alerts', type=int, default=20000, help="模拟的TradingView数据条数")
+    parser.add_argument('--scan-alerts', type=int, default=50, help="全量扫描测量的数据条数")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    symbols = [f"SYM{index:04d}" for index in range(args.symbols)]
+
+    started = time.perf_counter()
+    rules = make_rules(args.rules, symbols, rng)
+    compile_seconds = time.perf_counter() - started
+    alerts = make_alerts(args.alerts, symbols, rng)
+    print(f"规则 {args.rules:,} 条（编译 {compile_seconds:.2f}s），股票 {args.symbols}，数据 {args.alerts:,} 条")
+
+    scan = run_full_scan(rules, alerts[:args.scan_alerts])
+    by_symbol, per_alert = run_symbol_index(rules, alerts)
+    engine, index_seconds, latencies = run_engine(rules, alerts)
+    stats = engine.get_stats()
+    mean = sum(latencies) / len(latencies)
+
+    print(f"\n{'方式':<16}{'每条数据µs':>12}{'每秒数据条数':>14}{'每条求值规则数':>16}")
+    print(f"{'全量扫描':<16}{scan * 1e6:>12.1f}{1 / scan:>14,.0f}{args.rules:>16,}")
+    print(f"{'按股票索引':<16}{by_symbol * 1e6:>12.1f}{1 / by_symbol:>14,.0f}{per_alert:>16.1f}")
+    print(f"{'按字段索引':<16}{mean * 1e6:>12.1f}{1 / mean:>14,.0f}{stats['avg_rules_per_alert']:>16.1f}")
+
+    print(f"\n按字段索引: 建索引 {index_seconds:.2f}s, P50 {latencies[len(latencies) // 2] * 1e6:.1f}µs, "
+          f"P99 {latencies[int(len(latencies) * 0.99)] * 1e6:.1f}µs, 最大 {latencies[-1] * 1e6:.0f}µs, "
+          f"触发 {stats['rules_triggered']:,} 次")
+    burst = args.symbols * len(TIMEFRAMES)
+    print(f"收盘集中到达（{burst} 条数据）约 {burst * mean * 1000:.1f}ms，全量扫描约 {burst * scan:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
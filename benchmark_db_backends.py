@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+数据库后端吞吐量测量脚本
+在DATABASE_URL指定的后端（Postgres或SQLite嵌入式配置）上，用与db_executor相同的线程池
+并发执行三类典型负载，输出每秒操作数和延迟分位数
+
+负载:
+    chart    图表请求 - 限制检查 + 记录请求
+    webhook  TradingView webhook写入 - store_enhanced_data
+    report   报告读取 - get_latest_data
+
+用法:
+    DATABASE_URL=sqlite:///bench.db python benchmark_db_backends.py
+    DATABASE_URL=postgresql://... python benchmark_db_backends.py --ops 2000 --concurrency 1,8,32
+"""
+
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import models
+from models import create_tables, get_pool_metrics
+from rate_limiter import RateLimiter
+from tradingview_handler import TradingViewHandler
+
+SYMBOLS = ['AAPL', 'TSLA', 'NVDA', 'MSFT', 'AMZN', 'META', 'GOOGL', 'AMD']
+TIMEFRAMES = ['15m', '1h', '4h']
+
+
+def build_signal_payload(i: int) -> dict:
+    """构建一个signal类型的webhook负载"""
+    return {
+        'symbol': SYMBOLS[i % len(SYMBOLS)],
+        'CurrentTimeframe': TIMEFRAMES[i % len(TIMEFRAMES)],
+        'pmaText': 'PMA Strong Bullish',
+        'CVDsignal': 'cvdAboveMA',
+        'BullishOscRating': 70.0 + i % 10,
+        'BearishOscRating': 30.0,
+        'MAtrend': '1',
+        'SQZsignal': 'squeeze firing'
+    }
+
+
+def build_workloads(limiter: RateLimiter, handler: TradingViewHandler) -> dict:
+    """构建各类负载的单次操作函数"""
+    def chart(i: int):
+        user_id = f"bench_user_{i % 200}"
+        limiter.check_user_limit(user_id, f"BenchUser{i % 200}")
+        limiter.record_request(user_id, f"BenchUser{i % 200}")
+
+    def webhook(i: int):
+        handler.store_enhanced_data(build_signal_payload(i))
+
+    def report(i: int):
+        handler.get_latest_data(SYMBOLS[i % len(SYMBOLS)], TIMEFRAMES[i % len(TIMEFRAMES)])
+
+    return {'chart': chart, 'webhook': webhook, 'report': report}
+
+
+def run_workload(func, ops: int, concurrency: int) -> dict:
+    """并发执行ops次操作，返回吞吐量和延迟统计"""
+    latencies = []
+
+    def timed(i: int):
+        started = time.perf_counter()
+        func(i)
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bench-db') as pool:
+        list(pool.map(timed, range(ops)))
+    elapsed = time.perf_counter() - started
+
+    lat_ms = sorted(x * 1000 for x in latencies)
+    return {
+        'ops_per_sec': ops / elapsed,
+        'p50_ms': statistics.median(lat_ms),
+        'p99_ms': lat_ms[min(len(lat_ms) - 1, int(len(lat_ms) * 0.99))]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="数据库后端吞吐量测量")
+    parser.add_argument('--ops', type=int, default=1000, help='每个场景的操作次数')
+    parser.add_argument('--concurrency', default='1,4,8,16', help='并发线程数列表，逗号分隔')
+    parser.add_argument('--workloads', default='chart,webhook,report', help='要运行的负载')
+    args = parser.parse_args()
+
+    create_tables()
+    limiter = RateLimiter(daily_limit=10 ** 6)
+    limiter.refresh_exempt_cache("benchmark")
+    handler = TradingViewHandler()
+    workloads = build_workloads(limiter, handler)
+
+    # report负载需要先有数据
+    for i in range(len(SYMBOLS) * len(TIMEFRAMES)):
+        workloads['webhook'](i)
+
+    backend = 'SQLite (WAL)' if models.is_sqlite() else models.get_engine().dialect.name
+    print(f"=== 数据库后端吞吐量: {backend}, 每场景 {args.ops} 次操作 ===")
+    print(f"{'负载':<10}{'并发':>6}{'ops/s':>12}{'p50 ms':>10}{'p99 ms':>10}")
+
+    for name in args.workloads.split(','):
+        for concurrency in (int(c) for c in args.concurrency.split(',')):
+            result = run_workload(workloads[name], args.ops, concurrency)
+            print(f"{name:<10}{concurrency:>6}{result['ops_per_sec']:>12.0f}"
+                  f"{result['p50_ms']:>10.2f}{result['p99_ms']:>10.2f}")
+
+    metrics = get_pool_metrics()
+    print(f"\n连接池: 检出 {metrics['checkouts']} 次, 最大等待 {metrics['checkout_wait_max_ms']}ms, "
+          f"超时 {metrics['timeouts']} 次")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+数据库调用事件循环延迟测量脚本
+对比"在事件循环中直接执行同步数据库调用"与"通过db_executor线程池执行"时的事件循环延迟
+
+用法:
+    python benchmark_db_loop_lag.py                 # 使用模拟的数据库延迟（无需数据库）
+    python benchmark_db_loop_lag.py --real          # 使用DATABASE_URL执行真实的限制检查
+    python benchmark_db_loop_lag.py --latency 0.05 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from db_executor import DBExecutor
+
+
+async def measure_loop_lag(stop_event: asyncio.Event, samples: list, interval: float = 0.005):
+    """周期性休眠并记录实际唤醒时间与预期时间的差值"""
+    loop = asyncio.get_running_loop()
+    while not stop_event.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - expected))
+
+
+async def run_scenario(name: str, db_call, use_executor: bool, concurrency: int, rounds: int):
+    """运行单个场景并输出延迟统计"""
+    executor = DBExecutor(max_workers=8)
+    samples = []
+    stop_event = asyncio.Event()
+    probe = asyncio.create_task(measure_loop_lag(stop_event, samples))
+
+    async def handler(i: int):
+        for _ in range(rounds):
+            if use_executor:
+                await executor.run(db_call, i)
+            else:
+                db_call(i)
+            await asyncio.sleep(0)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(handler(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    stop_event.set()
+    await probe
+    executor.shutdown()
+
+    lags_ms = sorted(s * 1000 for s in samples) or [0.0]
+    p99 = lags_ms[min(len(lags_ms) - 1, int(len(lags_ms) * 0.99))]
+    print(f"{name:<28} 总耗时 {elapsed:7.2f}s | 探针样本 {len(lags_ms):5d} | "
+          f"平均延迟 {statistics.mean(lags_ms):8.2f}ms | p99 {p99:8.2f}ms | 最大 {lags_ms[-1]:8.2f}ms")
+
+
+def build_db_call(real: bool, latency: float):
+    """构建数据库调用：真实限制检查或模拟延迟"""
+    if real:
+        from rate_limiter import RateLimiter
+        limiter = RateLimiter(daily_limit=3)
+
+        def db_call(i: int):
+            limiter.check_user_limit(f"bench_user_{i}", f"BenchUser{i}")
+        return db_call
+
+    def db_call(i: int):
+        time.sleep(latency)  # 模拟一次到Postgres的网络往返
+    return db_call
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="数据库调用事件循环延迟测量")
+    parser.add_argument('--real', action='store_true', help='使用DATABASE_URL执行真实数据库调用')
+    parser.add_argument('--latency', type=float, default=0.02, help='模拟的数据库往返延迟（秒）')
+    parser.add_argument('--concurrency', type=int, default=20, help='并发处理器数量')
+    parser.add_argument('--rounds', type=int, default=5, help='每个处理器的调用次数')
+    args = parser.parse_args()
+
+    db_call = build_db_call(args.real, args.latency)
+    mode = "真实数据库" if args.real else f"模拟延迟 {args.latency * 1000:.0f}ms"
+    print(f"=== 事件循环延迟测量 ({mode}, 并发 {args.concurrency}, 每个 {args.rounds} 次) ===")
+
+    await run_scenario("直接在事件循环中调用", db_call, False, args.concurrency, args.rounds)
+    await run_scenario("db_executor线程池", db_call, True, args.concurrency, args.rounds)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+数据库往返次数测量脚本
+统计一次图表请求（限制检查 + 记录请求）实际发送到数据库的语句数，
+对比旧版get_db_session（每次获取会话都执行SELECT 1）与当前实现
+
+用法:
+    DATABASE_URL=... python benchmark_db_roundtrips.py [--requests 200]
+"""
+
+import argparse
+import time
+
+from sqlalchemy import event, text
+
+import models
+import rate_limiter as rate_limiter_module
+from models import create_tables, get_db_session, get_pool_metrics
+from rate_limiter import RateLimiter
+
+
+class StatementCounter:
+    """通过SQLAlchemy事件统计执行的SQL语句"""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def legacy_get_db_session():
+    """旧版会话获取方式：每次都额外执行一次SELECT 1"""
+    session = get_db_session()
+    session.execute(text("SELECT 1"))
+    return session
+
+
+def run_requests(limiter: RateLimiter, counter: StatementCounter, requests: int) -> tuple:
+    """模拟图表请求流程，返回(语句总数, 总耗时)"""
+    counter.count = 0
+    started = time.perf_counter()
+    for i in range(requests):
+        user_id = f"roundtrip_user_{i % 50}"
+        limiter.check_user_limit(user_id, f"RoundTrip{i % 50}")
+        limiter.record_request(user_id, f"RoundTrip{i % 50}")
+    return counter.count, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="数据库往返次数测量")
+    parser.add_argument('--requests', type=int, default=200, help='模拟的图表请求数量')
+    args = parser.parse_args()
+
+    create_tables()
+    counter = StatementCounter(models.get_engine())
+    limiter = RateLimiter(daily_limit=10 ** 6)
+    limiter.refresh_exempt_cache("benchmark")
+
+    # 旧版：每次获取会话都执行SELECT 1
+    rate_limiter_module.get_db_session = legacy_get_db_session
+    legacy_count, legacy_time = run_requests(limiter, counter, args.requests)
+
+    # 当前实现：会话按需检出连接，仅依赖pool_pre_ping
+    rate_limiter_module.get_db_session = get_db_session
+    current_count, current_time = run_requests(limiter, counter, args.requests)
+
+    print(f"=== 数据库往返次数 ({args.requests} 次图表请求) ===")
+    print(f"旧版 (SELECT 1 每会话): {legacy_count / args.requests:.2f} 条语句/请求, "
+          f"{legacy_time / args.requests * 1000:.3f} ms/请求")
+    print(f"当前实现:               {current_count / args.requests:.2f} 条语句/请求, "
+          f"{current_time / args.requests * 1000:.3f} ms/请求")
+    print(f"每次请求节省往返:       {(legacy_count - current_count) / args.requests:.2f}")
+    print(f"连接池指标: {get_pool_metrics()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+共享HTTP客户端延迟测量脚本
+在本地启动一个HTTPS服务器（自签名证书），对比"每次请求新建ClientSession"与"共享http_client"
+在图表请求（返回PNG）和webhook请求（提交JSON）上的单次延迟
+
+本地回环没有网络往返，测得的节省只包含TCP+TLS握手的CPU开销；
+对api.chart-img.com等远程主机，还要再加上握手所需的1~2个网络往返（RTT）
+
+用法:
+    python benchmark_http_client.py [--requests 200] [--image-kb 300]
+"""
+
+import argparse
+import asyncio
+import os
+import ssl
+import statistics
+import subprocess
+import tempfile
+import time
+
+import aiohttp
+from aiohttp import web
+
+from http_client import HTTPClientManager
+
+
+def create_self_signed_cert(directory: str):
+    """使用openssl生成自签名证书，失败时返回None（退回HTTP）"""
+    cert_file = os.path.join(directory, 'cert.pem')
+    key_file = os.path.join(directory, 'key.pem')
+    try:
+        subprocess.run(
+            ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+             '-subj', '/CN=localhost', '-keyout', key_file, '-out', cert_file],
+            check=True, capture_output=True
+        )
+        return cert_file, key_file
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def start_server(image_bytes: bytes, cert):
+    """启动模拟chart-img和webhook的本地服务器"""
+    async def chart(request):
+        await request.json()
+        return web.Response(body=image_bytes, content_type='image/png')
+
+    async def webhook(request):
+        await request.json()
+        return web.json_response({'ok': True})
+
+    app = web.Application()
+    app.router.add_post('/chart', chart)
+    app.router.add_post('/webhook', webhook)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+
+    server_ssl = None
+    if cert:
+        server_ssl = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        server_ssl.load_cert_chain(*cert)
+    site = web.TCPSite(runner, '127.0.0.1', 0, ssl_context=server_ssl)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, port
+
+
+async def request_once(session: aiohttp.ClientSession, url: str, payload: dict, client_ssl, timeout):
+    async with session.post(url, json=payload, ssl=client_ssl, timeout=timeout) as response:
+        await response.read()
+
+
+async def measure(name: str, url: str, payload: dict, requests: int, client_ssl, shared: bool) -> list:
+    """测量单次请求延迟（毫秒）"""
+    manager = HTTPClientManager()
+    latencies = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        if shared:
+            await request_once(manager.get_session(), url, payload, client_ssl, manager.timeout(name))
+        else:
+            async with aiohttp.ClientSession() as session:
+                await request_once(session, url, payload, client_ssl, manager.timeout(name))
+        latencies.append((time.perf_counter() - started) * 1000)
+    if shared:
+        stats = manager.get_stats()
+        print(f"    连接复用: 新建 {stats['connections_created']} / 复用 {stats['connections_reused']}")
+        await manager.close()
+    return latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="共享HTTP客户端延迟测量")
+    parser.add_argument('--requests', type=int, default=200, help='每个场景的请求数')
+    parser.add_argument('--image-kb', type=int, default=300, help='模拟图表PNG大小（KB）')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cert = create_self_signed_cert(tmp)
+        runner, port = await start_server(os.urandom(args.image_kb * 1024), cert)
+        scheme = 'https' if cert else 'http'
+        client_ssl = False if cert else None  # 自签名证书跳过验证
+
+        print(f"=== 单次请求延迟 ({scheme}://127.0.0.1, 每场景 {args.requests} 次) ===")
+        scenarios = [
+            ('chart', '/chart', {'symbol': 'NASDAQ:AAPL', 'interval': '1h', 'width': 1920, 'height': 1080}),
+            ('webhook', '/webhook', {'event_type': 'discord_mention', 'data': {'content': 'x' * 2000}})
+        ]
+        for name, path, payload in scenarios:
+            url = f"{scheme}://127.0.0.1:{port}{path}"
+            print(f"  {name}")
+            per_call = await measure(name, url, payload, args.requests, client_ssl, shared=False)
+            shared = await measure(name, url, payload, args.requests, client_ssl, shared=True)
+            saved = statistics.mean(per_call) - statistics.mean(shared)
+            print(f"    每次新建会话: 平均 {statistics.mean(per_call):6.2f}ms  p50 {statistics.median(per_call):6.2f}ms")
+            print(f"    共享会话:     平均 {statistics.mean(shared):6.2f}ms  p50 {statistics.median(shared):6.2f}ms")
+            print(f"    每次请求节省: {saved:6.2f}ms（远程主机另加握手RTT）")
+
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
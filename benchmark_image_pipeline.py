@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+图表图片后处理效果测量脚本
+使用仓库中的chart-img样例图片，对比原始PNG与各输出格式的单次发送字节数，
+以及私信发送的端到端延迟（后处理耗时 + 按上传带宽估算的上传耗时）
+
+上传耗时按 --upload-mbps 估算，不包含Discord API本身的处理时间（两种方式相同）；
+进程池处理在事件循环之外，测量期间同时记录事件循环的最大阻塞时间
+
+用法:
+    python benchmark_image_pipeline.py [--upload-mbps 10] [--rounds 5]
+"""
+
+import argparse
+import asyncio
+import glob
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from image_pipeline import process_image
+
+CONFIGS = [
+    ('webp 无损', 'webp', 100),
+    ('webp q85', 'webp', 85),
+    ('png 调色板', 'png', 100),
+    ('jpeg q85', 'jpeg', 85),
+]
+
+
+def load_samples():
+    """仓库中的完整尺寸图表样例"""
+    samples = []
+    for path in sorted(glob.glob('test_*.png')):
+        try:
+            with Image.open(path) as image:
+                if image.width < 800:
+                    continue
+        except Exception:
+            continue
+        with open(path, 'rb') as f:
+            samples.append((path, f.read()))
+    return samples
+
+
+async def measure_loop_lag(stop: asyncio.Event) -> float:
+    """记录事件循环的最大调度延迟"""
+    worst = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.005)
+        worst = max(worst, time.perf_counter() - started - 0.005)
+    return worst
+
+
+async def run(upload_mbps: float, rounds: int):
+    samples = load_samples()
+    if not samples:
+        print("未找到样例图片")
+        return
+
+    upload_bytes_per_second = upload_mbps * 1024 * 1024 / 8
+    raw_sizes = [len(data) for _, data in samples]
+    raw_avg = statistics.mean(raw_sizes)
+    raw_upload_ms = raw_avg / upload_bytes_per_second * 1000
+
+    print(f"样例图片: {len(samples)} 张, 平均 {raw_avg / 1024:.1f}KB; 上传带宽 {upload_mbps:g}Mbit/s\n")
+    print(f"{'方式':<12}{'图片KB':>10}{'节省':>8}{'处理ms':>10}{'上传ms':>10}{'端到端ms':>11}{'循环阻塞ms':>12}")
+    print(f"{'原始PNG':<12}{raw_avg / 1024:>10.1f}{'-':>8}{0:>10.1f}{raw_upload_ms:>10.1f}{raw_upload_ms:>11.1f}{'-':>12}")
+
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        # 预热子进程（导入Pillow）
+        await loop.run_in_executor(executor, process_image, samples[0][1], 'png', 100, (0, 0, 0, 0))
+
+        for label, fmt, quality in CONFIGS:
+            full_sizes, process_times = [], []
+            stop = asyncio.Event()
+            lag_task = asyncio.create_task(measure_loop_lag(stop))
+            for _ in range(rounds):
+                for _, data in samples:
+                    started = time.perf_counter()
+                    result = await loop.run_in_executor(executor, process_image, data, fmt, quality, (0, 0, 0, 0))
+                    process_times.append(time.perf_counter() - started)
+                    full_sizes.append(len(result))
+            stop.set()
+            worst_lag = await lag_task
+
+            full_avg = statistics.mean(full_sizes)
+            process_ms = statistics.median(process_times) * 1000
+            upload_ms = full_avg / upload_bytes_per_second * 1000
+            saved = 1 - full_avg / raw_avg
+            print(f"{label:<12}{full_avg / 1024:>10.1f}"
+                  f"{saved:>8.0%}{process_ms:>10.1f}{upload_ms:>10.1f}{process_ms + upload_ms:>11.1f}{worst_lag * 1000:>12.1f}")
+
+    print("\n处理结果随图表一起缓存，同一K线内的重复请求只付上传耗时")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="图表图片后处理效果测量")
+    parser.add_argument('--upload-mbps', type=float, default=10, help="估算用的上传带宽（Mbit/s）")
+    parser.add_argument('--rounds', type=int, default=5, help="每张样例图片的处理次数")
+    args = parser.parse_args()
+    asyncio.run(run(args.upload_mbps, args.rounds))
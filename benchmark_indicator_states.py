@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+指标状态编码基准测试
+生成一批信号数据（raw_data为完整的TradingView JSON，同时写入状态编码列），对比:
+  - 每行存储: raw_data JSON文本 vs 15个SMALLINT状态列
+  - 查询耗时: 读取raw_data逐行json.loads（SQLite时另测json_extract）vs 直接查询状态列
+
+默认使用临时SQLite数据库；设置 DATABASE_URL 可在Postgres上测量（会写入测试数据，请使用测试库）
+
+用法:
+    python benchmark_indicator_states.py [--rows 50000] [--rounds 5]
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+if not os.environ.get('DATABASE_URL'):
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'indicator_states.db')}"
+
+from sqlalchemy import text
+
+from indicator_codes import INDICATOR_CODES, STATE_COLUMNS, encode_indicator_states, get_state_distribution, get_state_history
+from models import TradingViewData, create_tables, get_db_session, get_engine
+
+TIMEFRAMES = ('15m', '1h', '4h')
+
+
+def make_payload(symbol, rng):
+    """一条完整的TradingView信号数据"""
+    payload = {
+        'symbol': symbol, 'Current_timeframe': '60', 'adaptive_timeframe_1': '15', 'adaptive_timeframe_2': '60',
+        'choppiness': f"{rng.uniform(20, 80):.2f}", 'adxValue': f"{rng.uniform(10, 60):.2f}",
+        'BullishOscRating': rng.randint(0, 5), 'BullishTrendRating': rng.randint(0, 5),
+        'BearishOscRating': rng.randint(0, 5), 'BearishTrendRating': rng.randint(0, 5),
+        'trend_change_volatility_stop': f"{rng.uniform(100, 200):.2f}", 'MOMOsignal': 'bullishmomo',
+        'AIbandsignal': rng.choice(('green uptrend', 'red downtrend')), 'Middle_smooth_trend': 'Bullish +',
+        'rsi_state_trend': rng.choice(('Bullish', 'Bearish', 'Neutral')), 'timestamp': '2025-01-15T14:30:00Z',
+    }
+    for column, (field, codes) in INDICATOR_CODES.items():
+        payload[field] = rng.choice(list(codes)) if codes else str(rng.choice((-1, 0, 1)))
+    return payload
+
+
+def populate(count: int, rng):
+    symbols = [f"SYM{index:03d}" for index in range(200)]
+    now = datetime.now()
+    db = get_db_session()
+    try:
+        db.query(TradingViewData).delete()
+        batch = []
+        for index in range(count):
+            symbol = rng.choice(symbols)
+            payload = make_payload(symbol, rng)
+            row = {
+                'symbol': symbol, 'timeframe': rng.choice(TIMEFRAMES), 'data_type': 'signal',
+                'raw_data': json.dumps(payload, ensure_ascii=False),
+                'received_at': now - timedelta(minutes=count - index)
+            }
+            row.update(encode_indicator_states(payload))
+            batch.append(row)
+            if len(batch) >= 5000:
+                db.bulk_insert_mappings(TradingViewData, batch)
+                batch = []
+        if batch:
+            db.bulk_insert_mappings(TradingViewData, batch)
+        db.commit()
+    finally:
+        db.close()
+    return symbols
+
+
+def timed(function, rounds: int):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        result = function()
+    return (time.perf_counter() - started) / rounds * 1000, result
+
+
+def json_distribution(since):
+    db = get_db_session()
+    try:
+        rows = db.query(TradingViewData.raw_data).filter(
+            TradingViewData.data_type == 'signal', TradingViewData.timeframe == '1h',
+            TradingViewData.received_at >= since
+        ).all()
+        return Counter(json.loads(raw).get('pmaText') for (raw,) in rows)
+    finally:
+        db.close()
+
+
+def json_extract_distribution(since):
+    db = get_db_session()
+    try:
+        return dict(db.execute(text(
+            "SELECT json_extract(raw_data, '$.pmaText'), COUNT(*) FROM tradingview_data "
+            "WHERE data_type = 'signal' AND timeframe = '1h' AND received_at >= :since "
+            "GROUP BY json_extract(raw_data, '$.pmaText')"
+        ), {'since': since}).fetchall())
+    finally:
+        db.close()
+
+
+def json_history(symbol):
+    db = get_db_session()
+    try:
+        rows = db.query(TradingViewData.received_at, TradingViewData.raw_data).filter(
+            TradingViewData.symbol == symbol, TradingViewData.timeframe == '1h', TradingViewData.data_type == 'signal'
+        ).order_by(TradingViewData.received_at.desc()).limit(500).all()
+        return [(received_at, json.loads(raw)) for received_at, raw in rows]
+    finally:
+        db.close()
+
+
+def json_aligned_counts():
+    """1h上三个MA趋势都看涨且不在挤压中的信号数（按股票）"""
+    db = get_db_session()
+    try:
+        counts = Counter()
+        for symbol, raw in db.query(TradingViewData.symbol, TradingViewData.raw_data).filter(
+                TradingViewData.data_type == 'signal', TradingViewData.timeframe == '1h').all():
+            data = json.loads(raw)
+            if (data.get('MAtrend') == '1' and data.get('MAtrend_timeframe1') == '1'
+                    and data.get('MAtrend_timeframe2') == '1' and data.get('SQZsignal') == 'no squeeze'):
+                counts[symbol] += 1
+        return counts
+    finally:
+        db.close()
+
+
+def column_aligned_counts():
+    db = get_db_session()
+    try:
+        return dict(db.execute(text(
+            "SELECT symbol, COUNT(*) FROM tradingview_data "
+            "WHERE data_type = 'signal' AND timeframe = '1h' "
+            "AND ma_trend = 1 AND ma_trend_tf1 = 1 AND ma_trend_tf2 = 1 AND sqz_state = 0 GROUP BY symbol"
+        )).fetchall())
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="指标状态编码基准测试")
+    parser.add_argument('--rows', type=int, default=50000, help="生成的信号数据行数")
+    parser.add_argument('--rounds', type=int, default=5, help="每个查询的执行次数")
+    args = parser.parse_args()
+
+    create_tables()
+    rng = random.Random(11)
+    started = time.perf_counter()
+    symbols = populate(args.rows, rng)
+    print(f"数据库: {get_engine().url.drivername}，写入 {args.rows:,} 行 ({time.perf_counter() - started:.1f}s)")
+
+    db = get_db_session()
+    try:
+        json_bytes = db.execute(text("SELECT AVG(LENGTH(raw_data)) FROM tradingview_data")).scalar()
+    finally:
+        db.close()
+    print(f"\n每行存储: raw_data {json_bytes:.0f} 字节，状态列 {len(STATE_COLUMNS)} × SMALLINT = {len(STATE_COLUMNS) * 2} 字节"
+          f"（状态查询只需读取约 {len(STATE_COLUMNS) * 2 / json_bytes:.1%} 的数据）")
+
+    since = datetime.now() - timedelta(minutes=args.rows // 2)
+    symbol = symbols[0]
+    comparisons = [
+        ("PMA分布（1h，最近一半数据）", lambda: json_distribution(since),
+         lambda: get_state_distribution('pma_state', timeframe='1h', since=since)),
+        ("单个股票1h状态历史（500条）", lambda: json_history(symbol),
+         lambda: get_state_history(symbol, '1h', limit=500)),
+        ("三个MA看涨且未挤压的次数（按股票）", json_aligned_counts, column_aligned_counts),
+    ]
+
+    print(f"\n{'查询':<30}{'raw_data+json.loads ms':>24}{'状态列 ms':>12}{'倍数':>8}")
+    for name, json_query, column_query in comparisons:
+        json_ms, json_result = timed(json_query, args.rounds)
+        column_ms, column_result = timed(column_query, args.rounds)
+        assert len(json_result) == len(column_result), name
+        print(f"{name:<30}{json_ms:>24.1f}{column_ms:>12.1f}{json_ms / column_ms:>7.1f}x")
+
+    if get_engine().url.drivername.startswith('sqlite'):
+        extract_ms, _ = timed(lambda: json_extract_distribution(since), args.rounds)
+        print(f"{'PMA分布（SQLite json_extract）':<30}{extract_ms:>24.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+消息路由吞吐测量脚本
+用模拟的消息流（大部分是与机器人无关的闲聊）对比原on_message中的逐条判断与MessageRouter，
+输出每秒可路由的消息数，并校验两者对每条消息的路由结果一致
+
+用法:
+    python benchmark_message_router.py [--messages 50000] [--rounds 5]
+"""
+
+import argparse
+import random
+import re
+import statistics
+import time
+from types import SimpleNamespace
+
+import message_router
+from message_router import MessageRouter
+
+PREDICTION_KEYWORDS = ['预测', 'predict', '趋势', 'trend', '分析', 'analysis', '预测分析', '走势预测']
+ADMIN_COMMANDS = ['!vip_add', '!vip_remove', '!vip_list', '!quota', '!help_admin', '!exempt_add', '!exempt_remove', '!exempt_list', '!loop_stats']
+
+BOT_ID = 1400000000000000001
+MONITOR_IDS = [str(1404532905916760125 + i) for i in range(5)]
+
+CHATTER = [
+    "今天大盘怎么样", "gm everyone", "NVDA又涨了哈哈", "有人看昨晚的财报吗", "lol",
+    "I think TSLA is overvalued here", "午饭吃什么", "https://example.com/some/news/article",
+]
+
+
+class LegacyClassifier:
+    """原on_message中的判断逻辑（保持原样，用作对比基线）"""
+
+    def __init__(self, config, user):
+        self.config = config
+        self.user = user
+
+    def has_stock_command(self, content):
+        return bool(re.search(r'[A-Z:]+[,\s]+\d+[smhdwMy]', content, re.IGNORECASE))
+
+    def is_report_channel(self, channel):
+        if hasattr(self.config, 'report_channel_ids') and self.config.report_channel_ids:
+            return str(channel.id) in self.config.report_channel_ids
+        else:
+            return channel.name and "report" in channel.name.lower()
+
+    def has_prediction_command(self, content):
+        content_lower = content.lower()
+        has_keyword = any(keyword in content_lower for keyword in PREDICTION_KEYWORDS)
+        has_symbol = bool(re.search(r'[A-Z]{2,}', content, re.IGNORECASE))
+        return has_keyword and has_symbol
+
+    def has_chart_image(self, attachments):
+        for attachment in attachments:
+            filename = attachment.filename.lower()
+            if filename.endswith(('.png', '.jpg', '.jpeg')):
+                if attachment.size < 10 * 1024 * 1024:
+                    return True
+        return False
+
+    def has_admin_command(self, content):
+        content_lower = content.lower().strip()
+        return any(content_lower.startswith(cmd) for cmd in ADMIN_COMMANDS)
+
+    def route(self, message):
+        if message.author == self.user:
+            return message_router.IGNORE
+
+        bot_role_mentioned = False
+        if message.guild and self.user:
+            bot_member = message.guild.get_member(self.user.id)
+            if bot_member:
+                bot_role_mentioned = any(role in message.role_mentions for role in bot_member.roles)
+
+        is_mentioned = (self.user and (self.user in message.mentions or
+                        bot_role_mentioned or
+                        f'<@{self.user.id}>' in message.content or
+                        f'<@!{self.user.id}>' in message.content))
+
+        is_monitored_channel = (
+            self.config.monitor_channel_ids and
+            str(message.channel.id) in self.config.monitor_channel_ids
+        )
+        is_report_channel = self.is_report_channel(message.channel)
+
+        if message.content.startswith('!'):
+            if self.has_admin_command(message.content):
+                return message_router.ADMIN_COMMAND
+            return message_router.COMMAND
+
+        if is_report_channel and not message.author.bot:
+            return message_router.REPORT
+        elif is_mentioned and is_monitored_channel and self.has_stock_command(message.content):
+            return message_router.CHART
+        elif is_mentioned:
+            if message.attachments and self.has_chart_image(message.attachments):
+                return message_router.CHART_ANALYSIS
+            elif self.has_prediction_command(message.content):
+                return message_router.PREDICTION
+            elif self.has_stock_command(message.content) and not is_report_channel:
+                return message_router.CHART
+            else:
+                return message_router.MENTION
+        elif is_monitored_channel and self.has_stock_command(message.content):
+            return message_router.CHART
+        elif is_monitored_channel and self.has_prediction_command(message.content):
+            return message_router.PREDICTION
+        elif is_monitored_channel and message.attachments and self.has_chart_image(message.attachments):
+            return message_router.CHART_ANALYSIS
+        return message_router.IGNORE
+
+
+class FakeUser(SimpleNamespace):
+    def __eq__(self, other):
+        return isinstance(other, FakeUser) and other.id == self.id
+
+    __hash__ = None
+
+
+class FakeMember(SimpleNamespace):
+    def get_role(self, role_id):
+        return next((role for role in self.roles if role.id == role_id), None)
+
+
+def build_messages(count: int, seed: int = 7):
+    """模拟消息流：约90%为其他频道的闲聊，其余为监控频道、report频道、@提及和命令"""
+    rng = random.Random(seed)
+    bot_user = FakeUser(id=BOT_ID, bot=True, name='bot')
+    roles = [SimpleNamespace(id=5000 + i) for i in range(8)]
+    bot_member = FakeMember(id=BOT_ID, roles=roles[:5])
+    guild = SimpleNamespace(id=1, get_member=lambda user_id: bot_member if user_id == BOT_ID else None)
+
+    other_channels = [SimpleNamespace(id=9000 + i, name=f'general-{i}') for i in range(40)]
+    monitor_channels = [SimpleNamespace(id=int(channel_id), name='charts') for channel_id in MONITOR_IDS]
+    report_channel = SimpleNamespace(id=8888, name='daily-report')
+    image = SimpleNamespace(filename='chart.PNG', size=300_000)
+
+    messages = []
+    for _ in range(count):
+        roll = rng.random()
+        author = FakeUser(id=rng.randint(10, 10_000), bot=False, name='user')
+        channel, content, mentions, role_mentions, attachments = rng.choice(other_channels), rng.choice(CHATTER), [], [], []
+        if roll < 0.04:
+            channel = rng.choice(monitor_channels)
+        elif roll < 0.06:
+            channel, content = rng.choice(monitor_channels), "AAPL,15m"
+        elif roll < 0.07:
+            channel, content = report_channel, "TSLA分析"
+        elif roll < 0.08:
+            content, mentions = f"<@{BOT_ID}> NVDA走势预测", [bot_user]
+        elif roll < 0.085:
+            content, role_mentions = "<@&5001> hi", [roles[1]]
+        elif roll < 0.09:
+            content, attachments = "看看这个", [image]
+        elif roll < 0.10:
+            content = rng.choice(["!quota", "!ping", "!cleanup_status"])
+        messages.append(SimpleNamespace(
+            author=author, content=content, channel=channel, guild=guild,
+            mentions=mentions, role_mentions=role_mentions, attachments=attachments
+        ))
+    return bot_user, messages
+
+
+def measure(route, messages, rounds: int) -> float:
+    """返回每秒路由的消息数（多轮取中位数）"""
+    rates = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for message in messages:
+            route(message)
+        rates.append(len(messages) / (time.perf_counter() - started))
+    return statistics.median(rates)
+
+
+def run(count: int, rounds: int):
+    config = SimpleNamespace(monitor_channel_ids=MONITOR_IDS, report_channel_ids=[])
+    bot_user, messages = build_messages(count)
+
+    legacy = LegacyClassifier(config, bot_user)
+    router = MessageRouter(config, PREDICTION_KEYWORDS, ADMIN_COMMANDS)
+    router.bind_user(BOT_ID)
+
+    mismatches = sum(1 for message in messages if legacy.route(message) != router.route(message)[0])
+    if mismatches:
+        raise SystemExit(f"❌ {mismatches} 条消息的路由结果与原逻辑不一致")
+
+    before = measure(legacy.route, messages, rounds)
+    after = measure(router.route, messages, rounds)
+    print(f"模拟消息: {count} 条（约90%为无关闲聊），路由结果与原逻辑一致")
+    print(f"{'方式':<14}{'消息/秒':>14}")
+    print(f"{'原on_message':<14}{before:>14,.0f}")
+    print(f"{'MessageRouter':<14}{after:>14,.0f}")
+    print(f"提升: {after / before:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="消息路由吞吐测量")
+    parser.add_argument('--messages', type=int, default=50000, help="模拟消息数")
+    parser.add_argument('--rounds', type=int, default=5, help="测量轮数")
+    args = parser.parse_args()
+    run(args.messages, args.rounds)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+选股基准测试
+对比两种方式回答 "1h上三个MA时间框架都看涨且不在挤压中的股票，按评级排序":
+  - 原始方式: 对每个 (股票, 时间框架) 最新一行的原始JSON做 json.loads 后逐行判断
+  - 选股索引: 位图与/或/非 + 列式数值比较（"筛选+排序" 为索引上的耗时中位数，"含结果" 另含构建前20条结果）
+
+用法:
+    python benchmark_screener.py [--symbols 500] [--rounds 200]
+"""
+
+import argparse
+import json
+import random
+import time
+
+from screener import SignalScreener
+
+TIMEFRAMES = ('15m', '1h', '4h', '1d')
+QUERIES = (
+    "MAtrend=1 and MAtrend_timeframe1=1 and MAtrend_timeframe2=1 and SQZsignal!=squeeze",
+    "PMA Strong Bullish and BullishTrendRating+BullishOscRating > 7",
+    "(cvdAboveMA or bullpower) and not AIbandsignal == 'red downtrend' and adxValue > 25",
+)
+
+
+def make_payload(symbol, rng):
+    return {
+        'symbol': symbol,
+        'MAtrend': str(rng.choice((1, 0, -1))), 'MAtrend_timeframe1': str(rng.choice((1, 0, -1))),
+        'MAtrend_timeframe2': str(rng.choice((1, 0, -1))),
+        'SQZsignal': rng.choice(('squeeze', 'no squeeze')),
+        'pmaText': rng.choice(('PMA Strong Bullish', 'PMA Bullish', 'PMA Trendless', 'PMA Bearish', 'PMA Strong Bearish')),
+        'AIbandsignal': rng.choice(('green uptrend', 'red downtrend')),
+        'CVDsignal': rng.choice(('cvdAboveMA', 'cvdBelowMA')), 'BBPsignal': rng.choice(('bullpower', 'bearpower')),
+        'BullishTrendRating': rng.randint(0, 5), 'BullishOscRating': rng.randint(0, 5),
+        'BearishTrendRating': rng.randint(0, 5), 'BearishOscRating': rng.randint(0, 5),
+        'adxValue': f"{rng.uniform(10, 60):.2f}", 'choppiness': f"{rng.uniform(20, 80):.2f}",
+        'Current_timeframe': '60', 'timestamp': '2025-01-15T14:30:00Z',
+        'trend_change_volatility_stop': f"{rng.uniform(100, 200):.2f}",
+    }
+
+
+def raw_scan(rows):
+    """原始方式: 逐行解析JSON并判断"""
+    matches = []
+    for symbol, timeframe, raw_data in rows:
+        if timeframe != '1h':
+            continue
+        data = json.loads(raw_data)
+        if (data.get('MAtrend') == '1' and data.get('MAtrend_timeframe1') == '1'
+                and data.get('MAtrend_timeframe2') == '1' and data.get('SQZsignal') != 'squeeze'):
+            matches.append((float(data['BullishTrendRating']) + float(data['BullishOscRating']), symbol))
+    matches.sort(reverse=True)
+    return matches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="选股基准测试")
+    parser.add_argument('--symbols', type=int, default=500, help="股票代码数（每个股票4个时间框架）")
+    parser.add_argument('--rounds', type=int, default=200, help="每个查询的执行次数")
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    rows = []
+    screener = SignalScreener()
+    started = time.perf_counter()
+    for index in range(args.symbols):
+        symbol = f"SYM{index:04d}"
+        for timeframe in TIMEFRAMES:
+            payload = make_payload(symbol, rng)
+            rows.append((symbol, timeframe, json.dumps(payload)))
+            screener.update(symbol, timeframe, payload)
+    update_us = (time.perf_counter() - started) / len(rows) * 1e6
+    print(f"{len(rows):,} 个股票/时间框架，增量更新 {update_us:.1f}µs/条")
+
+    started = time.perf_counter()
+    for _ in range(max(1, args.rounds // 20)):
+        expected = raw_scan(rows)
+    raw_us = (time.perf_counter() - started) / max(1, args.rounds // 20) * 1e6
+
+    result = screener.screen(QUERIES[0], timeframe='1h', sort_by='BullishTrendRating+BullishOscRating', limit=len(rows))
+    assert result['matches'] == len(expected)
+    assert [item['sort_value'] for item in result['results']] == [score for score, _ in expected]
+
+    print(f"\n{'查询':<90}{'匹配':>6}{'筛选+排序µs':>14}{'含结果µs':>10}")
+    print(f"{'原始JSON逐行解析（查询1）':<84}{len(expected):>6}{raw_us:>14.1f}{raw_us:>10.1f}")
+    for query in QUERIES:
+        filter_us = []
+        started = time.perf_counter()
+        for _ in range(args.rounds):
+            result = screener.screen(query, timeframe='1h', sort_by='BullishTrendRating+BullishOscRating')
+            filter_us.append(result['elapsed_us'])
+        elapsed = (time.perf_counter() - started) / args.rounds * 1e6
+        filter_us.sort()
+        print(f"{query:<90}{result['matches']:>6}{filter_us[len(filter_us) // 2]:>14.1f}{elapsed:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+信号差量存储基准测试
+模拟稳定状态的信号流（每条只有时间戳和少数数值变化，指标状态偶尔翻转），对比:
+  - raw_data存储字节: 每条完整JSON vs 差量+定期快照（不同 SIGNAL_SNAPSHOT_INTERVAL）
+  - 入库耗时和重建最新信号、查询状态变化历史的耗时（临时SQLite数据库）
+
+用法:
+    python benchmark_signal_deltas.py [--symbols 50] [--signals 200]
+"""
+
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+if not os.environ.get('DATABASE_URL'):
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'signal_deltas.db')}"
+
+from benchmark_indicator_states import make_payload
+from signal_deltas import SignalDeltaTracker, get_signal_changes, signal_deltas
+from models import create_tables
+from tradingview_handler import TradingViewHandler
+
+STATES = {
+    'pmaText': ('PMA Strong Bullish', 'PMA Bullish', 'PMA Trendless', 'PMA Bearish', 'PMA Strong Bearish'),
+    'SQZsignal': ('squeeze', 'no squeeze'),
+    'MAtrend': ('1', '0', '-1'),
+    'CVDsignal': ('cvdAboveMA', 'cvdBelowMA'),
+    'AIbandsignal': ('green uptrend', 'red downtrend'),
+}
+
+
+def make_stream(symbols: int, signals: int, flip_rate: float, rng):
+    """[(股票代码, 信号列表)]，相邻信号之间只有少数字段变化"""
+    streams = []
+    for index in range(symbols):
+        symbol = f"SYM{index:03d}"
+        payload = make_payload(symbol, rng)
+        payload['Current_timeframe'] = '60'
+        series = []
+        for bar in range(signals):
+            payload = dict(payload)
+            payload['timestamp'] = f"2025-01-{1 + bar // 24:02d}T{bar % 24:02d}:00:00Z"
+            payload['adxValue'] = f"{float(payload['adxValue']) + rng.uniform(-0.5, 0.5):.2f}"
+            if rng.random() < 0.3:
+                payload['choppiness'] = f"{float(payload['choppiness']) + rng.uniform(-1, 1):.2f}"
+            for field, values in STATES.items():
+                if rng.random() < flip_rate:
+                    payload[field] = rng.choice(values)
+            series.append(payload)
+        streams.append((symbol, series))
+    return streams
+
+
+def measure_bytes(streams, interval: int):
+    tracker = SignalDeltaTracker(snapshot_interval=interval)
+    row_id = 0
+    for symbol, series in streams:
+        for payload in series:
+            row_id += 1
+            entry = tracker.prepare(symbol, '1h', payload)
+            tracker.stored(entry, row_id)
+    return tracker.get_stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="信号差量存储基准测试")
+    parser.add_argument('--symbols', type=int, default=50, help="股票代码数")
+    parser.add_argument('--signals', type=int, default=200, help="每个股票的信号条数")
+    parser.add_argument('--flip-rate', type=float, default=0.03, help="每条信号每个状态字段翻转的概率")
+    args = parser.parse_args()
+
+    rng = random.Random(5)
+    streams = make_stream(args.symbols, args.signals, args.flip_rate, rng)
+    total = args.symbols * args.signals
+    print(f"{args.symbols} 个股票 × {args.signals} 条信号 = {total:,} 条（状态翻转概率 {args.flip_rate}）")
+
+    print(f"\n{'快照间隔':<10}{'完整字节':>12}{'存储字节':>12}{'节省':>8}{'快照':>8}{'差量':>8}")
+    for interval in (0, 5, 20, 50):
+        stats = measure_bytes(streams, interval)
+        print(f"{interval:<14}{stats['full_bytes']:>12,}{stats['stored_bytes']:>12,}"
+              f"{stats['saved_ratio']:>8.1%}{stats['snapshots']:>8}{stats['deltas']:>8}")
+
+    create_tables()
+    handler = TradingViewHandler()
+    started = time.perf_counter()
+    for symbol, series in streams[:10]:
+        for payload in series:
+            handler.store_enhanced_data(payload)
+    ingest_us = (time.perf_counter() - started) / (10 * args.signals) * 1e6
+    print(f"\n入库（间隔 {signal_deltas.snapshot_interval}，含SQLite写入）: {ingest_us:.0f}µs/条")
+
+    symbol, series = streams[0]
+    started = time.perf_counter()
+    for _ in range(50):
+        latest = handler.get_latest_data(symbol, '1h')
+    latest_ms = (time.perf_counter() - started) / 50 * 1000
+    started = time.perf_counter()
+    for _ in range(10):
+        changes = get_signal_changes(symbol, '1h', limit=args.signals)
+    changes_ms = (time.perf_counter() - started) / 10 * 1000
+    print(f"重建最新信号: {latest_ms:.2f}ms，状态变化历史（{args.signals}条信号，{len(changes)}次变化）: {changes_ms:.1f}ms")
+    assert json.loads(latest.raw_data) == series[-1]
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+webhook负载测量脚本
+用一条典型的@提及消息数据（中型服务器、带多个角色的作者），对比各投影档位、
+静态部分按版本号引用、gzip压缩时每个事件的字节数和序列化耗时（构建负载 + JSON编码 + 压缩）
+
+用法:
+    python benchmark_webhook_payload.py [--rounds 2000]
+"""
+
+import argparse
+import gzip
+import json
+import time
+
+from webhook_handler import WebhookHandler
+
+
+def sample_message_data():
+    """一条典型的@提及消息数据（字段结构与bot.build_message_data一致）"""
+    permissions = {key: True for key in (
+        'read_messages', 'send_messages', 'manage_messages', 'embed_links', 'attach_files',
+        'read_message_history', 'add_reactions', 'use_external_emojis')}
+    return {
+        'message_id': 1300000000000000001,
+        'content': '<@1400000000000000001> 帮我看看NVDA这周的走势，财报前要不要减仓？',
+        'created_at': '2025-01-15T14:30:00+00:00',
+        'edited_at': None,
+        'jump_url': 'https://discord.com/channels/1/2/1300000000000000001',
+        'timestamp': '2025-01-15T14:30:00.123456',
+        'author': {
+            'id': 1145170623354638418, 'name': 'trader', 'display_name': '交易员', 'discriminator': '0',
+            'bot': False, 'avatar_url': 'https://cdn.discordapp.com/avatars/1145170623354638418/abcdef.png',
+            'created_at': '2021-03-01T00:00:00+00:00', 'public_flags': 0,
+            'recent_activity': {}, 'joined_server_at': '2023-06-01T00:00:00+00:00', 'premium_since': None,
+            'roles': [{'id': 1200000000000000000 + i, 'name': f'角色{i}', 'color': 3447003,
+                       'permissions': 1071698660929, 'position': i} for i in range(12)],
+            'permissions': {'administrator': False, 'manage_guild': False, 'manage_channels': False,
+                            'manage_messages': False, 'kick_members': False, 'ban_members': False}
+        },
+        'channel': {
+            'id': 1404532905916760125, 'name': 'stock-charts', 'type': 'text',
+            'created_at': '2024-01-01T00:00:00+00:00', 'position': 3, 'topic': '股票图表和讨论频道',
+            'nsfw': False, 'slowmode_delay': 0, 'guild_id': 1,
+            'category': {'id': 1100, 'name': '交易', 'position': 1},
+            'permissions': permissions, 'member_count': 5234,
+            'members': [{'id': 1000 + i, 'name': f'user{i}', 'display_name': f'用户{i}'} for i in range(10)],
+            'snapshot_version': 42
+        },
+        'guild': {
+            'id': 1, 'name': '美股交易社区', 'owner_id': 2, 'member_count': 5234,
+            'created_at': '2022-01-01T00:00:00+00:00', 'verification_level': 'medium',
+            'explicit_content_filter': 'all_members', 'default_notifications': 'only_mentions',
+            'features': ['COMMUNITY', 'NEWS', 'WELCOME_SCREEN_ENABLED', 'MEMBER_VERIFICATION_GATE_ENABLED'],
+            'boost_level': 2, 'boost_count': 9, 'icon_url': 'https://cdn.discordapp.com/icons/1/abc.png',
+            'banner_url': None, 'channels': {'total': 48, 'text': 35, 'voice': 6, 'categories': 7},
+            'roles_count': 40, 'emojis_count': 25, 'region': 'unknown',
+            'active_members': [{'id': 2000 + i, 'name': f'member{i}', 'display_name': f'成员{i}',
+                                'status': 'online', 'joined_at': '2023-01-01T00:00:00+00:00'} for i in range(5)],
+            'statistics': {'online_members': 812, 'bot_count': 6, 'human_count': 5228},
+            'snapshot_version': 97, 'static_version': 12
+        },
+        'attachments': [],
+        'embeds': [],
+        'mentions': [{'id': 1400000000000000001, 'name': 'TDbot', 'display_name': 'TDbot'}]
+    }
+
+
+def measure(handler, message_data, rounds: int, use_gzip: bool):
+    """返回 (每事件字节数, 每事件耗时µs)"""
+    full_sections = []
+    handler.build_webhook_payload(message_data, full_sections)  # 引用模式下第一次发送完整内容
+    handler.mark_static_delivered(full_sections)
+    size = 0
+    started = time.perf_counter()
+    for _ in range(rounds):
+        body = json.dumps(handler.build_webhook_payload(message_data), ensure_ascii=False).encode('utf-8')
+        if use_gzip:
+            body = gzip.compress(body, compresslevel=6)
+        size = len(body)
+    return size, (time.perf_counter() - started) / rounds * 1e6
+
+
+def run(rounds: int):
+    message_data = sample_message_data()
+    print(f"{'档位':<10}{'静态引用':<10}{'gzip':<8}{'字节/事件':>12}{'耗时µs':>10}")
+    baseline = None
+    for profile in ('full', 'standard', 'minimal'):
+        for static_refs in (False, True):
+            for use_gzip in (False, True):
+                handler = WebhookHandler('http://localhost/webhook')
+                handler.profile, handler.static_refs = profile, static_refs
+                size, micros = measure(handler, message_data, rounds, use_gzip)
+                baseline = baseline or size
+                print(f"{profile:<10}{('是' if static_refs else '否'):<10}{('是' if use_gzip else '否'):<8}"
+                      f"{size:>12,}{micros:>10.1f}   ({size / baseline:.0%})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="webhook负载测量")
+    parser.add_argument('--rounds', type=int, default=2000, help="每种配置的测量次数")
+    args = parser.parse_args()
+    run(args.rounds)
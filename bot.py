@@ -5,22 +5,44 @@ Discord机器人核心实现
 
 import discord
 from discord.ext import commands
+import asyncio
 import logging
+import os
+import time
 from datetime import datetime
 from webhook_handler import WebhookHandler
 from chart_service import ChartService
+from chart_queue import PRIORITY_VIP, PRIORITY_NORMAL
+from chart_prefetch import ChartPrefetcher
 from rate_limiter import RateLimiter
 from prediction_service import StockPredictionService
 from chart_analysis_service import ChartAnalysisService
 from channel_cleaner import ChannelCleaner
 from daily_logger import daily_logger
+from db_executor import db_executor
+from http_client import http_client
+from loop_watchdog import loop_watchdog
+from image_pipeline import image_pipeline
 from report_handler import ReportHandler
+from guild_snapshot import GuildSnapshots
+from alert_subscriptions import AlertSubscriptions, AlertFanout, EVENT_TYPES, ALL_TIMEFRAMES, parse_subscription_args
+from alert_rules import AlertRules, FIELD_NAMES, RuleSyntaxError, parse_rule_command
+from screener import screener, parse_screen_command
+from ingest_spool import ingest_spool
+from symbol_registry import symbol_registry
+import message_router
+from message_router import MessageRouter
 import io
-import re
 
 class DiscordBot(commands.Bot):
     """Discord机器人类"""
     
+    # 预测请求关键词
+    PREDICTION_KEYWORDS = ['预测', 'predict', '趋势', 'trend', '分析', 'analysis', '预测分析', '走势预测']
+    
+    # 管理员命令前缀
+    ADMIN_COMMANDS = ['!vip_add', '!vip_remove', '!vip_list', '!quota', '!help_admin', '!exempt_add', '!exempt_remove', '!exempt_list', '!loop_stats']
+    
     def __init__(self, config):
         """初始化机器人"""
         # 设置机器人意图
@@ -36,18 +58,53 @@ class DiscordBot(commands.Bot):
         )
         
         self.config = config
+        self.startup_started = time.perf_counter()  # 入口脚本可覆盖为进程启动时间
         self.webhook_handler = WebhookHandler(config.webhook_url)
         self.chart_service = ChartService(config)
+        self.chart_prefetcher = ChartPrefetcher(self.chart_service)  # 开盘前热门图表预取
+        self.chart_bundle_quota_units = int(os.getenv('CHART_BUNDLE_QUOTA_UNITS', '1'))  # 多时间框架组合请求消耗的配额
         self.rate_limiter = RateLimiter(daily_limit=3)  # 每日限制3次
         self.prediction_service = StockPredictionService(config)  # 股票预测服务
         self.chart_analysis_service = ChartAnalysisService(config)  # 图表分析服务
         self.channel_cleaner = ChannelCleaner(self, config)  # 频道清理服务
         self.report_handler = ReportHandler(self)  # 报告处理器
+        self.guild_snapshots = GuildSnapshots(self)  # 服务器/频道信息快照（@提及转发用）
+        self.alert_subscriptions = AlertSubscriptions()  # 股票提醒订阅
+        self.alert_rules = AlertRules()  # 股票提醒规则
+        self.alert_fanout = AlertFanout(self.alert_subscriptions, self.send_alert_dm, self.alert_rules)  # 提醒私信分发
         self.logger = logging.getLogger(__name__)
         
+        # 消息路由（频道ID集合和正则在启动时构建一次）
+        self.router = MessageRouter(config, self.PREDICTION_KEYWORDS, self.ADMIN_COMMANDS)
+        self.route_handlers = {
+            message_router.ADMIN_COMMAND: self.handle_admin_command,
+            message_router.REPORT: self.report_handler.process_report_request,
+            message_router.CHART: self.handle_chart_request,
+            message_router.CHART_ANALYSIS: self.handle_chart_analysis_request,
+            message_router.PREDICTION: self.handle_prediction_request,
+            message_router.MENTION: self.handle_mention,
+        }
+        self.direct_commands = {
+            'cleanup_now': self.manual_cleanup_command_direct,
+            'cleanup_status': self.cleanup_status_command_direct,
+            'cleanup_channel': self.cleanup_specific_channel_direct,
+            'help_admin': self.help_admin_command_direct,
+            'subscribe': self.handle_subscribe_command,
+            'unsubscribe': self.handle_unsubscribe_command,
+            'subscriptions': self.handle_subscriptions_command,
+            'rule': self.handle_rule_command,
+            'rules': self.handle_rules_command,
+            'unrule': self.handle_unrule_command,
+            'screen': self.handle_screen_command,
+        }
+        
     async def on_ready(self):
         """机器人就绪事件"""
+        # 尽早启动事件循环卡顿监测，覆盖启动阶段
+        await loop_watchdog.start()
+        
         if self.user:
+            self.router.bind_user(self.user.id)
             self.logger.info(f'机器人已登录: {self.user.name} (ID: {self.user.id})')
             self.logger.info(f'机器人在 {len(self.guilds)} 个服务器中')
             
@@ -58,14 +115,21 @@ class DiscordBot(commands.Bot):
         try:
             import os
             from models import create_tables
-            create_tables()
+            await db_executor.run(create_tables)
             self.logger.info("✅ 数据库表初始化完成")
             
-            # 测试用户限制功能
-            from rate_limiter import RateLimiter
-            test_rate_limiter = RateLimiter()
+            # 加载豁免用户缓存（同时验证用户限制功能）
+            await db_executor.run(self.rate_limiter.refresh_exempt_cache, "startup")
             self.logger.info("✅ 用户限制功能验证完成")
             
+            # 加载已学习的交易所映射
+            await db_executor.run(self.chart_service.exchange_registry.load)
+            
+            # 加载提醒订阅索引
+            await self.alert_subscriptions.load()
+            await self.alert_rules.load()
+            await screener.load()
+            
         except Exception as e:
             self.logger.error(f"❌ 数据库初始化失败: {e}")
             self.logger.error(f"DATABASE_URL: {os.environ.get('DATABASE_URL', 'NOT_SET')}")
@@ -95,102 +159,59 @@ class DiscordBot(commands.Bot):
         await self.channel_cleaner.start_daily_cleanup()
         self.logger.info("频道清理服务已启动")
         
+        # 启动豁免用户缓存定时刷新
+        await self.rate_limiter.start_exempt_refresh()
+        
+        # 启动开盘前图表预取
+        await self.chart_prefetcher.start_prefetch()
+        
+        # 启动webhook发件箱投递（继续投递上次未完成的消息）
+        await self.webhook_handler.outbox.start()
+        
+        # 启动提醒私信分发
+        await self.alert_fanout.start()
+        
+        self.logger.info(f"⏱️ 机器人就绪，启动耗时: {(time.perf_counter() - self.startup_started):.2f}s")
+
+    async def close(self):
+        """关闭机器人，停止后台任务并释放共享HTTP连接"""
+        await self.channel_cleaner.stop_daily_cleanup()
+        await self.rate_limiter.stop_exempt_refresh()
+        await self.chart_prefetcher.stop_prefetch()
+        await self.chart_service.render_queue.stop()
+        await self.webhook_handler.outbox.stop()
+        await ingest_spool.stop()
+        await self.alert_fanout.stop()
+        await http_client.close()
+        await loop_watchdog.stop()
+        image_pipeline.shutdown(wait=False)
+        await super().close()
+
     async def on_message(self, message):
-        """消息事件处理"""
+        """消息事件处理：按路由结果查分发表"""
         # 添加调试日志
         self.logger.debug(f'收到消息: {message.content[:50]}... 来自: {message.author.name}')
         
-        # 忽略机器人自己的消息
-        if message.author == self.user:
-            self.logger.debug('忽略机器人自己的消息')
-            return
-            
-        # 检查是否被@提及（检查机器人角色是否被提及）
-        bot_role_mentioned = False
-        if message.guild and self.user:
-            bot_member = message.guild.get_member(self.user.id)
-            if bot_member:
-                bot_role_mentioned = any(role in message.role_mentions for role in bot_member.roles)
-        
-        is_mentioned = (self.user and (self.user in message.mentions or 
-                       bot_role_mentioned or
-                       f'<@{self.user.id}>' in message.content or
-                       f'<@!{self.user.id}>' in message.content))
-        
-        # 检查是否在监控频道中
-        is_monitored_channel = (
-            self.config.monitor_channel_ids and 
-            str(message.channel.id) in self.config.monitor_channel_ids
-        )
+        if self.router.bot_user_id is None and self.user:
+            self.router.bind_user(self.user.id)
         
-        # 检查是否在report频道中
-        is_report_channel = self.is_report_channel(message.channel)
+        route, command_name = self.router.route(message)
+        if route == message_router.IGNORE:
+            self.logger.debug(f'消息不包含提及或股票命令: {message.content[:30]}')
+            return
         
-        # 检查命令（包括管理员命令） - 优先级最高
-        if message.content.startswith('!'):
-            command_name = message.content.split()[0][1:]  # 移除!前缀
+        if route == message_router.COMMAND:
             self.logger.info(f'检测到命令: !{command_name}')
-            
-            # 管理员命令优先处理
-            if self.has_admin_command(message.content):
-                await self.handle_admin_command(message)
-                return
-            
-            # 其他特殊命令
-            if command_name == 'cleanup_now':
-                await self.manual_cleanup_command_direct(message)
-                return
-            elif command_name == 'cleanup_status':
-                await self.cleanup_status_command_direct(message)
-                return
-            elif command_name == 'cleanup_channel':
-                await self.cleanup_specific_channel_direct(message)
-                return
-            elif command_name == 'help_admin':
-                await self.help_admin_command_direct(message)
-                return
-            else:
-                # 其他commands框架命令
-                await self.process_commands(message)
-                return
+            # 其他特殊命令，未注册的交给commands框架
+            handler = self.direct_commands.get(command_name, self.process_commands)
+            await handler(message)
+            return
         
-        # 优先处理report频道的请求 - 专门生成AI报告
-        if is_report_channel and not message.author.bot:
+        if route == message_router.REPORT:
             self.logger.info(f'在report频道 #{message.channel.name} 中检测到分析报告请求...')
-            await self.report_handler.process_report_request(message)
-        # 监控频道的@提及股票命令 - 生成图表
-        elif is_mentioned and is_monitored_channel and self.has_stock_command(message.content):
-            self.logger.info(f'在监控频道中检测到提及和股票命令，开始处理股票图表请求...')
-            await self.handle_chart_request(message)
-        # 其他@提及处理
-        elif is_mentioned:
-            # 检查是否有图片附件需要分析
-            if message.attachments and self.has_chart_image(message.attachments):
-                self.logger.info(f'检测到图表图片，开始处理图表分析...')
-                await self.handle_chart_analysis_request(message)
-            # 检查是否是预测请求
-            elif self.has_prediction_command(message.content):
-                self.logger.info(f'检测到预测请求，开始处理股票预测...')
-                await self.handle_prediction_request(message)
-            # 检查是否是股票命令（在非监控/非report频道中也支持@提及方式）
-            elif self.has_stock_command(message.content) and not is_report_channel:
-                self.logger.info(f'检测到@提及的股票命令，开始处理股票图表请求...')
-                await self.handle_chart_request(message)
-            else:
-                self.logger.info(f'检测到@提及，开始处理webhook转发...')
-                await self.handle_mention(message)
-        # 监控频道中的直接命令 - 生成图表
-        elif is_monitored_channel and self.has_stock_command(message.content):
-            self.logger.info(f'在监控频道中检测到股票命令，开始处理图表请求...')
-            await self.handle_chart_request(message)
-        elif is_monitored_channel and self.has_prediction_command(message.content):
-            self.logger.info(f'在监控频道中检测到预测请求，开始处理股票预测...')
-            await self.handle_prediction_request(message)
-        elif is_monitored_channel and message.attachments and self.has_chart_image(message.attachments):
-            self.logger.info(f'在监控频道中检测到图表图片，开始处理图表分析...')
-            await self.handle_chart_analysis_request(message)
         else:
-            self.logger.debug(f'消息不包含提及或股票命令: {message.content[:30]}')
+            self.logger.info(f'消息路由: {route}，开始处理...')
+        await self.route_handlers[route](message)
     
     async def handle_chart_request(self, message):
         """处理股票图表请求"""
@@ -199,7 +220,9 @@ class DiscordBot(commands.Bot):
             user_id = str(message.author.id)
             username = message.author.display_name or message.author.name
             
-            can_request, current_count, remaining = self.rate_limiter.check_user_limit(user_id, username)
+            can_request, current_count, remaining = await db_executor.run(
+                self.rate_limiter.check_user_limit, user_id, username
+            )
             is_exempt = remaining == 999  # 豁免用户的标识
             
             if not can_request:
@@ -210,25 +233,36 @@ class DiscordBot(commands.Bot):
                 self.logger.warning(f"用户 {username} ({user_id}) 超过每日请求限制: {current_count}/3")
                 return
             
-            # 解析命令
-            command_result = self.chart_service.parse_command(message.content)
+            # 解析命令（支持 NVDA,15m/1h/4h 多时间框架组合）
+            command_result = self.chart_service.parse_chart_request(message.content)
             if not command_result:
                 await message.channel.send(
                     f"{message.author.mention} ❌ 命令格式错误！\n" +
                     f"请使用正确格式：\n" +
                     f"• `AAPL,1h` 或 `AAPL，1h`（支持中英文逗号）\n" +
                     f"• `NASDAQ:GOOG,15m`\n" +
+                    f"• `NVDA,15m/1h/4h`（一次获取多个时间框架，最多{self.chart_service.bundle_max}个）\n" +
                     f"• 支持时间框架：1m, 5m, 15m, 30m, 1h, 2h, 4h, 6h, 12h, 1d, 1w, 1M"
                 )
                 await message.add_reaction("❌")
                 return
             
-            symbol, timeframe = command_result
+            symbol, timeframes = command_result
+            timeframe = "/".join(timeframes)
+            
+            # 组合请求按配置的配额单位计数
+            units = self.chart_bundle_quota_units if len(timeframes) > 1 else 1
+            if not is_exempt and remaining < units:
+                await message.reply(
+                    f"⚠️ {username}, 多时间框架组合请求需要 {units} 次配额，您今日仅剩 {remaining} 次。"
+                )
+                await message.add_reaction("❌")
+                return
             
             # 记录请求（在实际处理前记录，豁免用户跳过）
             if not is_exempt:
-                success = self.rate_limiter.record_request(user_id, username)
-                remaining_after = remaining - 1
+                success = await db_executor.run(self.rate_limiter.record_request, user_id, username, units)
+                remaining_after = remaining - units
                 if success:
                     self.logger.info(f"用户 {username} 请求图表，今日剩余: {remaining_after}/3")
             else:
@@ -238,20 +272,52 @@ class DiscordBot(commands.Bot):
             # 添加处理中的反应
             await message.add_reaction("⏳")
             
-            # 获取图表
+            # 获取图表（VIP请求在渲染队列中优先；需要排队时提示排队位置）
             self.logger.info(f"开始获取图表: {symbol} {timeframe}")
-            chart_data = await self.chart_service.get_chart(symbol, timeframe)
+            queue_messages = []
+            
+            async def notify_queued(position):
+                if queue_messages:
+                    return  # 组合请求只提示一次
+                queue_messages.append(await message.channel.send(
+                    f"{message.author.mention} ⏳ 当前图表请求较多，您排在第 {position} 位，请稍候"
+                ))
             
-            if chart_data:
-                # 发送私信
+            try:
+                # 组合请求的各时间框架并发获取，总耗时约等于最慢的一张
+                results = await asyncio.gather(*(
+                    self.chart_service.get_chart(
+                        symbol, interval,
+                        priority=PRIORITY_VIP if is_exempt else PRIORITY_NORMAL,
+                        on_queued=notify_queued
+                    )
+                    for interval in timeframes
+                ))
+            finally:
+                for queue_message in queue_messages:
+                    try:
+                        await queue_message.delete()
+                    except discord.HTTPException:
+                        pass
+            
+            charts = [(interval, data) for interval, data in zip(timeframes, results) if data]
+            failed_timeframes = [interval for interval, data in zip(timeframes, results) if not data]
+            
+            if charts:
+                # 发送私信（组合请求的多张图表放在同一条私信中）
                 try:
                     dm_content = self.chart_service.format_chart_dm_content(symbol, timeframe)
-                    file = discord.File(
-                        io.BytesIO(chart_data), 
-                        filename=f"{symbol}_{timeframe}.png"
-                    )
+                    if failed_timeframes:
+                        dm_content += f"\n⚠️ 以下时间框架获取失败: {', '.join(failed_timeframes)}"
+                    files = [
+                        discord.File(
+                            io.BytesIO(data),
+                            filename=f"{symbol}_{interval}.{image_pipeline.detect_extension(data)}"
+                        )
+                        for interval, data in charts
+                    ]
                     
-                    await message.author.send(content=dm_content, file=file)
+                    await message.author.send(content=dm_content, files=files)
                     
                     # 在频道中提示成功（包含剩余次数信息）
                     success_msg = self.chart_service.format_success_message(symbol, timeframe)
@@ -338,26 +404,15 @@ class DiscordBot(commands.Bot):
     
     def has_stock_command(self, content: str) -> bool:
         """检查消息是否包含股票命令格式"""
-        # 简单检查是否包含股票符号和时间框架格式
-        return bool(re.search(r'[A-Z:]+[,\s]+\d+[smhdwMy]', content, re.IGNORECASE))
+        return self.router.has_stock_command(content)
     
     def is_report_channel(self, channel) -> bool:
         """检查是否为report频道"""
-        if hasattr(self.config, 'report_channel_ids') and self.config.report_channel_ids:
-            # 如果配置了特定的report频道ID
-            return str(channel.id) in self.config.report_channel_ids
-        else:
-            # 默认检查频道名是否包含"report"
-            return channel.name and "report" in channel.name.lower()
+        return self.router.is_report_channel(channel)
     
     def has_prediction_command(self, content: str) -> bool:
         """检查消息是否包含预测请求"""
-        prediction_keywords = ['预测', 'predict', '趋势', 'trend', '分析', 'analysis', '预测分析', '走势预测']
-        content_lower = content.lower()
-        # 检查是否包含预测关键词和股票符号
-        has_keyword = any(keyword in content_lower for keyword in prediction_keywords)
-        has_symbol = bool(re.search(r'[A-Z]{2,}', content, re.IGNORECASE))
-        return has_keyword and has_symbol
+        return self.router.has_prediction_command(content)
     
     async def handle_prediction_request(self, message):
         """处理股票预测请求"""
@@ -366,7 +421,9 @@ class DiscordBot(commands.Bot):
             user_id = str(message.author.id)
             username = message.author.display_name or message.author.name
             
-            can_request, current_count, remaining = self.rate_limiter.check_user_limit(user_id, username)
+            can_request, current_count, remaining = await db_executor.run(
+                self.rate_limiter.check_user_limit, user_id, username
+            )
             is_exempt = remaining == 999  # 豁免用户的标识
             
             if not can_request:
@@ -377,23 +434,21 @@ class DiscordBot(commands.Bot):
                 self.logger.warning(f"用户 {username} ({user_id}) 超过每日请求限制: {current_count}/3")
                 return
                 
-            # 从消息中提取股票符号
-            symbol_match = re.search(r'([A-Z][A-Z:]*[A-Z]+)', message.content, re.IGNORECASE)
-            if not symbol_match:
+            # 从消息中提取股票符号（通过注册表校验，忽略预测关键词）
+            symbol = symbol_registry.find_symbol(message.content, exclude=self.PREDICTION_KEYWORDS)
+            if not symbol:
                 await message.channel.send(
                     f"{message.author.mention} 请提供有效的股票符号，例如：`@bot 预测 AAPL 趋势`"
                 )
                 return
             
-            symbol = symbol_match.group(1).upper()
-            
             # 使用chart_service的交易所映射逻辑
             # 这将在chart_service.get_chart()中自动处理
             pass
             
             # 记录请求（在实际处理前记录，豁免用户跳过）
             if not is_exempt:
-                success = self.rate_limiter.record_request(user_id, username)
+                success = await db_executor.run(self.rate_limiter.record_request, user_id, username)
                 remaining_after = remaining - 1
                 if success:
                     self.logger.info(f"用户 {username} 请求预测，今日剩余: {remaining_after}/3")
@@ -460,14 +515,7 @@ class DiscordBot(commands.Bot):
     
     def has_chart_image(self, attachments) -> bool:
         """检查附件中是否包含图表图片"""
-        for attachment in attachments:
-            # 检查文件扩展名
-            filename = attachment.filename.lower()
-            if filename.endswith(('.png', '.jpg', '.jpeg')):
-                # 检查文件大小（避免过大的文件）
-                if attachment.size < 10 * 1024 * 1024:  # 10MB限制
-                    return True
-        return False
+        return self.router.has_chart_image(attachments)
     
     async def handle_chart_analysis_request(self, message):
         """处理图表分析请求"""
@@ -476,7 +524,9 @@ class DiscordBot(commands.Bot):
             user_id = str(message.author.id)
             username = message.author.display_name or message.author.name
             
-            can_request, current_count, remaining = self.rate_limiter.check_user_limit(user_id, username)
+            can_request, current_count, remaining = await db_executor.run(
+                self.rate_limiter.check_user_limit, user_id, username
+            )
             is_exempt = remaining == 999  # 豁免用户的标识
             
             if not can_request:
@@ -524,7 +574,7 @@ class DiscordBot(commands.Bot):
             
             # 记录请求（在实际处理前记录，豁免用户跳过）
             if not is_exempt:
-                success = self.rate_limiter.record_request(user_id, username)
+                success = await db_executor.run(self.rate_limiter.record_request, user_id, username)
                 remaining_after = remaining - 1
                 if success:
                     self.logger.info(f"用户 {username} 请求图表分析，今日剩余: {remaining_after}/3")
@@ -591,9 +641,7 @@ class DiscordBot(commands.Bot):
     
     def has_admin_command(self, content: str) -> bool:
         """检查消息是否包含管理员命令"""
-        admin_commands = ['!vip_add', '!vip_remove', '!vip_list', '!quota', '!help_admin', '!exempt_add', '!exempt_remove', '!exempt_list']
-        content_lower = content.lower().strip()
-        return any(content_lower.startswith(cmd) for cmd in admin_commands)
+        return self.router.has_admin_command(content)
     
     def is_admin_user(self, user_id: str) -> bool:
         """检查用户是否有管理员权限"""
@@ -638,6 +686,8 @@ class DiscordBot(commands.Bot):
                 await self.handle_quota_command(message, content)
             elif content.lower().startswith('!help_admin'):
                 await self.handle_admin_help_command(message)
+            elif content.lower().startswith('!loop_stats'):
+                await self.handle_loop_stats_command(message)
             
         except Exception as e:
             self.logger.error(f"处理管理员命令失败: {e}")
@@ -660,12 +710,9 @@ class DiscordBot(commands.Bot):
                 return
             
             # 检查用户是否已经是VIP
-            from models import ExemptUser, get_db_session
-            db = get_db_session()
-            existing_user = db.query(ExemptUser).filter(ExemptUser.user_id == target_user_id).first()
+            existing_user = await db_executor.run(self.rate_limiter.get_exempt_user, target_user_id)
             
             if existing_user:
-                db.close()
                 await message.reply(f"⚠️ 用户 {target_user_id} 已经是VIP用户")
                 return
             
@@ -678,17 +725,14 @@ class DiscordBot(commands.Bot):
             except:
                 pass
             
-            # 添加到豁免列表
-            new_exempt = ExemptUser(
-                user_id=target_user_id,
-                username=target_username,
-                reason=reason,
-                added_by=str(message.author.id)
+            # 添加到豁免列表（同时刷新豁免缓存）
+            success = await db_executor.run(
+                self.rate_limiter.add_exempt_user,
+                target_user_id, target_username, reason, str(message.author.id)
             )
-            
-            db.add(new_exempt)
-            db.commit()
-            db.close()
+            if not success:
+                await message.reply("❌ 添加VIP用户时发生错误")
+                return
             
             self.logger.info(f"管理员 {message.author.name} 添加VIP用户: {target_user_id}")
             await message.reply(f"✅ 成功添加VIP用户！\n**用户ID:** {target_user_id}\n**用户名:** {target_username}\n**原因:** {reason}")
@@ -712,20 +756,18 @@ class DiscordBot(commands.Bot):
                 await message.reply("❌ 用户ID格式错误！请提供有效的Discord用户ID")
                 return
             
-            # 查找并删除用户
-            from models import ExemptUser, get_db_session
-            db = get_db_session()
-            exempt_user = db.query(ExemptUser).filter(ExemptUser.user_id == target_user_id).first()
+            # 查找并删除用户（同时刷新豁免缓存）
+            exempt_user = await db_executor.run(self.rate_limiter.get_exempt_user, target_user_id)
             
             if not exempt_user:
-                db.close()
                 await message.reply(f"⚠️ 用户 {target_user_id} 不在VIP列表中")
                 return
             
-            username = exempt_user.username
-            db.delete(exempt_user)
-            db.commit()
-            db.close()
+            username = exempt_user['username']
+            success = await db_executor.run(self.rate_limiter.remove_exempt_user, target_user_id)
+            if not success:
+                await message.reply("❌ 移除VIP用户时发生错误")
+                return
             
             self.logger.info(f"管理员 {message.author.name} 移除VIP用户: {target_user_id}")
             await message.reply(f"✅ 成功移除VIP用户！\n**用户ID:** {target_user_id}\n**用户名:** {username}")
@@ -737,10 +779,7 @@ class DiscordBot(commands.Bot):
     async def handle_vip_list_command(self, message):
         """处理VIP列表命令: !vip_list"""
         try:
-            from models import ExemptUser, get_db_session
-            db = get_db_session()
-            exempt_users = db.query(ExemptUser).order_by(ExemptUser.created_at).all()
-            db.close()
+            exempt_users = await db_executor.run(self.rate_limiter.list_exempt_users)
             
             if not exempt_users:
                 await message.reply("📋 当前没有VIP用户")
@@ -748,10 +787,10 @@ class DiscordBot(commands.Bot):
             
             vip_list = "📋 **VIP用户列表：**\n\n"
             for i, user in enumerate(exempt_users, 1):
-                created_date = user.created_at.strftime("%Y-%m-%d")
-                vip_list += f"**{i}.** `{user.user_id}`\n"
-                vip_list += f"   • 用户名: {user.username}\n"
-                vip_list += f"   • 原因: {user.reason}\n"
+                created_date = user['created_at'][:10]
+                vip_list += f"**{i}.** `{user['user_id']}`\n"
+                vip_list += f"   • 用户名: {user['username']}\n"
+                vip_list += f"   • 原因: {user['reason']}\n"
                 vip_list += f"   • 添加时间: {created_date}\n\n"
             
             # 分割长消息
@@ -761,10 +800,10 @@ class DiscordBot(commands.Bot):
                 current_part = "📋 **VIP用户列表：**\n\n"
                 
                 for i, user in enumerate(exempt_users, 1):
-                    created_date = user.created_at.strftime("%Y-%m-%d")
-                    user_info = f"**{i}.** `{user.user_id}`\n"
-                    user_info += f"   • 用户名: {user.username}\n"
-                    user_info += f"   • 原因: {user.reason}\n"
+                    created_date = user['created_at'][:10]
+                    user_info = f"**{i}.** `{user['user_id']}`\n"
+                    user_info += f"   • 用户名: {user['username']}\n"
+                    user_info += f"   • 原因: {user['reason']}\n"
                     user_info += f"   • 添加时间: {created_date}\n\n"
                     
                     if len(current_part + user_info) > 1800:
@@ -815,7 +854,9 @@ class DiscordBot(commands.Bot):
                 return
             
             # 检查配额
-            can_request, current_count, remaining = self.rate_limiter.check_user_limit(target_user_id, target_username)
+            can_request, current_count, remaining = await db_executor.run(
+                self.rate_limiter.check_user_limit, target_user_id, target_username
+            )
             is_vip = remaining == 999
             
             if is_vip:
@@ -849,6 +890,9 @@ class DiscordBot(commands.Bot):
 • `!quota` - 查看自己的配额
 • `!quota <用户ID>` - 查看指定用户配额
 
+**运行状态命令:**
+• `!loop_stats` - 查看事件循环延迟直方图和最近的卡顿位置
+
 **其他命令:**
 • `!help_admin` - 显示此帮助信息
 
@@ -863,6 +907,199 @@ class DiscordBot(commands.Bot):
         
         await message.reply(help_text)
         
+    async def handle_loop_stats_command(self, message):
+        """处理事件循环监测命令: !loop_stats"""
+        try:
+            stats = loop_watchdog.get_stats(include_stacks=False)
+            if not stats['running']:
+                await message.reply("⚠️ 事件循环监测未运行（LOOP_WATCHDOG_ENABLED=false）")
+                return
+            
+            histogram_lines = "\n".join(
+                f"{bucket:>9} {count}" for bucket, count in stats['histogram'].items() if count
+            )
+            status_msg = (
+                f"⏱️ **事件循环监测**\n"
+                f"• 样本: {stats['samples']}（间隔 {stats['interval_ms']}ms）\n"
+                f"• 延迟: 平均 {stats['avg_lag_ms']}ms, P50≤{stats['p50_lag_ms']}ms, "
+                f"P99≤{stats['p99_lag_ms']}ms, 最大 {stats['max_lag_ms']}ms\n"
+                f"• 卡顿（≥{stats['threshold_ms']}ms）: {stats['stall_count']} 次\n"
+                f"```\n{histogram_lines or '暂无数据'}\n```"
+            )
+            
+            recent = stats['recent_stalls'][-5:]
+            if recent:
+                status_msg += "**最近卡顿:**\n" + "\n".join(
+                    f"• {stall['at']} {stall['lag_ms']:.0f}ms - `{stall['location'][:120]}`"
+                    for stall in reversed(recent)
+                )
+            
+            await message.reply(status_msg[:2000])
+            
+        except Exception as e:
+            self.logger.error(f"处理事件循环监测命令失败: {e}")
+            await message.reply("❌ 查询事件循环监测时发生错误")
+    
+    async def send_alert_dm(self, user_id: str, text: str):
+        """发送提醒私信（私信频道由discord.py缓存，不需要先获取用户信息）"""
+        channel = await self.create_dm(discord.Object(id=int(user_id)))
+        await channel.send(text)
+    
+    async def handle_subscribe_command(self, message):
+        """处理订阅命令: !subscribe <代码> [时间框架] [trade|close|pma|state ...]"""
+        try:
+            symbol, timeframe, event_types = parse_subscription_args(message.content.split()[1:])
+        except ValueError as e:
+            await message.reply(
+                f"❌ {e}\n格式: `!subscribe <代码> [时间框架] [{'|'.join(EVENT_TYPES)}]`，例如 `!subscribe NVDA 15m trade`"
+            )
+            return
+        
+        try:
+            user_id = str(message.author.id)
+            username = message.author.display_name or message.author.name
+            added, error = await self.alert_subscriptions.subscribe(user_id, username, symbol, timeframe, event_types)
+            if error:
+                await message.reply(f"❌ {error}")
+                return
+            
+            timeframe_text = '所有时间框架' if timeframe == ALL_TIMEFRAMES else timeframe
+            events_text = '、'.join(EVENT_TYPES[event_type] for event_type in event_types)
+            if added:
+                await message.reply(f"✅ 已订阅 **{symbol}** {timeframe_text} 的{events_text}，触发时会私信通知您")
+            else:
+                await message.reply(f"ℹ️ 您已订阅 **{symbol}** {timeframe_text} 的{events_text}")
+            
+        except Exception as e:
+            self.logger.error(f"处理订阅命令失败: {e}")
+            await message.reply("❌ 订阅失败，请稍后重试")
+    
+    async def handle_unsubscribe_command(self, message):
+        """处理取消订阅命令: !unsubscribe [代码] [时间框架] [事件类型]，不带参数时取消全部"""
+        try:
+            args = message.content.split()[1:]
+            symbol = timeframe = event_types = None
+            if args:
+                symbol, timeframe, event_types = parse_subscription_args(args)
+                # 未显式指定的条件不作为过滤
+                if all(arg.lower() in EVENT_TYPES for arg in args[1:]):
+                    timeframe = None
+                if not any(arg.lower() in EVENT_TYPES for arg in args[1:]):
+                    event_types = None
+        except ValueError as e:
+            await message.reply(f"❌ {e}\n格式: `!unsubscribe [代码] [时间框架] [事件类型]`")
+            return
+        
+        try:
+            removed = await self.alert_subscriptions.unsubscribe(str(message.author.id), symbol, timeframe, event_types)
+            if removed:
+                await message.reply(f"✅ 已取消 {removed} 条订阅")
+            else:
+                await message.reply("ℹ️ 没有匹配的订阅")
+        except Exception as e:
+            self.logger.error(f"处理取消订阅命令失败: {e}")
+            await message.reply("❌ 取消订阅失败，请稍后重试")
+    
+    async def handle_subscriptions_command(self, message):
+        """查看自己的订阅: !subscriptions"""
+        subscriptions = self.alert_subscriptions.list_for_user(str(message.author.id))
+        if not subscriptions:
+            await message.reply("ℹ️ 您还没有订阅任何提醒，使用 `!subscribe NVDA 15m trade` 订阅")
+            return
+        
+        lines = [
+            f"• **{symbol}** {'所有时间框架' if timeframe == ALL_TIMEFRAMES else timeframe} - {EVENT_TYPES.get(event_type, event_type)}"
+            for symbol, timeframe, event_type in subscriptions
+        ]
+        await message.reply(f"🔔 **您的提醒订阅** ({len(subscriptions)}/{self.alert_subscriptions.max_per_user})\n" + "\n".join(lines))
+    
+    async def handle_rule_command(self, message):
+        """处理添加规则命令: !rule <代码> [时间框架]: <条件>"""
+        usage = ("格式: `!rule <代码> [时间框架]: <条件>`，例如 "
+                 "`!rule NVDA 1h: BullishTrendRating+BullishOscRating > 8 and PMA Strong Bullish`")
+        try:
+            symbol, timeframe, expression = parse_rule_command(message.content.partition(' ')[2])
+        except ValueError as e:
+            await message.reply(f"❌ {e}\n{usage}")
+            return
+        
+        try:
+            user_id = str(message.author.id)
+            username = message.author.display_name or message.author.name
+            rule, error = await self.alert_rules.add(user_id, username, symbol, timeframe, expression)
+            if error:
+                await message.reply(f"❌ {error}\n{usage}")
+                return
+            
+            timeframe_text = '所有时间框架' if timeframe == ALL_TIMEFRAMES else timeframe
+            fields_text = '、'.join(FIELD_NAMES[name] for name in sorted(rule.fields))
+            await message.reply(
+                f"✅ 已添加规则 #{rule.rule_id}: **{symbol}** {timeframe_text} `{expression}`\n"
+                f"引用字段: {fields_text}，条件由不满足变为满足时会私信通知您"
+            )
+            
+        except Exception as e:
+            self.logger.error(f"处理规则命令失败: {e}")
+            await message.reply("❌ 添加规则失败，请稍后重试")
+    
+    async def handle_rules_command(self, message):
+        """查看自己的规则: !rules"""
+        rules = self.alert_rules.list_for_user(str(message.author.id))
+        if not rules:
+            await message.reply("ℹ️ 您还没有添加规则，使用 `!rule NVDA 1h: BullishTrendRating > 4` 添加")
+            return
+        
+        lines = [
+            f"• #{rule.rule_id} **{rule.symbol}** {'所有时间框架' if rule.timeframe == ALL_TIMEFRAMES else rule.timeframe} `{rule.expression}`"
+            for rule in rules
+        ]
+        await message.reply(f"📐 **您的提醒规则** ({len(rules)}/{self.alert_rules.max_per_user})\n" + "\n".join(lines))
+    
+    async def handle_unrule_command(self, message):
+        """处理删除规则命令: !unrule <规则ID>"""
+        args = message.content.split()[1:]
+        if len(args) != 1 or not args[0].lstrip('#').isdigit():
+            await message.reply("❌ 格式: `!unrule <规则ID>`，规则ID可通过 `!rules` 查看")
+            return
+        
+        try:
+            rule_id = int(args[0].lstrip('#'))
+            if await self.alert_rules.remove(str(message.author.id), rule_id):
+                await message.reply(f"✅ 已删除规则 #{rule_id}")
+            else:
+                await message.reply(f"ℹ️ 没有找到您的规则 #{rule_id}")
+        except Exception as e:
+            self.logger.error(f"处理删除规则命令失败: {e}")
+            await message.reply("❌ 删除规则失败，请稍后重试")
+    
+    async def handle_screen_command(self, message):
+        """处理选股命令: !screen [时间框架] <条件> [sort=字段]"""
+        usage = ("格式: `!screen [时间框架] <条件> [sort=字段]`，例如 "
+                 "`!screen 1h MAtrend=1 and MAtrend_timeframe1=1 and MAtrend_timeframe2=1 and SQZsignal!=squeeze sort=BullishTrendRating`")
+        timeframe, expression, sort_by, ascending = parse_screen_command(message.content.partition(' ')[2])
+        if not expression and not sort_by:
+            await message.reply(f"ℹ️ {usage}")
+            return
+        
+        try:
+            result = screener.screen(expression, timeframe, sort_by, ascending, limit=15)
+        except RuleSyntaxError as e:
+            await message.reply(f"❌ {e}\n{usage}")
+            return
+        except Exception as e:
+            self.logger.error(f"处理选股命令失败: {e}")
+            await message.reply("❌ 选股失败，请稍后重试")
+            return
+        
+        if not result['matches']:
+            await message.reply(f"ℹ️ 没有符合条件的股票（{result['elapsed_us']:.0f}µs）")
+            return
+        
+        header = f"🔎 **选股结果** {result['matches']} 个（显示前 {len(result['results'])} 个，{result['elapsed_us']:.0f}µs）\n"
+        table = "\n".join(screener.format_results(result))
+        legend = "评级: 多头趋势/多头震荡/空头趋势/空头震荡"
+        await message.reply(f"{header}```\n{table}\n```{legend}"[:2000])
+    
     async def handle_mention(self, message):
         """处理@提及的消息"""
         try:
@@ -871,15 +1108,15 @@ class DiscordBot(commands.Bot):
             # 构建消息数据
             message_data = await self.build_message_data(message)
             
-            # 发送到webhook
-            success = await self.webhook_handler.send_message(message_data)
+            # 写入webhook发件箱（后台投递，不阻塞消息处理）
+            success = await self.webhook_handler.enqueue_message(message_data)
             
             if success:
-                self.logger.info(f'成功转发消息到webhook: {message.id}')
+                self.logger.info(f'消息已进入webhook发件箱: {message.id}')
                 # 添加反应表示处理成功
                 await message.add_reaction('✅')
             else:
-                self.logger.error(f'转发消息到webhook失败: {message.id}')
+                self.logger.error(f'写入webhook发件箱失败: {message.id}')
                 await message.add_reaction('❌')
                 
         except Exception as e:
@@ -962,63 +1199,9 @@ class DiscordBot(commands.Bot):
         return message_data
     
     async def collect_detailed_channel_info(self, channel):
-        """收集详细的频道信息"""
+        """收集详细的频道信息（来自频道快照）"""
         try:
-            channel_info = {
-                'id': channel.id,
-                'name': channel.name,
-                'type': str(channel.type),
-                'created_at': channel.created_at.isoformat() if channel.created_at else None,
-                'category': None,
-                'position': getattr(channel, 'position', None),
-                'topic': getattr(channel, 'topic', None),
-                'nsfw': getattr(channel, 'nsfw', False),
-                'permissions': {},
-                'member_count': None,
-                'slowmode_delay': getattr(channel, 'slowmode_delay', 0),
-                'guild_id': channel.guild.id if hasattr(channel, 'guild') and channel.guild else None
-            }
-            
-            # 获取分类信息
-            if hasattr(channel, 'category') and channel.category:
-                channel_info['category'] = {
-                    'id': channel.category.id,
-                    'name': channel.category.name,
-                    'position': channel.category.position
-                }
-            
-            # 获取权限信息（针对文字频道）
-            if hasattr(channel, 'guild') and channel.guild and self.user:
-                try:
-                    # 获取机器人在该频道的权限
-                    bot_member = channel.guild.get_member(self.user.id)
-                    if bot_member:
-                        perms = channel.permissions_for(bot_member)
-                        channel_info['permissions'] = {
-                            'read_messages': perms.read_messages,
-                            'send_messages': perms.send_messages,
-                            'manage_messages': perms.manage_messages,
-                            'embed_links': perms.embed_links,
-                            'attach_files': perms.attach_files,
-                            'read_message_history': perms.read_message_history,
-                            'add_reactions': perms.add_reactions,
-                            'use_external_emojis': perms.use_external_emojis
-                        }
-                except Exception as e:
-                    self.logger.debug(f"获取频道权限时出错: {e}")
-            
-            # 获取成员数量（针对语音频道）
-            if hasattr(channel, 'members'):
-                channel_info['member_count'] = len(channel.members)
-                channel_info['members'] = [
-                    {
-                        'id': member.id,
-                        'name': member.name if member else None,
-                        'display_name': member.display_name if member else None
-                    } for member in channel.members[:10] if member  # 限制最多10个成员信息
-                ]
-            
-            return channel_info
+            return self.guild_snapshots.channel_info(channel)
             
         except Exception as e:
             self.logger.error(f"收集频道信息时出错: {e}")
@@ -1030,71 +1213,12 @@ class DiscordBot(commands.Bot):
             }
     
     async def collect_guild_info(self, guild):
-        """收集详细的服务器信息"""
+        """收集详细的服务器信息（来自服务器快照，由网关事件增量更新）"""
         if not guild:
             return None
             
         try:
-            guild_info = {
-                'id': guild.id,
-                'name': guild.name,
-                'owner_id': guild.owner_id,
-                'member_count': guild.member_count,
-                'created_at': guild.created_at.isoformat() if guild.created_at else None,
-                'verification_level': str(guild.verification_level),
-                'explicit_content_filter': str(guild.explicit_content_filter),
-                'default_notifications': str(getattr(guild, 'default_message_notifications', 'unknown')),
-                'features': list(guild.features),
-                'boost_level': guild.premium_tier,
-                'boost_count': guild.premium_subscription_count or 0,
-                'icon_url': str(guild.icon.url) if guild.icon else None,
-                'banner_url': str(guild.banner.url) if guild.banner else None,
-                'channels': {
-                    'total': len(guild.channels),
-                    'text': len([c for c in guild.channels if c.type.name == 'text']),
-                    'voice': len([c for c in guild.channels if c.type.name == 'voice']),
-                    'categories': len([c for c in guild.channels if c.type.name == 'category'])
-                },
-                'roles_count': len(guild.roles),
-                'emojis_count': len(guild.emojis),
-                'region': getattr(guild, 'region', 'unknown')
-            }
-            
-            # 获取活跃成员信息（最近在线的前5位）
-            active_members = []
-            try:
-                for member in guild.members[:5]:  # 限制数量
-                    if not member.bot:
-                        active_members.append({
-                            'id': member.id,
-                            'name': member.name,
-                            'display_name': member.display_name,
-                            'status': str(member.status) if hasattr(member, 'status') else 'unknown',
-                            'joined_at': member.joined_at.isoformat() if member.joined_at else None
-                        })
-                guild_info['active_members'] = active_members
-            except Exception as e:
-                self.logger.debug(f"获取活跃成员时出错: {e}")
-            
-            # 获取服务器统计信息
-            try:
-                if hasattr(guild, 'members') and guild.members:
-                    guild_info['statistics'] = {
-                        'online_members': sum(1 for m in guild.members if hasattr(m, 'status') and m.status != discord.Status.offline),
-                        'bot_count': sum(1 for m in guild.members if m.bot),
-                        'human_count': sum(1 for m in guild.members if not m.bot)
-                    }
-                else:
-                    guild_info['statistics'] = {
-                        'online_members': 0,
-                        'bot_count': 0,
-                        'human_count': guild.member_count or 0
-                    }
-            except Exception as e:
-                self.logger.debug(f"计算服务器统计时出错: {e}")
-                guild_info['statistics'] = {'error': str(e)}
-            
-            return guild_info
+            return self.guild_snapshots.guild_info(guild)
             
         except Exception as e:
             self.logger.error(f"收集服务器信息时出错: {e}")
@@ -1203,7 +1327,9 @@ class DiscordBot(commands.Bot):
         username = ctx.author.display_name or ctx.author.name
         
         # 检查是否为豁免用户
-        can_request, current_count, remaining = self.rate_limiter.check_user_limit(user_id, username)
+        can_request, current_count, remaining = await db_executor.run(
+            self.rate_limiter.check_user_limit, user_id, username
+        )
         if remaining == 999:  # 豁免用户
             embed = discord.Embed(
                 title="🌟 豁免用户状态",
@@ -1215,7 +1341,7 @@ class DiscordBot(commands.Bot):
             await ctx.send(embed=embed)
             return
         
-        stats = self.rate_limiter.get_user_stats(user_id)
+        stats = await db_executor.run(self.rate_limiter.get_user_stats, user_id)
         if stats:
             embed = discord.Embed(
                 title="📊 每日请求配额",
@@ -1249,8 +1375,8 @@ class DiscordBot(commands.Bot):
         except:
             username = f"User_{user_id}"
             
-        success = self.rate_limiter.add_exempt_user(
-            user_id, username, reason, str(ctx.author.id)
+        success = await db_executor.run(
+            self.rate_limiter.add_exempt_user, user_id, username, reason, str(ctx.author.id)
         )
         
         if success:
@@ -1262,7 +1388,7 @@ class DiscordBot(commands.Bot):
     @commands.has_permissions(administrator=True)
     async def remove_exempt_user(self, ctx: commands.Context, user_id: str):
         """移除豁免用户（仅管理员）"""
-        success = self.rate_limiter.remove_exempt_user(user_id)
+        success = await db_executor.run(self.rate_limiter.remove_exempt_user, user_id)
         
         if success:
             await ctx.send(f"✅ 成功移除豁免用户: `{user_id}`")
@@ -1273,7 +1399,12 @@ class DiscordBot(commands.Bot):
     @commands.has_permissions(administrator=True)
     async def list_exempt_users(self, ctx: commands.Context):
         """查看所有豁免用户（仅管理员）"""
-        exempt_users = self.rate_limiter.list_exempt_users()
+        try:
+            exempt_users = await db_executor.run(self.rate_limiter.list_exempt_users)
+        except Exception as e:
+            self.logger.error(f"获取豁免用户列表失败: {e}")
+            await ctx.send("❌ 获取豁免用户列表时发生错误")
+            return
         
         if not exempt_users:
             await ctx.send("📋 当前没有豁免用户")
@@ -1454,6 +1585,29 @@ class DiscordBot(commands.Bot):
         
         await message.channel.send(embed=embed)
 
+    def add_exempt_cache_field(self, embed):
+        """在状态embed中添加豁免用户缓存信息"""
+        stats = self.rate_limiter.get_exempt_cache_stats()
+        
+        if stats['age_seconds'] is None:
+            age_text = "尚未加载"
+        else:
+            age_text = f"{int(stats['age_seconds'])} 秒前"
+        
+        value = (f"缓存用户数: {stats['size']}\n"
+                 f"最近刷新: {age_text}\n"
+                 f"刷新次数: {stats['refresh_count']} (定时间隔 {stats['refresh_interval']} 秒, "
+                 f"{'运行中' if stats['is_running'] else '未运行'})")
+        
+        recent_events = stats['recent_events'][-3:]
+        if recent_events:
+            value += "\n最近事件:"
+            for event in reversed(recent_events):
+                status = "✅" if event['success'] else "❌"
+                value += f"\n{status} {event['time'].strftime('%H:%M:%S')} {event['source']} ({event['size']}人)"
+        
+        embed.add_field(name="👑 豁免用户缓存", value=value, inline=False)
+
     async def cleanup_status_command_direct(self, message):
         """直接处理清理状态命令"""
         # 检查管理员权限
@@ -1486,6 +1640,8 @@ class DiscordBot(commands.Bot):
                 inline=False
             )
             
+            self.add_exempt_cache_field(embed)
+            
             await message.channel.send(embed=embed)
             
         except Exception as e:
@@ -1562,6 +1718,8 @@ class DiscordBot(commands.Bot):
                     inline=False
                 )
             
+            self.add_exempt_cache_field(embed)
+            
             embed.set_footer(text="每日自动清理时间: 凌晨2点 (UTC)")
             await ctx.send(embed=embed)
             
@@ -1611,6 +1769,12 @@ class DiscordBot(commands.Bot):
             name="📊 其他命令",
             value=(
                 "`!quota` - 查看配额状态\n"
+                "`!subscribe <代码> [时间框架] [trade|close|pma|state]` - 订阅提醒私信\n"
+                "`!unsubscribe [代码]` - 取消订阅\n"
+                "`!subscriptions` - 查看我的订阅\n"
+                "`!rule <代码> [时间框架]: <条件>` - 添加提醒规则\n"
+                "`!rules` / `!unrule <ID>` - 查看/删除我的规则\n"
+                "`!screen [时间框架] <条件> [sort=字段]` - 按最新指标状态选股\n"
                 "`!ping` - 测试机器人延迟\n"
                 "`!info` - 查看机器人信息"
             ),
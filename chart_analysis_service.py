@@ -3,13 +3,13 @@
 处理用户上传的TradingView图表图片分析
 """
 
-import aiohttp
 import logging
 import base64
 import io
 from typing import Dict, Optional, List
 from datetime import datetime
 import re
+from http_client import http_client
 
 class ChartAnalysisService:
     """图表分析服务类"""
@@ -39,10 +39,10 @@ class ChartAnalysisService:
     async def download_image(self, image_url: str) -> Optional[bytes]:
         """下载图片数据"""
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get(image_url) as response:
-                    if response.status == 200:
-                        return await response.read()
+            session = http_client.get_session()
+            async with session.get(image_url, timeout=http_client.timeout('download')) as response:
+                if response.status == 200:
+                    return await response.read()
             return None
         except Exception as e:
             self.logger.error(f"下载图片失败: {e}")
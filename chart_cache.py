@@ -0,0 +1,247 @@
+"""
+图表图片缓存
+按 (交易所代码, 时间框架, 布局ID, 变体, K线时间段) 缓存chart-img的图表（原始PNG或按输出格式后处理后的图片），
+同一根K线内的重复请求直接返回缓存图片。磁盘存储，内存索引，按总大小LRU淘汰
+"""
+
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+
+class ChartImageCache:
+    """磁盘LRU图表缓存"""
+
+    # 缓存文件后缀（内容可能是PNG/WebP/JPEG）；.png为旧版本写入的文件，启动时一并加载
+    FILE_SUFFIX = '.img'
+    LOADABLE_SUFFIXES = ('.img', '.png')
+
+    # 每根K线的秒数（键为normalize_timeframe的输出）
+    BAR_SECONDS = {
+        '1m': 60, '5m': 300, '15m': 900, '30m': 1800,
+        '1h': 3600, '2h': 7200, '4h': 14400, '6h': 21600, '12h': 43200,
+        '1D': 86400, '1W': 604800, '1M': 2592000
+    }
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: Optional[int] = None,
+                 max_bucket_seconds: Optional[int] = None, stale_while_revalidate: Optional[bool] = None):
+        """
+        初始化缓存
+
+        Args:
+            cache_dir: 缓存目录，默认CHART_CACHE_DIR
+            max_bytes: 磁盘占用上限，默认CHART_CACHE_MAX_MB
+            max_bucket_seconds: 时间段上限，日线及以上的图表最多缓存这么久（当前K线仍在变化）
+            stale_while_revalidate: 是否在新K线开始后先返回上一时间段的图表并后台刷新
+        """
+        self.logger = logging.getLogger(__name__)
+        self.cache_dir = cache_dir or os.getenv('CHART_CACHE_DIR', 'chart_cache')
+        self.max_bytes = max_bytes or int(float(os.getenv('CHART_CACHE_MAX_MB', '200')) * 1024 * 1024)
+        self.max_bucket_seconds = max_bucket_seconds or int(os.getenv('CHART_CACHE_MAX_BUCKET_SECONDS', '3600'))
+        if stale_while_revalidate is None:
+            stale_while_revalidate = os.getenv('CHART_CACHE_SWR', 'true').lower() in ('1', 'true', 'yes')
+        self.stale_while_revalidate = stale_while_revalidate
+
+        # 内存索引: 基础键 -> {'bucket', 'path', 'size', 'created_at'}，按访问顺序排列
+        # 每个基础键只保留最新时间段的图片，旧时间段的图片没有复用价值
+        self._index = OrderedDict()
+        self.total_bytes = 0
+
+        # 统计
+        self.fresh_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.stores = 0
+        self.evictions = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+    # ---- 键和时间段 ----
+
+    def bucket_seconds(self, interval: str) -> int:
+        """时间段长度：K线周期，最长不超过max_bucket_seconds"""
+        return min(self.BAR_SECONDS.get(interval, 3600), self.max_bucket_seconds)
+
+    def bar_bucket(self, interval: str, now: Optional[float] = None) -> int:
+        """当前时间所在的K线时间段编号"""
+        return int((now if now is not None else time.time()) // self.bucket_seconds(interval))
+
+    @staticmethod
+    def make_key(exchange_symbol: str, interval: str, layout_id: Optional[str],
+                 variant: Optional[str] = None) -> str:
+        """基础缓存键（不含时间段），同时用作文件名前缀；variant为None表示原始PNG"""
+        raw = f"{exchange_symbol}__{interval}__{layout_id or 'default'}"
+        if variant:
+            raw = f"{raw}__{variant}"
+        return re.sub(r'[^A-Za-z0-9_.-]', '_', raw)
+
+    def _path_for(self, key: str, bucket: int) -> str:
+        return os.path.join(self.cache_dir, f"{key}__{bucket}{self.FILE_SUFFIX}")
+
+    def _load_index(self):
+        """启动时扫描缓存目录重建索引（按修改时间作为LRU顺序）"""
+        entries = []
+        for filename in os.listdir(self.cache_dir):
+            stem, suffix = os.path.splitext(filename)
+            if suffix not in self.LOADABLE_SUFFIXES or '__' not in stem:
+                continue
+            key, _, bucket = stem.rpartition('__')
+            if not bucket.isdigit():
+                continue
+            path = os.path.join(self.cache_dir, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, key, int(bucket), path, stat.st_size))
+
+        for mtime, key, bucket, path, size in sorted(entries):
+            previous = self._index.get(key)
+            if previous is not None:
+                self._remove_file(previous['path'])
+                self.total_bytes -= previous['size']
+            self._index[key] = {'bucket': bucket, 'path': path, 'size': size, 'created_at': mtime}
+            self._index.move_to_end(key)
+            self.total_bytes += size
+
+        self._remove_files(self._evict())
+        if self._index:
+            self.logger.info(f"图表缓存已加载: {len(self._index)} 个图片, {self.total_bytes / 1024 / 1024:.1f}MB")
+
+    # ---- 读写 ----
+
+    async def get(self, exchange_symbol: str, interval: str, layout_id: Optional[str],
+                  variant: Optional[str] = None) -> Tuple[Optional[bytes], Optional[str]]:
+        """
+        查找缓存
+
+        Returns:
+            (图片数据, 状态)，状态为 'fresh'（当前时间段）、'stale'（上一时间段，需后台刷新）或 None（未命中）
+        """
+        key = self.make_key(exchange_symbol, interval, layout_id, variant)
+        entry = self._index.get(key)
+        current_bucket = self.bar_bucket(interval)
+
+        if entry is None:
+            self.misses += 1
+            return None, None
+
+        if entry['bucket'] == current_bucket:
+            state = 'fresh'
+        elif self.stale_while_revalidate and entry['bucket'] == current_bucket - 1:
+            state = 'stale'
+        else:
+            self.misses += 1
+            return None, None
+
+        try:
+            data = await asyncio.to_thread(self._read_file, entry['path'])
+        except OSError as e:
+            self.logger.warning(f"读取图表缓存失败，已移除: {entry['path']} - {e}")
+            self._drop(key)
+            self.misses += 1
+            return None, None
+
+        self._index.move_to_end(key)
+        self.bytes_saved += len(data)
+        if state == 'fresh':
+            self.fresh_hits += 1
+        else:
+            self.stale_hits += 1
+        return data, state
+
+    def is_fresh(self, exchange_symbol: str, interval: str, layout_id: Optional[str],
+                 variant: Optional[str] = None) -> bool:
+        """是否已缓存当前时间段的图表（不读取文件、不计入命中统计）"""
+        entry = self._index.get(self.make_key(exchange_symbol, interval, layout_id, variant))
+        return entry is not None and entry['bucket'] == self.bar_bucket(interval)
+
+    async def put(self, exchange_symbol: str, interval: str, layout_id: Optional[str], data: bytes,
+                  variant: Optional[str] = None):
+        """写入当前时间段的图表，替换该键的旧图片并按大小淘汰"""
+        key = self.make_key(exchange_symbol, interval, layout_id, variant)
+        bucket = self.bar_bucket(interval)
+        path = self._path_for(key, bucket)
+
+        try:
+            await asyncio.to_thread(self._write_file, path, data)
+        except OSError as e:
+            self.logger.warning(f"写入图表缓存失败: {path} - {e}")
+            return
+
+        previous = self._index.pop(key, None)
+        if previous is not None:
+            self.total_bytes -= previous['size']
+            if previous['path'] != path:
+                await asyncio.to_thread(self._remove_file, previous['path'])
+
+        self._index[key] = {'bucket': bucket, 'path': path, 'size': len(data), 'created_at': time.time()}
+        self.total_bytes += len(data)
+        self.stores += 1
+        evicted = self._evict()
+        if evicted:
+            await asyncio.to_thread(self._remove_files, evicted)
+
+    def _evict(self) -> list:
+        """从最久未使用的图片开始淘汰直到低于大小上限，返回待删除的文件路径"""
+        evicted = []
+        while self.total_bytes > self.max_bytes and self._index:
+            _, entry = self._index.popitem(last=False)
+            self.total_bytes -= entry['size']
+            evicted.append(entry['path'])
+            self.evictions += 1
+        return evicted
+
+    def _drop(self, key: str):
+        entry = self._index.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry['size']
+
+    @staticmethod
+    def _read_file(path: str) -> bytes:
+        with open(path, 'rb') as f:
+            data = f.read()
+        os.utime(path)  # 更新修改时间，重启后按此恢复LRU顺序
+        return data
+
+    @staticmethod
+    def _write_file(path: str, data: bytes):
+        # 先写临时文件再原子替换，避免读到半个文件
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _remove_files(self, paths: list):
+        for path in paths:
+            self._remove_file(path)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        lookups = self.fresh_hits + self.stale_hits + self.misses
+        return {
+            'entries': len(self._index),
+            'total_mb': round(self.total_bytes / 1024 / 1024, 2),
+            'max_mb': round(self.max_bytes / 1024 / 1024, 2),
+            'fresh_hits': self.fresh_hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'hit_ratio': round((self.fresh_hits + self.stale_hits) / lookups, 3) if lookups else 0.0,
+            'bytes_saved': self.bytes_saved,
+            'bytes_saved_mb': round(self.bytes_saved / 1024 / 1024, 2),
+            'stores': self.stores,
+            'evictions': self.evictions
+        }
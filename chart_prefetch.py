@@ -0,0 +1,234 @@
+"""
+开盘前图表预取
+从daily_logs中统计最近几天请求最多的 (股票代码, 时间框架)，在美股开盘前及交易时段内按间隔
+把这些图表预取到图表缓存，开盘后第一波请求直接命中缓存。预取以后台优先级排队，并受每日调用预算限制
+"""
+
+import asyncio
+import json
+import logging
+import os
+from collections import Counter
+from datetime import datetime, time as dt_time, timedelta
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import pytz
+
+EASTERN = pytz.timezone('America/New_York')
+MARKET_OPEN = dt_time(9, 30)
+MARKET_CLOSE = dt_time(16, 0)
+
+
+class ChartPrefetcher:
+    """热门图表预取调度器"""
+
+    def __init__(self, chart_service, log_dir: str = "daily_logs"):
+        self.chart_service = chart_service
+        self.logger = logging.getLogger(__name__)
+        self.log_dir = Path(log_dir)
+        self.enabled = os.getenv('PREFETCH_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+        self.top_n = int(os.getenv('PREFETCH_TOP_N', '10'))
+        self.lookback_days = int(os.getenv('PREFETCH_LOOKBACK_DAYS', '7'))
+        self.run_times = self._parse_times(os.getenv('PREFETCH_TIMES', '09:25'))
+        self.interval_minutes = int(os.getenv('PREFETCH_INTERVAL_MINUTES', '0'))
+        self.daily_budget = int(os.getenv('PREFETCH_DAILY_BUDGET', '30'))
+
+        # 当日（美东日期）已使用的chart-img调用次数
+        self.budget_date = None
+        self.budget_used = 0
+
+        self.prefetch_task = None
+
+        # 统计
+        self.runs = 0
+        self.prefetched = 0
+        self.already_cached = 0
+        self.budget_skipped = 0
+        self.last_run = None
+        self.last_ranking = []
+
+    def _parse_times(self, value: str) -> List[dt_time]:
+        """解析 "09:25,12:00" 形式的美东时间列表"""
+        times = []
+        for part in filter(None, (item.strip() for item in value.split(','))):
+            try:
+                hour, minute = part.split(':')
+                times.append(dt_time(int(hour), int(minute)))
+            except ValueError:
+                self.logger.warning(f"PREFETCH_TIMES格式错误，已忽略: {part}")
+        return sorted(times)
+
+    # ---- 排名 ----
+
+    def rank_pairs(self, today: Optional[datetime] = None) -> List[Tuple[Tuple[str, str], int]]:
+        """
+        统计最近几天成功的图表请求，返回请求最多的前N个 (代码, 时间框架)
+
+        Returns:
+            [((代码, 时间框架), 次数), ...]
+        """
+        today = today or datetime.now()
+        counts = Counter()
+        for days_ago in range(self.lookback_days):
+            date = (today - timedelta(days=days_ago)).strftime("%Y-%m-%d")
+            log_file = self.log_dir / f"requests_{date}.json"
+            if not log_file.exists():
+                continue
+            try:
+                with open(log_file, 'r', encoding='utf-8') as f:
+                    requests = json.load(f)
+            except Exception as e:
+                self.logger.warning(f"读取请求日志失败 {log_file}: {e}")
+                continue
+
+            for request in requests:
+                if request.get('request_type') != 'chart' or not request.get('success'):
+                    continue
+                # 图表请求的content为 "代码 时间框架"，组合请求为 "代码 15m/1h/4h"
+                parts = (request.get('content') or '').split()
+                if len(parts) != 2:
+                    continue
+                for timeframe in parts[1].split('/'):
+                    if self.chart_service.normalize_timeframe(timeframe) is not None:
+                        counts[(parts[0].upper(), timeframe)] += 1
+
+        return counts.most_common(self.top_n)
+
+    # ---- 预算 ----
+
+    def _budget_remaining(self, now: datetime) -> int:
+        """当日剩余预算（按美东日期重置）"""
+        today = now.astimezone(EASTERN).date()
+        if self.budget_date != today:
+            self.budget_date = today
+            self.budget_used = 0
+        return self.daily_budget - self.budget_used
+
+    # ---- 执行 ----
+
+    async def prefetch_once(self, now: Optional[datetime] = None) -> int:
+        """
+        执行一次预取
+
+        Returns:
+            本次调用chart-img的次数
+        """
+        now = now or datetime.now(EASTERN)
+        # 读取和解析多天的请求日志放到线程中，避免阻塞事件循环
+        ranking = await asyncio.to_thread(self.rank_pairs, now.astimezone(EASTERN).replace(tzinfo=None))
+        self.last_ranking = ranking
+        self.runs += 1
+        self.last_run = now.isoformat()
+
+        fetched = 0
+        for (symbol, timeframe), count in ranking:
+            # 交易所未知的代码还需要探测，剩余预算不够探测加一次图表调用时跳过
+            if self._budget_remaining(now) < self.chart_service.estimate_calls(symbol):
+                self.budget_skipped += 1
+                continue
+            try:
+                calls = await self.chart_service.prefetch_chart(symbol, timeframe)
+            except Exception as e:
+                self.logger.error(f"预取图表失败 {symbol} {timeframe}: {e}")
+                continue
+
+            if calls:
+                self.budget_used += calls
+                self.prefetched += 1
+                fetched += calls
+            else:
+                self.already_cached += 1
+
+        self.logger.info(
+            f"📈 图表预取完成: {len(ranking)} 个热门图表, 调用chart-img {fetched} 次, "
+            f"今日预算剩余 {self._budget_remaining(now)}/{self.daily_budget}"
+        )
+        return fetched
+
+    # ---- 调度 ----
+
+    def _day_schedule(self) -> List[dt_time]:
+        """一个交易日内的预取时间（美东）：固定时间 + 交易时段内的间隔时间"""
+        times = set(self.run_times)
+        if self.interval_minutes > 0:
+            minutes = MARKET_OPEN.hour * 60 + MARKET_OPEN.minute + self.interval_minutes
+            close_minutes = MARKET_CLOSE.hour * 60 + MARKET_CLOSE.minute
+            while minutes < close_minutes:
+                times.add(dt_time(minutes // 60, minutes % 60))
+                minutes += self.interval_minutes
+        return sorted(times)
+
+    def next_run_time(self, now: Optional[datetime] = None) -> Optional[datetime]:
+        """下一次预取时间（只在工作日执行）"""
+        now = (now or datetime.now(EASTERN)).astimezone(EASTERN)
+        schedule = self._day_schedule()
+        if not schedule:
+            return None
+
+        for days_ahead in range(8):
+            day = now.date() + timedelta(days=days_ahead)
+            if day.weekday() >= 5:
+                continue
+            for run_time in schedule:
+                candidate = EASTERN.localize(datetime.combine(day, run_time))
+                if candidate > now:
+                    return candidate
+        return None
+
+    async def start_prefetch(self):
+        """启动预取调度任务"""
+        if not self.enabled:
+            self.logger.info("图表预取已禁用")
+            return
+        if self.prefetch_task is None or self.prefetch_task.done():
+            self.prefetch_task = asyncio.create_task(self._prefetch_loop())
+            self.logger.info("图表预取调度已启动")
+
+    async def stop_prefetch(self):
+        """停止预取调度任务"""
+        if self.prefetch_task and not self.prefetch_task.done():
+            self.prefetch_task.cancel()
+            try:
+                await self.prefetch_task
+            except asyncio.CancelledError:
+                pass
+            self.logger.info("图表预取调度已停止")
+
+    async def _prefetch_loop(self):
+        """预取循环"""
+        while True:
+            try:
+                next_run = self.next_run_time()
+                if next_run is None:
+                    self.logger.warning("未配置预取时间，预取调度退出")
+                    return
+
+                wait_seconds = (next_run - datetime.now(EASTERN)).total_seconds()
+                self.logger.info(f"下次图表预取时间: {next_run.strftime('%Y-%m-%d %H:%M %Z')}, 等待 {wait_seconds / 3600:.1f} 小时")
+                await asyncio.sleep(max(wait_seconds, 0))
+
+                await self.prefetch_once()
+
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                self.logger.error(f"图表预取任务发生错误: {e}")
+                await asyncio.sleep(300)
+
+    def get_stats(self) -> dict:
+        """获取预取统计"""
+        next_run = self.next_run_time() if self.enabled else None
+        return {
+            'enabled': self.enabled,
+            'top_n': self.top_n,
+            'daily_budget': self.daily_budget,
+            'budget_used_today': self.budget_used,
+            'runs': self.runs,
+            'prefetched': self.prefetched,
+            'already_cached': self.already_cached,
+            'budget_skipped': self.budget_skipped,
+            'last_run': self.last_run,
+            'next_run': next_run.isoformat() if next_run else None,
+            'last_ranking': [f"{symbol} {timeframe} x{count}" for (symbol, timeframe), count in self.last_ranking]
+        }
@@ -0,0 +1,294 @@
+"""
+图表渲染任务队列
+所有chart-img上游调用经由此队列执行：固定数量的工作协程限制并发，
+令牌桶把调用速率限制在chart-img套餐的每分钟额度内，VIP请求优先，
+遇到429/5xx时按退避策略重试
+"""
+
+import asyncio
+import itertools
+import logging
+import os
+import random
+import time
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+# 任务优先级（数值越小越先执行）
+PRIORITY_VIP = 0
+PRIORITY_NORMAL = 1
+PRIORITY_BACKGROUND = 2  # 缓存后台刷新等无人等待的任务
+
+
+class RetryableUpstreamError(Exception):
+    """上游返回可重试的错误（429/5xx）"""
+
+    def __init__(self, status: int, retry_after: Optional[float] = None):
+        super().__init__(f"上游返回 {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+class ChartJob:
+    """队列中的一个渲染任务"""
+
+    def __init__(self, key: Hashable, factory: Callable[[], Awaitable[Any]], priority: int, seq: int):
+        self.key = key
+        self.factory = factory
+        self.priority = priority
+        self.seq = seq
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+        self.future = asyncio.get_running_loop().create_future()
+        self.task: Optional[asyncio.Task] = None  # 正在执行的上游调用
+
+    def sort_key(self):
+        return (self.priority, self.seq)
+
+
+class ChartRenderQueue:
+    """带优先级和速率预算的图表渲染队列"""
+
+    def __init__(self, workers: Optional[int] = None, rpm: Optional[float] = None,
+                 max_retries: Optional[int] = None, retry_base: Optional[float] = None):
+        self.logger = logging.getLogger(__name__)
+        self.workers = workers or int(os.getenv('CHART_QUEUE_WORKERS', '3'))
+        self.rpm = rpm or float(os.getenv('CHART_QUEUE_RPM', '30'))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('CHART_QUEUE_MAX_RETRIES', '3'))
+        self.retry_base = retry_base if retry_base is not None else float(os.getenv('CHART_QUEUE_RETRY_BASE_SECONDS', '2'))
+
+        # 令牌桶：容量等于工作协程数，避免空闲后瞬间打满上游
+        self.burst = self.workers
+        self._tokens = float(self.burst)
+        self._tokens_updated = time.monotonic()
+
+        # 等待中的任务：key -> 任务（队列长度通常只有几十，按需线性选取）
+        self._pending = {}
+        self._taken = {}  # 已被工作协程取出、尚未执行完的任务
+        self._seq = itertools.count()
+        self._condition = None
+        self._token_lock = None  # 按取出任务的顺序分配令牌
+        self._worker_tasks = []
+        self._retry_tasks = set()
+        self._busy = 0  # 已取出任务的工作协程数（含等待令牌的）
+
+        # 统计
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.retries = 0
+        self.cancelled = 0
+        self.rate_limited = 0
+        self.max_depth = 0
+        self.wait_time_total = 0.0
+        self.started_jobs = 0
+
+    def _ensure_workers(self):
+        """在事件循环中首次使用时启动工作协程"""
+        if self._worker_tasks:
+            return
+        self._condition = asyncio.Condition()
+        self._token_lock = asyncio.Lock()
+        self._busy = 0
+        self._worker_tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self.logger.info(f"图表渲染队列已启动: {self.workers} 个工作协程, {self.rpm:g} 次/分钟")
+
+    async def submit(self, key: Hashable, factory: Callable[[], Awaitable[Any]],
+                     priority: int = PRIORITY_NORMAL) -> Any:
+        """
+        提交渲染任务并等待结果
+
+        Args:
+            key: 任务标识（相同key的任务在队列中只保留一个）
+            factory: 返回上游调用协程的函数，可重试错误需抛出RetryableUpstreamError
+            priority: 任务优先级
+
+        Returns:
+            上游调用结果，重试耗尽后返回None
+        """
+        self._ensure_workers()
+        job = self._pending.get(key)
+        if job is None:
+            job = ChartJob(key, factory, priority, next(self._seq))
+            await self._push(job)
+        else:
+            self.prioritize(key, priority)
+        return await asyncio.shield(job.future)
+
+    async def _push(self, job: ChartJob):
+        """把任务放入等待队列并唤醒一个工作协程"""
+        self._pending[job.key] = job
+        self.max_depth = max(self.max_depth, len(self._pending))
+        async with self._condition:
+            self._condition.notify()
+
+    def prioritize(self, key: Hashable, priority: int):
+        """提升等待中任务的优先级（例如VIP加入了普通用户的相同请求）"""
+        job = self._pending.get(key)
+        if job is not None and priority < job.priority:
+            job.priority = priority
+
+    def cancel(self, key: Hashable):
+        """取消任务：等待中的任务不再执行，正在调用上游的任务立即中止并释放工作协程"""
+        job = self._pending.pop(key, None) or self._taken.get(key)
+        if job is None:
+            return
+        if not job.future.done():
+            job.future.cancel()
+        if job.task is not None and not job.task.done():
+            job.task.cancel()
+
+    def position(self, key: Hashable) -> Optional[int]:
+        """
+        获取任务的排队位置
+
+        Returns:
+            从1开始的位置；任务已在执行或会被空闲工作协程立即执行时返回None
+        """
+        job = self._pending.get(key)
+        if job is None:
+            return None
+        ahead = sum(1 for other in self._pending.values() if other.sort_key() < job.sort_key())
+        if ahead < self.workers - self._busy and self._tokens >= ahead + 1:
+            return None
+        return ahead + 1
+
+    async def _next_job(self) -> ChartJob:
+        """取出优先级最高的等待任务"""
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._pending)
+            job = min(self._pending.values(), key=ChartJob.sort_key)
+            del self._pending[job.key]
+            self._taken[job.key] = job
+            self._busy += 1
+            return job
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._tokens_updated) * self.rpm / 60)
+        self._tokens_updated = now
+
+    async def _acquire_token(self):
+        """按每分钟额度获取一次上游调用令牌（先取出任务的工作协程先拿到令牌，高优先级任务不会被后取出的任务抢先）"""
+        async with self._token_lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) * 60 / self.rpm)
+
+    async def _worker(self, index: int):
+        """工作协程：依次执行队列中的任务"""
+        while True:
+            job = await self._next_job()
+            try:
+                await self._run_job(job)
+            finally:
+                self._busy -= 1
+                if self._taken.get(job.key) is job:
+                    del self._taken[job.key]
+
+    async def _run_job(self, job: ChartJob):
+        """执行一个任务"""
+        if job.future.done():
+            return
+
+        await self._acquire_token()
+        if job.future.done():
+            # 等待令牌期间被取消：归还令牌
+            self._tokens = min(self.burst, self._tokens + 1)
+            return
+        if job.attempts == 0:
+            self.started_jobs += 1
+            self.wait_time_total += time.monotonic() - job.enqueued_at
+
+        self.running += 1
+        # 上游调用放在单独的任务中执行，cancel()可以中止它而不影响工作协程
+        job.task = asyncio.create_task(job.factory())
+        try:
+            await asyncio.wait((job.task,))
+            if job.task.cancelled():
+                self.cancelled += 1
+                return
+            result = job.task.result()
+            self.completed += 1
+            if not job.future.done():
+                job.future.set_result(result)
+        except RetryableUpstreamError as e:
+            self._handle_retryable(job, e)
+        except asyncio.CancelledError:
+            # 工作协程被停止
+            job.task.cancel()
+            if not job.future.done():
+                job.future.cancel()
+            raise
+        except Exception as e:
+            self.failed += 1
+            self.logger.error(f"图表渲染任务异常 {job.key}: {e}")
+            if not job.future.done():
+                job.future.set_exception(e)
+        finally:
+            job.task = None
+            self.running -= 1
+
+    def _handle_retryable(self, job: ChartJob, error: RetryableUpstreamError):
+        """429/5xx：退避后重新入队，重试耗尽则返回None"""
+        job.attempts += 1
+        if error.status == 429:
+            # 上游已限流：清空令牌，所有工作协程一起放慢
+            self.rate_limited += 1
+            self._tokens = 0.0
+
+        if job.attempts > self.max_retries:
+            self.failed += 1
+            self.logger.error(f"图表渲染任务重试 {self.max_retries} 次后仍失败 {job.key}: {error}")
+            if not job.future.done():
+                job.future.set_result(None)
+            return
+
+        delay = error.retry_after if error.retry_after else self.retry_base * 2 ** (job.attempts - 1)
+        delay *= random.uniform(1.0, 1.25)  # 抖动，避免重试同时到达
+        self.retries += 1
+        self.logger.warning(f"图表渲染任务 {job.key} {error}，{delay:.1f}s 后第 {job.attempts} 次重试")
+
+        async def requeue():
+            await asyncio.sleep(delay)
+            # 保留原序号，重试的任务不排到后来者后面
+            await self._push(job)
+
+        task = asyncio.create_task(requeue())
+        self._retry_tasks.add(task)
+        task.add_done_callback(self._retry_tasks.discard)
+
+    async def stop(self):
+        """停止工作协程，取消等待中的任务"""
+        tasks = self._worker_tasks + list(self._retry_tasks)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        for job in self._pending.values():
+            if not job.future.done():
+                job.future.cancel()
+        self._pending.clear()
+        self._taken.clear()
+        self._worker_tasks = []
+        self._retry_tasks.clear()
+
+    def get_stats(self) -> dict:
+        """获取队列统计"""
+        self._refill()
+        return {
+            'workers': self.workers,
+            'rpm': self.rpm,
+            'queued': len(self._pending),
+            'running': self.running,
+            'max_depth': self.max_depth,
+            'tokens': round(self._tokens, 2),
+            'completed': self.completed,
+            'failed': self.failed,
+            'retries': self.retries,
+            'cancelled': self.cancelled,
+            'rate_limited': self.rate_limited,
+            'avg_wait_ms': round(self.wait_time_total / self.started_jobs * 1000, 1) if self.started_jobs else 0.0
+        }
@@ -0,0 +1,107 @@
+"""
+数据库异步访问层
+在有界线程池中执行同步SQLAlchemy操作，避免数据库往返阻塞Discord/aiohttp事件循环
+"""
+
+import asyncio
+import functools
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+
+class DBExecutor:
+    """数据库线程池适配器"""
+
+    def __init__(self, max_workers: Optional[int] = None):
+        """
+        初始化线程池适配器
+
+        Args:
+            max_workers: 最大工作线程数，默认读取DB_EXECUTOR_WORKERS（应不超过连接池大小）
+        """
+        self.logger = logging.getLogger(__name__)
+        self.max_workers = max_workers or int(os.getenv('DB_EXECUTOR_WORKERS', '8'))
+        self._executor = None
+
+        # 运行统计
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.total_run_time = 0.0
+        self.max_run_time = 0.0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """延迟创建线程池"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix='db-worker'
+            )
+            self.logger.info(f"数据库线程池已创建，最大线程数: {self.max_workers}")
+        return self._executor
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        在线程池中执行同步数据库操作
+
+        Args:
+            func: 同步函数（如 RateLimiter.check_user_limit）
+            *args, **kwargs: 传给函数的参数
+
+        Returns:
+            函数的返回值
+        """
+        loop = asyncio.get_running_loop()
+        call = functools.partial(self._timed_call, func, args, kwargs)
+
+        self.submitted += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            return await loop.run_in_executor(self._get_executor(), call)
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+
+    def _timed_call(self, func: Callable, args: tuple, kwargs: dict) -> Any:
+        """在工作线程中执行并记录耗时"""
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.total_run_time += elapsed
+            self.max_run_time = max(self.max_run_time, elapsed)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取线程池运行统计"""
+        avg_ms = (self.total_run_time / self.completed * 1000) if self.completed else 0.0
+        return {
+            'max_workers': self.max_workers,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'in_flight': self.in_flight,
+            'max_in_flight': self.max_in_flight,
+            'avg_run_ms': round(avg_ms, 2),
+            'max_run_ms': round(self.max_run_time * 1000, 2)
+        }
+
+    def shutdown(self, wait: bool = True):
+        """关闭线程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+            self.logger.info("数据库线程池已关闭")
+
+
+# 全局数据库线程池实例
+db_executor = DBExecutor()
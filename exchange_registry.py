@@ -0,0 +1,129 @@
+"""
+股票代码-交易所注册表
+记录对stock_exchange_map之外的代码的交易所探测结果，持久化到数据库并在启动时加载到内存。
+探测失败的代码进行负缓存，在有效期内不再重复探测
+"""
+
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Optional, Tuple
+
+from models import SymbolExchange, get_db_session, upsert
+
+
+class ExchangeRegistry:
+    """学习型交易所注册表"""
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self.negative_ttl = float(os.getenv('EXCHANGE_NEGATIVE_TTL_HOURS', '24')) * 3600
+
+        # 内存映射: 代码 -> 带交易所前缀的代码；代码 -> 探测失败时间（epoch秒）
+        self._resolved = {}
+        self._unresolved = {}
+        self.loaded = False
+
+        # 统计
+        self.hits = 0
+        self.negative_hits = 0
+        self.probes = 0
+        self.probe_time_total = 0.0
+
+    def load(self) -> int:
+        """从数据库加载全部映射（同步，通过db_executor调用）"""
+        db = None
+        try:
+            db = get_db_session()
+            rows = db.query(SymbolExchange).all()
+            resolved = {}
+            unresolved = {}
+            for row in rows:
+                if row.resolved and row.exchange_symbol:
+                    resolved[row.symbol] = row.exchange_symbol
+                elif row.probed_at:
+                    unresolved[row.symbol] = row.probed_at.timestamp()
+
+            self._resolved = resolved
+            self._unresolved = unresolved
+            self.loaded = True
+            self.logger.info(f"交易所注册表已加载: {len(resolved)} 个已解析, {len(unresolved)} 个未解析")
+            return len(rows)
+
+        except Exception as e:
+            self.logger.error(f"加载交易所注册表失败: {e}")
+            return 0
+        finally:
+            if db:
+                db.close()
+
+    def lookup(self, symbol: str) -> Tuple[Optional[str], bool]:
+        """
+        查找已学习的映射
+
+        Returns:
+            (带交易所前缀的代码, 是否处于负缓存期)
+        """
+        exchange_symbol = self._resolved.get(symbol)
+        if exchange_symbol:
+            self.hits += 1
+            return exchange_symbol, False
+
+        failed_at = self._unresolved.get(symbol)
+        if failed_at is not None and time.time() - failed_at < self.negative_ttl:
+            self.negative_hits += 1
+            return None, True
+
+        return None, False
+
+    def record_probe_time(self, seconds: float):
+        """记录一次并行探测的耗时"""
+        self.probes += 1
+        self.probe_time_total += seconds
+
+    def record(self, symbol: str, exchange_symbol: Optional[str]) -> bool:
+        """
+        记录探测结果并持久化（同步，通过db_executor调用）
+
+        Args:
+            symbol: 股票代码
+            exchange_symbol: 探测到的带前缀代码，None表示所有交易所都失败
+        """
+        if exchange_symbol:
+            self._resolved[symbol] = exchange_symbol
+            self._unresolved.pop(symbol, None)
+        else:
+            self._unresolved[symbol] = time.time()
+
+        db = None
+        try:
+            db = get_db_session()
+            upsert(db, SymbolExchange, {
+                'symbol': symbol,
+                'exchange_symbol': exchange_symbol,
+                'resolved': exchange_symbol is not None,
+                'probed_at': datetime.now()
+            }, conflict_columns=['symbol'], update_columns=['exchange_symbol', 'resolved', 'probed_at'])
+            db.commit()
+            return True
+
+        except Exception as e:
+            # 持久化失败不影响本次结果，内存中的映射仍然有效
+            self.logger.warning(f"保存交易所映射失败 {symbol}: {e}")
+            return False
+        finally:
+            if db:
+                db.close()
+
+    def get_stats(self) -> dict:
+        """获取注册表统计"""
+        return {
+            'loaded': self.loaded,
+            'resolved': len(self._resolved),
+            'unresolved': len(self._unresolved),
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'probes': self.probes,
+            'avg_probe_ms': round(self.probe_time_total / self.probes * 1000, 1) if self.probes else 0.0
+        }
@@ -10,8 +10,8 @@ from typing import Dict, Any, Optional
 from datetime import datetime, timedelta
 from google import genai
 from google.genai import types
-from models import TradingViewData, ReportCache
-from sqlalchemy.orm import sessionmaker
+from models import TradingViewData, ReportCache, get_db_session
+from signal_deltas import expand_signal_row
 from sqlalchemy import desc
 
 class GeminiReportGenerator:
@@ -30,21 +30,6 @@ class GeminiReportGenerator:
         except Exception as e:
             self.logger.error(f"❌ Gemini客户端初始化失败: {e}")
             raise
-            
-        # 初始化数据库连接
-        try:
-            from sqlalchemy import create_engine
-            database_url = os.environ.get("DATABASE_URL")
-            if database_url:
-                self.engine = create_engine(database_url)
-                Session = sessionmaker(bind=self.engine)
-                self.session = Session()
-            else:
-                self.logger.warning("DATABASE_URL环境变量未设置")
-                self.session = None
-        except Exception as e:
-            self.logger.warning(f"数据库连接初始化失败: {e}")
-            self.session = None
     
     def generate_stock_report(self, trading_data: TradingViewData, user_request: str = "") -> str:
         """基于TradingView数据生成股票分析报告"""
@@ -647,7 +632,6 @@ class GeminiReportGenerator:
     def _get_latest_signal_data(self, symbol: str, timeframe: str):
         """获取最新的signal数据"""
         try:
-            from models import get_db_session, TradingViewData
             session = get_db_session()
             
             latest_signal = session.query(TradingViewData).filter(
@@ -655,6 +639,7 @@ class GeminiReportGenerator:
                 TradingViewData.timeframe == timeframe,
                 TradingViewData.data_type == 'signal'
             ).order_by(TradingViewData.received_at.desc()).first()
+            latest_signal = expand_signal_row(session, latest_signal)
             
             session.close()
             return latest_signal
@@ -666,7 +651,6 @@ class GeminiReportGenerator:
     def _get_latest_trade_data(self, symbol: str):
         """获取最新的trade或close数据"""
         try:
-            from models import get_db_session, TradingViewData
             session = get_db_session()
             
             latest_trade = session.query(TradingViewData).filter(
@@ -779,10 +763,10 @@ class GeminiReportGenerator:
     
     def _check_report_cache(self, symbol: str, timeframe: str, signal_data, trade_data) -> Optional[str]:
         """检查报告缓存是否有效"""
-        if not self.session:
-            return None
-            
+        session = None
         try:
+            session = get_db_session()
+            
             # 计算缓存过期时间（基于时间框架）
             timeframe_minutes = {
                 '15m': 15, '1h': 60, '4h': 240, '1d': 1440
@@ -795,7 +779,7 @@ class GeminiReportGenerator:
             cutoff_time = datetime.now() - timedelta(minutes=minutes)
             
             # 查找最新的有效缓存
-            cache_record = self.session.query(ReportCache).filter(
+            cache_record = session.query(ReportCache).filter(
                 ReportCache.symbol == symbol,
                 ReportCache.timeframe == timeframe,
                 ReportCache.is_valid == True,
@@ -812,15 +796,17 @@ class GeminiReportGenerator:
                     cache_record.based_on_trade_id == trade_id):
                     
                     # 更新命中次数
-                    cache_record.hit_count += 1
-                    self.session.commit()
+                    report_content = cache_record.report_content
+                    hit_count = cache_record.hit_count + 1
+                    cache_record.hit_count = hit_count
+                    session.commit()
                     
-                    self.logger.info(f"✅ 缓存命中 {symbol}-{timeframe}, 命中次数: {cache_record.hit_count}")
-                    return cache_record.report_content
+                    self.logger.info(f"✅ 缓存命中 {symbol}-{timeframe}, 命中次数: {hit_count}")
+                    return report_content
                 else:
                     # 数据已更新，标记旧缓存为无效
                     cache_record.is_valid = False
-                    self.session.commit()
+                    session.commit()
                     self.logger.info(f"🔄 缓存失效 {symbol}-{timeframe}, 数据已更新")
             
             return None
@@ -828,13 +814,16 @@ class GeminiReportGenerator:
         except Exception as e:
             self.logger.error(f"检查缓存失败: {e}")
             return None
+        finally:
+            if session:
+                session.close()
     
     def _save_report_cache(self, symbol: str, timeframe: str, report_content: str, signal_data, trade_data):
         """保存报告到缓存"""
-        if not self.session:
-            return
-            
+        session = None
         try:
+            session = get_db_session()
+            
             # 计算过期时间
             timeframe_minutes = {
                 '15m': 15, '1h': 60, '4h': 240, '1d': 1440
@@ -857,24 +846,27 @@ class GeminiReportGenerator:
                 expires_at=expires_at
             )
             
-            self.session.add(cache_record)
-            self.session.commit()
+            session.add(cache_record)
+            session.commit()
             
             self.logger.info(f"✅ 报告已缓存 {symbol}-{timeframe}, 过期时间: {expires_at}")
             
             # 清理旧的缓存（保留最近的5个）
-            self._cleanup_old_cache(symbol, timeframe)
+            self._cleanup_old_cache(session, symbol, timeframe)
             
         except Exception as e:
             self.logger.error(f"保存缓存失败: {e}")
-            if self.session:
-                self.session.rollback()
+            if session:
+                session.rollback()
+        finally:
+            if session:
+                session.close()
     
-    def _cleanup_old_cache(self, symbol: str, timeframe: str):
+    def _cleanup_old_cache(self, session, symbol: str, timeframe: str):
         """清理旧的缓存记录，保留最近的5个"""
         try:
             # 获取该股票和时间框架的所有缓存
-            all_cache = self.session.query(ReportCache).filter(
+            all_cache = session.query(ReportCache).filter(
                 ReportCache.symbol == symbol,
                 ReportCache.timeframe == timeframe
             ).order_by(desc(ReportCache.created_at)).all()
@@ -883,15 +875,14 @@ class GeminiReportGenerator:
             if len(all_cache) > 5:
                 old_cache = all_cache[5:]
                 for cache in old_cache:
-                    self.session.delete(cache)
+                    session.delete(cache)
                 
-                self.session.commit()
+                session.commit()
                 self.logger.info(f"🧹 清理了 {len(old_cache)} 个旧缓存 {symbol}-{timeframe}")
                 
         except Exception as e:
             self.logger.error(f"清理缓存失败: {e}")
-            if self.session:
-                self.session.rollback()
+            session.rollback()
     
     def _build_trade_section(self, trade_data):
         """构建交易解读部分 - 按照用户最终要求的格式"""
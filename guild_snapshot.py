@@ -0,0 +1,383 @@
+"""
+服务器/频道信息快照
+@提及转发时需要的服务器信息（成员统计、频道数量等）和频道信息（机器人权限、成员列表）
+原来每条消息都重新遍历 guild.members 计算，大服务器上是 O(成员数) 的开销。
+这里为每个服务器、每个频道缓存一份快照，通过网关事件（成员加入/离开、在线状态、频道/角色变化）
+增量更新并打上版本号；构建转发数据只需复制快照，与服务器规模无关。
+没有开启成员/在线状态意图时收不到部分事件，快照超过最大存活时间后整体重建以限制误差
+"""
+
+import itertools
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+import discord
+
+# 活跃成员列表取前几位成员（与原逻辑一致）
+ACTIVE_MEMBER_SAMPLE = 5
+# 频道信息中最多列出的成员数
+CHANNEL_MEMBER_SAMPLE = 10
+
+# 全局递增的版本号，每次快照变化都取一个新值。
+# 以进程启动时间（微秒）为起点，重启后的版本号大于上次运行的所有版本号，接收端按 (ID, 版本) 缓存的内容不会被误用
+_versions = itertools.count(time.time_ns() // 1000)
+
+
+def _member_summary(member) -> Dict[str, Any]:
+    return {
+        'id': member.id,
+        'name': member.name,
+        'display_name': member.display_name,
+        'status': str(member.status) if hasattr(member, 'status') else 'unknown',
+        'joined_at': member.joined_at.isoformat() if member.joined_at else None
+    }
+
+
+def _is_online(member) -> bool:
+    return hasattr(member, 'status') and member.status != discord.Status.offline
+
+
+class GuildSnapshots:
+    """服务器/频道快照缓存，注册到机器人的网关事件上增量更新"""
+
+    def __init__(self, bot, max_age: Optional[float] = None):
+        """
+        Args:
+            bot: 机器人实例（用于获取机器人自身成员和注册事件）
+            max_age: 快照最长存活秒数，默认GUILD_SNAPSHOT_MAX_AGE_SECONDS
+        """
+        self.bot = bot
+        self.logger = logging.getLogger(__name__)
+        self.max_age = max_age if max_age is not None else float(os.getenv('GUILD_SNAPSHOT_MAX_AGE_SECONDS', '300'))
+
+        # 服务器ID -> {'static', 'static_version', 'head', 'head_ids', 'stats', 'version', 'built_at'}
+        self._guilds: Dict[int, Dict[str, Any]] = {}
+        # 频道ID -> {'info', 'guild_id', 'version', 'built_at'}
+        self._channels: Dict[int, Dict[str, Any]] = {}
+
+        # 统计
+        self.hits = 0
+        self.rebuilds = 0
+        self.events_applied = 0
+
+        self._register_listeners()
+
+    def _register_listeners(self):
+        """把增量更新函数注册为机器人的事件监听器"""
+        listeners = {
+            'on_member_join': self._on_member_join,
+            'on_member_remove': self._on_member_remove,
+            'on_member_update': self._on_member_update,
+            'on_presence_update': self._on_presence_update,
+            'on_guild_update': self._on_guild_update,
+            'on_guild_remove': self._on_guild_remove,
+            'on_guild_channel_create': self._on_guild_channel_create,
+            'on_guild_channel_delete': self._on_guild_channel_delete,
+            'on_guild_channel_update': self._on_guild_channel_update,
+            'on_guild_role_create': self._on_guild_role_create,
+            'on_guild_role_delete': self._on_guild_role_delete,
+            'on_guild_role_update': self._on_guild_role_update,
+            'on_guild_emojis_update': self._on_guild_emojis_update,
+            'on_voice_state_update': self._on_voice_state_update,
+        }
+        for event, listener in listeners.items():
+            self.bot.add_listener(listener, event)
+
+    # ---- 服务器快照 ----
+
+    def guild_info(self, guild) -> Dict[str, Any]:
+        """获取服务器信息（返回副本，调用方可以修改）"""
+        entry = self._guilds.get(guild.id)
+        if entry is None or time.monotonic() - entry['built_at'] > self.max_age:
+            entry = self._rebuild_guild(guild)
+        else:
+            self.hits += 1
+            # 事件只标记失效的部分，在下次读取时按需重建
+            if entry['static'] is None:
+                entry['static'] = self._build_static(guild)
+                entry['static_version'] = next(_versions)
+            if entry['head'] is None:
+                entry['head'], entry['head_ids'] = self._build_head(guild)
+
+        guild_info = dict(entry['static'])
+        guild_info['member_count'] = guild.member_count
+        guild_info['active_members'] = list(entry['head'])
+        guild_info['statistics'] = dict(entry['stats'])
+        guild_info['snapshot_version'] = entry['version']
+        # 基本信息/设置/频道数量等静态部分的版本，只在这部分重建时变化
+        guild_info['static_version'] = entry['static_version']
+        return guild_info
+
+    def _rebuild_guild(self, guild) -> Dict[str, Any]:
+        """完整重建服务器快照（首次访问或超过最大存活时间）"""
+        head, head_ids = self._build_head(guild)
+        entry = {
+            'static': self._build_static(guild),
+            'static_version': next(_versions),
+            'head': head,
+            'head_ids': head_ids,
+            'stats': self._count_members(guild),
+            'version': next(_versions),
+            'built_at': time.monotonic()
+        }
+        self._guilds[guild.id] = entry
+        self.rebuilds += 1
+        return entry
+
+    @staticmethod
+    def _build_static(guild) -> Dict[str, Any]:
+        """服务器的基本信息和频道数量（只随服务器/频道/角色/表情变化）"""
+        channel_types = [channel.type.name for channel in guild.channels]
+        return {
+            'id': guild.id,
+            'name': guild.name,
+            'owner_id': guild.owner_id,
+            'member_count': guild.member_count,
+            'created_at': guild.created_at.isoformat() if guild.created_at else None,
+            'verification_level': str(guild.verification_level),
+            'explicit_content_filter': str(guild.explicit_content_filter),
+            'default_notifications': str(getattr(guild, 'default_message_notifications', 'unknown')),
+            'features': list(guild.features),
+            'boost_level': guild.premium_tier,
+            'boost_count': guild.premium_subscription_count or 0,
+            'icon_url': str(guild.icon.url) if guild.icon else None,
+            'banner_url': str(guild.banner.url) if guild.banner else None,
+            'channels': {
+                'total': len(channel_types),
+                'text': channel_types.count('text'),
+                'voice': channel_types.count('voice'),
+                'categories': channel_types.count('category')
+            },
+            'roles_count': len(guild.roles),
+            'emojis_count': len(guild.emojis),
+            'region': getattr(guild, 'region', 'unknown')
+        }
+
+    @staticmethod
+    def _build_head(guild):
+        """活跃成员信息（前几位成员中的非机器人成员）及这几位成员的ID"""
+        members = guild.members[:ACTIVE_MEMBER_SAMPLE]
+        head = [_member_summary(member) for member in members if not member.bot]
+        return head, {member.id for member in members}
+
+    def _refresh_head_member(self, entry: Dict[str, Any], member):
+        """活跃成员列表中的成员资料/状态变化时原地替换，不重新遍历成员列表"""
+        if entry['head'] is None or member.id not in entry['head_ids']:
+            return
+        entry['head'] = [
+            _member_summary(member) if summary['id'] == member.id else summary for summary in entry['head']
+        ]
+        self._touch(entry)
+
+    @staticmethod
+    def _count_members(guild) -> Dict[str, int]:
+        """遍历一次成员列表计算在线/机器人/真人数量"""
+        members = guild.members
+        if not members:
+            return {'online_members': 0, 'bot_count': 0, 'human_count': guild.member_count or 0}
+        online = bots = 0
+        for member in members:
+            online += _is_online(member)
+            bots += member.bot
+        return {'online_members': online, 'bot_count': bots, 'human_count': len(members) - bots}
+
+    def _touch(self, entry: Dict[str, Any]):
+        entry['version'] = next(_versions)
+        self.events_applied += 1
+
+    # ---- 频道快照 ----
+
+    def channel_info(self, channel) -> Dict[str, Any]:
+        """获取频道信息（返回副本，调用方可以修改）"""
+        entry = self._channels.get(channel.id)
+        if entry is None or time.monotonic() - entry['built_at'] > self.max_age:
+            guild = getattr(channel, 'guild', None)
+            entry = {
+                'info': self._build_channel(channel),
+                'guild_id': guild.id if guild else None,
+                'version': next(_versions),
+                'built_at': time.monotonic()
+            }
+            self._channels[channel.id] = entry
+            self.rebuilds += 1
+        else:
+            self.hits += 1
+
+        channel_info = dict(entry['info'])
+        channel_info['snapshot_version'] = entry['version']
+        return channel_info
+
+    def _build_channel(self, channel) -> Dict[str, Any]:
+        """收集频道信息：基本属性、分类、机器人权限和成员"""
+        channel_info = {
+            'id': channel.id,
+            'name': channel.name,
+            'type': str(channel.type),
+            'created_at': channel.created_at.isoformat() if channel.created_at else None,
+            'category': None,
+            'position': getattr(channel, 'position', None),
+            'topic': getattr(channel, 'topic', None),
+            'nsfw': getattr(channel, 'nsfw', False),
+            'permissions': {},
+            'member_count': None,
+            'slowmode_delay': getattr(channel, 'slowmode_delay', 0),
+            'guild_id': channel.guild.id if hasattr(channel, 'guild') and channel.guild else None
+        }
+
+        # 获取分类信息
+        if hasattr(channel, 'category') and channel.category:
+            channel_info['category'] = {
+                'id': channel.category.id,
+                'name': channel.category.name,
+                'position': channel.category.position
+            }
+
+        # 获取机器人在该频道的权限
+        if hasattr(channel, 'guild') and channel.guild and self.bot.user:
+            try:
+                bot_member = channel.guild.get_member(self.bot.user.id)
+                if bot_member:
+                    perms = channel.permissions_for(bot_member)
+                    channel_info['permissions'] = {
+                        'read_messages': perms.read_messages,
+                        'send_messages': perms.send_messages,
+                        'manage_messages': perms.manage_messages,
+                        'embed_links': perms.embed_links,
+                        'attach_files': perms.attach_files,
+                        'read_message_history': perms.read_message_history,
+                        'add_reactions': perms.add_reactions,
+                        'use_external_emojis': perms.use_external_emojis
+                    }
+            except Exception as e:
+                self.logger.debug(f"获取频道权限时出错: {e}")
+
+        # 获取成员数量（文字频道的members需要遍历服务器成员计算权限）
+        if hasattr(channel, 'members'):
+            members = channel.members
+            channel_info['member_count'] = len(members)
+            channel_info['members'] = [
+                {
+                    'id': member.id,
+                    'name': member.name if member else None,
+                    'display_name': member.display_name if member else None
+                } for member in members[:CHANNEL_MEMBER_SAMPLE] if member
+            ]
+
+        return channel_info
+
+    def _drop_channel(self, channel_id: int):
+        if self._channels.pop(channel_id, None) is not None:
+            self.events_applied += 1
+
+    def _drop_guild_channels(self, guild_id: int):
+        """机器人权限可能变化时清除该服务器所有频道快照"""
+        for channel_id in [cid for cid, entry in self._channels.items() if entry['guild_id'] == guild_id]:
+            self._drop_channel(channel_id)
+
+    # ---- 网关事件 ----
+
+    async def _on_member_join(self, member):
+        entry = self._guilds.get(member.guild.id)
+        if entry is None:
+            return
+        stats = entry['stats']
+        stats['online_members'] += _is_online(member)
+        if member.bot:
+            stats['bot_count'] += 1
+        else:
+            stats['human_count'] += 1
+        if len(entry['head_ids']) < ACTIVE_MEMBER_SAMPLE:
+            entry['head'] = None
+        self._touch(entry)
+
+    async def _on_member_remove(self, member):
+        entry = self._guilds.get(member.guild.id)
+        if entry is None:
+            return
+        stats = entry['stats']
+        stats['online_members'] = max(0, stats['online_members'] - _is_online(member))
+        key = 'bot_count' if member.bot else 'human_count'
+        stats[key] = max(0, stats[key] - 1)
+        if member.id in entry['head_ids']:
+            entry['head'] = None
+        self._touch(entry)
+
+    async def _on_member_update(self, before, after):
+        if self.bot.user and after.id == self.bot.user.id:
+            # 机器人自己的角色变化会影响频道权限
+            self._drop_guild_channels(after.guild.id)
+        entry = self._guilds.get(after.guild.id)
+        if entry is not None:
+            self._refresh_head_member(entry, after)
+
+    async def _on_presence_update(self, before, after):
+        entry = self._guilds.get(after.guild.id)
+        if entry is None:
+            return
+        change = _is_online(after) - _is_online(before)
+        if change:
+            entry['stats']['online_members'] = max(0, entry['stats']['online_members'] + change)
+            self._touch(entry)
+        self._refresh_head_member(entry, after)
+
+    def _invalidate_static(self, guild):
+        entry = self._guilds.get(guild.id)
+        if entry is not None:
+            entry['static'] = None
+            self._touch(entry)
+
+    async def _on_guild_update(self, before, after):
+        self._invalidate_static(after)
+
+    async def _on_guild_remove(self, guild):
+        self._guilds.pop(guild.id, None)
+        self._drop_guild_channels(guild.id)
+
+    async def _on_guild_channel_create(self, channel):
+        self._invalidate_static(channel.guild)
+
+    async def _on_guild_channel_delete(self, channel):
+        self._invalidate_static(channel.guild)
+        self._drop_channel(channel.id)
+
+    async def _on_guild_channel_update(self, before, after):
+        if after.type.name == 'category':
+            # 分类名称/位置出现在其下所有频道的快照中
+            self._drop_guild_channels(after.guild.id)
+        else:
+            self._drop_channel(after.id)
+        if before.type != after.type:
+            self._invalidate_static(after.guild)
+
+    async def _on_guild_role_create(self, role):
+        self._invalidate_static(role.guild)
+
+    async def _on_guild_role_delete(self, role):
+        self._invalidate_static(role.guild)
+        self._drop_guild_channels(role.guild.id)
+
+    async def _on_guild_role_update(self, before, after):
+        self._drop_guild_channels(after.guild.id)
+
+    async def _on_guild_emojis_update(self, guild, before, after):
+        self._invalidate_static(guild)
+
+    async def _on_voice_state_update(self, member, before, after):
+        for state in (before, after):
+            if state.channel is not None:
+                self._drop_channel(state.channel.id)
+
+    # ---- 统计 ----
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取快照缓存统计"""
+        return {
+            'guilds': len(self._guilds),
+            'channels': len(self._channels),
+            'hits': self.hits,
+            'rebuilds': self.rebuilds,
+            'events_applied': self.events_applied,
+            'max_age_seconds': self.max_age
+        }
@@ -0,0 +1,125 @@
+"""
+共享HTTP客户端
+所有出站HTTP请求共用一个aiohttp会话：按主机复用keep-alive连接、缓存DNS、限制单主机并发，
+并为不同服务提供超时配置。会话由机器人生命周期管理，关闭机器人时一并关闭
+"""
+
+import logging
+import os
+from typing import Any, Dict
+
+import aiohttp
+
+
+class HTTPClientManager:
+    """共享HTTP客户端管理器"""
+
+    # 各服务的超时配置（秒）
+    TIMEOUT_PROFILES = {
+        'chart': {'total': 180, 'connect': 10},    # Chart-img Layout Chart Storage需要较长时间
+        'probe': {'total': 10, 'connect': 5},      # 交易所探测
+        'webhook': {'total': 30, 'connect': 10},   # n8n等webhook
+        'download': {'total': 60, 'connect': 10},  # 图片下载
+        'default': {'total': 30, 'connect': 10}
+    }
+
+    def __init__(self):
+        """初始化管理器（会话在首次使用时于事件循环中创建）"""
+        self.logger = logging.getLogger(__name__)
+        self.pool_limit = int(os.getenv('HTTP_POOL_LIMIT', '100'))
+        self.limit_per_host = int(os.getenv('HTTP_LIMIT_PER_HOST', '10'))
+        self.dns_cache_ttl = int(os.getenv('HTTP_DNS_CACHE_TTL', '300'))
+        self.keepalive_timeout = float(os.getenv('HTTP_KEEPALIVE_TIMEOUT', '60'))
+        self._session = None
+
+        # 连接统计
+        self.requests = 0
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.dns_cache_hits = 0
+        self.dns_cache_misses = 0
+
+    def _build_trace_config(self) -> aiohttp.TraceConfig:
+        """通过aiohttp跟踪钩子统计连接复用和DNS缓存命中"""
+        trace_config = aiohttp.TraceConfig()
+
+        async def on_request_start(session, ctx, params):
+            self.requests += 1
+
+        async def on_connection_create_end(session, ctx, params):
+            self.connections_created += 1
+
+        async def on_connection_reuseconn(session, ctx, params):
+            self.connections_reused += 1
+
+        async def on_dns_cache_hit(session, ctx, params):
+            self.dns_cache_hits += 1
+
+        async def on_dns_cache_miss(session, ctx, params):
+            self.dns_cache_misses += 1
+
+        trace_config.on_request_start.append(on_request_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(on_connection_reuseconn)
+        trace_config.on_dns_cache_hit.append(on_dns_cache_hit)
+        trace_config.on_dns_cache_miss.append(on_dns_cache_miss)
+        return trace_config
+
+    def get_session(self) -> aiohttp.ClientSession:
+        """获取共享会话（必须在事件循环中调用）"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_limit,
+                limit_per_host=self.limit_per_host,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout('default'),
+                trace_configs=[self._build_trace_config()]
+            )
+            self.logger.info(
+                f"共享HTTP会话已创建: 总连接上限 {self.pool_limit}, 单主机上限 {self.limit_per_host}, "
+                f"DNS缓存 {self.dns_cache_ttl}s, keep-alive {self.keepalive_timeout}s"
+            )
+        return self._session
+
+    def timeout(self, profile: str, **overrides) -> aiohttp.ClientTimeout:
+        """
+        获取服务的超时配置
+
+        Args:
+            profile: 配置名称（chart/probe/webhook/download/default）
+            **overrides: 覆盖的超时字段，如 total=60
+        """
+        settings = dict(self.TIMEOUT_PROFILES.get(profile, self.TIMEOUT_PROFILES['default']))
+        settings.update(overrides)
+        return aiohttp.ClientTimeout(**settings)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取连接统计"""
+        connector = self._session.connector if self._session and not self._session.closed else None
+        total_connects = self.connections_created + self.connections_reused
+        return {
+            'session_open': connector is not None,
+            'requests': self.requests,
+            'connections_created': self.connections_created,
+            'connections_reused': self.connections_reused,
+            'reuse_rate': round(self.connections_reused / total_connects, 3) if total_connects else 0.0,
+            'dns_cache_hits': self.dns_cache_hits,
+            'dns_cache_misses': self.dns_cache_misses,
+            'limit': self.pool_limit,
+            'limit_per_host': self.limit_per_host
+        }
+
+    async def close(self):
+        """关闭共享会话及其连接池"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            self.logger.info("共享HTTP会话已关闭")
+        self._session = None
+
+
+# 全局共享HTTP客户端实例
+http_client = HTTPClientManager()
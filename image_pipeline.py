@@ -0,0 +1,177 @@
+"""
+图表图片后处理
+在进程池中对chart-img返回的PNG重新编码（WebP/PNG调色板/JPEG）并按需裁剪品牌区域，
+避免图像编码占用事件循环。未安装Pillow时原样返回图片
+"""
+
+import asyncio
+import io
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    Image = None
+    PIL_AVAILABLE = False
+
+# 输出格式 -> 文件扩展名
+FORMAT_EXTENSIONS = {'webp': 'webp', 'png': 'png', 'jpeg': 'jpg'}
+
+
+def _encode(image, fmt: str, quality: int) -> bytes:
+    """按输出格式编码图片"""
+    buffer = io.BytesIO()
+    if fmt == 'webp':
+        # quality>=100时使用无损WebP，图表文字和细线不失真
+        if quality >= 100:
+            image.save(buffer, 'WEBP', lossless=True, method=4)
+        else:
+            image.save(buffer, 'WEBP', quality=quality, method=4)
+    elif fmt == 'jpeg':
+        image.convert('RGB').save(buffer, 'JPEG', quality=quality, optimize=True)
+    else:
+        # 图表颜色有限，调色板PNG通常只有原图的三分之一
+        image.convert('RGB').quantize(256).save(buffer, 'PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def process_image(data: bytes, fmt: str, quality: int, crop: Tuple[int, int, int, int]) -> bytes:
+    """
+    处理一张图表（在子进程中执行）
+
+    Args:
+        data: 原始PNG数据
+        fmt: 输出格式 webp/png/jpeg
+        quality: 编码质量（webp为100时无损）
+        crop: 裁剪边距 (上, 右, 下, 左) 像素
+
+    Returns:
+        处理后的图片
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        top, right, bottom, left = crop
+        if any(crop) and image.width > left + right and image.height > top + bottom:
+            image = image.crop((left, top, image.width - right, image.height - bottom))
+        return _encode(image, fmt, quality)
+
+
+class ImagePipeline:
+    """图表图片后处理管道"""
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.logger = logging.getLogger(__name__)
+        self.enabled = PIL_AVAILABLE and os.getenv('CHART_IMAGE_PIPELINE', 'true').lower() in ('1', 'true', 'yes')
+        self.format = os.getenv('CHART_IMAGE_FORMAT', 'webp').lower()
+        if self.format not in FORMAT_EXTENSIONS:
+            self.logger.warning(f"不支持的图片格式 {self.format}，使用webp")
+            self.format = 'webp'
+        self.quality = int(os.getenv('CHART_IMAGE_QUALITY', '100'))
+        self.crop = self._parse_crop(os.getenv('CHART_IMAGE_CROP', '0,0,0,0'))
+        self.max_workers = max_workers or int(os.getenv('CHART_IMAGE_WORKERS', '2'))
+        self._executor = None
+
+        if not PIL_AVAILABLE:
+            self.logger.info("未安装Pillow，图表将以原始PNG发送")
+
+        # 统计
+        self.processed = 0
+        self.failed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.total_time = 0.0
+
+    def _parse_crop(self, value: str) -> Tuple[int, int, int, int]:
+        """解析裁剪边距 "上,右,下,左" """
+        try:
+            parts = [max(0, int(part)) for part in value.split(',')]
+            if len(parts) == 4:
+                return tuple(parts)
+        except ValueError:
+            pass
+        self.logger.warning(f"CHART_IMAGE_CROP格式错误: {value}，不裁剪")
+        return (0, 0, 0, 0)
+
+    @staticmethod
+    def detect_extension(data: bytes) -> str:
+        """根据文件头判断图片的扩展名（后处理失败时图片仍是原始PNG）"""
+        if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+            return 'webp'
+        if data[:3] == b'\xff\xd8\xff':
+            return 'jpg'
+        return 'png'
+
+    def variant(self) -> Optional[str]:
+        """
+        缓存变体名（包含输出格式，修改配置后不会读到旧格式的缓存）
+
+        Returns:
+            未启用时返回None（缓存原始PNG）
+        """
+        if not self.enabled:
+            return None
+        return f"{self.format}{self.quality}-{'x'.join(map(str, self.crop))}"
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """延迟创建进程池"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            self.logger.info(f"图片处理进程池已创建，进程数: {self.max_workers}")
+        return self._executor
+
+    async def process(self, data: bytes) -> Optional[bytes]:
+        """
+        在进程池中处理图片
+
+        Returns:
+            处理后的图片，未启用或处理失败时返回None（调用方使用原图）
+        """
+        if not self.enabled:
+            return None
+
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            result = await loop.run_in_executor(
+                self._get_executor(), process_image,
+                data, self.format, self.quality, self.crop
+            )
+        except Exception as e:
+            self.failed += 1
+            self.logger.error(f"图表图片处理失败，使用原图: {e}")
+            return None
+
+        self.processed += 1
+        self.bytes_in += len(data)
+        self.bytes_out += len(result)
+        self.total_time += time.perf_counter() - started
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取处理统计"""
+        return {
+            'enabled': self.enabled,
+            'format': self.format if self.enabled else 'png',
+            'processed': self.processed,
+            'failed': self.failed,
+            'avg_bytes_in': self.bytes_in // self.processed if self.processed else 0,
+            'avg_bytes_out': self.bytes_out // self.processed if self.processed else 0,
+            'size_ratio': round(self.bytes_out / self.bytes_in, 3) if self.bytes_in else 0.0,
+            'avg_process_ms': round(self.total_time / self.processed * 1000, 1) if self.processed else 0.0
+        }
+
+    def shutdown(self, wait: bool = True):
+        """关闭进程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+            self.logger.info("图片处理进程池已关闭")
+
+
+# 全局图片处理管道实例
+image_pipeline = ImagePipeline()
@@ -0,0 +1,141 @@
+"""
+指标状态编码
+把TradingView信号中的分类指标状态编码为小整数，存入tradingview_data的SMALLINT列（入库时填充，
+历史数据由 migrate-indicator-states.py 回填）。编码按看跌到看涨排列（看跌为负、中性为0、看涨为正），
+历史查询和聚合可以直接在数据库中对窄列做过滤、GROUP BY 和 AVG，不需要逐行解析 raw_data
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+
+from models import TradingViewData, get_db_session
+
+# 列名 -> (TradingView字段名, 取值 -> 编码)；编码表为None表示字段本身就是 -1/0/1
+INDICATOR_CODES: Dict[str, Tuple[str, Optional[Dict[str, int]]]] = {
+    'pma_state': ('pmaText', {
+        'PMA Strong Bearish': -2, 'PMA Bearish': -1, 'PMA Trendless': 0, 'PMA Bullish': 1, 'PMA Strong Bullish': 2
+    }),
+    'cvd_state': ('CVDsignal', {'cvdBelowMA': -1, 'cvdAboveMA': 1}),
+    'rsi_ha_state': ('RSIHAsignal', {'BearishHA': -1, 'BullishHA': 1}),
+    'bbp_state': ('BBPsignal', {'bearpower': -1, 'bullpower': 1}),
+    'sqz_state': ('SQZsignal', {'no squeeze': 0, 'squeeze': 1}),
+    'chopping_state': ('choppingrange_signal', {'no chopping': 0, 'chopping': 1}),
+    'center_trend_state': ('center_trend', {
+        'Strong Bearish': -2, 'Weak Bearish': -1, 'Weak Bullish': 1, 'Strong Bullish': 2
+    }),
+    'wave_state': ('wavemarket_state', {
+        'Short Strong': -2, 'Short Weak': -1, 'Neutral': 0, 'Long Weak': 1, 'Long Strong': 2
+    }),
+    'ewo_state': ('ewotrend_state', {
+        'Strong Bearish': -2, 'Weak Bearish': -1, 'Weak Bullish': 1, 'Strong Bullish': 2
+    }),
+    'htf_wave_state': ('HTFwave_signal', {'Bearish': -1, 'Neutral': 0, 'Bullish': 1}),
+    'ma_trend': ('MAtrend', None),
+    'ma_trend_tf1': ('MAtrend_timeframe1', None),
+    'ma_trend_tf2': ('MAtrend_timeframe2', None),
+    'trend_tracer': ('TrendTracersignal', None),
+    'trend_tracer_htf': ('TrendTracerHTF', None),
+}
+STATE_COLUMNS = tuple(INDICATOR_CODES)
+
+# 列名 -> 编码 -> 取值（用于显示）
+_LABELS = {
+    column: ({code: value for value, code in codes.items()} if codes else {-1: '-1', 0: '0', 1: '1'})
+    for column, (_, codes) in INDICATOR_CODES.items()
+}
+# 列名 -> 小写取值 -> 编码（TradingView偶尔改变大小写）
+_LOOKUP = {
+    column: {value.lower(): code for value, code in codes.items()}
+    for column, (_, codes) in INDICATOR_CODES.items() if codes
+}
+
+
+def encode_indicator_states(payload: Dict[str, Any]) -> Dict[str, Optional[int]]:
+    """
+    TradingView数据 -> 各状态列的编码
+    缺失或无法识别的取值编码为None（raw_data中仍保留原始值）
+    """
+    states = {}
+    for column, (field, codes) in INDICATOR_CODES.items():
+        value = payload.get(field)
+        code = None
+        if value is not None and value != '':
+            if codes is None:
+                try:
+                    number = int(float(value))
+                except (TypeError, ValueError):
+                    number = None
+                code = number if number in (-1, 0, 1) else None
+            else:
+                code = _LOOKUP[column].get(str(value).strip().lower())
+        states[column] = code
+    return states
+
+
+def decode_indicator_state(column: str, code: Optional[int]) -> Optional[str]:
+    """编码 -> 取值"""
+    if code is None:
+        return None
+    return _LABELS[column].get(code)
+
+
+def _state_column(column: str):
+    if column not in INDICATOR_CODES:
+        raise ValueError(f"未知的指标状态列: {column}（可用: {', '.join(STATE_COLUMNS)}）")
+    return getattr(TradingViewData, column)
+
+
+def get_state_distribution(column: str, timeframe: Optional[str] = None, since: Optional[datetime] = None,
+                           symbol: Optional[str] = None) -> Dict[Optional[str], int]:
+    """
+    指标状态分布（数据库端 GROUP BY，在db_executor中调用）
+
+    Returns:
+        {取值: 信号条数}
+    """
+    state = _state_column(column)
+    db = get_db_session()
+    try:
+        query = db.query(state, func.count(TradingViewData.id)).filter(TradingViewData.data_type == 'signal')
+        if timeframe:
+            query = query.filter(TradingViewData.timeframe == timeframe)
+        if symbol:
+            query = query.filter(TradingViewData.symbol == symbol.upper())
+        if since:
+            query = query.filter(TradingViewData.received_at >= since)
+        return {decode_indicator_state(column, code): count for code, count in query.group_by(state).all()}
+    finally:
+        db.close()
+
+
+def get_state_history(symbol: str, timeframe: str, columns: Optional[List[str]] = None,
+                      since: Optional[datetime] = None, limit: int = 500) -> List[Dict[str, Any]]:
+    """
+    单个股票/时间框架的指标状态历史（只读取状态列，不读取raw_data，在db_executor中调用）
+
+    Returns:
+        按时间从新到旧的 [{'received_at': ..., 列名: 取值}]
+    """
+    columns = list(columns or STATE_COLUMNS)
+    selected = [_state_column(column) for column in columns]
+    db = get_db_session()
+    try:
+        query = db.query(TradingViewData.received_at, *selected).filter(
+            TradingViewData.symbol == symbol.upper(),
+            TradingViewData.timeframe == timeframe,
+            TradingViewData.data_type == 'signal'
+        )
+        if since:
+            query = query.filter(TradingViewData.received_at >= since)
+        rows = query.order_by(TradingViewData.received_at.desc()).limit(limit).all()
+        history = []
+        for row in rows:
+            item = {'received_at': row[0].isoformat() if row[0] else None}
+            for column, code in zip(columns, row[1:]):
+                item[column] = decode_indicator_state(column, code)
+            history.append(item)
+        return history
+    finally:
+        db.close()
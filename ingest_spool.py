@@ -0,0 +1,439 @@
+"""
+TradingView入库预写日志（本地spool）
+webhook收到的数据先追加写入本地spool文件（JSON Lines，同一时间到达的请求合并为一次fsync），fsync完成后立即响应，
+由回放任务按接收顺序写入数据库。数据库变慢或短暂不可用时，回放任务按指数退避重试同一条数据（不跳过、不乱序）；
+写入返回失败或抛出其他错误（数据本身有问题，重试也不会成功）时直接移入死信文件，不阻塞后面的数据。
+webhook响应不再等待数据库；待回放的数据超过 INGEST_SPOOL_MAX_DEPTH 时拒绝新数据（503），由发送方稍后重试。
+进程崩溃或重启后，从spool文件中恢复尚未回放的数据继续回放
+
+文件布局（INGEST_SPOOL_DIR）:
+    segment-<起始序号>.jsonl   每行 {"seq": 序号, "ts": 接收时间, "payload": 原始数据}
+    offset                    已回放的最大序号（每条回放完成后原子替换）
+    dead-letter.jsonl         无法写入的数据，以及暂时性错误重试 INGEST_SPOOL_MAX_ATTEMPTS 次仍失败的数据
+回放是至少一次：写入数据库后、更新offset前进程崩溃，重启后这一条会再写一次
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from retry_backoff import backoff_delay
+
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.jsonl'
+
+
+class SpoolFull(Exception):
+    """待回放的数据达到上限"""
+
+
+def is_connection_error(error: BaseException) -> bool:
+    """默认的暂时性错误判断：连接断开或超时"""
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+class IngestSpool:
+    """本地追加写spool和按顺序回放到数据库的任务"""
+
+    def __init__(self, directory: Optional[str] = None):
+        """
+        Args:
+            directory: spool目录，默认INGEST_SPOOL_DIR
+        """
+        self.logger = logging.getLogger(__name__)
+        self.directory = directory or os.getenv('INGEST_SPOOL_DIR', 'ingest_spool')
+        self.enabled = os.getenv('INGEST_SPOOL_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+        self.max_depth = int(os.getenv('INGEST_SPOOL_MAX_DEPTH', '20000'))
+        # 收到第一条数据后最多等待多久再fsync（合并同时到达的请求）
+        self.flush_interval = float(os.getenv('INGEST_SPOOL_FLUSH_MS', '2')) / 1000
+        self.flush_batch = int(os.getenv('INGEST_SPOOL_FLUSH_BATCH', '256'))
+        self.segment_bytes = int(os.getenv('INGEST_SPOOL_SEGMENT_MB', '16')) * 1024 * 1024
+        self.max_attempts = int(os.getenv('INGEST_SPOOL_MAX_ATTEMPTS', '50'))
+        self.retry_base = float(os.getenv('INGEST_SPOOL_RETRY_BASE_SECONDS', '0.5'))
+        self.retry_max = float(os.getenv('INGEST_SPOOL_RETRY_MAX_SECONDS', '60'))
+
+        # 文件读写只在这一个线程中执行
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='ingest-spool')
+        self._handler: Optional[Callable[[Dict[str, Any]], Awaitable[bool]]] = None
+        self._is_transient: Callable[[BaseException], bool] = is_connection_error
+        self._file = None
+        self._segment_size = 0
+        self._segments: List[Tuple[int, str]] = []
+        self._next_seq = 1
+        self._pending: List[Tuple[int, float, Dict[str, Any], str, asyncio.Future]] = []
+        self._records: Deque[Tuple[int, float, Dict[str, Any]]] = deque()
+        self._flush_wakeup = None
+        self._replay_wakeup = None
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+
+        # 统计
+        self.depth = 0
+        self.replayed_seq = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.recovered = 0
+        self.corrupt_lines = 0
+        self.replayed = 0
+        self.retries = 0
+        self.dead_lettered = 0
+        self.last_error = None
+        self.retrying_since = None
+        self.fsync_times = deque(maxlen=500)        # 单次写入+fsync耗时（秒）
+        self.replay_lags = deque(maxlen=500)        # 接收到写入数据库（秒）
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    # ---- 文件操作（在spool线程中执行） ----
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _sync_directory(self):
+        """新建/删除文件后fsync目录，保证文件本身在断电后仍存在"""
+        try:
+            fd = os.open(self.directory, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def _open(self) -> List[Tuple[int, float, Dict[str, Any]]]:
+        """恢复: 读取offset和所有分段，返回尚未回放的数据；截掉崩溃时写了一半的最后一行"""
+        os.makedirs(self.directory, exist_ok=True)
+        try:
+            with open(self._path('offset')) as f:
+                self.replayed_seq = int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            self.replayed_seq = 0
+
+        self._segments = sorted(
+            (int(name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]), self._path(name))
+            for name in os.listdir(self.directory)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        )
+        records = []
+        last_seq = self.replayed_seq
+        for _, path in self._segments:
+            with open(path, 'rb') as f:
+                data = f.read()
+            complete = data.rfind(b'\n') + 1
+            if complete < len(data):
+                # 写入中途崩溃的半行，对应的请求没有收到成功响应
+                with open(path, 'r+b') as f:
+                    f.truncate(complete)
+                self.corrupt_lines += 1
+            for line in data[:complete].splitlines():
+                try:
+                    record = json.loads(line)
+                    seq = int(record['seq'])
+                except (ValueError, KeyError, TypeError):
+                    self.corrupt_lines += 1
+                    continue
+                last_seq = max(last_seq, seq)
+                if seq > self.replayed_seq:
+                    records.append((seq, float(record.get('ts', 0)), record['payload']))
+        records.sort(key=lambda record: record[0])
+        self._next_seq = last_seq + 1
+
+        if self._segments:
+            path = self._segments[-1][1]
+            self._file = open(path, 'ab')
+            self._segment_size = os.path.getsize(path)
+        self._remove_replayed_segments()
+        return records
+
+    def _roll(self, first_seq: int):
+        """开始新的分段文件"""
+        if self._file is not None:
+            self._file.close()
+        path = self._path(f"{SEGMENT_PREFIX}{first_seq:012d}{SEGMENT_SUFFIX}")
+        self._file = open(path, 'ab')
+        self._segment_size = 0
+        self._segments.append((first_seq, path))
+        self._sync_directory()
+
+    def _write(self, data: bytes, first_seq: int) -> float:
+        """追加一批数据并fsync；失败时截回写入前的长度，避免半行和后面的数据粘在一起"""
+        started = time.perf_counter()
+        if self._file is None or self._segment_size >= self.segment_bytes:
+            self._roll(first_seq)
+        position = self._segment_size
+        try:
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except Exception:
+            try:
+                self._file.truncate(position)
+            except Exception:
+                pass
+            raise
+        self._segment_size += len(data)
+        return time.perf_counter() - started
+
+    def _commit_offset(self, seq: int):
+        """记录已回放的序号（原子替换），删除已全部回放的分段"""
+        temporary = self._path('offset.tmp')
+        with open(temporary, 'w') as f:
+            f.write(str(seq))
+        os.replace(temporary, self._path('offset'))
+        self._remove_replayed_segments()
+
+    def _remove_replayed_segments(self):
+        """下一个分段的起始序号之前的数据都已回放时删除该分段（当前写入的分段保留）"""
+        removed = False
+        while len(self._segments) > 1 and self._segments[1][0] - 1 <= self.replayed_seq:
+            _, path = self._segments.pop(0)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            removed = True
+        if removed:
+            self._sync_directory()
+
+    def _append_dead_letter(self, line: str):
+        with open(self._path('dead-letter.jsonl'), 'a', encoding='utf-8') as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    # ---- 接收 ----
+
+    async def append(self, payload: Dict[str, Any]) -> int:
+        """
+        写入spool，fsync完成后返回序号（之后由回放任务写入数据库）
+
+        Raises:
+            SpoolFull: 待回放的数据达到上限（数据库长时间不可用）
+            RuntimeError: spool未启动
+        """
+        if not self._tasks or self._stopping:
+            raise RuntimeError("入库spool未启动")
+        if self.depth >= self.max_depth:
+            self.rejected += 1
+            raise SpoolFull(f"待入库数据已达上限 {self.max_depth} 条")
+        seq = self._next_seq
+        self._next_seq += 1
+        received_at = time.time()
+        line = json.dumps({'seq': seq, 'ts': received_at, 'payload': payload}, ensure_ascii=False) + '\n'
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((seq, received_at, payload, line, future))
+        self.depth += 1
+        self._flush_wakeup.set()
+        return await future
+
+    async def _flush_pending(self):
+        """把等待中的数据一次写入并fsync，然后通知等待的请求和回放任务"""
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            elapsed = await self._run(self._write, ''.join(item[3] for item in batch).encode('utf-8'), batch[0][0])
+        except Exception as e:
+            self.flush_errors += 1
+            self.depth -= len(batch)
+            self.logger.error(f"写入入库spool失败: {e}")
+            for item in batch:
+                if not item[4].done():
+                    item[4].set_exception(e)
+            return
+        self.flushes += 1
+        self.accepted += len(batch)
+        self.fsync_times.append(elapsed)
+        for seq, received_at, payload, _, future in batch:
+            self._records.append((seq, received_at, payload))
+            if not future.done():
+                future.set_result(seq)
+        self._replay_wakeup.set()
+
+    async def _flusher(self):
+        """合并写入任务：第一条数据到达后等待一小段时间，把同时到达的请求合并为一次fsync"""
+        while not self._stopping:
+            try:
+                await self._flush_wakeup.wait()
+                self._flush_wakeup.clear()
+                if len(self._pending) < self.flush_batch and self.flush_interval > 0 and not self._stopping:
+                    await asyncio.sleep(self.flush_interval)
+                await self._flush_pending()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                self.logger.error(f"入库spool写入任务发生错误: {e}")
+                await asyncio.sleep(0.1)
+
+    # ---- 回放 ----
+
+    async def start(self, handler: Callable[[Dict[str, Any]], Awaitable[bool]],
+                    is_transient: Optional[Callable[[BaseException], bool]] = None):
+        """
+        打开spool（恢复未回放的数据）并启动写入和回放任务
+
+        Args:
+            handler: 把一条数据写入数据库的协程，返回是否成功（返回False的数据直接移入死信）
+            is_transient: 判断handler抛出的异常是否为暂时性错误（重试），默认只重试连接断开或超时
+        """
+        if self._tasks:
+            return
+        self._handler = handler
+        self._is_transient = is_transient or is_connection_error
+        self._stopping = False
+        records = await self._run(self._open)
+        self._records.extend(records)
+        self.depth = len(self._records)
+        self.recovered = len(records)
+        self._flush_wakeup = asyncio.Event()
+        self._replay_wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._flusher()), asyncio.create_task(self._replayer())]
+        self.logger.info(f"入库spool已启动: {self.directory}, 待回放 {self.depth} 条（已回放至 #{self.replayed_seq}）")
+
+    async def stop(self):
+        """停止任务：等待中的数据先写入spool，未回放的数据保留在spool中，下次启动继续回放"""
+        if not self._tasks:
+            return
+        flusher, replayer = self._tasks
+        # 写入任务处理完已接收的请求后退出；回放任务直接取消（当前这条下次启动时重新回放）
+        self._stopping = True
+        self._flush_wakeup.set()
+        replayer.cancel()
+        for task in (flusher, replayer):
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self._flush_pending()
+        self._tasks = []
+        await self._run(self._close)
+
+    async def _replayer(self):
+        """回放任务：按序号逐条写入数据库，成功（或移入死信）后才处理下一条"""
+        while True:
+            try:
+                self._replay_wakeup.clear()
+                while self._records:
+                    await self._replay_one(self._records[0])
+                    # 先移出队列再减少深度，深度为0时oldest_age一定为None
+                    self._records.popleft()
+                    self.depth -= 1
+                await self._replay_wakeup.wait()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                self.logger.error(f"入库spool回放任务发生错误: {e}")
+                await asyncio.sleep(1)
+
+    async def _replay_one(self, record: Tuple[int, float, Dict[str, Any]]):
+        seq, received_at, payload = record
+        attempts = 0
+        while True:
+            try:
+                ok, error, transient = await self._handler(payload), '数据库写入失败', False
+            except Exception as e:
+                ok, error, transient = False, str(e) or type(e).__name__, self._is_transient(e)
+            if ok:
+                self.replayed += 1
+                self.replay_lags.append(time.time() - received_at)
+                break
+            attempts += 1
+            self.last_error = error
+            if not transient or attempts >= self.max_attempts:
+                line = json.dumps({'seq': seq, 'ts': received_at, 'payload': payload, 'error': error,
+                                   'attempts': attempts, 'failed_at': time.time()}, ensure_ascii=False) + '\n'
+                await self._run(self._append_dead_letter, line)
+                self.dead_lettered += 1
+                if transient:
+                    self.logger.error(f"入库spool #{seq} 重试 {attempts} 次仍失败，已移入死信文件: {error}")
+                else:
+                    self.logger.error(f"入库spool #{seq} 无法写入，已移入死信文件: {error}")
+                break
+            self.retries += 1
+            if self.retrying_since is None:
+                self.retrying_since = time.time()
+            delay = backoff_delay(attempts, self.retry_base, self.retry_max)
+            self.logger.warning(f"入库spool #{seq} 写入失败 (第 {attempts} 次): {error}，{delay:.1f} 秒后重试")
+            await asyncio.sleep(delay)
+
+        self.retrying_since = None
+        self.replayed_seq = seq
+        await self._run(self._commit_offset, seq)
+
+    # ---- 统计 ----
+
+    def oldest_age(self) -> Optional[float]:
+        """最早一条待回放数据已等待的秒数"""
+        if self._records:
+            return time.time() - self._records[0][1]
+        if self._pending:
+            return time.time() - self._pending[0][1]
+        return None
+
+    @staticmethod
+    def _percentile(values, fraction: float) -> Optional[float]:
+        if not values:
+            return None
+        ordered = sorted(values)
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000, 1)
+
+    def get_health(self) -> Dict[str, Any]:
+        """健康检查用的简要状态"""
+        age = self.oldest_age()
+        return {
+            'enabled': self.enabled,
+            'running': self.running,
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'oldest_age_seconds': round(age, 1) if age is not None else None,
+            'retrying_seconds': round(time.time() - self.retrying_since, 1) if self.retrying_since else None,
+            'last_error': self.last_error,
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取spool统计"""
+        stats = self.get_health()
+        stats.update({
+            'directory': self.directory,
+            'segments': len(self._segments),
+            'replayed_seq': self.replayed_seq,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'flushes': self.flushes,
+            'avg_flush_batch': round(self.accepted / self.flushes, 1) if self.flushes else 0,
+            'flush_errors': self.flush_errors,
+            'recovered': self.recovered,
+            'corrupt_lines': self.corrupt_lines,
+            'replayed': self.replayed,
+            'retries': self.retries,
+            'dead_lettered': self.dead_lettered,
+            'fsync_p50_ms': self._percentile(self.fsync_times, 0.5),
+            'fsync_p95_ms': self._percentile(self.fsync_times, 0.95),
+            'replay_lag_p50_ms': self._percentile(self.replay_lags, 0.5),
+            'replay_lag_p95_ms': self._percentile(self.replay_lags, 0.95),
+        })
+        return stats
+
+
+# 全局实例（API服务器启动时打开）
+ingest_spool = IngestSpool()
@@ -0,0 +1,206 @@
+"""
+事件循环卡顿监测
+心跳协程持续测量事件循环延迟并记录直方图；独立的监视线程在心跳超过阈值未更新时
+抓取事件循环线程当前的调用栈，定位阻塞事件循环的同步调用（数据库、Gemini、文件I/O、正则等）。
+开销为每个间隔一次sleep唤醒和一次线程检查，可在生产环境常开
+"""
+
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# 延迟直方图的桶上限（毫秒），最后一个桶为无穷大
+LAG_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf'))
+
+
+class LoopWatchdog:
+    """事件循环看门狗"""
+
+    def __init__(self, interval_ms: Optional[float] = None, threshold_ms: Optional[float] = None,
+                 max_stalls: Optional[int] = None):
+        """
+        Args:
+            interval_ms: 心跳间隔，默认LOOP_WATCHDOG_INTERVAL_MS
+            threshold_ms: 判定为卡顿的延迟，默认LOOP_WATCHDOG_THRESHOLD_MS
+            max_stalls: 保留的最近卡顿记录数
+        """
+        self.logger = logging.getLogger(__name__)
+        self.enabled = os.getenv('LOOP_WATCHDOG_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+        self.interval = (interval_ms or float(os.getenv('LOOP_WATCHDOG_INTERVAL_MS', '100'))) / 1000
+        self.threshold = (threshold_ms or float(os.getenv('LOOP_WATCHDOG_THRESHOLD_MS', '250'))) / 1000
+
+        self._loop = None
+        self._loop_thread_id = None
+        self._heartbeat_task = None
+        self._watcher_thread = None
+        self._stop_event = threading.Event()
+
+        # 最近一次心跳的单调时钟时间（监视线程只读）
+        self._last_beat = None
+        # 当前正在进行的卡顿记录（监视线程写入，心跳协程在卡顿结束时补全时长）
+        self._current_stall = None
+
+        # 统计
+        self.histogram = [0] * len(LAG_BUCKETS_MS)
+        self.samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.stall_count = 0
+        self.stalls = deque(maxlen=max_stalls or int(os.getenv('LOOP_WATCHDOG_MAX_STALLS', '20')))
+
+    # ---- 生命周期 ----
+
+    async def start(self):
+        """在当前事件循环中启动心跳协程和监视线程"""
+        if not self.enabled or self._heartbeat_task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop_event.clear()
+
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        self._watcher_thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._watcher_thread.start()
+        self.logger.info(
+            f"事件循环监测已启动: 心跳间隔 {self.interval * 1000:.0f}ms, 卡顿阈值 {self.threshold * 1000:.0f}ms"
+        )
+
+    async def stop(self):
+        """停止监测"""
+        self._stop_event.set()
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            try:
+                await self._heartbeat_task
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat_task = None
+        if self._watcher_thread is not None:
+            self._watcher_thread.join(timeout=1)
+            self._watcher_thread = None
+
+    # ---- 测量 ----
+
+    async def _heartbeat(self):
+        """心跳协程：每个间隔醒来一次，实际醒来时间与预期之差即为事件循环延迟"""
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._record_lag(max(0.0, now - expected))
+            self._last_beat = now
+
+    def _record_lag(self, lag: float):
+        """记录一次延迟样本"""
+        lag_ms = lag * 1000
+        for index, upper in enumerate(LAG_BUCKETS_MS):
+            if lag_ms <= upper:
+                self.histogram[index] += 1
+                break
+        self.samples += 1
+        self.total_lag += lag
+        self.max_lag = max(self.max_lag, lag)
+
+        stall = self._current_stall
+        if stall is not None:
+            # 卡顿结束：补全总时长
+            stall['lag_ms'] = round(lag_ms, 1)
+            stall['resolved'] = True
+            self._current_stall = None
+            self.logger.warning(f"⚠️ 事件循环卡顿 {lag_ms:.0f}ms，阻塞位置: {stall['location']}")
+        elif lag >= self.threshold:
+            # 卡顿发生在两次监视线程检查之间，未抓到调用栈
+            self._add_stall(lag_ms, [], resolved=True)
+
+    def _watch(self):
+        """监视线程：心跳超过阈值未更新时抓取事件循环线程的调用栈"""
+        check_interval = max(self.threshold / 2, 0.01)
+        while not self._stop_event.wait(check_interval):
+            last_beat = self._last_beat
+            if last_beat is None or self._current_stall is not None:
+                continue
+            overdue = time.monotonic() - last_beat - self.interval
+            if overdue < self.threshold:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.format_stack(frame)
+            self._current_stall = self._add_stall(overdue * 1000, stack, resolved=False)
+
+    def _add_stall(self, lag_ms: float, stack: List[str], resolved: bool) -> Dict[str, Any]:
+        """保存一条卡顿记录"""
+        stall = {
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'lag_ms': round(lag_ms, 1),
+            'resolved': resolved,
+            'location': self._blocking_location(stack),
+            'stack': [line.rstrip() for line in stack[-15:]]
+        }
+        self.stalls.append(stall)
+        self.stall_count += 1
+        return stall
+
+    @staticmethod
+    def _blocking_location(stack: List[str]) -> str:
+        """调用栈中最深的项目代码位置（跳过标准库和第三方库）"""
+        this_file = os.path.abspath(__file__)
+        project_dir = os.path.dirname(this_file)
+        for entry in reversed(stack):
+            first_line = entry.strip().splitlines()[0]
+            if (project_dir in first_line and 'site-packages' not in first_line
+                    and f'"{this_file}"' not in first_line):
+                return first_line.replace(project_dir + os.sep, '')
+        return stack[-1].strip().splitlines()[0] if stack else '未知（卡顿期间未抓到调用栈）'
+
+    # ---- 统计 ----
+
+    def _percentile(self, fraction: float) -> float:
+        """按直方图估算分位数（返回所在桶的上限）"""
+        if not self.samples:
+            return 0.0
+        target = self.samples * fraction
+        cumulative = 0
+        for index, count in enumerate(self.histogram):
+            cumulative += count
+            if cumulative >= target:
+                upper = LAG_BUCKETS_MS[index]
+                return upper if upper != float('inf') else round(self.max_lag * 1000, 1)
+        return round(self.max_lag * 1000, 1)
+
+    def get_stats(self, include_stacks: bool = True) -> Dict[str, Any]:
+        """获取监测统计"""
+        histogram = {
+            (f"<={upper:g}ms" if upper != float('inf') else f">{LAG_BUCKETS_MS[-2]:g}ms"): count
+            for upper, count in zip(LAG_BUCKETS_MS, self.histogram)
+        }
+        stalls = list(self.stalls)
+        if not include_stacks:
+            stalls = [{key: value for key, value in stall.items() if key != 'stack'} for stall in stalls]
+        return {
+            'enabled': self.enabled,
+            'running': self._heartbeat_task is not None,
+            'interval_ms': round(self.interval * 1000),
+            'threshold_ms': round(self.threshold * 1000),
+            'samples': self.samples,
+            'avg_lag_ms': round(self.total_lag / self.samples * 1000, 2) if self.samples else 0.0,
+            'p50_lag_ms': self._percentile(0.5),
+            'p99_lag_ms': self._percentile(0.99),
+            'max_lag_ms': round(self.max_lag * 1000, 1),
+            'stall_count': self.stall_count,
+            'histogram': histogram,
+            'recent_stalls': stalls
+        }
+
+
+# 全局事件循环看门狗实例
+loop_watchdog = LoopWatchdog()
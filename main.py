@@ -8,6 +8,7 @@ import asyncio
 import logging
 import sys
 import os
+import time
 from datetime import datetime
 from aiohttp import web
 
@@ -47,14 +48,21 @@ def validate_environment():
 
 # 全局变量追踪服务状态
 bot_status = {"running": False, "started_at": None}
+startup_started = time.perf_counter()
+
+def startup_elapsed() -> str:
+    """自进程启动以来的耗时"""
+    return f"+{(time.perf_counter() - startup_started) * 1000:.0f}ms"
 
 async def health_check(request):
     """健康检查端点"""
+    from models import get_db_status
     status = {
         "status": "healthy" if bot_status["running"] else "starting",
         "timestamp": datetime.now().isoformat(),
         "bot_running": bot_status["running"],
-        "started_at": bot_status["started_at"]
+        "started_at": bot_status["started_at"],
+        "database": get_db_status()
     }
     return web.json_response(status)
 
@@ -86,7 +94,7 @@ async def create_health_server():
     await site.start()
     
     logger = logging.getLogger(__name__)
-    logger.info("✅ 健康检查服务器启动在端口5000")
+    logger.info(f"✅ 健康检查服务器启动在端口5000 ({startup_elapsed()})")
     
     return runner
 
@@ -98,6 +106,9 @@ async def start_discord_bot():
         # 导入核心组件
         from bot import DiscordBot
         from config import Config
+        from db_executor import db_executor
+        from models import init_db
+        logger.info(f"⏱️ 模块导入完成 ({startup_elapsed()})")
         
         # 加载配置
         config = Config()
@@ -105,13 +116,23 @@ async def start_discord_bot():
         
         # 创建机器人实例
         bot = DiscordBot(config)
-        logger.info("✅ Discord机器人初始化完成")
+        bot.startup_started = startup_started
+        logger.info(f"✅ Discord机器人初始化完成 ({startup_elapsed()})")
         
         # 确认token存在
         if not config.discord_token:
             logger.error("❌ Discord token 配置错误")
             sys.exit(1)
         
+        # 数据库握手在后台进行，不阻塞Discord连接
+        async def connect_database():
+            if await db_executor.run(init_db):
+                logger.info(f"⏱️ 数据库就绪 ({startup_elapsed()})")
+            else:
+                logger.error(f"❌ 数据库初始化失败，将在首次使用时重试 ({startup_elapsed()})")
+        
+        db_init_task = asyncio.create_task(connect_database())
+        
         logger.info("🤖 正在连接Discord...")
         
         # 更新状态
@@ -119,7 +140,12 @@ async def start_discord_bot():
         bot_status["started_at"] = datetime.now().isoformat()
         
         # 启动Discord机器人
-        await bot.start(config.discord_token)
+        try:
+            await bot.start(config.discord_token)
+        finally:
+            # 机器人退出时数据库握手仍未完成则取消
+            if not db_init_task.done():
+                db_init_task.cancel()
         
     except Exception as e:
         logger.error(f"❌ Discord机器人启动错误: {e}")
@@ -8,6 +8,7 @@ import asyncio
 import logging
 import sys
 import os
+import time
 from datetime import datetime
 from aiohttp import web
 
@@ -27,9 +28,13 @@ def setup_logging():
 
 async def main():
     """主函数 - Discord机器人 + API服务器"""
+    startup_started = time.perf_counter()
     setup_logging()
     logger = logging.getLogger(__name__)
     
+    def elapsed() -> str:
+        return f"+{(time.perf_counter() - startup_started) * 1000:.0f}ms"
+    
     try:
         logger.info("🚀 启动完整版TDbot-tradingview (Discord + API)...")
         
@@ -47,6 +52,9 @@ async def main():
         from bot import DiscordBot
         from config import Config
         from api_server import DiscordAPIServer
+        from db_executor import db_executor
+        from models import init_db
+        logger.info(f"⏱️ 模块导入完成 ({elapsed()})")
         
         # 加载配置
         config = Config()
@@ -54,7 +62,8 @@ async def main():
         
         # 创建机器人实例
         bot = DiscordBot(config)
-        logger.info("✅ Discord机器人初始化完成")
+        bot.startup_started = startup_started
+        logger.info(f"✅ Discord机器人初始化完成 ({elapsed()})")
         
         # 创建API服务器
         api_server = DiscordAPIServer(bot)
@@ -62,7 +71,16 @@ async def main():
         
         # 启动API服务器（包含健康检查和TradingView webhook）
         api_runner = await api_server.start_server('0.0.0.0', 5000)
-        logger.info("✅ API服务器已启动在端口5000")
+        logger.info(f"✅ API服务器已启动在端口5000 ({elapsed()})")
+        
+        # 数据库握手在后台进行，不阻塞健康检查和Discord连接
+        async def connect_database():
+            if await db_executor.run(init_db):
+                logger.info(f"⏱️ 数据库就绪 ({elapsed()})")
+            else:
+                logger.error(f"❌ 数据库初始化失败，将在首次使用时重试 ({elapsed()})")
+        
+        db_init_task = asyncio.create_task(connect_database())
         
         logger.info("🤖 连接Discord机器人...")
         
@@ -72,7 +90,12 @@ async def main():
             sys.exit(1)
         
         # 启动Discord机器人
-        await bot.start(config.discord_token)
+        try:
+            await bot.start(config.discord_token)
+        finally:
+            # 机器人退出时数据库握手仍未完成则取消
+            if not db_init_task.done():
+                db_init_task.cancel()
         
     except KeyboardInterrupt:
         logger.info("⏹️ 收到停止信号，正在关闭...")
@@ -0,0 +1,167 @@
+"""
+消息路由
+启动时构建一次：频道ID集合和预编译的命令/预测/提及正则。
+每条消息先用几次哈希查找排除无关消息（非监控频道、非report频道、未@机器人），
+只有可能需要处理的消息才做正则匹配；bot.py按路由结果查分发表调用处理函数
+"""
+
+import logging
+import re
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
+
+# 路由结果
+IGNORE = 'ignore'
+COMMAND = 'command'
+ADMIN_COMMAND = 'admin_command'
+REPORT = 'report'
+CHART = 'chart'
+CHART_ANALYSIS = 'chart_analysis'
+PREDICTION = 'prediction'
+MENTION = 'mention'
+
+# 股票命令格式：股票符号 + 逗号/空格 + 时间框架
+STOCK_COMMAND_PATTERN = re.compile(r'[A-Z:]+[,\s]+\d+[smhdwMy]', re.IGNORECASE)
+# 预测请求中的股票符号
+PREDICTION_SYMBOL_PATTERN = re.compile(r'[A-Z]{2,}', re.IGNORECASE)
+
+CHART_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+CHART_IMAGE_MAX_BYTES = 10 * 1024 * 1024  # 10MB限制
+
+
+def _id_set(values: Optional[Iterable[str]]) -> FrozenSet[int]:
+    """配置中的频道ID字符串 -> 整数集合"""
+    return frozenset(int(value) for value in (values or []) if str(value).strip().isdigit())
+
+
+class MessageRouter:
+    """预编译的消息路由器"""
+
+    def __init__(self, config, prediction_keywords: Iterable[str], admin_commands: Iterable[str]):
+        self.logger = logging.getLogger(__name__)
+        self.monitor_channel_ids = _id_set(getattr(config, 'monitor_channel_ids', None))
+        # 配置了report频道ID时按ID判断，否则按频道名包含"report"判断
+        self.report_channel_ids = _id_set(getattr(config, 'report_channel_ids', None))
+
+        keywords = sorted({keyword.lower() for keyword in prediction_keywords}, key=len, reverse=True)
+        self.prediction_keyword_pattern = re.compile('|'.join(map(re.escape, keywords)))
+        self.admin_command_pattern = re.compile(
+            r'\s*(?:' + '|'.join(re.escape(command) for command in admin_commands) + ')', re.IGNORECASE
+        )
+
+        self.bot_user_id = None
+        self.mention_pattern = None
+        # 频道名 -> 是否为report频道
+        self._report_names: Dict[str, bool] = {}
+
+    def bind_user(self, user_id: int):
+        """登录后绑定机器人用户ID，预编译提及格式"""
+        self.bot_user_id = user_id
+        self.mention_pattern = re.compile(rf'<@!?{user_id}>')
+
+    # ---- 分类 ----
+
+    def has_stock_command(self, content: str) -> bool:
+        """检查消息是否包含股票命令格式"""
+        return STOCK_COMMAND_PATTERN.search(content) is not None
+
+    def has_prediction_command(self, content: str) -> bool:
+        """检查消息是否包含预测关键词和股票符号"""
+        return (self.prediction_keyword_pattern.search(content.lower()) is not None
+                and PREDICTION_SYMBOL_PATTERN.search(content) is not None)
+
+    def has_admin_command(self, content: str) -> bool:
+        """检查消息是否以管理员命令开头"""
+        return self.admin_command_pattern.match(content) is not None
+
+    @staticmethod
+    def has_chart_image(attachments) -> bool:
+        """检查附件中是否包含图表图片"""
+        return any(
+            attachment.filename.lower().endswith(CHART_IMAGE_EXTENSIONS) and attachment.size < CHART_IMAGE_MAX_BYTES
+            for attachment in attachments
+        )
+
+    def is_report_channel(self, channel) -> bool:
+        """检查是否为report频道"""
+        if self.report_channel_ids:
+            return channel.id in self.report_channel_ids
+        name = getattr(channel, 'name', None)
+        if not name:
+            return False
+        result = self._report_names.get(name)
+        if result is None:
+            result = self._report_names[name] = 'report' in name.lower()
+        return result
+
+    def is_mentioned(self, message) -> bool:
+        """检查机器人（或机器人的角色）是否被@提及"""
+        user_id = self.bot_user_id
+        if user_id is None:
+            return False
+        for user in message.mentions:
+            if user.id == user_id:
+                return True
+        # 只有消息提及了角色时才查机器人成员的角色
+        if message.role_mentions and message.guild is not None:
+            bot_member = message.guild.get_member(user_id)
+            if bot_member and any(bot_member.get_role(role.id) for role in message.role_mentions):
+                return True
+        # 未解析到mentions时（如部分缓存缺失）再检查原始提及格式
+        content = message.content
+        return '<@' in content and self.mention_pattern.search(content) is not None
+
+    # ---- 路由 ----
+
+    def route(self, message) -> Tuple[str, Optional[str]]:
+        """
+        判断消息的处理方式
+
+        Returns:
+            (路由结果, 命令名)；命令名只在COMMAND时返回
+        """
+        if message.author.id == self.bot_user_id:
+            return IGNORE, None
+
+        content = message.content
+        # 命令（包括管理员命令） - 优先级最高
+        if content.startswith('!'):
+            if self.has_admin_command(content):
+                return ADMIN_COMMAND, None
+            return COMMAND, content.split()[0][1:]
+
+        channel = message.channel
+        is_monitored = channel.id in self.monitor_channel_ids
+        is_report = self.is_report_channel(channel)
+        is_mentioned = self.is_mentioned(message)
+
+        # 大多数消息在这里结束：不在关注的频道，也没有@机器人
+        if not (is_monitored or is_report or is_mentioned):
+            return IGNORE, None
+
+        # 优先处理report频道的请求 - 专门生成AI报告
+        if is_report and not message.author.bot:
+            return REPORT, None
+
+        has_stock = self.has_stock_command(content)
+        # 监控频道的@提及股票命令 - 生成图表
+        if is_mentioned and is_monitored and has_stock:
+            return CHART, None
+        # 其他@提及处理
+        if is_mentioned:
+            if message.attachments and self.has_chart_image(message.attachments):
+                return CHART_ANALYSIS, None
+            if self.has_prediction_command(content):
+                return PREDICTION, None
+            # 在非监控/非report频道中也支持@提及方式的股票命令
+            if has_stock and not is_report:
+                return CHART, None
+            return MENTION, None
+        # 监控频道中的直接命令
+        if is_monitored:
+            if has_stock:
+                return CHART, None
+            if self.has_prediction_command(content):
+                return PREDICTION, None
+            if message.attachments and self.has_chart_image(message.attachments):
+                return CHART_ANALYSIS, None
+        return IGNORE, None
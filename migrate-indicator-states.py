@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+数据库字段迁移脚本 - 分类指标状态编码
+为tradingview_data添加指标状态SMALLINT列和 (symbol, timeframe, received_at) 组合索引，
+并从raw_data回填已有的信号数据（分批执行，可重复运行，已编码的行会被跳过）
+
+用法:
+    python migrate-indicator-states.py [--batch-size 2000]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from sqlalchemy import create_engine, text, inspect
+from sqlalchemy.exc import OperationalError
+
+from indicator_codes import STATE_COLUMNS, encode_indicator_states
+
+def get_database_url():
+    """获取数据库URL"""
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        print("❌ 错误: DATABASE_URL环境变量未设置")
+        return None
+    return database_url
+
+def add_state_columns(engine):
+    """添加缺失的状态列"""
+    print("🔧 检查并添加指标状态列...")
+    existing = {col['name'] for col in inspect(engine).get_columns('tradingview_data')}
+    added_count = 0
+    for column_name in STATE_COLUMNS:
+        if column_name in existing:
+            continue
+        with engine.connect() as conn:
+            conn.execute(text(f"ALTER TABLE tradingview_data ADD COLUMN {column_name} SMALLINT"))
+            conn.commit()
+        print(f"✅ 添加列: {column_name}")
+        added_count += 1
+    print(f"✅ 新增 {added_count} 列，共 {len(STATE_COLUMNS)} 个状态列")
+
+def create_history_index(engine):
+    """创建历史查询用的组合索引"""
+    print("🔧 检查并创建组合索引...")
+    with engine.connect() as conn:
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS idx_tradingview_symbol_timeframe_received "
+            "ON tradingview_data (symbol, timeframe, received_at)"
+        ))
+        conn.commit()
+    print("✅ idx_tradingview_symbol_timeframe_received")
+
+def backfill_states(engine, batch_size):
+    """按ID分批回填，只处理所有状态列都为空的信号数据"""
+    print("🔧 回填已有信号数据的指标状态...")
+    all_null = " AND ".join(f"{column} IS NULL" for column in STATE_COLUMNS)
+    select_sql = text(
+        f"SELECT id, raw_data FROM tradingview_data "
+        f"WHERE data_type = 'signal' AND id > :last_id AND {all_null} "
+        f"ORDER BY id LIMIT :limit"
+    )
+    update_sql = text(
+        "UPDATE tradingview_data SET "
+        + ", ".join(f"{column} = :{column}" for column in STATE_COLUMNS)
+        + " WHERE id = :id"
+    )
+
+    last_id = 0
+    updated = skipped = 0
+    started = time.time()
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(select_sql, {'last_id': last_id, 'limit': batch_size}).fetchall()
+            if not rows:
+                break
+            params = []
+            for row_id, raw_data in rows:
+                try:
+                    states = encode_indicator_states(json.loads(raw_data))
+                except (TypeError, ValueError):
+                    skipped += 1
+                    continue
+                if all(code is None for code in states.values()):
+                    skipped += 1
+                    continue
+                states['id'] = row_id
+                params.append(states)
+            if params:
+                conn.execute(update_sql, params)
+            conn.commit()
+        updated += len(params)
+        last_id = rows[-1][0]
+        print(f"  已回填 {updated} 行（跳过 {skipped} 行），当前ID {last_id}")
+    print(f"✅ 回填完成: {updated} 行, 跳过 {skipped} 行, 耗时 {time.time() - started:.1f}s")
+    return updated
+
+def show_state_summary(engine):
+    """显示编码后的状态分布"""
+    print("\n📊 PMA状态分布（信号数据）:")
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT pma_state, COUNT(*) FROM tradingview_data WHERE data_type = 'signal' "
+            "GROUP BY pma_state ORDER BY pma_state"
+        )).fetchall()
+    for code, count in rows:
+        print(f"  {code if code is not None else '空'}: {count}条")
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="分类指标状态编码迁移")
+    parser.add_argument('--batch-size', type=int, default=2000, help="每批回填的行数")
+    args = parser.parse_args()
+
+    print("🚀 数据库字段迁移工具 - 分类指标状态编码")
+    print("=" * 50)
+
+    database_url = get_database_url()
+    if not database_url:
+        sys.exit(1)
+
+    try:
+        engine = create_engine(database_url)
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        print("✅ 数据库连接成功")
+
+        add_state_columns(engine)
+        create_history_index(engine)
+        backfill_states(engine, args.batch_size)
+        show_state_summary(engine)
+        print("\n🎉 迁移完成")
+
+    except OperationalError as e:
+        print(f"❌ 数据库连接失败: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"❌ 迁移过程中出错: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+数据库字段迁移脚本 - 信号差量存储
+为tradingview_data添加snapshot_id列及索引（已有数据都是完整数据，snapshot_id保持为空，不需要回填）
+
+用法:
+    python migrate-signal-deltas.py
+"""
+import os
+import sys
+from sqlalchemy import create_engine, text, inspect
+from sqlalchemy.exc import OperationalError
+
+def get_database_url():
+    """获取数据库URL"""
+    database_url = os.environ.get('DATABASE_URL')
+    if not database_url:
+        print("❌ 错误: DATABASE_URL环境变量未设置")
+        return None
+    return database_url
+
+def add_snapshot_column(engine):
+    """添加snapshot_id列和索引"""
+    print("🔧 检查并添加snapshot_id列...")
+    existing = {col['name'] for col in inspect(engine).get_columns('tradingview_data')}
+    with engine.connect() as conn:
+        if 'snapshot_id' in existing:
+            print("✅ snapshot_id 列已存在")
+        else:
+            conn.execute(text("ALTER TABLE tradingview_data ADD COLUMN snapshot_id INTEGER"))
+            print("✅ 添加列: snapshot_id")
+        conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_tradingview_data_snapshot_id ON tradingview_data (snapshot_id)"
+        ))
+        conn.commit()
+    print("✅ ix_tradingview_data_snapshot_id")
+
+def show_storage_summary(engine):
+    """显示信号数据的存储形式"""
+    print("\n📊 信号数据存储:")
+    with engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT snapshot_id IS NULL, COUNT(*), AVG(LENGTH(raw_data)) FROM tradingview_data "
+            "WHERE data_type = 'signal' GROUP BY snapshot_id IS NULL"
+        )).fetchall()
+    for is_full, count, avg_bytes in rows:
+        print(f"  {'完整数据' if is_full else '差量'}: {count}条, 平均 {avg_bytes or 0:.0f} 字节")
+
+def main():
+    """主函数"""
+    print("🚀 数据库字段迁移工具 - 信号差量存储")
+    print("=" * 50)
+
+    database_url = get_database_url()
+    if not database_url:
+        sys.exit(1)
+
+    try:
+        engine = create_engine(database_url)
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        print("✅ 数据库连接成功")
+
+        add_snapshot_column(engine)
+        show_storage_summary(engine)
+        print("\n🎉 迁移完成")
+
+    except OperationalError as e:
+        print(f"❌ 数据库连接失败: {e}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"❌ 迁移过程中出错: {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
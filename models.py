@@ -3,8 +3,14 @@
 用于跟踪用户每日请求限制和使用统计，以及TradingView数据存储
 """
 import os
+import time
+import threading
 from datetime import datetime, timezone
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Date, text, Text, Float, Boolean
+from sqlalchemy import create_engine, event, Column, Integer, String, DateTime, Date, text, Text, Float, Boolean, UniqueConstraint, SmallInteger, Index
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DBAPIError, DisconnectionError
+from sqlalchemy.exc import TimeoutError as SATimeoutError
+from sqlalchemy.pool import QueuePool, StaticPool
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.sql import func
@@ -47,6 +53,10 @@ class ExemptUser(Base):
 class TradingViewData(Base):
     """TradingView webhook数据存储 - 增强版支持3种数据类型"""
     __tablename__ = 'tradingview_data'
+    __table_args__ = (
+        # 单个股票/时间框架的历史查询
+        Index('idx_tradingview_symbol_timeframe_received', 'symbol', 'timeframe', 'received_at'),
+    )
     
     id = Column(Integer, primary_key=True, autoincrement=True)
     symbol = Column(String(20), nullable=False, index=True)  # 股票代码，如 AAPL
@@ -75,12 +85,30 @@ class TradingViewData(Base):
     bearish_trend_rating = Column(Float, nullable=True)
     current_timeframe = Column(String(10), nullable=True)
     
+    # 分类指标状态编码 (signal类型，编码见indicator_codes.py：看跌为负、中性为0、看涨为正)
+    pma_state = Column(SmallInteger, nullable=True)  # PMA
+    cvd_state = Column(SmallInteger, nullable=True)  # CVD
+    rsi_ha_state = Column(SmallInteger, nullable=True)  # Heikin Ashi RSI
+    bbp_state = Column(SmallInteger, nullable=True)  # 多空力量
+    sqz_state = Column(SmallInteger, nullable=True)  # 挤压 (1=挤压中)
+    chopping_state = Column(SmallInteger, nullable=True)  # 震荡区间 (1=震荡中)
+    center_trend_state = Column(SmallInteger, nullable=True)  # 中心趋势
+    wave_state = Column(SmallInteger, nullable=True)  # WaveMatrix状态
+    ewo_state = Column(SmallInteger, nullable=True)  # 艾略特波浪趋势
+    htf_wave_state = Column(SmallInteger, nullable=True)  # 高时间框架波浪
+    ma_trend = Column(SmallInteger, nullable=True)  # 当前时间框架MA趋势 (-1/0/1)
+    ma_trend_tf1 = Column(SmallInteger, nullable=True)  # 时间框架1 MA趋势
+    ma_trend_tf2 = Column(SmallInteger, nullable=True)  # 时间框架2 MA趋势
+    trend_tracer = Column(SmallInteger, nullable=True)  # TrendTracer (-1/1)
+    trend_tracer_htf = Column(SmallInteger, nullable=True)  # 高时间框架TrendTracer
+    
     # 触发指标信息 (仅trade类型使用)
     trigger_indicator = Column(String(100), nullable=True)
     trigger_timeframe = Column(String(10), nullable=True)
     
     # 原始JSON数据存储（用于保存完整信息）
-    raw_data = Column(Text, nullable=False)  # 原始JSON字符串
+    raw_data = Column(Text, nullable=False)  # 原始JSON字符串（snapshot_id不为空时为差量，见signal_deltas.py）
+    snapshot_id = Column(Integer, nullable=True, index=True)  # 差量所基于的完整快照行ID，为空表示raw_data是完整数据
     
     # 解析后的信号数据 (JSON格式存储)
     parsed_signals = Column(Text, nullable=True)  # 解析后的信号列表JSON
@@ -149,52 +177,354 @@ class ReportCache(Base):
             'processed_at': self.processed_at.isoformat() if self.processed_at else None
         }
 
+class SymbolExchange(Base):
+    """股票代码-交易所映射表 - 记录探测结果，避免重复探测未知代码"""
+    __tablename__ = 'symbol_exchanges'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    symbol = Column(String(20), nullable=False, unique=True, index=True)  # 股票代码，如 SOFI
+    exchange_symbol = Column(String(40), nullable=True)  # 带交易所前缀的代码，如 NASDAQ:SOFI；未解析时为空
+    resolved = Column(Boolean, default=True, nullable=False)  # False表示所有交易所都探测失败（负缓存）
+    probed_at = Column(DateTime, default=func.now(), nullable=False)  # 最近一次探测时间
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
+    
+    def __repr__(self):
+        return f"<SymbolExchange {self.symbol} -> {self.exchange_symbol} resolved:{self.resolved}>"
+
+class AlertSubscription(Base):
+    """股票提醒订阅表 - 用户订阅 (股票代码, 时间框架, 事件类型)，事件发生时私信通知"""
+    __tablename__ = 'alert_subscriptions'
+    __table_args__ = (
+        UniqueConstraint('user_id', 'symbol', 'timeframe', 'event_type', name='uq_alert_subscription'),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(String(50), nullable=False, index=True)  # Discord用户ID
+    username = Column(String(100), nullable=False)  # Discord用户名
+    symbol = Column(String(20), nullable=False, index=True)  # 股票代码，如 NVDA
+    timeframe = Column(String(10), nullable=False)  # 时间框架，"*" 表示所有时间框架
+    event_type = Column(String(20), nullable=False)  # 事件类型: trade / close / pma
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+    
+    def __repr__(self):
+        return f"<AlertSubscription {self.user_id}: {self.symbol}-{self.timeframe} {self.event_type}>"
+
+class AlertRule(Base):
+    """股票提醒规则表 - 用户定义的信号条件（如 BullishTrendRating+BullishOscRating > 8），满足时私信通知"""
+    __tablename__ = 'alert_rules'
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(String(50), nullable=False, index=True)  # Discord用户ID
+    username = Column(String(100), nullable=False)  # Discord用户名
+    symbol = Column(String(20), nullable=False, index=True)  # 股票代码，如 NVDA
+    timeframe = Column(String(10), nullable=False)  # 时间框架，"*" 表示所有时间框架
+    expression = Column(Text, nullable=False)  # 规则条件表达式
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+    
+    def __repr__(self):
+        return f"<AlertRule #{self.id} {self.user_id}: {self.symbol}-{self.timeframe} {self.expression}>"
+
 # 数据库连接设置
 DATABASE_URL = os.environ.get('DATABASE_URL')
 
-if not DATABASE_URL:
-    raise ValueError("DATABASE_URL环境变量未设置，用户限制功能将无法工作")
+# 连接池配置（可通过环境变量调整）
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '300'))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', '10'))
+
+# SQLite嵌入式配置（DATABASE_URL以sqlite开头时生效）
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+SQLITE_CACHE_SIZE_KB = int(os.environ.get('SQLITE_CACHE_SIZE_KB', '20000'))
+
+
+class PoolMetrics:
+    """连接池指标 - 记录连接等待时间、使用中连接数和溢出事件"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_wait_total = 0.0
+        self.checkout_wait_max = 0.0
+        self.overflow_events = 0
+        self.peak_overflow = 0
+        self.timeouts = 0
+        self.connections_created = 0
+    
+    def record_checkout(self, wait_seconds: float, overflow_created: bool, overflow: int):
+        """记录一次连接获取"""
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_wait_total += wait_seconds
+            self.checkout_wait_max = max(self.checkout_wait_max, wait_seconds)
+            if overflow_created:
+                self.overflow_events += 1
+            self.peak_overflow = max(self.peak_overflow, overflow)
+    
+    def record_timeout(self):
+        """记录一次连接获取超时"""
+        with self._lock:
+            self.timeouts += 1
+    
+    def record_connect(self):
+        """记录一次新建数据库连接"""
+        with self._lock:
+            self.connections_created += 1
+    
+    def snapshot(self, pool=None) -> dict:
+        """获取当前指标快照"""
+        with self._lock:
+            avg_wait_ms = (self.checkout_wait_total / self.checkouts * 1000) if self.checkouts else 0.0
+            data = {
+                'checkouts': self.checkouts,
+                'checkout_wait_avg_ms': round(avg_wait_ms, 3),
+                'checkout_wait_max_ms': round(self.checkout_wait_max * 1000, 3),
+                'overflow_events': self.overflow_events,
+                'peak_overflow': self.peak_overflow,
+                'timeouts': self.timeouts,
+                'connections_created': self.connections_created
+            }
+        
+        if pool is not None and isinstance(pool, QueuePool):
+            data.update({
+                'pool_size': pool.size(),
+                'max_overflow': DB_MAX_OVERFLOW,
+                'checked_out': pool.checkedout(),
+                'checked_in': pool.checkedin(),
+                'overflow': max(0, pool.overflow())
+            })
+        return data
+
 
-try:
-    # 创建引擎，添加连接池配置
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """记录连接获取等待时间和溢出事件的连接池"""
+    
+    def _do_get(self):
+        overflow_before = self.overflow()
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except SATimeoutError:
+            pool_metrics.record_timeout()
+            raise
+        overflow_after = self.overflow()
+        pool_metrics.record_checkout(
+            time.perf_counter() - started,
+            overflow_created=overflow_after > overflow_before and overflow_after > 0,
+            overflow=max(0, overflow_after)
+        )
+        return conn
+
+
+# 延迟初始化的全局引擎 - 导入模块时不建立任何连接
+_engine = None
+_session_factory = None
+_engine_lock = threading.Lock()
+
+# 数据库初始化状态（供健康检查端点使用）
+db_status = {
+    'status': 'pending',  # pending / ready / error
+    'error': None,
+    'connect_ms': None,
+    'ready_at': None
+}
+
+
+def get_engine():
+    """
+    获取全局共享引擎，首次调用时创建
+    
+    所有模块通过get_db_session使用同一个连接池
+    """
+    global _engine, _session_factory
+    if _engine is not None:
+        return _engine
+    
+    with _engine_lock:
+        if _engine is None:
+            if not DATABASE_URL:
+                raise ValueError("DATABASE_URL环境变量未设置，用户限制功能将无法工作")
+            
+            if is_sqlite():
+                engine = _create_sqlite_engine(DATABASE_URL)
+            else:
+                engine = create_engine(
+                    DATABASE_URL, 
+                    echo=False,
+                    poolclass=InstrumentedQueuePool,
+                    pool_size=DB_POOL_SIZE,
+                    max_overflow=DB_MAX_OVERFLOW,
+                    pool_timeout=DB_POOL_TIMEOUT,
+                    pool_pre_ping=DB_POOL_PRE_PING,  # 检出时验证连接有效性（唯一的存活检查）
+                    pool_recycle=DB_POOL_RECYCLE,
+                    connect_args={"connect_timeout": DB_CONNECT_TIMEOUT}
+                )
+            event.listen(engine, "connect", lambda dbapi_conn, conn_record: pool_metrics.record_connect())
+            _session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+            
+            # 嵌入式数据库没有docker-db-init.sql，首次使用时自动建表
+            if is_sqlite():
+                Base.metadata.create_all(bind=engine)
+            _engine = engine
+    return _engine
+
+
+def is_sqlite() -> bool:
+    """是否使用SQLite嵌入式配置"""
+    return bool(DATABASE_URL) and DATABASE_URL.startswith('sqlite')
+
+
+def _create_sqlite_engine(url: str):
+    """
+    创建SQLite引擎 - WAL模式，适用于测试、基准测试和小型部署
+    
+    文件数据库使用带指标的连接池（WAL允许读写并发）；内存数据库只能共享单个连接
+    """
+    in_memory = url in ('sqlite://', 'sqlite:///:memory:')
+    pool_options = {'poolclass': StaticPool} if in_memory else {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT
+    }
     engine = create_engine(
-        DATABASE_URL, 
+        url,
         echo=False,
-        pool_pre_ping=True,  # 验证连接有效性
-        pool_recycle=300,    # 5分钟回收连接
-        connect_args={"connect_timeout": 10}  # 10秒连接超时
+        connect_args={
+            'check_same_thread': False,  # 连接由db_executor线程池中的多个线程使用
+            'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000
+        },
+        **pool_options
     )
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
     
-    # 测试数据库连接
-    with engine.connect() as conn:
-        conn.execute(text("SELECT 1"))
-    print("✅ 数据库连接成功")
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_conn, conn_record):
+        cursor = dbapi_conn.cursor()
+        if not in_memory:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+    
+    return engine
+
+
+def upsert(session, model, values: dict, conflict_columns: list, update_columns: list = None) -> int:
+    """
+    可移植的INSERT ... ON CONFLICT（Postgres和SQLite语法一致）
+    
+    Args:
+        session: 数据库会话
+        model: 模型类
+        values: 要插入的字段值
+        conflict_columns: 唯一约束字段
+        update_columns: 冲突时更新的字段，为None时冲突则忽略
+        
+    Returns:
+        受影响的行数（冲突且忽略时为0）
+    """
+    dialect = session.get_bind().dialect.name
+    insert_func = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+    stmt = insert_func(model).values(**values)
+    
+    if update_columns:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=conflict_columns,
+            set_={column: stmt.excluded[column] for column in update_columns}
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=conflict_columns)
     
-except Exception as e:
-    print(f"❌ 数据库连接失败: {e}")
-    print(f"DATABASE_URL: {DATABASE_URL}")
-    raise
+    return session.execute(stmt).rowcount
+
+
+def init_db() -> bool:
+    """
+    显式初始化数据库：创建引擎并测试连接
+    
+    Returns:
+        连接是否成功（失败时不抛出异常，状态记录在db_status中）
+    """
+    started = time.perf_counter()
+    try:
+        with get_engine().connect() as conn:
+            conn.execute(text("SELECT 1"))
+        
+        db_status.update({
+            'status': 'ready',
+            'error': None,
+            'connect_ms': round((time.perf_counter() - started) * 1000, 1),
+            'ready_at': datetime.now().isoformat()
+        })
+        print(f"✅ 数据库连接成功 ({db_status['connect_ms']}ms)")
+        return True
+        
+    except Exception as e:
+        db_status.update({
+            'status': 'error',
+            'error': str(e),
+            'connect_ms': round((time.perf_counter() - started) * 1000, 1)
+        })
+        print(f"❌ 数据库连接失败: {e}")
+        return False
+
+
+def get_db_status() -> dict:
+    """获取数据库初始化状态"""
+    return dict(db_status)
+
 
 def create_tables():
     """创建数据库表"""
-    Base.metadata.create_all(bind=engine)
+    Base.metadata.create_all(bind=get_engine())
     print("数据库表创建完成")
 
 def get_db_session():
-    """获取数据库会话"""
-    return SessionLocal()
+    """获取数据库会话（首次调用时创建引擎；连接在首次查询时从连接池检出，由pool_pre_ping保证有效）"""
+    if _session_factory is None:
+        get_engine()
+    return _session_factory()
 
-def get_db_session():
-    """获取数据库会话"""
-    try:
-        session = SessionLocal()
-        # 测试连接
-        session.execute(text("SELECT 1"))
-        return session
-    except Exception as e:
-        print(f"❌ 获取数据库会话失败: {e}")
-        raise
+# 暂时性错误的SQLSTATE：连接异常(08xxx)、管理员关闭/数据库重启(57Pxx)、串行化冲突(40001)、死锁(40P01)
+_TRANSIENT_SQLSTATES = ('08', '57P', '40001', '40P01')
+# 驱动没有给出SQLSTATE时（SQLite、连接阶段的错误），按错误信息判断
+_TRANSIENT_MESSAGES = (
+    'database is locked', 'database is busy', 'database table is locked',
+    'could not connect', 'connection refused', 'server closed the connection', 'connection already closed',
+    'terminating connection', 'ssl connection has been closed',
+)
+
+def is_transient_db_error(error: BaseException) -> bool:
+    """
+    数据库暂时不可用（连接断开、连接池超时、数据库繁忙/锁定）导致的错误，稍后重试可能成功
+
+    缺少表或列（未迁移的数据库）、约束冲突、数据类型错误等重试也不会成功，返回False
+    """
+    if isinstance(error, (DisconnectionError, SATimeoutError, ConnectionError, TimeoutError)):
+        return True
+    if not isinstance(error, DBAPIError):
+        return False
+    if error.connection_invalidated:
+        return True
+    sqlstate = getattr(error.orig, 'pgcode', None) or getattr(error.orig, 'sqlstate', None)
+    if sqlstate:
+        return sqlstate.startswith(_TRANSIENT_SQLSTATES)
+    message = str(error.orig).lower()
+    return any(pattern in message for pattern in _TRANSIENT_MESSAGES)
+
+def get_pool_metrics() -> dict:
+    """获取连接池指标"""
+    return pool_metrics.snapshot(_engine.pool if _engine is not None else None)
 
 if __name__ == "__main__":
     # 创建表
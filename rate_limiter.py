@@ -3,13 +3,16 @@
 处理每日请求限制检查和更新
 """
 import os
+import asyncio
 import logging
+from collections import deque
 from datetime import datetime, timezone, date
 from typing import Optional, Tuple
 from sqlalchemy.orm import Session
 from sqlalchemy import and_
 
-from models import UserRequestLimit, ExemptUser, get_db_session
+from models import UserRequestLimit, ExemptUser, get_db_session, upsert
+from db_executor import db_executor
 
 class RateLimiter:
     """用户请求频率限制管理器"""
@@ -17,6 +20,102 @@ class RateLimiter:
     def __init__(self, daily_limit: int = 3):
         self.daily_limit = daily_limit
         self.logger = logging.getLogger(__name__)
+        
+        # 豁免用户内存缓存 - 只在管理员变更和定时刷新时重新加载
+        self._exempt_user_ids = frozenset()
+        self._exempt_cache_loaded_at = None
+        self.exempt_refresh_interval = int(os.getenv('EXEMPT_CACHE_REFRESH_SECONDS', '300'))
+        self.exempt_refresh_task = None
+        self.exempt_refresh_count = 0
+        self.exempt_refresh_events = deque(maxlen=10)  # 最近的刷新事件
+    
+    def refresh_exempt_cache(self, source: str = "manual") -> bool:
+        """
+        从数据库重新加载豁免用户集合
+        
+        Args:
+            source: 触发刷新的来源（startup/periodic/vip_add等），用于管理员查看
+            
+        Returns:
+            bool: 是否刷新成功（失败时保留旧的缓存）
+        """
+        db = None
+        try:
+            db = get_db_session()
+            rows = db.query(ExemptUser.user_id).all()
+            self._exempt_user_ids = frozenset(row[0] for row in rows)
+            self._exempt_cache_loaded_at = datetime.now(timezone.utc)
+            self.exempt_refresh_count += 1
+            self.exempt_refresh_events.append({
+                'time': self._exempt_cache_loaded_at,
+                'source': source,
+                'size': len(self._exempt_user_ids),
+                'success': True
+            })
+            self.logger.info(f"豁免用户缓存已刷新 ({source}): {len(self._exempt_user_ids)} 个用户")
+            return True
+            
+        except Exception as e:
+            self.exempt_refresh_events.append({
+                'time': datetime.now(timezone.utc),
+                'source': source,
+                'size': len(self._exempt_user_ids),
+                'success': False
+            })
+            self.logger.error(f"刷新豁免用户缓存失败 ({source}): {e}")
+            return False
+        finally:
+            if db:
+                db.close()
+    
+    def is_exempt_user(self, user_id: str) -> bool:
+        """检查用户是否在豁免缓存中（首次调用时加载缓存）"""
+        if self._exempt_cache_loaded_at is None:
+            self.refresh_exempt_cache("startup")
+        return user_id in self._exempt_user_ids
+    
+    def get_exempt_cache_stats(self) -> dict:
+        """获取豁免用户缓存状态（用于管理员命令）"""
+        age_seconds = None
+        if self._exempt_cache_loaded_at:
+            age_seconds = (datetime.now(timezone.utc) - self._exempt_cache_loaded_at).total_seconds()
+        
+        return {
+            'size': len(self._exempt_user_ids),
+            'loaded_at': self._exempt_cache_loaded_at,
+            'age_seconds': age_seconds,
+            'refresh_interval': self.exempt_refresh_interval,
+            'refresh_count': self.exempt_refresh_count,
+            'is_running': bool(self.exempt_refresh_task and not self.exempt_refresh_task.done()),
+            'recent_events': list(self.exempt_refresh_events)
+        }
+    
+    async def start_exempt_refresh(self):
+        """启动豁免用户缓存定时刷新任务（多进程部署时保证最终一致）"""
+        if self.exempt_refresh_task is None or self.exempt_refresh_task.done():
+            self.exempt_refresh_task = asyncio.create_task(self._exempt_refresh_loop())
+            self.logger.info(f"豁免用户缓存定时刷新已启动，间隔 {self.exempt_refresh_interval} 秒")
+    
+    async def stop_exempt_refresh(self):
+        """停止豁免用户缓存定时刷新任务"""
+        if self.exempt_refresh_task and not self.exempt_refresh_task.done():
+            self.exempt_refresh_task.cancel()
+            try:
+                await self.exempt_refresh_task
+            except asyncio.CancelledError:
+                pass
+            self.logger.info("豁免用户缓存定时刷新已停止")
+    
+    async def _exempt_refresh_loop(self):
+        """豁免用户缓存刷新循环"""
+        while True:
+            try:
+                await asyncio.sleep(self.exempt_refresh_interval)
+                await db_executor.run(self.refresh_exempt_cache, "periodic")
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                self.logger.error(f"豁免用户缓存刷新任务发生错误: {e}")
     
     def check_user_limit(self, user_id: str, username: str) -> Tuple[bool, int, int]:
         """
@@ -30,15 +129,12 @@ class RateLimiter:
             Tuple[bool, int, int]: (是否允许请求, 当前使用次数, 剩余次数)
         """
         try:
-            db = get_db_session()
-            
-            # 检查用户是否在豁免列表中
-            exempt_user = db.query(ExemptUser).filter(ExemptUser.user_id == user_id).first()
-            if exempt_user:
+            # 检查用户是否在豁免列表中（内存缓存，不查询数据库）
+            if self.is_exempt_user(user_id):
                 self.logger.info(f"用户 {username} ({user_id}) 在豁免列表中，无限制")
-                db.close()
                 return True, 0, 999  # 豁免用户返回999剩余次数表示无限制
             
+            db = get_db_session()
             today = date.today()
             
             # 查找用户今日记录
@@ -83,13 +179,14 @@ class RateLimiter:
             # 发生错误时，为了安全起见，拒绝请求
             return False, 0, 0
     
-    def record_request(self, user_id: str, username: str) -> bool:
+    def record_request(self, user_id: str, username: str, units: int = 1) -> bool:
         """
         记录用户请求，增加计数
         
         Args:
             user_id: Discord用户ID
             username: Discord用户名
+            units: 本次请求消耗的配额单位（多时间框架组合请求可配置）
             
         Returns:
             bool: 是否成功记录
@@ -109,7 +206,7 @@ class RateLimiter:
             
             if user_record:
                 # 更新现有记录
-                user_record.request_count += 1
+                user_record.request_count += units
                 user_record.last_request_time = datetime.now(timezone.utc)
                 user_record.username = username  # 更新用户名（可能变化）
             else:
@@ -118,7 +215,7 @@ class RateLimiter:
                     user_id=user_id,
                     username=username,
                     request_date=today,
-                    request_count=1,
+                    request_count=units,
                     last_request_time=datetime.now(timezone.utc)
                 )
                 db.add(user_record)
@@ -237,25 +334,23 @@ class RateLimiter:
         try:
             db = get_db_session()
             
-            # 检查用户是否已经在豁免列表中
-            existing = db.query(ExemptUser).filter(ExemptUser.user_id == user_id).first()
-            if existing:
+            # 单条INSERT ... ON CONFLICT DO NOTHING，已存在时不插入
+            inserted = upsert(db, ExemptUser, {
+                'user_id': user_id,
+                'username': username,
+                'reason': reason,
+                'added_by': added_by
+            }, conflict_columns=['user_id'])
+            db.commit()
+            
+            if not inserted:
                 self.logger.warning(f"用户 {username} ({user_id}) 已在豁免列表中")
                 db.close()
                 return False
             
-            # 添加新的豁免用户
-            exempt_user = ExemptUser(
-                user_id=user_id,
-                username=username,
-                reason=reason,
-                added_by=added_by
-            )
-            db.add(exempt_user)
-            db.commit()
-            
             self.logger.info(f"成功添加豁免用户: {username} ({user_id}), 原因: {reason}")
             db.close()
+            self.refresh_exempt_cache("exempt_add")
             return True
             
         except Exception as e:
@@ -283,6 +378,7 @@ class RateLimiter:
                 db.commit()
                 self.logger.info(f"成功移除豁免用户: {username} ({user_id})")
                 db.close()
+                self.refresh_exempt_cache("exempt_remove")
                 return True
             else:
                 self.logger.warning(f"用户 {user_id} 不在豁免列表中")
@@ -293,16 +389,50 @@ class RateLimiter:
             self.logger.error(f"移除豁免用户时发生错误: {e}")
             return False
     
+    def get_exempt_user(self, user_id: str) -> Optional[dict]:
+        """
+        从数据库获取单个豁免用户信息
+        
+        Args:
+            user_id: Discord用户ID
+            
+        Returns:
+            dict: 豁免用户信息，不存在时返回None
+        """
+        try:
+            db = get_db_session()
+            user = db.query(ExemptUser).filter(ExemptUser.user_id == user_id).first()
+            
+            result = None
+            if user:
+                result = {
+                    'user_id': user.user_id,
+                    'username': user.username,
+                    'reason': user.reason,
+                    'added_by': user.added_by,
+                    'created_at': user.created_at.strftime('%Y-%m-%d %H:%M:%S')
+                }
+            
+            db.close()
+            return result
+            
+        except Exception as e:
+            self.logger.error(f"获取豁免用户信息时发生错误: {e}")
+            raise
+    
     def list_exempt_users(self) -> list:
         """
         获取所有豁免用户列表
         
         Returns:
             list: 豁免用户信息列表
+            
+        Raises:
+            数据库错误时直接抛出，避免把查询失败显示成"没有豁免用户"
         """
         try:
             db = get_db_session()
-            exempt_users = db.query(ExemptUser).all()
+            exempt_users = db.query(ExemptUser).order_by(ExemptUser.created_at).all()
             
             result = []
             for user in exempt_users:
@@ -319,4 +449,4 @@ class RateLimiter:
             
         except Exception as e:
             self.logger.error(f"获取豁免用户列表时发生错误: {e}")
-            return []
\ No newline at end of file
+            raise
\ No newline at end of file
@@ -3,6 +3,7 @@
 处理report频道的股票分析报告请求
 """
 import re
+import asyncio
 import logging
 from typing import Optional, Tuple
 from datetime import datetime
@@ -11,6 +12,8 @@ import pytz
 from tradingview_handler import TradingViewHandler
 from gemini_report_generator import GeminiReportGenerator
 from rate_limiter import RateLimiter
+from symbol_registry import symbol_registry
+from db_executor import db_executor
 
 class ReportHandler:
     """报告请求处理器"""
@@ -20,7 +23,8 @@ class ReportHandler:
         self.logger = logging.getLogger(__name__)
         self.tv_handler = TradingViewHandler()
         self.gemini_generator = GeminiReportGenerator()
-        self.rate_limiter = RateLimiter()
+        # 与机器人共享限制器，保证豁免用户缓存只有一份
+        self.rate_limiter = getattr(bot, 'rate_limiter', None) or RateLimiter()
     
     def is_report_request(self, message: discord.Message, report_channel_name: str = "report") -> bool:
         """检查是否是report频道的有效请求"""
@@ -43,7 +47,8 @@ class ReportHandler:
         """解析报告请求，提取股票代码和时间框架"""
         try:
             # 移除多余空格
-            content = content.strip().upper()
+            original_content = content.strip()
+            content = original_content.upper()
             
             # 支持的时间框架格式
             timeframe_patterns = [
@@ -52,9 +57,6 @@ class ReportHandler:
                 r'\b(4H|4小时|4HOUR|240M|240MIN)\b'
             ]
             
-            # 股票代码模式（2-5个字母）
-            symbol_pattern = r'\b([A-Z]{1,5})\b'
-            
             # 查找时间框架
             timeframe = None
             for pattern in timeframe_patterns:
@@ -69,16 +71,8 @@ class ReportHandler:
                         timeframe = '4h'
                     break
             
-            # 查找股票代码
-            symbol = None
-            symbol_matches = re.findall(symbol_pattern, content)
-            if symbol_matches:
-                # 过滤掉时间框架词汇
-                excluded = {'H', 'M', 'MIN', 'HOUR'}
-                for match in symbol_matches:
-                    if match not in excluded:
-                        symbol = match
-                        break
+            # 查找股票代码（通过注册表校验，过滤掉时间框架词汇和无效代码）
+            symbol = symbol_registry.find_symbol(original_content, exclude={'H', 'M', 'MIN', 'HOUR'})
             
             if symbol and timeframe:
                 self.logger.info(f"解析报告请求成功: {symbol} {timeframe}")
@@ -98,7 +92,9 @@ class ReportHandler:
             user_id = str(message.author.id)
             username = message.author.display_name
             
-            can_request, current_count, remaining = self.rate_limiter.check_user_limit(user_id, username)
+            can_request, current_count, remaining = await db_executor.run(
+                self.rate_limiter.check_user_limit, user_id, username
+            )
             is_exempt = remaining == 999  # 豁免用户的标识
             
             if not can_request:
@@ -119,7 +115,7 @@ class ReportHandler:
             symbol, timeframe = parsed
             
             # 获取最新TradingView数据
-            latest_data = self.tv_handler.get_latest_data(symbol, timeframe)
+            latest_data = await db_executor.run(self.tv_handler.get_latest_data, symbol, timeframe)
             if not latest_data:
                 await message.reply(
                     f"❌ 未找到 {symbol} ({timeframe}) 的TradingView数据。\n"
@@ -137,10 +133,13 @@ class ReportHandler:
             
             # 生成报告 - 使用增强版数据库驱动方式
             try:
-                report = self.gemini_generator.generate_enhanced_report(symbol, timeframe)
+                # Gemini调用耗时较长，使用独立线程避免占用数据库线程池
+                report = await asyncio.to_thread(
+                    self.gemini_generator.generate_enhanced_report, symbol, timeframe
+                )
                 
                 # 更新用户请求计数
-                self.rate_limiter.record_request(user_id, username)
+                await db_executor.run(self.rate_limiter.record_request, user_id, username)
                 
                 # 发送私信，使用embeds格式
                 try:
@@ -0,0 +1,21 @@
+"""
+重试退避
+Webhook发件箱投递和TradingView入库spool回放共用的指数退避计算
+"""
+
+import random
+
+
+def backoff_delay(attempts: int, base: float, cap: float) -> float:
+    """
+    带等抖动（equal jitter）的指数退避
+
+    上限为 min(cap, base * 2^(attempts-1))，实际等待在上限的一半到上限之间随机，
+    既保证每次至少等待一半时间，又让同时失败的任务错开重试
+
+    Args:
+        attempts: 已失败次数（从1开始）
+        base: 第一次重试的基准等待秒数
+        cap: 最长等待秒数
+    """
+    return random.uniform(0.5, 1.0) * min(cap, base * 2 ** (attempts - 1))
@@ -0,0 +1,479 @@
+"""
+跨股票选股
+内存中保存每个 (股票代码, 时间框架) 最新的指标状态：分类字段（MAtrend*、pmaText、SQZsignal等）按取值
+维护位图（Python整数的每一位对应一行），评级等数值字段按列存储在数组中。TradingView数据入库时增量更新，
+筛选条件直接在位图上做与/或/非运算，不需要读取和解析数据库中的原始JSON
+"""
+
+import logging
+import math
+import operator
+import re
+import time
+from array import array
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import func
+
+from alert_rules import FIELD_NAMES, RuleSyntaxError, decode_signal_fields, format_value, tokenize_expression
+from alert_subscriptions import ALL_TIMEFRAMES, normalize_timeframe
+from db_executor import db_executor
+from models import TradingViewData, get_db_session
+
+# 按取值建位图的分类字段
+CATEGORICAL_FIELDS = (
+    'MAtrend', 'MAtrend_timeframe1', 'MAtrend_timeframe2', 'TrendTracersignal', 'TrendTracerHTF',
+    'pmaText', 'SQZsignal', 'AIbandsignal', 'CVDsignal', 'RSIHAsignal', 'BBPsignal', 'MOMOsignal',
+    'center_trend', 'choppingrange_signal', 'wavemarket_state', 'ewotrend_state', 'rsi_state_trend',
+    'HTFwave_signal', 'Middle_smooth_trend'
+)
+# 按列存储的数值字段（可比较大小和排序）
+NUMERIC_FIELDS = (
+    'BullishOscRating', 'BullishTrendRating', 'BearishOscRating', 'BearishTrendRating', 'adxValue', 'choppiness'
+)
+# 结果中总是展示的字段
+SUMMARY_FIELDS = ('bullishtrendrating', 'bullishoscrating', 'bearishtrendrating', 'bearishoscrating', 'pmatext')
+
+_CATEGORICAL = {name.lower() for name in CATEGORICAL_FIELDS} | {'timeframe'}
+_NUMERIC = {name.lower() for name in NUMERIC_FIELDS}
+_DISPLAY_NAMES = dict(FIELD_NAMES, timeframe='timeframe')
+
+_COMPARE = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+    '=': operator.eq,
+    '!=': operator.ne,
+}
+
+# 缓存的已编译筛选条件数
+FILTER_CACHE_SIZE = 256
+
+SORT_PATTERN = re.compile(r'\bsort\s*[=:]\s*(-?[A-Za-z_][A-Za-z0-9_+]*)', re.IGNORECASE)
+
+
+def _bit_rows(bits: int) -> List[int]:
+    """位图中为1的行号（从小到大）"""
+    text = bin(bits)[:1:-1]
+    rows = []
+    position = text.find('1')
+    while position != -1:
+        rows.append(position)
+        position = text.find('1', position + 1)
+    return rows
+
+
+def parse_screen_command(text: str) -> Tuple[Optional[str], str, Optional[str], bool]:
+    """
+    解析选股命令参数: [时间框架] [条件] [sort=字段]，字段前加 - 表示升序
+
+    Returns:
+        (时间框架, 条件表达式, 排序字段, 是否升序)
+    """
+    sort_by, ascending = None, False
+    match = SORT_PATTERN.search(text)
+    if match:
+        sort_by = match.group(1)
+        if sort_by.startswith('-'):
+            sort_by, ascending = sort_by[1:], True
+        text = text[:match.start()] + text[match.end():]
+
+    timeframe = None
+    parts = text.split(None, 1)
+    if parts:
+        normalized = normalize_timeframe(parts[0])
+        if normalized is not None:
+            timeframe = None if normalized == ALL_TIMEFRAMES else normalized
+            text = parts[1] if len(parts) > 1 else ''
+    return timeframe, text.strip(), sort_by, ascending
+
+
+class _FilterCompiler:
+    """
+    筛选条件编译器，语法与提醒规则相同:
+        expr       := and_expr ('or' and_expr)*
+        and_expr   := not_expr ('and' not_expr)*
+        not_expr   := 'not' not_expr | '(' expr ')' | comparison
+        comparison := 分类字段 比较运算符 值 | 数值表达式 比较运算符 数值表达式
+    分类字段与不是字段名的单词比较时，单词视为取值（如 SQZsignal != squeeze）
+
+    每个节点编译为 (是否需要逐行计算, 函数(候选位图) -> 结果位图)。
+    and 中先算分类字段的位图，数值比较只在剩下的候选行上逐行计算
+    """
+
+    def __init__(self, screener: 'SignalScreener', expression: str):
+        self.screener = screener
+        self.tokens = tokenize_expression(expression)
+        self.position = 0
+        self.fields = set()
+
+    def compile(self) -> Callable[[int], int]:
+        _, node = self._expr()
+        if self.position < len(self.tokens):
+            raise RuleSyntaxError(f"多余的内容: {self.tokens[self.position][1]}")
+        return node
+
+    def _peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def _accept(self, *values: str) -> Optional[str]:
+        token = self._peek()
+        if token and token[0] == 'op' and token[1] in values:
+            self.position += 1
+            return token[1]
+        return None
+
+    def _next(self):
+        token = self._peek()
+        if token is None:
+            raise RuleSyntaxError("条件不完整")
+        self.position += 1
+        return token
+
+    def _expr(self):
+        parts = [self._and_expr()]
+        while self._accept('or'):
+            parts.append(self._and_expr())
+        if len(parts) == 1:
+            return parts[0]
+        nodes = [node for _, node in parts]
+
+        def union(within):
+            bits = 0
+            for node in nodes:
+                bits |= node(within)
+            return bits
+        return any(slow for slow, _ in parts), union
+
+    def _and_expr(self):
+        parts = [self._not_expr()]
+        while self._accept('and'):
+            parts.append(self._not_expr())
+        if len(parts) == 1:
+            return parts[0]
+        # 位图运算在前，逐行计算在后
+        nodes = [node for _, node in sorted(parts, key=lambda part: part[0])]
+
+        def intersection(within):
+            for node in nodes:
+                within = node(within)
+                if not within:
+                    break
+            return within
+        return any(slow for slow, _ in parts), intersection
+
+    def _not_expr(self):
+        if self._accept('not'):
+            slow, inner = self._not_expr()
+            return slow, lambda within: within & ~inner(within)
+        if self._accept('('):
+            part = self._expr()
+            if not self._accept(')'):
+                raise RuleSyntaxError("缺少右括号")
+            return part
+        return self._comparison()
+
+    def _comparison(self):
+        token = self._peek()
+        if token and token[0] == 'name' and token[1].lower() in _CATEGORICAL:
+            self.position += 1
+            field, compare, value = self._categorical(token[1].lower())
+            screener = self.screener
+            if compare is operator.eq:
+                return False, lambda within: within & screener.bitsets[field].get(value, 0)
+            return False, lambda within: within & screener.matching_bits(field, compare, value)
+
+        left = self._numeric_terms()
+        comparator = self._accept(*_COMPARE)
+        if comparator is None:
+            raise RuleSyntaxError("缺少比较运算符（> >= < <= == !=）")
+        right = self._numeric_terms()
+        compare = _COMPARE[comparator]
+        screener = self.screener
+
+        def scan(within):
+            rows = _bit_rows(within)
+            bits = 0
+            for row, a, b in zip(rows, screener.row_values(left, rows), screener.row_values(right, rows)):
+                if a == a and b == b and compare(a, b):  # NaN != NaN
+                    bits |= 1 << row
+            return bits
+        return True, scan
+
+    def _categorical(self, field: str) -> Tuple[str, Callable[[Any, Any], bool], Any]:
+        """分类字段比较: (字段, 比较函数, 取值)"""
+        self.fields.add(field)
+        comparator = self._accept(*_COMPARE)
+        if comparator is None:
+            raise RuleSyntaxError(f"缺少比较运算符: {_DISPLAY_NAMES[field]}")
+        kind, value = self._next()
+        if kind == 'op' and value == '-' and self._peek() and self._peek()[0] == 'number':
+            kind, value = 'number', '-' + self._next()[1]
+        if kind == 'number':
+            value = float(value)
+        elif kind == 'string':
+            value = value[1:-1].strip().lower()
+        elif kind == 'name' and value.lower() not in FIELD_NAMES:
+            value = value.lower()
+        else:
+            raise RuleSyntaxError(f"{_DISPLAY_NAMES[field]} 只能与取值比较: {value}")
+        if isinstance(value, str) and comparator not in ('==', '=', '!='):
+            raise RuleSyntaxError(f"文本只能用 == 或 != 比较: {value}")
+        return field, _COMPARE[comparator], value
+
+    def _numeric_terms(self) -> List[Tuple[int, Any]]:
+        """数值表达式: [(符号, 字段名或数字)]"""
+        terms = []
+        sign = 1
+        while True:
+            kind, value = self._next()
+            if (kind, value) == ('op', '-') and self._peek() and self._peek()[0] == 'number':
+                kind, value = 'number', '-' + self._next()[1]
+            if kind == 'number':
+                terms.append((sign, float(value)))
+            elif kind == 'name' and value.lower() in _NUMERIC:
+                self.fields.add(value.lower())
+                terms.append((sign, value.lower()))
+            elif kind == 'name' and value.lower() in FIELD_NAMES:
+                raise RuleSyntaxError(f"不支持筛选的字段: {value}")
+            else:
+                raise RuleSyntaxError(f"此处应为数值字段或数字: {value}")
+            operation = self._accept('+', '-')
+            if operation is None:
+                return terms
+            sign = 1 if operation == '+' else -1
+
+
+class SignalScreener:
+    """最新指标状态的位图/列式索引（只在事件循环线程中修改和查询）"""
+
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._rows: Dict[Tuple[str, str], int] = {}
+        self.keys: List[Tuple[str, str]] = []
+        # 分类字段: 字段 -> 取值 -> 位图；字段 -> 每行当前取值
+        self.bitsets: Dict[str, Dict[Any, int]] = {field: {} for field in _CATEGORICAL}
+        self._values: Dict[str, List[Any]] = {field: [] for field in _CATEGORICAL}
+        # 数值字段: 字段 -> 每行数值（缺失为NaN）
+        self.columns: Dict[str, array] = {field: array('d') for field in _NUMERIC}
+        self.updated_at: List[float] = []
+        self.all_rows = 0
+        self._filter_cache: Dict[str, Tuple[Callable[[int], int], frozenset]] = {}
+        self.loaded = False
+
+        # 统计
+        self.updates = 0
+        self.queries = 0
+        self.query_seconds = 0.0
+
+    # ---- 维护 ----
+
+    def _row(self, symbol: str, timeframe: str) -> int:
+        key = (symbol, timeframe)
+        row = self._rows.get(key)
+        if row is not None:
+            return row
+        row = len(self.keys)
+        self._rows[key] = row
+        self.keys.append(key)
+        for values in self._values.values():
+            values.append(None)
+        for column in self.columns.values():
+            column.append(math.nan)
+        self.updated_at.append(0.0)
+        self.all_rows |= 1 << row
+        self._set(row, 'timeframe', timeframe)
+        return row
+
+    def _set(self, row: int, field: str, value: Any):
+        values = self._values[field]
+        previous = values[row]
+        if previous == value:
+            return
+        by_value = self.bitsets[field]
+        bit = 1 << row
+        if previous is not None:
+            remaining = by_value[previous] & ~bit
+            if remaining:
+                by_value[previous] = remaining
+            else:
+                del by_value[previous]
+        by_value[value] = by_value.get(value, 0) | bit
+        values[row] = value
+
+    def update(self, symbol: str, timeframe: str, payload: Dict[str, Any], received_at: Optional[float] = None):
+        """入库后调用：用这条数据中出现的字段更新该股票/时间框架的最新状态"""
+        if not symbol or not timeframe:
+            return
+        row = self._row(symbol.upper(), timeframe)
+        for field, value in decode_signal_fields(payload).items():
+            if field in _CATEGORICAL:
+                self._set(row, field, value)
+            elif field in _NUMERIC and isinstance(value, float):
+                self.columns[field][row] = value
+        self.updated_at[row] = received_at or time.time()
+        self.updates += 1
+
+    def _load_latest(self) -> List[Tuple[str, str, Dict[str, Any], datetime]]:
+        """每个 (股票代码, 时间框架) 最新的一条信号数据（差量行重建为完整数据）"""
+        # signal_deltas 依赖本模块的字段定义，在这里导入避免循环导入
+        from signal_deltas import load_full_payloads
+
+        db = get_db_session()
+        try:
+            latest = db.query(func.max(TradingViewData.id)).filter(
+                TradingViewData.data_type == 'signal'
+            ).group_by(TradingViewData.symbol, TradingViewData.timeframe)
+            rows = db.query(
+                TradingViewData.id, TradingViewData.snapshot_id, TradingViewData.raw_data,
+                TradingViewData.symbol, TradingViewData.timeframe, TradingViewData.received_at
+            ).filter(TradingViewData.id.in_(latest)).all()
+            payloads = load_full_payloads(db, [(row.id, row.snapshot_id, row.raw_data) for row in rows])
+            return [(row.symbol, row.timeframe, payloads[row.id], row.received_at) for row in rows if row.id in payloads]
+        finally:
+            db.close()
+
+    async def load(self):
+        """启动时从数据库加载最新状态（只在启动时解析一次原始JSON）"""
+        rows = await db_executor.run(self._load_latest)
+        skipped = 0
+        for symbol, timeframe, payload, received_at in rows:
+            stored_at = received_at.timestamp() if received_at else 0.0
+            # 查询期间入库的新数据已直接更新索引，不能用较旧的数据库行覆盖
+            row = self._rows.get((symbol.upper(), timeframe))
+            if row is not None and self.updated_at[row] >= stored_at:
+                skipped += 1
+                continue
+            self.update(symbol, timeframe, payload, stored_at or None)
+        self.loaded = True
+        if skipped:
+            self.logger.info(f"选股索引加载时跳过 {skipped} 条已被新数据更新的股票/时间框架")
+        self.logger.info(f"选股索引已加载 {len(self.keys)} 个股票/时间框架")
+
+    # ---- 查询 ----
+
+    def matching_bits(self, field: str, compare: Callable[[Any, Any], bool], value: Any) -> int:
+        """分类字段中满足比较条件的取值的位图之并（只比较同类型的取值）"""
+        bits = 0
+        for candidate, candidate_bits in self.bitsets[field].items():
+            if type(candidate) is type(value) and compare(candidate, value):
+                bits |= candidate_bits
+        return bits
+
+    def row_values(self, terms: List[Tuple[int, Any]], rows: List[int]) -> List[float]:
+        """数值表达式在指定行上的值（缺失为NaN）"""
+        totals = None
+        for sign, term in terms:
+            if isinstance(term, float):
+                values = [sign * term] * len(rows)
+            else:
+                column = self.columns[term]
+                values = [column[row] for row in rows] if sign == 1 else [-column[row] for row in rows]
+            totals = values if totals is None else [a + b for a, b in zip(totals, values)]
+        return totals
+
+    def compile_filter(self, expression: str):
+        """编译筛选条件（按表达式缓存，位图在执行时读取，索引更新后仍然有效）"""
+        cached = self._filter_cache.get(expression)
+        if cached is None:
+            compiler = _FilterCompiler(self, expression)
+            cached = (compiler.compile(), frozenset(compiler.fields))
+            if len(self._filter_cache) >= FILTER_CACHE_SIZE:
+                self._filter_cache.clear()
+            self._filter_cache[expression] = cached
+        return cached
+
+    def screen(self, expression: str = '', timeframe: Optional[str] = None, sort_by: Optional[str] = None,
+               ascending: bool = False, limit: int = 20) -> Dict[str, Any]:
+        """
+        筛选股票
+
+        Args:
+            expression: 筛选条件（与提醒规则语法相同），为空表示全部
+            timeframe: 只看指定时间框架
+            sort_by: 排序字段，可用 + 连接多个数值字段（如 BullishTrendRating+BullishOscRating）
+            ascending: 是否升序（默认评级从高到低）
+            limit: 最多返回条数
+
+        Raises:
+            RuleSyntaxError: 条件格式错误
+        """
+        started = time.perf_counter()
+        fields = set()
+        bits = self.all_rows
+        if timeframe:
+            bits &= self.bitsets['timeframe'].get(timeframe, 0)
+        if expression.strip():
+            node, filter_fields = self.compile_filter(expression.strip())
+            bits = node(bits)
+            fields = set(filter_fields)
+
+        rows = _bit_rows(bits)
+        sort_terms = None
+        if sort_by:
+            sort_terms = []
+            for name in sort_by.split('+'):
+                if name.lower() not in _NUMERIC:
+                    raise RuleSyntaxError(f"只能按数值字段排序: {name}（{', '.join(NUMERIC_FIELDS)}）")
+                sort_terms.append((1, name.lower()))
+                fields.add(name.lower())
+            sort_values = dict(zip(rows, self.row_values(sort_terms, rows)))
+            # 缺失值总是排在最后
+            rows.sort(key=lambda row: (math.isnan(sort_values[row]),
+                                       sort_values[row] if ascending else -sort_values[row]))
+        elapsed_us = (time.perf_counter() - started) * 1e6
+
+        results = []
+        for row in rows[:limit]:
+            symbol, row_timeframe = self.keys[row]
+            values = {}
+            for field in list(SUMMARY_FIELDS) + sorted(fields - set(SUMMARY_FIELDS) - {'timeframe'}):
+                value = self.columns[field][row] if field in _NUMERIC else self._values[field][row]
+                values[_DISPLAY_NAMES[field]] = None if isinstance(value, float) and math.isnan(value) else value
+            result = {
+                'symbol': symbol,
+                'timeframe': row_timeframe,
+                'values': values,
+                'updated_at': datetime.fromtimestamp(self.updated_at[row]).isoformat() if self.updated_at[row] else None
+            }
+            if sort_terms:
+                result['sort_value'] = None if math.isnan(sort_values[row]) else sort_values[row]
+            results.append(result)
+
+        self.queries += 1
+        self.query_seconds += elapsed_us / 1e6
+        return {
+            'matches': len(rows),
+            'results': results,
+            'elapsed_us': round(elapsed_us, 1)
+        }
+
+    def format_results(self, result: Dict[str, Any]) -> List[str]:
+        """Discord消息用的每行文本"""
+        lines = []
+        for item in result['results']:
+            values = item['values']
+            ratings = '/'.join(format_value(values.get(name)) for name in (
+                'BullishTrendRating', 'BullishOscRating', 'BearishTrendRating', 'BearishOscRating'))
+            extra = ' '.join(
+                f"{name}={format_value(value)}" for name, value in values.items()
+                if name.lower() not in SUMMARY_FIELDS
+            )
+            lines.append(f"{item['symbol']:<8}{item['timeframe']:<5}{ratings:<12}{format_value(values.get('pmaText')):<20}{extra}")
+        return lines
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'loaded': self.loaded,
+            'rows': len(self.keys),
+            'updates': self.updates,
+            'queries': self.queries,
+            'avg_query_us': round(self.query_seconds / self.queries * 1e6, 1) if self.queries else None
+        }
+
+
+# 全局选股索引
+screener = SignalScreener()
@@ -0,0 +1,271 @@
+"""
+信号差量存储
+同一 (股票代码, 时间框架) 的连续信号通常只有少数字段变化（时间戳、ADX等数值，偶尔一个指标状态）。
+入库时与该股票/时间框架的上一条信号比较，只把变化的字段作为差量写入raw_data，snapshot_id指向差量链起点的
+完整快照；每 SIGNAL_SNAPSHOT_INTERVAL 条差量（或差量不比完整数据小多少时）重新写一次完整快照，
+重建任意一条信号最多读取一个快照和其后的差量。snapshot_id为空的行（快照、交易/平仓数据、历史数据）
+raw_data就是完整数据
+
+差量格式: {"changed": {字段: 新值}, "removed": [被移除的字段]}
+"""
+
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+
+from models import TradingViewData, get_db_session
+from screener import CATEGORICAL_FIELDS
+
+# 状态变化事件和历史查询默认只关注分类指标字段（数值和时间戳几乎每条都变）
+TRANSITION_FIELDS = CATEGORICAL_FIELDS
+
+Changes = Dict[str, Tuple[Any, Any]]
+
+
+def compute_delta(previous: Dict[str, Any], current: Dict[str, Any]) -> Dict[str, Any]:
+    """上一条信号 -> 当前信号的差量"""
+    delta = {'changed': {key: value for key, value in current.items()
+                         if key not in previous or previous[key] != value}}
+    removed = [key for key in previous if key not in current]
+    if removed:
+        delta['removed'] = removed
+    return delta
+
+
+def apply_delta(payload: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+    """在完整数据上应用差量，返回新的完整数据"""
+    result = dict(payload)
+    result.update(delta.get('changed', {}))
+    for key in delta.get('removed', ()):
+        result.pop(key, None)
+    return result
+
+
+def diff_fields(previous: Dict[str, Any], current: Dict[str, Any],
+                fields: Optional[Iterable[str]] = TRANSITION_FIELDS) -> Changes:
+    """
+    两条完整信号之间变化的字段
+
+    Args:
+        fields: 只比较这些字段，None表示比较所有字段
+
+    Returns:
+        {字段: (旧值, 新值)}，新出现或被移除的字段一侧为None
+    """
+    keys = fields if fields is not None else list(dict.fromkeys([*previous, *current]))
+    changes = {}
+    for key in keys:
+        old, new = previous.get(key), current.get(key)
+        if old != new:
+            changes[key] = (old, new)
+    return changes
+
+
+class SignalDeltaTracker:
+    """记录每个 (股票代码, 时间框架) 差量链的状态，决定新信号写入快照还是差量"""
+
+    def __init__(self, snapshot_interval: Optional[int] = None):
+        """
+        Args:
+            snapshot_interval: 两个快照之间最多的差量条数，默认读取SIGNAL_SNAPSHOT_INTERVAL（0表示不使用差量）
+        """
+        self.logger = logging.getLogger(__name__)
+        self.snapshot_interval = (snapshot_interval if snapshot_interval is not None
+                                  else int(os.getenv('SIGNAL_SNAPSHOT_INTERVAL', '20')))
+        # (股票代码, 时间框架) -> [快照ID, 快照后的差量条数, 最近一条信号的完整数据]
+        self._chains: Dict[Tuple[str, str], List[Any]] = {}
+        self._locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._guard = threading.Lock()
+
+        # 统计
+        self.snapshots = 0
+        self.deltas = 0
+        self.transitions = 0
+        self.full_bytes = 0
+        self.stored_bytes = 0
+
+    def lock(self, symbol: str, timeframe: str) -> threading.Lock:
+        """同一股票/时间框架的 准备-写入-记录 必须串行（数据库线程池中可能并发入库）"""
+        key = (symbol, timeframe)
+        with self._guard:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    def prepare(self, symbol: str, timeframe: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        决定新信号的存储形式（在lock内调用，写入成功后调用stored）
+
+        Returns:
+            {'raw_data': 写入的JSON, 'snapshot_id': 差量所基于的快照ID（快照为None）,
+             'changes': 相对上一条信号变化的分类字段（首条信号为None）, ...}
+        """
+        key = (symbol, timeframe)
+        full_json = json.dumps(payload, ensure_ascii=False)
+        chain = self._chains.get(key)
+        entry = {
+            'key': key, 'payload': dict(payload), 'raw_data': full_json, 'snapshot_id': None,
+            'full_bytes': len(full_json.encode('utf-8')),
+            'changes': diff_fields(chain[2], payload) if chain else None
+        }
+        if chain and chain[1] < self.snapshot_interval:
+            delta_json = json.dumps(compute_delta(chain[2], payload), ensure_ascii=False)
+            # 差量超过完整数据一半时直接写快照，重建更快且几乎不多占空间
+            if len(delta_json) * 2 < len(full_json):
+                entry['raw_data'] = delta_json
+                entry['snapshot_id'] = chain[0]
+        return entry
+
+    def stored(self, entry: Dict[str, Any], row_id: int):
+        """信号已写入数据库，更新差量链"""
+        if entry['snapshot_id'] is None:
+            self._chains[entry['key']] = [row_id, 0, entry['payload']]
+            self.snapshots += 1
+        else:
+            chain = self._chains[entry['key']]
+            chain[1] += 1
+            chain[2] = entry['payload']
+            self.deltas += 1
+        if entry['changes']:
+            self.transitions += 1
+        self.full_bytes += entry['full_bytes']
+        self.stored_bytes += len(entry['raw_data'].encode('utf-8'))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """差量存储统计（本次运行）"""
+        return {
+            'snapshot_interval': self.snapshot_interval,
+            'chains': len(self._chains),
+            'snapshots': self.snapshots,
+            'deltas': self.deltas,
+            'transitions': self.transitions,
+            'full_bytes': self.full_bytes,
+            'stored_bytes': self.stored_bytes,
+            'saved_ratio': round(1 - self.stored_bytes / self.full_bytes, 3) if self.full_bytes else 0.0,
+        }
+
+
+def _loads(raw_data: str) -> Optional[Dict[str, Any]]:
+    try:
+        payload = json.loads(raw_data)
+    except (TypeError, ValueError):
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+def load_full_payloads(db, rows: Iterable[Tuple[int, Optional[int], str]]) -> Dict[int, Dict[str, Any]]:
+    """
+    重建信号的完整数据（每条差量链只查询一次）
+
+    Args:
+        rows: [(行ID, snapshot_id, raw_data)]
+
+    Returns:
+        {行ID: 完整数据}，快照缺失或JSON无效的行不在结果中
+    """
+    payloads = {}
+    targets: Dict[int, set] = {}
+    for row_id, snapshot_id, raw_data in rows:
+        if snapshot_id is None:
+            payload = _loads(raw_data)
+            if payload is not None:
+                payloads[row_id] = payload
+        else:
+            targets.setdefault(snapshot_id, set()).add(row_id)
+    if not targets:
+        return payloads
+
+    last_id = max(max(ids) for ids in targets.values())
+    chain_rows = db.query(TradingViewData.id, TradingViewData.snapshot_id, TradingViewData.raw_data).filter(
+        or_(TradingViewData.id.in_(list(targets)),
+            and_(TradingViewData.snapshot_id.in_(list(targets)), TradingViewData.id <= last_id))
+    ).order_by(TradingViewData.id).all()
+
+    current: Dict[int, Dict[str, Any]] = {}
+    for row_id, snapshot_id, raw_data in chain_rows:
+        if snapshot_id is None:
+            payload = _loads(raw_data)
+            if payload is not None:
+                current[row_id] = payload
+            continue
+        base, delta = current.get(snapshot_id), _loads(raw_data)
+        if base is None or delta is None:
+            # 快照缺失或差量损坏，这条链后面的行都无法重建
+            current.pop(snapshot_id, None)
+            continue
+        current[snapshot_id] = apply_delta(base, delta)
+        if row_id in targets[snapshot_id]:
+            payloads[row_id] = current[snapshot_id]
+    return payloads
+
+
+def expand_signal_row(db, row: Optional[TradingViewData]) -> Optional[TradingViewData]:
+    """
+    查询出的差量行 -> raw_data为完整数据的行（从会话中分离，修改不会写回数据库）
+    读取raw_data的地方（报告、选股加载）在查询后调用，完整行原样返回
+    """
+    if row is None or row.snapshot_id is None:
+        return row
+    payload = load_full_payloads(db, [(row.id, row.snapshot_id, row.raw_data)]).get(row.id)
+    db.expunge(row)
+    if payload is not None:
+        row.raw_data = json.dumps(payload, ensure_ascii=False)
+        row.snapshot_id = None
+    return row
+
+
+def get_signal_changes(symbol: str, timeframe: str, since: Optional[datetime] = None, limit: int = 200,
+                       fields: Optional[List[str]] = TRANSITION_FIELDS) -> List[Dict[str, Any]]:
+    """
+    最近limit条信号中的字段变化（在db_executor中调用）
+
+    Args:
+        fields: 关注的字段，None表示所有字段（含数值和时间戳）
+
+    Returns:
+        按时间从新到旧的 [{'received_at': ..., 'changes': {字段: [旧值, 新值]}}]，没有变化的信号不返回
+    """
+    db = get_db_session()
+    try:
+        query = db.query(
+            TradingViewData.id, TradingViewData.snapshot_id, TradingViewData.raw_data, TradingViewData.received_at
+        ).filter(
+            TradingViewData.symbol == symbol.upper(),
+            TradingViewData.timeframe == timeframe,
+            TradingViewData.data_type == 'signal'
+        )
+        if since:
+            query = query.filter(TradingViewData.received_at >= since)
+        # 多取一条作为窗口内第一条信号的比较基准
+        rows = query.order_by(TradingViewData.id.desc()).limit(limit + 1).all()
+        rows.reverse()
+        payloads = load_full_payloads(db, [(row[0], row[1], row[2]) for row in rows])
+    finally:
+        db.close()
+
+    history = []
+    previous = None
+    for row_id, _, _, received_at in rows:
+        payload = payloads.get(row_id)
+        if payload is None:
+            continue
+        if previous is not None:
+            changes = diff_fields(previous, payload, fields)
+            if changes:
+                history.append({
+                    'received_at': received_at.isoformat() if received_at else None,
+                    'changes': {key: list(values) for key, values in changes.items()}
+                })
+        previous = payload
+    history.reverse()
+    return history
+
+
+# 全局实例（TradingViewHandler每个请求新建，差量链状态放在模块级）
+signal_deltas = SignalDeltaTracker()
@@ -0,0 +1,30 @@
+"""
+测试用TradingView信号数据和临时数据库
+供提醒、选股、指标编码、信号差量和入库spool等测试脚本共用
+"""
+
+import os
+import tempfile
+
+
+def use_temp_database(name: str):
+    """
+    未设置DATABASE_URL时使用临时目录中的SQLite数据库，不在仓库目录中留下 .db/-wal/-shm 文件
+
+    必须在导入models之前调用
+    """
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(tempfile.mkdtemp(), name)}")
+
+
+def signal_payload(symbol: str = 'NVDA', timeframe: str = '60', **fields) -> dict:
+    """
+    生成一条信号数据
+
+    Args:
+        symbol: 股票代码
+        timeframe: Current_timeframe（分钟）
+        fields: 其他字段，值为None的字段不出现在数据中
+    """
+    payload = {'symbol': symbol, 'Current_timeframe': timeframe}
+    payload.update(fields)
+    return {key: value for key, value in payload.items() if value is not None}
@@ -0,0 +1,179 @@
+"""
+股票代码注册表
+从symbols.csv一次性加载SP500 + 纳指100等已知股票（交易所、名称、别名），
+供图表、报告和预测请求的解析器以O(1)查找校验代码，无效代码在任何外部调用前被拒绝
+"""
+
+import csv
+import logging
+import os
+import re
+from types import MappingProxyType
+from typing import Iterable, Optional, Tuple
+
+# 校验结果
+KNOWN = 'known'        # 在注册表中
+UNKNOWN = 'unknown'    # 格式有效但不在注册表中（图表请求仍可通过交易所探测处理）
+INVALID = 'invalid'    # 不是合法的股票代码格式
+
+SUPPORTED_EXCHANGES = ('NASDAQ', 'NYSE', 'AMEX', 'OTC')
+
+# 代码格式：1-5个字母，可带一位类别后缀（BRK.B）
+_SYMBOL_PATTERN = re.compile(r'^[A-Z]{1,5}(\.[A-Z])?$')
+# 类别股写法: BRK-B、BRK/B、BRK B -> BRK.B
+_CLASS_SHARE_PATTERN = re.compile(r'^([A-Z]{1,5})[\-/ ]([A-Z])$')
+# 从消息中提取候选代码（可带交易所前缀和类别后缀）
+_TOKEN_PATTERN = re.compile(r'(?<![A-Za-z0-9])(?:[A-Za-z]+:)?[A-Za-z]{1,5}(?:[.\-/][A-Za-z])?(?![A-Za-z0-9])')
+
+
+class SymbolRegistry:
+    """只读股票代码注册表"""
+
+    def __init__(self, data_file: Optional[str] = None):
+        self.logger = logging.getLogger(__name__)
+        self.data_file = data_file or os.getenv(
+            'SYMBOLS_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'symbols.csv')
+        )
+        exchange_map, aliases, names = self._load(self.data_file)
+
+        # 代码 -> 带交易所前缀的代码；别名 -> 规范代码；代码 -> 名称
+        self.exchange_map = MappingProxyType(exchange_map)
+        self.aliases = MappingProxyType(aliases)
+        self.names = MappingProxyType(names)
+
+    def _load(self, path: str) -> Tuple[dict, dict, dict]:
+        """读取数据文件"""
+        exchange_map, aliases, names = {}, {}, {}
+        try:
+            with open(path, newline='', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    symbol = row['symbol'].strip().upper()
+                    exchange = row['exchange'].strip().upper()
+                    if not symbol or exchange not in SUPPORTED_EXCHANGES:
+                        continue
+                    exchange_map[symbol] = f"{exchange}:{symbol}"
+                    if row.get('name'):
+                        names[symbol] = row['name'].strip()
+                    for alias in filter(None, (row.get('aliases') or '').split('|')):
+                        aliases[alias.strip().upper()] = symbol
+        except OSError as e:
+            self.logger.error(f"加载股票代码注册表失败: {path} - {e}")
+
+        self.logger.info(f"股票代码注册表已加载: {len(exchange_map)} 个代码, {len(aliases)} 个别名")
+        return exchange_map, aliases, names
+
+    def normalize(self, raw: str) -> Optional[str]:
+        """
+        规范化代码：大写、去除交易所前缀、统一类别股写法并解析别名
+
+        Returns:
+            规范代码，格式无效时返回None
+        """
+        symbol = raw.strip().upper()
+        if ':' in symbol:
+            exchange, _, symbol = symbol.partition(':')
+            if exchange not in SUPPORTED_EXCHANGES:
+                return None
+
+        class_share = _CLASS_SHARE_PATTERN.match(symbol)
+        if class_share:
+            symbol = f"{class_share.group(1)}.{class_share.group(2)}"
+
+        symbol = self.aliases.get(symbol, symbol)
+        if not _SYMBOL_PATTERN.match(symbol):
+            return None
+        
+        # BRKB 这类省略分隔符的类别股写法
+        if symbol not in self.exchange_map and f"{symbol[:-1]}.{symbol[-1]}" in self.exchange_map:
+            return f"{symbol[:-1]}.{symbol[-1]}"
+        return symbol
+
+    def validate(self, raw: str) -> Tuple[str, Optional[str]]:
+        """
+        校验代码
+
+        Returns:
+            (KNOWN/UNKNOWN/INVALID, 规范代码)
+        """
+        symbol = self.normalize(raw)
+        if symbol is None:
+            return INVALID, None
+        if symbol in self.exchange_map:
+            return KNOWN, symbol
+        return UNKNOWN, symbol
+
+    def resolve(self, raw: str) -> Optional[str]:
+        """
+        获取带交易所前缀的代码
+
+        用户显式指定交易所时保留用户的选择，否则使用注册表中的交易所；未知代码返回None
+        """
+        text = raw.strip().upper()
+        status, symbol = self.validate(text)
+        if status == INVALID:
+            return None
+        if ':' in text:
+            return f"{text.partition(':')[0]}:{symbol}"
+        return self.exchange_map.get(symbol)
+
+    def accept_token(self, token: str) -> Optional[Tuple[str, str]]:
+        """
+        判断消息中的单个词能否作为股票代码
+
+        大写书写的有效代码都接受（未知代码可经交易所探测处理）；小写书写或单字母的词
+        必须是注册表中的已知代码，单个小写字母（如 a）不作为代码
+
+        Returns:
+            (KNOWN/UNKNOWN, 规范代码)，不接受时返回None
+        """
+        status, symbol = self.validate(token)
+        if status == INVALID:
+            return None
+        written = token.strip().rpartition(':')[2]
+        if written != written.upper():
+            if status != KNOWN or len(written) == 1:
+                return None
+        elif status == UNKNOWN and len(symbol) == 1:
+            return None
+        return status, symbol
+
+    def find_symbol(self, text: str, exclude: Iterable[str] = ()) -> Optional[str]:
+        """
+        从自由文本中找出股票代码
+
+        按优先级返回：大写书写的已知代码 > 小写书写的已知代码 > 大写书写的格式有效代码。
+        用户通常大写输入代码，这样 "give me a chart of AAPL" 不会把 a（安捷伦）当成代码，
+        也不会把 please、predict 之类的单词当成代码
+
+        Args:
+            text: 消息内容
+            exclude: 需要忽略的词（如时间框架、命令关键词）
+        """
+        excluded = {word.upper() for word in exclude}
+        known_lowercase = None
+        unknown_uppercase = None
+        for token in _TOKEN_PATTERN.findall(text):
+            if token.upper() in excluded:
+                continue
+            accepted = self.accept_token(token)
+            if accepted is None:
+                continue
+            status, symbol = accepted
+            is_uppercase = token == token.upper()
+            if status == KNOWN and is_uppercase:
+                return symbol
+            if status == KNOWN and known_lowercase is None:
+                known_lowercase = symbol
+            elif status == UNKNOWN and unknown_uppercase is None:
+                unknown_uppercase = symbol
+        return known_lowercase or unknown_uppercase
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self.exchange_map
+
+    def __len__(self) -> int:
+        return len(self.exchange_map)
+
+
+# 全局股票代码注册表实例（模块导入时加载一次）
+symbol_registry = SymbolRegistry()
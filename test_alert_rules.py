@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+测试股票提醒规则
+使用DATABASE_URL指定的数据库，未设置时使用临时目录中的SQLite数据库
+验证规则编译、按字段索引只对输入变化的规则求值、从不满足变为满足时触发，以及通过提醒分发私信
+"""
+import asyncio
+import os
+
+from signal_fixtures import signal_payload, use_temp_database
+
+use_temp_database('test_alert_rules.db')
+os.environ['ALERT_DM_PER_SECOND'] = '1000'
+
+from alert_rules import AlertRules, CompiledRule, RuleEngine, RuleSyntaxError, compile_rule, parse_rule_command
+from alert_subscriptions import AlertFanout, AlertSubscriptions
+from models import create_tables
+
+def test_compile():
+    """规则表达式编译"""
+    print("=== 测试规则编译 ===")
+    predicate, fields = compile_rule("BullishTrendRating+BullishOscRating > 8 and PMA Strong Bullish")
+    assert fields == {'bullishtrendrating', 'bullishoscrating', 'pmatext'}
+    assert predicate({'bullishtrendrating': 5.0, 'bullishoscrating': 4.0, 'pmatext': 'pma strong bullish'})
+    assert not predicate({'bullishtrendrating': 5.0, 'bullishoscrating': 4.0, 'pmatext': 'pma bullish'})
+    assert not predicate({'bullishtrendrating': 5.0, 'pmatext': 'pma strong bullish'})  # 缺少字段视为不满足
+
+    predicate, _ = compile_rule("not (adxValue < 25 || choppiness > 61.8) && risk >= -1")
+    assert predicate({'adxvalue': 30.0, 'choppiness': 40.0, 'risk': 0.0})
+    assert not predicate({'adxvalue': 20.0, 'choppiness': 40.0, 'risk': 0.0})
+
+    predicate, _ = compile_rule("center_trend == 'Strong Bullish' or PMA Bullish")
+    assert predicate({'center_trend': 'strong bullish'}) and predicate({'pmatext': 'pma bullish'})
+
+    for bad in ("BullishRating > 3", "BullishTrendRating >", "PMA Bullish and", "adxValue > 'high'", "5 > 3", "(adxValue > 1"):
+        try:
+            compile_rule(bad)
+            raise AssertionError(bad)
+        except RuleSyntaxError as e:
+            print(f"  {bad!r} -> {e}")
+
+    assert parse_rule_command("nvda 1H: adxValue > 25") == ('NVDA', '1h', 'adxValue > 25')
+    assert parse_rule_command("NVDA adxValue > 25") == ('NVDA', '*', 'adxValue > 25')
+    print("✅ 规则编译正确")
+
+def test_engine_index():
+    """只对输入变化的规则求值，从不满足变为满足时触发一次"""
+    print("\n=== 测试按字段索引 ===")
+    engine = RuleEngine()
+    engine.add(CompiledRule(1, 'u1', 'NVDA', '1h', "BullishTrendRating+BullishOscRating > 8 and PMA Strong Bullish"))
+    engine.add(CompiledRule(2, 'u2', 'NVDA', '*', "adxValue > 25"))
+    engine.add(CompiledRule(3, 'u3', 'NVDA', '15m', "adxValue > 25"))
+    engine.add(CompiledRule(4, 'u4', 'AAPL', '1h', "adxValue > 25"))
+
+    hits = engine.evaluate(signal_payload(BullishTrendRating=5, BullishOscRating=3, pmaText='PMA Strong Bullish', adxValue='20'), 'NVDA', '1h')
+    assert hits == [] and engine.rules_evaluated == 2  # 规则1和2，不含其他时间框架/股票
+
+    # adxValue变化：只求值规则2
+    hits = engine.evaluate(signal_payload(BullishTrendRating=5, BullishOscRating=3, pmaText='PMA Strong Bullish', adxValue='30'), 'NVDA', '1h')
+    assert [rule.rule_id for rule, _ in hits] == [2] and engine.rules_evaluated == 3
+
+    # 输入没有变化：不求值
+    engine.evaluate(signal_payload(BullishTrendRating=5, BullishOscRating=3, pmaText='PMA Strong Bullish', adxValue='30'), 'NVDA', '1h')
+    assert engine.rules_evaluated == 3
+
+    # 评级上升到满足条件：规则1触发；规则2仍满足但不重复触发
+    hits = engine.evaluate(signal_payload(BullishTrendRating=5, BullishOscRating=4, pmaText='PMA Strong Bullish', adxValue='31'), 'NVDA', '1h')
+    assert [rule.rule_id for rule, _ in hits] == [1]
+
+    # 不满足后再次满足：重新触发
+    engine.evaluate(signal_payload(BullishTrendRating=5, BullishOscRating=4, pmaText='PMA Bullish', adxValue='31'), 'NVDA', '1h')
+    hits = engine.evaluate(signal_payload(BullishTrendRating=5, BullishOscRating=4, pmaText='PMA Strong Bullish', adxValue='31'), 'NVDA', '1h')
+    assert [rule.rule_id for rule, _ in hits] == [1]
+
+    # 没有规则的股票直接返回
+    assert engine.evaluate(signal_payload(adxValue='50'), 'TSLA', '1h') == []
+
+    engine.remove(1)
+    engine.remove(2)
+    assert engine.evaluate(signal_payload(BullishTrendRating=1, adxValue='10'), 'NVDA', '1h') == []
+    print(f"  统计: {engine.get_stats()}")
+    print("✅ 只对输入变化的规则求值")
+
+async def test_rules_and_fanout():
+    """规则持久化，触发时私信规则所有者"""
+    print("\n=== 测试规则持久化和私信 ===")
+    rules = AlertRules()
+    await rules.load()
+    for rule in rules.list_for_user('42'):
+        await rules.remove('42', rule.rule_id)
+
+    rule, error = await rules.add('42', 'bob', 'NVDA', '1h', "BullishTrendRating >= 4 and cvdAboveMA")
+    assert error is None
+    _, error = await rules.add('42', 'bob', 'NVDA', '1h', "BullishTrendRating >= ")
+    assert error
+
+    reloaded = AlertRules()
+    await reloaded.load()
+    assert [r.expression for r in reloaded.list_for_user('42')] == ["BullishTrendRating >= 4 and cvdAboveMA"]
+
+    sent = []
+
+    async def fake_send_dm(user_id, text):
+        sent.append((user_id, text))
+
+    fanout = AlertFanout(AlertSubscriptions(), fake_send_dm, reloaded)
+    await fanout.start()
+    assert fanout.publish(signal_payload(BullishTrendRating=3, CVDsignal='cvdAboveMA'), 'signal', 'NVDA', '1h') == 0
+    assert fanout.publish(signal_payload(BullishTrendRating=4, CVDsignal='cvdAboveMA'), 'signal', 'NVDA', '1h') == 1
+    while fanout.events_completed < 1:
+        await asyncio.sleep(0.01)
+    await fanout.stop()
+    assert sent[0][0] == '42' and f"#{rule.rule_id}" in sent[0][1] and f"!unrule {rule.rule_id}" in sent[0][1]
+    print(f"  {sent[0][1]}")
+
+    assert await reloaded.remove('42', rule.rule_id)
+    assert not await reloaded.remove('42', rule.rule_id)
+    print("✅ 规则触发后私信所有者")
+
+if __name__ == "__main__":
+    create_tables()
+    test_compile()
+    test_engine_index()
+    asyncio.run(test_rules_and_fanout())
+    print("\n🎉 股票提醒规则测试通过")
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+测试股票提醒订阅
+使用DATABASE_URL指定的数据库，未设置时使用临时目录中的SQLite数据库
+验证订阅索引、PMA状态变化检测，以及数千订阅者时入库路径不阻塞、私信并发有上限
+"""
+import asyncio
+import os
+import time
+
+from signal_fixtures import use_temp_database
+
+use_temp_database('test_alert_subscriptions.db')
+os.environ['ALERT_DM_CONCURRENCY'] = '20'
+os.environ['ALERT_DM_PER_SECOND'] = '5000'
+os.environ['ALERT_MAX_SUBSCRIPTIONS_PER_USER'] = '5'
+
+from alert_subscriptions import AlertFanout, AlertSubscriptions, parse_subscription_args
+from models import create_tables
+
+def test_parse_args():
+    """订阅命令参数解析"""
+    print("=== 测试命令解析 ===")
+    assert parse_subscription_args(['nvda']) == ('NVDA', '*', ['trade', 'close', 'pma'])
+    assert parse_subscription_args(['NVDA', '15M', 'trade']) == ('NVDA', '15m', ['trade'])
+    assert parse_subscription_args(['TSLA', 'pma', '1h', 'close']) == ('TSLA', '1h', ['pma', 'close'])
+    for bad in ([], ['NVDA', 'soon'], ['$$$']):
+        try:
+            parse_subscription_args(bad)
+            raise AssertionError(bad)
+        except ValueError as e:
+            print(f"  {bad} -> {e}")
+    print("✅ 命令解析正确")
+
+async def test_subscribe_and_index():
+    """订阅写入数据库和索引，重新加载后一致"""
+    print("\n=== 测试订阅和索引 ===")
+    subscriptions = AlertSubscriptions()
+    await subscriptions.load()
+    await subscriptions.unsubscribe('1')
+
+    added, error = await subscriptions.subscribe('1', 'alice', 'nvda', '15m', ['trade', 'pma'])
+    assert added == 2 and error is None
+    added, _ = await subscriptions.subscribe('1', 'alice', 'NVDA', '15m', ['trade'])
+    assert added == 0  # 重复订阅
+    added, _ = await subscriptions.subscribe('1', 'alice', 'AAPL', '*', ['trade', 'close', 'trade'])
+    assert added == 2  # 重复的事件类型只计一次
+    added, error = await subscriptions.subscribe('1', 'alice', 'TSLA', '*', ['trade', 'close'])
+    assert added == 0 and error  # 超过每人上限（5条）
+
+    reloaded = AlertSubscriptions()
+    await reloaded.load()
+    assert reloaded.index.resolve('NVDA', '15m', 'trade') == {'1'}
+    assert reloaded.index.resolve('NVDA', '1h', 'trade') == set()
+    assert reloaded.index.resolve('AAPL', '1h', 'close') == {'1'}
+
+    assert await reloaded.unsubscribe('1', 'NVDA', None, ['pma']) == 1
+    assert ('NVDA', '15m', 'pma') not in reloaded.list_for_user('1')
+    assert len(reloaded.list_for_user('1')) == 3
+    await reloaded.unsubscribe('1')
+    print("✅ 订阅持久化，索引按代码/时间框架/事件查找")
+
+async def test_fanout_thousands():
+    """3000个订阅者：入库路径立即返回，私信全部送达且并发不超过上限"""
+    print("\n=== 测试大规模分发 ===")
+    subscriptions = AlertSubscriptions()
+    for user_id in range(3000):
+        subscriptions._index_add(str(user_id), ('NVDA', '*' if user_id % 2 else '15m', 'trade'))
+
+    delivered = []
+    in_flight = 0
+    peak = 0
+
+    async def fake_send_dm(user_id, text):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.005)
+        in_flight -= 1
+        delivered.append(user_id)
+
+    fanout = AlertFanout(subscriptions, fake_send_dm)
+    await fanout.start()
+
+    payload = {'ticker': 'NVDA', 'action': 'buy', 'takeProfit': {'limitPrice': 150}, 'stopLoss': {'stopPrice': 120}}
+    started = time.perf_counter()
+    queued = fanout.publish(payload, 'trade', 'NVDA', '15m')
+    publish_ms = (time.perf_counter() - started) * 1000
+    assert queued == 1 and publish_ms < 5, publish_ms
+
+    # 没有订阅者的代码不入队
+    assert fanout.publish(payload, 'trade', 'AAPL', '15m') == 0
+
+    while fanout.events_completed < 1:
+        await asyncio.sleep(0.05)
+    stats = fanout.get_stats()
+    record = stats['recent_events'][-1]
+    print(f"  入队耗时 {publish_ms:.2f}ms, 私信 {record['sent']}/{record['recipients']}, "
+          f"并发峰值 {peak}, 首条延迟 {record['first_dm_lag_ms']}ms, 全部完成 {record['last_dm_lag_ms']}ms")
+    assert len(delivered) == 3000 and len(set(delivered)) == 3000
+    assert peak <= fanout.concurrency
+    await fanout.stop()
+    print("✅ 分发不阻塞入库，并发受限")
+
+def test_pma_change():
+    """PMA状态变化才产生事件"""
+    print("\n=== 测试PMA状态变化 ===")
+    fanout = AlertFanout(AlertSubscriptions(), None)
+    assert fanout.extract_events({'pmaText': 'PMA Bullish'}, 'signal', 'nvda', '1h') == []
+    assert fanout.extract_events({'pmaText': 'PMA Bullish'}, 'signal', 'NVDA', '1h') == []
+    events = fanout.extract_events({'pmaText': 'PMA Bearish'}, 'signal', 'NVDA', '1h')
+    assert len(events) == 1 and events[0]['event_type'] == 'pma' and 'PMA Bullish → PMA Bearish' in events[0]['text']
+    print(f"  {events[0]['text']}")
+    print("✅ 只在状态变化时提醒")
+
+if __name__ == "__main__":
+    create_tables()
+    test_parse_args()
+    asyncio.run(test_subscribe_and_index())
+    asyncio.run(test_fanout_thousands())
+    test_pma_change()
+    print("\n🎉 股票提醒订阅测试通过")
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+测试多时间框架组合命令
+验证 NVDA,15m/1h/4h 的解析，以及各时间框架并发获取（总耗时约等于最慢的一张）
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+from chart_service import ChartService
+
+class MockConfig:
+    """最小化的配置对象"""
+    layout_id = "test_layout"
+    chart_img_api_key = "test_key"
+    tradingview_session_id = None
+    tradingview_session_id_sign = None
+
+def test_parse_bundle():
+    """组合命令解析"""
+    print("=== 测试组合命令解析 ===")
+    service = ChartService(MockConfig())
+    cases = [
+        ("NVDA,15m/1h/4h", ("NVDA", ["15m", "1h", "4h"])),
+        ("<@123456> nvda，15m / 1h", ("NVDA", ["15m", "1h"])),
+        ("TSLA 5m/5m/1d", ("TSLA", ["5m", "1d"])),            # 重复的时间框架去重
+        ("AAPL,1h", ("AAPL", ["1h"])),                          # 单个时间框架
+        ("BRK.B,1h/4h", ("BRK.B", ["1h", "4h"])),
+        ("NVDA,15m/7x", None),                                  # 含无效时间框架
+        ("NVDA,1m/5m/15m/1h/4h", None),                         # 超过上限
+    ]
+    for text, expected in cases:
+        result = service.parse_chart_request(text)
+        print(f"  {text!r} -> {result}")
+        assert result == expected, text
+
+    # parse_command保持原有返回格式
+    assert service.parse_command("NVDA,15m/1h/4h") == ("NVDA", "15m")
+    assert service.parse_command("AAPL,1h") == ("AAPL", "1h")
+    print("✅ 组合命令解析正确")
+
+async def test_bundle_concurrent_fetch():
+    """组合请求的各时间框架并发获取"""
+    print("\n=== 测试并发获取 ===")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        os.environ['CHART_CACHE_DIR'] = cache_dir
+        service = ChartService(MockConfig())
+
+        async def slow_fetch(symbol, timeframe, normalized_timeframe):
+            await asyncio.sleep(0.1 if timeframe == "15m" else 0.3)
+            return f"png:{normalized_timeframe}".encode()
+
+        service._fetch_chart = slow_fetch
+
+        symbol, timeframes = service.parse_chart_request("NVDA,15m/1h/4h")
+        started = time.perf_counter()
+        results = await asyncio.gather(*(service.get_chart(symbol, interval) for interval in timeframes))
+        elapsed = time.perf_counter() - started
+
+        assert results == [b"png:15m", b"png:1h", b"png:4h"]
+        assert elapsed < 0.45, f"总耗时应接近最慢的一张(0.3s)，实际 {elapsed:.2f}s"
+        print(f"✅ 3个时间框架并发获取耗时 {elapsed:.2f}s（串行约0.7s）")
+        await service.render_queue.stop()
+
+if __name__ == "__main__":
+    test_parse_bundle()
+    asyncio.run(test_bundle_concurrent_fetch())
+    print("\n🎉 多时间框架组合命令测试通过")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+测试图表图片缓存
+验证时间段键、过期重新验证、LRU大小淘汰和磁盘索引重建
+"""
+import asyncio
+import tempfile
+import time
+from unittest.mock import patch
+
+from chart_cache import ChartImageCache
+
+LAYOUT_ID = "test_layout"
+
+async def test_fresh_and_stale():
+    """同一时间段命中，下一时间段返回过期图表"""
+    print("=== 测试时间段命中与过期重新验证 ===")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = ChartImageCache(cache_dir=cache_dir, max_bytes=10 * 1024 * 1024)
+        now = 1_700_000_000 - (1_700_000_000 % 3600)  # 整点
+
+        with patch('chart_cache.time.time', return_value=now + 10):
+            data, state = await cache.get("NASDAQ:AAPL", "1h", LAYOUT_ID)
+            assert state is None, "空缓存应未命中"
+            await cache.put("NASDAQ:AAPL", "1h", LAYOUT_ID, b"png-1")
+            data, state = await cache.get("NASDAQ:AAPL", "1h", LAYOUT_ID)
+            assert (data, state) == (b"png-1", 'fresh')
+            print("✅ 同一根K线内命中缓存")
+
+        with patch('chart_cache.time.time', return_value=now + 3600 + 10):
+            data, state = await cache.get("NASDAQ:AAPL", "1h", LAYOUT_ID)
+            assert (data, state) == (b"png-1", 'stale'), "新K线开始后应返回上一时间段的图表"
+            print("✅ 新K线开始后返回过期图表")
+
+        with patch('chart_cache.time.time', return_value=now + 7200 + 10):
+            data, state = await cache.get("NASDAQ:AAPL", "1h", LAYOUT_ID)
+            assert state is None, "超过一个时间段的图表不应返回"
+            print("✅ 过旧的图表不再返回")
+
+        stats = cache.get_stats()
+        assert stats['fresh_hits'] == 1 and stats['stale_hits'] == 1 and stats['misses'] == 2
+        assert stats['bytes_saved_mb'] >= 0
+        print(f"缓存统计: {stats}")
+
+async def test_lru_eviction_and_reload():
+    """超过大小上限时淘汰最久未使用的图片，重启后从磁盘恢复索引"""
+    print("\n=== 测试LRU淘汰与索引重建 ===")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = ChartImageCache(cache_dir=cache_dir, max_bytes=250)
+        await cache.put("NASDAQ:AAPL", "15m", LAYOUT_ID, b"a" * 100)
+        await cache.put("NASDAQ:TSLA", "15m", LAYOUT_ID, b"t" * 100)
+        await cache.get("NASDAQ:AAPL", "15m", LAYOUT_ID)  # AAPL变为最近使用
+        await cache.put("NASDAQ:NVDA", "15m", LAYOUT_ID, b"n" * 100)
+
+        assert cache.get_stats()['evictions'] == 1
+        _, state = await cache.get("NASDAQ:TSLA", "15m", LAYOUT_ID)
+        assert state is None, "最久未使用的TSLA应被淘汰"
+        print("✅ 按LRU淘汰最久未使用的图片")
+
+        reloaded = ChartImageCache(cache_dir=cache_dir, max_bytes=250)
+        data, state = await reloaded.get("NASDAQ:AAPL", "15m", LAYOUT_ID)
+        assert state == 'fresh' and data == b"a" * 100
+        assert reloaded.get_stats()['entries'] == 2
+        print("✅ 重启后从磁盘重建索引")
+
+def test_bucket_cap():
+    """日线及以上的时间段受上限约束"""
+    print("\n=== 测试时间段上限 ===")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache = ChartImageCache(cache_dir=cache_dir, max_bucket_seconds=3600)
+        assert cache.bucket_seconds('15m') == 900
+        assert cache.bucket_seconds('1D') == 3600
+        assert cache.bar_bucket('15m', now=time.time()) > 0
+        print("✅ 日线图表最多缓存1小时")
+
+if __name__ == "__main__":
+    asyncio.run(test_fresh_and_stale())
+    asyncio.run(test_lru_eviction_and_reload())
+    test_bucket_cap()
+    print("\n🎉 图表缓存测试通过")
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+测试图表请求合并
+多个用户同时请求同一图表时只调用一次chart-img，所有请求拿到相同的图片
+"""
+import asyncio
+import os
+import tempfile
+
+from chart_service import ChartService
+
+class MockConfig:
+    """最小化的配置对象"""
+    layout_id = "test_layout"
+    chart_img_api_key = "test_key"
+    tradingview_session_id = None
+    tradingview_session_id_sign = None
+
+def create_service(cache_dir: str) -> ChartService:
+    """创建使用临时缓存目录的图表服务"""
+    os.environ['CHART_CACHE_DIR'] = cache_dir
+    return ChartService(MockConfig())
+
+async def test_concurrent_requests_coalesced():
+    """并发的相同请求只触发一次上游调用"""
+    print("=== 测试并发请求合并 ===")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        service = create_service(cache_dir)
+        calls = []
+
+        async def slow_fetch(symbol, timeframe, normalized_timeframe):
+            calls.append((symbol, normalized_timeframe))
+            await asyncio.sleep(0.2)  # 模拟chart-img的长耗时
+            return f"png:{symbol}:{normalized_timeframe}".encode()
+
+        service._fetch_chart = slow_fetch
+
+        results = await asyncio.gather(*(service.get_chart('TSLA', '15m') for _ in range(5)))
+        assert len(calls) == 1, f"应只调用一次上游，实际 {len(calls)} 次"
+        assert len(set(results)) == 1 and results[0] == b"png:NASDAQ:TSLA:15m"
+        stats = service.get_fetch_stats()
+        assert stats['upstream_calls'] == 1 and stats['coalesced_requests'] == 4
+        assert stats['in_flight'] == 0
+        print(f"✅ 5个并发请求只调用1次上游: {stats}")
+
+        # 不同时间框架不合并
+        await asyncio.gather(service.get_chart('TSLA', '1h'), service.get_chart('TSLA', '4h'))
+        assert len(calls) == 3
+        print("✅ 不同时间框架分别请求")
+
+async def test_cancelled_waiter_does_not_cancel_fetch():
+    """取消某个等待者不影响其他请求"""
+    print("\n=== 测试取消等待者 ===")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        service = create_service(cache_dir)
+
+        async def slow_fetch(symbol, timeframe, normalized_timeframe):
+            await asyncio.sleep(0.2)
+            return b"png"
+
+        service._fetch_chart = slow_fetch
+
+        first = asyncio.create_task(service.get_chart('NVDA', '1h'))
+        second = asyncio.create_task(service.get_chart('NVDA', '1h'))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        assert await second == b"png"
+        print("✅ 共享的上游调用未被取消")
+
+async def test_failed_fetch_not_cached():
+    """上游失败时所有等待者得到None，下一次请求重新调用"""
+    print("\n=== 测试上游失败 ===")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        service = create_service(cache_dir)
+        calls = []
+
+        async def failing_fetch(symbol, timeframe, normalized_timeframe):
+            calls.append(symbol)
+            await asyncio.sleep(0.05)
+            return None
+
+        service._fetch_chart = failing_fetch
+
+        results = await asyncio.gather(*(service.get_chart('AMD', '5m') for _ in range(3)))
+        assert results == [None, None, None] and len(calls) == 1
+        await service.get_chart('AMD', '5m')
+        assert len(calls) == 2
+        print("✅ 失败结果不缓存，下一次请求重新调用上游")
+
+if __name__ == "__main__":
+    asyncio.run(test_concurrent_requests_coalesced())
+    asyncio.run(test_cancelled_waiter_does_not_cancel_fetch())
+    asyncio.run(test_failed_fetch_not_cached())
+    print("\n🎉 图表请求合并测试通过")
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+测试开盘前图表预取
+验证请求日志排名、调度时间、每日预算和已缓存图表的跳过
+"""
+import asyncio
+import json
+import os
+import tempfile
+from datetime import datetime
+
+from chart_prefetch import ChartPrefetcher, EASTERN
+from chart_service import ChartService
+
+class MockConfig:
+    """最小化的配置对象"""
+    layout_id = "test_layout"
+    chart_img_api_key = "test_key"
+    tradingview_session_id = None
+    tradingview_session_id_sign = None
+
+def write_log(log_dir: str, date: str, entries):
+    """写入一天的请求日志"""
+    requests = [
+        {"request_type": request_type, "content": content, "success": success}
+        for request_type, content, success in entries
+    ]
+    with open(os.path.join(log_dir, f"requests_{date}.json"), "w", encoding="utf-8") as f:
+        json.dump(requests, f)
+
+def create_prefetcher(log_dir: str, cache_dir: str) -> ChartPrefetcher:
+    os.environ['CHART_CACHE_DIR'] = cache_dir
+    return ChartPrefetcher(ChartService(MockConfig()), log_dir=log_dir)
+
+def test_rank_pairs():
+    """按最近几天的成功图表请求排名"""
+    print("=== 测试热门图表排名 ===")
+    with tempfile.TemporaryDirectory() as log_dir, tempfile.TemporaryDirectory() as cache_dir:
+        write_log(log_dir, "2025-08-12", [
+            ("chart", "AAPL 1h", True), ("chart", "AAPL 1h", True), ("chart", "TSLA 15m", True),
+            ("chart", "AAPL 15m", False),    # 失败的请求不计入
+            ("prediction", "TSLA", True),    # 非图表请求不计入
+            ("chart", "NVDA 7x", True),      # 无效时间框架
+        ])
+        write_log(log_dir, "2025-08-13", [("chart", "TSLA 15m", True), ("chart", "AAPL 1h/4h", True)])  # 组合请求
+        write_log(log_dir, "2025-08-01", [("chart", "MSFT 1d", True)] * 5)  # 超出回看范围
+
+        prefetcher = create_prefetcher(log_dir, cache_dir)
+        prefetcher.top_n = 3
+        ranking = prefetcher.rank_pairs(datetime(2025, 8, 13, 9, 25))
+        print(f"  排名: {ranking}")
+        assert ranking == [(("AAPL", "1h"), 3), (("TSLA", "15m"), 2), (("AAPL", "4h"), 1)]
+    print("✅ 排名正确")
+
+def test_next_run_time():
+    """只在工作日的配置时间（美东）执行，可按间隔在交易时段内重复"""
+    print("\n=== 测试调度时间 ===")
+    with tempfile.TemporaryDirectory() as log_dir, tempfile.TemporaryDirectory() as cache_dir:
+        prefetcher = create_prefetcher(log_dir, cache_dir)
+        prefetcher.run_times = prefetcher._parse_times("09:25")
+
+        friday_evening = EASTERN.localize(datetime(2025, 8, 15, 18, 0))
+        assert prefetcher.next_run_time(friday_evening) == EASTERN.localize(datetime(2025, 8, 18, 9, 25))
+
+        monday_early = EASTERN.localize(datetime(2025, 8, 18, 6, 0))
+        assert prefetcher.next_run_time(monday_early) == EASTERN.localize(datetime(2025, 8, 18, 9, 25))
+
+        prefetcher.interval_minutes = 60
+        after_open = EASTERN.localize(datetime(2025, 8, 18, 9, 26))
+        assert prefetcher.next_run_time(after_open) == EASTERN.localize(datetime(2025, 8, 18, 10, 30))
+        after_last = EASTERN.localize(datetime(2025, 8, 18, 15, 31))
+        assert prefetcher.next_run_time(after_last) == EASTERN.localize(datetime(2025, 8, 19, 9, 25))
+    print("✅ 调度时间正确")
+
+async def test_prefetch_budget_and_cache():
+    """预取写入缓存，已缓存的图表不再调用，超出每日预算后停止"""
+    print("\n=== 测试预取预算 ===")
+    with tempfile.TemporaryDirectory() as log_dir, tempfile.TemporaryDirectory() as cache_dir:
+        today = datetime.now(EASTERN)
+        write_log(log_dir, today.strftime("%Y-%m-%d"), [
+            ("chart", "AAPL 1h", True), ("chart", "AAPL 1h", True),
+            ("chart", "TSLA 15m", True), ("chart", "NVDA 4h", True),
+        ])
+        prefetcher = create_prefetcher(log_dir, cache_dir)
+        prefetcher.daily_budget = 2
+        service = prefetcher.chart_service
+        calls = []
+
+        async def fetch(symbol, timeframe, normalized_timeframe):
+            calls.append(symbol)
+            return b"png"
+
+        service._fetch_chart = fetch
+
+        assert await prefetcher.prefetch_once(today) == 2
+        assert calls == ["NASDAQ:AAPL", "NASDAQ:TSLA"] and prefetcher.budget_skipped == 1
+        print(f"✅ 预算内预取 {calls}")
+
+        # 用户请求直接命中缓存
+        assert await service.get_chart("AAPL", "1h") == b"png"
+        assert len(calls) == 2 and service.chart_cache.fresh_hits == 1
+        print("✅ 用户请求命中预取的缓存")
+
+        # 再次预取：已缓存的跳过，只使用剩余的1次预算
+        prefetcher.daily_budget = 3
+        assert await prefetcher.prefetch_once(today) == 1
+        assert calls[-1] == "NASDAQ:NVDA" and prefetcher.already_cached == 2
+        print(f"✅ 已缓存的图表不重复调用: {prefetcher.get_stats()}")
+
+        # 交易所未知的代码需要探测，探测调用计入预算；剩余预算不够时跳过
+        write_log(log_dir, today.strftime("%Y-%m-%d"), [("chart", "ZZPRE 1h", True)])
+        skipped = prefetcher.budget_skipped
+        prefetcher.daily_budget = prefetcher.budget_used + 4
+        assert await prefetcher.prefetch_once(today) == 0 and prefetcher.budget_skipped == skipped + 1
+
+        async def prefetch_unknown(symbol, timeframe):
+            return 5 if symbol == "ZZPRE" else 0  # 4次探测 + 1次图表；其余图表已缓存
+
+        service.prefetch_chart = prefetch_unknown
+        prefetcher.daily_budget = prefetcher.budget_used + 5
+        assert await prefetcher.prefetch_once(today) == 5 and prefetcher._budget_remaining(today) == 0
+        print("✅ 交易所探测计入预取预算")
+        await service.render_queue.stop()
+
+if __name__ == "__main__":
+    test_rank_pairs()
+    test_next_run_time()
+    asyncio.run(test_prefetch_budget_and_cache())
+    print("\n🎉 图表预取测试通过")
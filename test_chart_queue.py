@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+测试图表渲染队列
+验证并发上限、VIP优先、每分钟额度、429/5xx退避重试、取消任务和排队位置
+"""
+import asyncio
+import time
+
+from chart_queue import (ChartRenderQueue, RetryableUpstreamError,
+                         PRIORITY_VIP, PRIORITY_NORMAL, PRIORITY_BACKGROUND)
+
+async def test_worker_limit():
+    """同时执行的上游调用不超过工作协程数"""
+    print("=== 测试并发上限 ===")
+    queue = ChartRenderQueue(workers=2, rpm=6000)
+    running = 0
+    peak = 0
+
+    def make_job(i):
+        async def job():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.05)
+            running -= 1
+            return i
+        return job
+
+    results = await asyncio.gather(*(queue.submit(i, make_job(i)) for i in range(6)))
+    assert results == list(range(6))
+    assert peak == 2, f"并发峰值应为2，实际 {peak}"
+    print(f"✅ 6个任务并发峰值 {peak}: {queue.get_stats()}")
+    await queue.stop()
+
+async def test_vip_priority():
+    """VIP任务插到普通任务之前"""
+    print("\n=== 测试VIP优先 ===")
+    queue = ChartRenderQueue(workers=1, rpm=6000)
+    order = []
+
+    def make_job(name):
+        async def job():
+            order.append(name)
+            await asyncio.sleep(0.02)
+            return name
+        return job
+
+    first = asyncio.create_task(queue.submit('first', make_job('first')))
+    await asyncio.sleep(0.005)  # 第一个任务已开始执行
+    tasks = [
+        asyncio.create_task(queue.submit('refresh', make_job('refresh'), PRIORITY_BACKGROUND)),
+        asyncio.create_task(queue.submit('normal', make_job('normal'), PRIORITY_NORMAL)),
+        asyncio.create_task(queue.submit('vip', make_job('vip'), PRIORITY_VIP)),
+    ]
+    await asyncio.sleep(0)
+    assert queue.position('vip') == 1 and queue.position('normal') == 2 and queue.position('refresh') == 3
+    await asyncio.gather(first, *tasks)
+    assert order == ['first', 'vip', 'normal', 'refresh'], order
+    print(f"✅ 执行顺序: {order}")
+
+    # 普通任务排队时被VIP请求提升优先级
+    order.clear()
+    blocker = asyncio.create_task(queue.submit('blocker', make_job('blocker')))
+    await asyncio.sleep(0.005)
+    normal = asyncio.create_task(queue.submit('a', make_job('a')))
+    shared = asyncio.create_task(queue.submit('b', make_job('b')))
+    await asyncio.sleep(0)
+    queue.prioritize('b', PRIORITY_VIP)
+    await asyncio.gather(blocker, normal, shared)
+    assert order == ['blocker', 'b', 'a'], order
+    print("✅ 排队中的任务可被提升优先级")
+    await queue.stop()
+
+async def test_rate_budget():
+    """上游调用速率不超过每分钟额度"""
+    print("\n=== 测试每分钟额度 ===")
+    queue = ChartRenderQueue(workers=2, rpm=600)  # 每秒10次，突发2次
+    started = time.perf_counter()
+
+    async def job():
+        return time.perf_counter() - started
+
+    times = await asyncio.gather(*(queue.submit(i, job) for i in range(6)))
+    # 前2次使用突发令牌，其余4次每0.1秒一次
+    assert times[-1] >= 0.35, f"应按额度限速，实际最后一次在 {times[-1]:.2f}s"
+    print(f"✅ 6次调用耗时 {times[-1]:.2f}s")
+    await queue.stop()
+
+async def test_retry_with_backoff():
+    """429/5xx退避重试，重试耗尽后返回None"""
+    print("\n=== 测试退避重试 ===")
+    queue = ChartRenderQueue(workers=1, rpm=6000, max_retries=2, retry_base=0.01)
+    attempts = []
+
+    async def flaky():
+        attempts.append(time.perf_counter())
+        if len(attempts) < 3:
+            raise RetryableUpstreamError(503 if len(attempts) == 1 else 429)
+        return b"png"
+
+    assert await queue.submit('flaky', flaky) == b"png"
+    assert len(attempts) == 3
+    stats = queue.get_stats()
+    assert stats['retries'] == 2 and stats['rate_limited'] == 1
+    print(f"✅ 两次失败后成功: {stats}")
+
+    async def always_failing():
+        raise RetryableUpstreamError(502)
+
+    assert await queue.submit('broken', always_failing) is None
+    assert queue.get_stats()['failed'] == 1
+    print("✅ 重试耗尽后返回None")
+
+    async def honours_retry_after():
+        attempts.append(time.perf_counter())
+        if len(attempts) == 4:
+            raise RetryableUpstreamError(429, retry_after=0.2)
+        return b"ok"
+
+    started = time.perf_counter()
+    assert await queue.submit('retry_after', honours_retry_after) == b"ok"
+    assert time.perf_counter() - started >= 0.2
+    print("✅ 遵守Retry-After")
+    await queue.stop()
+
+async def test_cancel_running():
+    """取消正在调用上游的任务：上游调用中止，工作协程立即处理下一个任务"""
+    print("\n=== 测试取消执行中的任务 ===")
+    queue = ChartRenderQueue(workers=1, rpm=6000)
+    aborted = asyncio.Event()
+
+    async def slow():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            aborted.set()
+            raise
+        return b"slow"
+
+    async def fast():
+        return b"fast"
+
+    slow_task = asyncio.create_task(queue.submit('slow', slow))
+    await asyncio.sleep(0.05)
+    assert queue.get_stats()['running'] == 1
+    queue.cancel('slow')
+    started = time.perf_counter()
+    assert await queue.submit('fast', fast) == b"fast"
+    assert time.perf_counter() - started < 0.5 and aborted.is_set()
+    try:
+        await slow_task
+        raise AssertionError('slow')
+    except asyncio.CancelledError:
+        pass
+    stats = queue.get_stats()
+    assert stats['cancelled'] == 1 and stats['running'] == 0 and stats['completed'] == 1
+    print(f"✅ 执行中的任务已中止: {stats}")
+    await queue.stop()
+
+if __name__ == "__main__":
+    asyncio.run(test_worker_limit())
+    asyncio.run(test_vip_priority())
+    asyncio.run(test_rate_budget())
+    asyncio.run(test_retry_with_backoff())
+    asyncio.run(test_cancel_running())
+    print("\n🎉 图表渲染队列测试通过")
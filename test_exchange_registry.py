@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+测试交易所注册表和并行探测
+需要DATABASE_URL（可使用SQLite嵌入式配置: DATABASE_URL=sqlite:///test.db）
+"""
+import asyncio
+import os
+import tempfile
+import time
+from unittest.mock import patch
+
+from chart_service import ChartService
+from exchange_registry import ExchangeRegistry
+from models import create_tables
+
+class MockConfig:
+    """最小化的配置对象"""
+    layout_id = "test_layout"
+    chart_img_api_key = "test_key"
+    tradingview_session_id = None
+    tradingview_session_id_sign = None
+
+class FakeResponse:
+    """模拟chart-img探测响应"""
+    def __init__(self, status, content_type):
+        self.status = status
+        self.headers = {'content-type': content_type}
+
+class FakeSession:
+    """按交易所返回不同延迟和结果的模拟会话"""
+    def __init__(self, results):
+        self.results = results  # 交易所 -> (延迟秒数, 是否存在)
+        self.requested = []
+
+    def get(self, url, params=None, timeout=None):
+        exchange = params['symbol'].split(':')[0]
+        self.requested.append(exchange)
+        delay, exists = self.results[exchange]
+
+        class Context:
+            async def __aenter__(self):
+                await asyncio.sleep(delay)
+                return FakeResponse(200, 'image/png') if exists else FakeResponse(404, 'application/json')
+
+            async def __aexit__(self, *args):
+                return False
+
+        return Context()
+
+async def test_parallel_probe():
+    """各交易所并行探测，第一个成功的胜出"""
+    print("=== 测试并行探测 ===")
+    service = ChartService(MockConfig())
+    fake = FakeSession({'NASDAQ': (0.3, False), 'NYSE': (0.1, True), 'AMEX': (0.3, False), 'OTC': (0.3, False)})
+
+    with patch('chart_service.http_client.get_session', return_value=fake):
+        started = time.perf_counter()
+        result = await service.detect_stock_exchange('ZZTEST')
+        elapsed = time.perf_counter() - started
+
+    assert result == 'NYSE:ZZTEST', result
+    assert elapsed < 0.25, f"并行探测应在最快成功的探测后返回，实际 {elapsed:.2f}s"
+    # 探测经渲染队列执行：工作协程数以内的探测并行发出，NYSE成功后还在排队的探测被取消
+    workers = service.render_queue.workers
+    assert 'NYSE' in fake.requested and len(fake.requested) == min(workers, 4), fake.requested
+    # 已在调用的其他探测被中止，不再占用工作协程
+    await asyncio.sleep(0.01)
+    stats = service.render_queue.get_stats()
+    assert stats['running'] == 0 and stats['cancelled'] == min(workers, 4) - 1, stats
+    print(f"✅ 并行探测耗时 {elapsed:.2f}s，结果 {result}，调用 {fake.requested}")
+
+    # 第二次查询直接命中注册表
+    with patch('chart_service.http_client.get_session', side_effect=AssertionError("不应再探测")):
+        assert await service.detect_stock_exchange('ZZTEST') == 'NYSE:ZZTEST'
+    print("✅ 已学习的映射不再探测")
+
+async def test_negative_cache_and_persistence():
+    """全部失败的代码进行负缓存，并在重启后从数据库加载"""
+    print("\n=== 测试负缓存与持久化 ===")
+    service = ChartService(MockConfig())
+    fake = FakeSession({exchange: (0.01, False) for exchange in ['NASDAQ', 'NYSE', 'AMEX', 'OTC']})
+
+    with patch('chart_service.http_client.get_session', return_value=fake):
+        await service.detect_stock_exchange('QQJUNK')
+    assert len(fake.requested) == 4
+
+    with patch('chart_service.http_client.get_session', side_effect=AssertionError("负缓存期内不应探测")):
+        result = await service.detect_stock_exchange('QQJUNK')
+    print(f"✅ 负缓存期内直接使用启发式规则: {result}")
+
+    registry = ExchangeRegistry()
+    registry.load()
+    assert registry.lookup('ZZTEST') == ('NYSE:ZZTEST', False)
+    assert registry.lookup('QQJUNK') == (None, True)
+    print(f"✅ 重启后从数据库加载: {registry.get_stats()}")
+
+async def test_network_errors_not_cached():
+    """探测因网络错误失败时不做负缓存"""
+    print("\n=== 测试网络错误 ===")
+    service = ChartService(MockConfig())
+
+    class BrokenSession:
+        def get(self, *args, **kwargs):
+            raise OSError("network down")
+
+    with patch('chart_service.http_client.get_session', return_value=BrokenSession()):
+        await service.detect_stock_exchange('NETERR')
+    assert service.exchange_registry.lookup('NETERR') == (None, False)
+    print("✅ 网络错误不写入负缓存")
+
+async def test_probe_rate_budget():
+    """探测与图表请求共用渲染队列的每分钟额度，预取时探测调用计入每日预算"""
+    print("\n=== 测试探测调用预算 ===")
+    os.environ['CHART_CACHE_DIR'] = tempfile.mkdtemp()
+    service = ChartService(MockConfig())
+    service.render_queue.rpm = 60  # 每秒1次，令牌桶容量为工作协程数
+    fake = FakeSession({exchange: (0.01, exchange == 'OTC') for exchange in ['NASDAQ', 'NYSE', 'AMEX', 'OTC']})
+
+    with patch('chart_service.http_client.get_session', return_value=fake):
+        started = time.perf_counter()
+        result = await service.detect_stock_exchange('ZZRATE')
+        elapsed = time.perf_counter() - started
+    assert result == 'OTC:ZZRATE' and len(fake.requested) == 4
+    if service.render_queue.workers < 4:
+        assert elapsed > 0.5, f"超出令牌桶容量的探测应等待令牌，实际 {elapsed:.2f}s"
+    print(f"✅ 4次探测经令牌桶限速，耗时 {elapsed:.2f}s")
+
+    # 预取未知代码：探测次数 + 图表调用一起计入返回的调用次数
+    assert service.estimate_calls('ZZBUDGET') == 5 and service.estimate_calls('AAPL') == 1
+    service.render_queue.rpm = 6000
+    fake = FakeSession({exchange: (0.01, exchange == 'NASDAQ') for exchange in ['NASDAQ', 'NYSE', 'AMEX', 'OTC']})
+
+    async def fetch(symbol, timeframe, normalized_timeframe):
+        return b"png"
+
+    service._fetch_chart = fetch
+    with patch('chart_service.http_client.get_session', return_value=fake):
+        calls = await service.prefetch_chart('ZZBUDGET', '1h')
+    assert calls == len(fake.requested) + 1, (calls, fake.requested)
+    assert service.estimate_calls('ZZBUDGET') == 1
+    print(f"✅ 预取时探测计入预算: {calls} 次调用")
+    await service.render_queue.stop()
+
+if __name__ == "__main__":
+    create_tables()
+    asyncio.run(test_parallel_probe())
+    asyncio.run(test_negative_cache_and_persistence())
+    asyncio.run(test_network_errors_not_cached())
+    asyncio.run(test_probe_rate_budget())
+    print("\n🎉 交易所注册表测试通过")
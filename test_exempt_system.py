@@ -34,6 +34,11 @@ def test_exempt_system():
     assert remaining == 999, "豁免用户应该显示999剩余次数"
     assert can_request == True, "豁免用户应该允许请求"
     
+    cache_stats = rate_limiter.get_exempt_cache_stats()
+    print(f"   豁免缓存: 用户数={cache_stats['size']}, 刷新次数={cache_stats['refresh_count']}")
+    assert test_user_id in rate_limiter._exempt_user_ids, "添加后豁免缓存应该立即包含该用户"
+    assert cache_stats['recent_events'][-1]['source'] == "exempt_add", "最近一次刷新应由添加操作触发"
+    
     print(f"\n4. 获取豁免用户列表...")
     exempt_list = rate_limiter.list_exempt_users()
     print(f"   豁免用户数量: {len(exempt_list)}")
@@ -49,6 +54,7 @@ def test_exempt_system():
     can_request, current_count, remaining = rate_limiter.check_user_limit(test_user_id, test_username)
     print(f"   移除后: 可请求={can_request}, 已用={current_count}, 剩余={remaining}")
     assert remaining != 999, "移除后应该恢复限制"
+    assert test_user_id not in rate_limiter._exempt_user_ids, "移除后豁免缓存不应包含该用户"
     
     print(f"\n✅ 所有测试通过！豁免用户系统工作正常")
 
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+测试服务器/频道信息快照
+验证快照只在首次访问时遍历成员列表，之后由网关事件增量更新并递增版本号
+"""
+import asyncio
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import discord
+
+from guild_snapshot import GuildSnapshots
+
+class FakeBot:
+    """只记录事件监听器的机器人"""
+    def __init__(self):
+        self.user = SimpleNamespace(id=1)
+        self.listeners = {}
+
+    def add_listener(self, func, name):
+        self.listeners[name] = func
+
+class FakeGuild:
+    """成员列表访问计数的服务器"""
+    def __init__(self, member_count):
+        self.id = 100
+        self.name = "测试服务器"
+        self.owner_id = 2
+        self.created_at = datetime(2024, 1, 1)
+        self.verification_level = "low"
+        self.explicit_content_filter = "disabled"
+        self.features = []
+        self.premium_tier = 0
+        self.premium_subscription_count = 0
+        self.icon = self.banner = None
+        self.roles = [object()] * 3
+        self.emojis = []
+        self.channels = [SimpleNamespace(type=SimpleNamespace(name=name)) for name in ('text', 'text', 'voice', 'category')]
+        self._members = [self.make_member(i, bot=(i % 10 == 0), online=(i % 2 == 0)) for i in range(member_count)]
+        self.member_count = member_count
+        self.member_scans = 0
+
+    def make_member(self, member_id, bot=False, online=True):
+        return SimpleNamespace(
+            id=member_id, name=f"user{member_id}", display_name=f"用户{member_id}", bot=bot, guild=self,
+            status=discord.Status.online if online else discord.Status.offline, joined_at=None
+        )
+
+    @property
+    def members(self):
+        self.member_scans += 1
+        return list(self._members)
+
+def test_incremental_updates():
+    """成员加入/离开、在线状态变化增量更新统计"""
+    print("=== 测试增量更新 ===")
+    bot = FakeBot()
+    snapshots = GuildSnapshots(bot, max_age=3600)
+    guild = FakeGuild(1000)
+
+    first = snapshots.guild_info(guild)
+    assert first['statistics'] == {'online_members': 500, 'bot_count': 100, 'human_count': 900}, first['statistics']
+    assert first['channels'] == {'total': 4, 'text': 2, 'voice': 1, 'categories': 1}
+    scans = guild.member_scans
+
+    async def apply_events():
+        newcomer = guild.make_member(5000, online=True)
+        await bot.listeners['on_member_join'](newcomer)
+        await bot.listeners['on_member_remove'](guild._members[10])  # 在线的机器人成员
+        before = guild._members[3]
+        after = guild.make_member(3, online=True)
+        await bot.listeners['on_presence_update'](before, after)
+
+    asyncio.run(apply_events())
+    second = snapshots.guild_info(guild)
+    print(f"  统计: {second['statistics']} 版本 {first['snapshot_version']} -> {second['snapshot_version']}")
+    assert second['statistics'] == {'online_members': 501, 'bot_count': 99, 'human_count': 901}
+    assert second['snapshot_version'] > first['snapshot_version']
+    assert guild.member_scans == scans, "增量更新后不应重新遍历成员列表"
+
+    # 返回的是副本，调用方修改不影响快照
+    second['statistics']['bot_count'] = -1
+    assert snapshots.guild_info(guild)['statistics']['bot_count'] == 99
+    print("✅ 增量更新正确，未重新遍历成员")
+
+def test_constant_cost():
+    """快照命中时构建服务器信息的耗时与成员数无关"""
+    print("\n=== 测试构建开销 ===")
+    timings = {}
+    for size in (1_000, 100_000):
+        snapshots = GuildSnapshots(FakeBot(), max_age=3600)
+        guild = FakeGuild(size)
+        snapshots.guild_info(guild)
+        started = time.perf_counter()
+        for _ in range(1000):
+            snapshots.guild_info(guild)
+        timings[size] = (time.perf_counter() - started) / 1000 * 1e6
+        print(f"  {size:>7} 成员: 每次 {timings[size]:.1f}µs")
+        assert guild.member_scans == 2  # 只在首次构建时遍历（活跃成员 + 统计）
+    assert timings[100_000] < timings[1_000] * 3
+    print("✅ 构建开销与服务器规模无关")
+
+def test_channel_snapshot_invalidation():
+    """频道更新、机器人角色变化时清除频道快照"""
+    print("\n=== 测试频道快照失效 ===")
+    bot = FakeBot()
+    snapshots = GuildSnapshots(bot, max_age=3600)
+    guild = FakeGuild(10)
+    channel = SimpleNamespace(
+        id=7, name="general", type=SimpleNamespace(name='text'), created_at=None, guild=guild, category=None,
+        permissions_for=lambda member: None
+    )
+    guild.get_member = lambda member_id: None
+
+    first = snapshots.channel_info(channel)
+    assert snapshots.channel_info(channel)['snapshot_version'] == first['snapshot_version']
+
+    channel.name = "general-2"
+    asyncio.run(bot.listeners['on_guild_channel_update'](channel, channel))
+    renamed = snapshots.channel_info(channel)
+    assert renamed['name'] == "general-2" and renamed['snapshot_version'] > first['snapshot_version']
+
+    bot_member = SimpleNamespace(id=bot.user.id, guild=guild)
+    asyncio.run(bot.listeners['on_member_update'](bot_member, bot_member))
+    assert snapshots.get_stats()['channels'] == 0
+    print("✅ 频道快照按事件失效")
+
+if __name__ == "__main__":
+    test_incremental_updates()
+    test_constant_cost()
+    test_channel_snapshot_invalidation()
+    print("\n🎉 服务器/频道快照测试通过")
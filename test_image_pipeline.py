@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+测试图表图片后处理
+使用仓库中的chart-img样例图片验证重新编码、裁剪和缓存（需要Pillow）
+"""
+import asyncio
+import io
+import os
+import tempfile
+
+from PIL import Image
+
+from chart_service import ChartService
+from image_pipeline import image_pipeline, process_image
+
+SAMPLE = "test_layout_chart.png"
+
+class MockConfig:
+    """最小化的配置对象"""
+    layout_id = "test_layout"
+    chart_img_api_key = "test_key"
+    tradingview_session_id = None
+    tradingview_session_id_sign = None
+
+def load_sample() -> bytes:
+    with open(SAMPLE, "rb") as f:
+        return f.read()
+
+def test_process_image():
+    """重新编码和裁剪"""
+    print("=== 测试图片处理 ===")
+    data = load_sample()
+    for fmt, quality, extension in [("webp", 100, "webp"), ("png", 100, "png"), ("jpeg", 85, "jpg")]:
+        result = process_image(data, fmt, quality, (0, 0, 0, 0))
+        assert Image.open(io.BytesIO(result)).size == (1920, 1080)
+        assert image_pipeline.detect_extension(result) == extension
+        print(f"  {fmt}: {len(data)} -> {len(result)} bytes")
+
+    cropped = process_image(data, "webp", 100, (0, 0, 60, 0))
+    assert Image.open(io.BytesIO(cropped)).size == (1920, 1020)
+    assert image_pipeline.detect_extension(data) == "png"
+    print("✅ 编码和裁剪正确")
+
+async def test_chart_service_variants():
+    """后处理结果写入缓存，重复请求直接命中"""
+    print("\n=== 测试缓存处理后的图片 ===")
+    data = load_sample()
+    with tempfile.TemporaryDirectory() as cache_dir:
+        os.environ['CHART_CACHE_DIR'] = cache_dir
+        service = ChartService(MockConfig())
+        calls = []
+
+        async def fetch(symbol, timeframe, normalized_timeframe):
+            calls.append(symbol)
+            return data
+
+        service._fetch_chart = fetch
+        full = await service.get_chart("AAPL", "1h")
+        cached = await service.get_chart("AAPL", "1h")
+        assert len(calls) == 1, "重复请求应直接命中缓存"
+        assert image_pipeline.detect_extension(full) == "webp"
+        assert cached == full and len(full) < len(data)
+        assert len(os.listdir(cache_dir)) == 1
+        print(f"✅ 原图 {len(data)} bytes -> 处理后 {len(full)} bytes")
+        print(f"  统计: {image_pipeline.get_stats()}")
+        await service.render_queue.stop()
+    image_pipeline.shutdown()
+
+if __name__ == "__main__":
+    test_process_image()
+    asyncio.run(test_chart_service_variants())
+    print("\n🎉 图表图片后处理测试通过")
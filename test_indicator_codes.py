@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+测试分类指标状态编码
+验证编码/解码、入库时填充状态列、数据库端分布和历史查询及其API端点，以及迁移脚本回填已有数据
+使用DATABASE_URL指定的数据库，未设置时使用临时目录中的SQLite数据库
+"""
+import asyncio
+import importlib.util
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from signal_fixtures import signal_payload, use_temp_database
+
+use_temp_database('test_indicator_codes.db')
+
+import aiohttp
+from aiohttp import web
+from sqlalchemy import create_engine, text
+
+from indicator_codes import STATE_COLUMNS, decode_indicator_state, encode_indicator_states, get_state_distribution, get_state_history
+from models import TradingViewData, create_tables, get_db_session
+from tradingview_handler import TradingViewHandler
+
+SIGNAL = signal_payload(
+    'ZZC', pmaText='PMA Strong Bullish', CVDsignal='cvdAboveMA',
+    RSIHAsignal='BearishHA', BBPsignal='bullpower', SQZsignal='no squeeze', choppingrange_signal='chopping',
+    center_trend='Weak Bullish', wavemarket_state='Short Weak', ewotrend_state='Strong Bearish',
+    HTFwave_signal='Neutral', MAtrend='1', MAtrend_timeframe1='0', MAtrend_timeframe2='-1',
+    TrendTracersignal='1', TrendTracerHTF='-1', BullishTrendRating=4
+)
+
+INDICATOR_FIELD = {column: field for column, field in (
+    ('pma_state', 'pmaText'), ('cvd_state', 'CVDsignal'), ('rsi_ha_state', 'RSIHAsignal'), ('bbp_state', 'BBPsignal'),
+    ('sqz_state', 'SQZsignal'), ('chopping_state', 'choppingrange_signal'), ('center_trend_state', 'center_trend'),
+    ('wave_state', 'wavemarket_state'), ('ewo_state', 'ewotrend_state'), ('htf_wave_state', 'HTFwave_signal')
+)}
+
+def test_encode_decode():
+    """编码按看跌到看涨排列，未知取值编码为空"""
+    print("=== 测试编码/解码 ===")
+    states = encode_indicator_states(SIGNAL)
+    print(f"  {states}")
+    assert states['pma_state'] == 2 and states['cvd_state'] == 1 and states['rsi_ha_state'] == -1
+    assert states['sqz_state'] == 0 and states['chopping_state'] == 1 and states['wave_state'] == -1
+    assert states['ewo_state'] == -2 and states['htf_wave_state'] == 0
+    assert (states['ma_trend'], states['ma_trend_tf1'], states['ma_trend_tf2']) == (1, 0, -1)
+    assert states['trend_tracer_htf'] == -1
+
+    odd = encode_indicator_states({'pmaText': 'pma bullish ', 'MAtrend': '1.0', 'SQZsignal': 'maybe', 'TrendTracersignal': '5'})
+    assert odd['pma_state'] == 1 and odd['ma_trend'] == 1
+    assert odd['sqz_state'] is None and odd['trend_tracer'] is None and odd['cvd_state'] is None
+
+    for column, code in states.items():
+        if code is not None and column not in ('ma_trend', 'ma_trend_tf1', 'ma_trend_tf2', 'trend_tracer', 'trend_tracer_htf'):
+            assert encode_indicator_states({INDICATOR_FIELD[column]: decode_indicator_state(column, code)})[column] == code
+    assert decode_indicator_state('pma_state', None) is None
+    print("✅ 编码/解码正确")
+
+def test_store_and_query():
+    """入库时填充状态列，分布和历史查询直接读取状态列"""
+    print("\n=== 测试入库和查询 ===")
+    create_tables()
+    db = get_db_session()
+    try:
+        db.query(TradingViewData).filter(TradingViewData.symbol == 'ZZC').delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+    handler = TradingViewHandler()
+    assert handler.store_enhanced_data(SIGNAL)
+    assert handler.store_enhanced_data(dict(SIGNAL, pmaText='PMA Bearish', MAtrend='-1'))
+
+    db = get_db_session()
+    try:
+        rows = db.query(TradingViewData).filter(TradingViewData.symbol == 'ZZC').order_by(TradingViewData.id).all()
+        assert len(rows) == 2 and rows[0].data_type == 'signal'
+        assert rows[0].pma_state == 2 and rows[1].pma_state == -1 and rows[1].ma_trend == -1
+    finally:
+        db.close()
+
+    distribution = get_state_distribution('pma_state', timeframe=rows[0].timeframe, symbol='zzc',
+                                          since=datetime.now() - timedelta(hours=1))
+    print(f"  PMA分布: {distribution}")
+    assert distribution == {'PMA Strong Bullish': 1, 'PMA Bearish': 1}
+
+    history = get_state_history('ZZC', rows[0].timeframe, columns=['pma_state', 'ma_trend'])
+    print(f"  历史: {history}")
+    assert [item['pma_state'] for item in history] == ['PMA Bearish', 'PMA Strong Bullish']
+    assert history[0]['ma_trend'] == '-1' and set(history[0]) == {'received_at', 'pma_state', 'ma_trend'}
+
+    try:
+        get_state_distribution('raw_data')
+        raise AssertionError('raw_data')
+    except ValueError:
+        pass
+    print("✅ 入库和查询正确")
+
+async def test_api_endpoints():
+    """历史和分布查询通过API暴露（依赖test_store_and_query写入的ZZC数据）"""
+    print("\n=== 测试状态查询API ===")
+    from api_server import DiscordAPIServer
+
+    server = DiscordAPIServer(None)
+    runner = web.AppRunner(server.app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    try:
+        async with aiohttp.ClientSession() as session:
+            params = {'symbol': 'zzc', 'timeframe': '1h', 'columns': 'pma_state,ma_trend',
+                      'since': (datetime.now() - timedelta(hours=1)).isoformat()}
+            async with session.get(f"{url}/api/signals/states", params=params) as response:
+                body = await response.json()
+                assert response.status == 200 and body['symbol'] == 'ZZC', body
+                assert [item['pma_state'] for item in body['history']] == ['PMA Bearish', 'PMA Strong Bullish']
+
+            params = {'column': 'pma_state', 'timeframe': '1h', 'symbol': 'ZZC'}
+            async with session.get(f"{url}/api/signals/states/distribution", params=params) as response:
+                body = await response.json()
+                print(f"  分布: {body['distribution']}")
+                assert response.status == 200
+                assert {item['value']: item['count'] for item in body['distribution']} == {'PMA Strong Bullish': 1, 'PMA Bearish': 1}
+
+            for path, params in (('/api/signals/states', {'symbol': 'ZZC'}),
+                                 ('/api/signals/states', {'symbol': 'ZZC', 'timeframe': '1h', 'columns': 'raw_data'}),
+                                 ('/api/signals/states/distribution', {'column': 'pma_state', 'since': 'yesterday'})):
+                async with session.get(f"{url}{path}", params=params) as response:
+                    assert response.status == 400, (path, params)
+    finally:
+        await runner.cleanup()
+    print("✅ 状态查询API正确")
+
+def test_migration_backfill():
+    """迁移脚本为旧表添加状态列并回填信号数据，重复运行不会重复处理"""
+    print("\n=== 测试迁移回填 ===")
+    spec = importlib.util.spec_from_file_location('migrate_indicator_states', 'migrate-indicator-states.py')
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+
+    engine = create_engine(f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'legacy.db')}")
+    with engine.connect() as conn:
+        conn.execute(text(
+            "CREATE TABLE tradingview_data (id INTEGER PRIMARY KEY, symbol VARCHAR(20), timeframe VARCHAR(10), "
+            "data_type VARCHAR(20), raw_data TEXT, received_at DATETIME)"
+        ))
+        conn.execute(text(
+            "INSERT INTO tradingview_data (symbol, timeframe, data_type, raw_data) VALUES (:symbol, '1h', :data_type, :raw_data)"
+        ), [
+            {'symbol': 'OLD', 'data_type': 'signal', 'raw_data': json.dumps(SIGNAL)},
+            {'symbol': 'OLD', 'data_type': 'trade', 'raw_data': json.dumps({'ticker': 'OLD', 'action': 'buy'})},
+            {'symbol': 'OLD', 'data_type': 'signal', 'raw_data': json.dumps({'symbol': 'OLD'})},
+            {'symbol': 'BAD', 'data_type': 'signal', 'raw_data': 'not json'},
+        ] + [{'symbol': 'OLD', 'data_type': 'signal', 'raw_data': json.dumps(dict(SIGNAL, pmaText='PMA Bearish'))}] * 5)
+        conn.commit()
+
+    migration.add_state_columns(engine)
+    migration.add_state_columns(engine)
+    migration.create_history_index(engine)
+    assert migration.backfill_states(engine, batch_size=3) == 6
+    assert migration.backfill_states(engine, batch_size=3) == 0
+
+    with engine.connect() as conn:
+        counts = dict(conn.execute(text("SELECT pma_state, COUNT(*) FROM tradingview_data GROUP BY pma_state")).fetchall())
+        trade_states = conn.execute(text(
+            f"SELECT {', '.join(STATE_COLUMNS)} FROM tradingview_data WHERE data_type = 'trade'"
+        )).fetchone()
+    print(f"  回填后PMA编码分布: {counts}")
+    assert counts == {2: 1, -1: 5, None: 3}
+    assert all(code is None for code in trade_states)
+    print("✅ 迁移回填正确")
+
+if __name__ == "__main__":
+    test_encode_decode()
+    test_store_and_query()
+    asyncio.run(test_api_endpoints())
+    test_migration_backfill()
+    print("\n🎉 指标状态编码测试通过")
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+测试TradingView入库spool
+验证合并fsync、数据库不可用时按顺序重试和背压、无法写入的数据直接移入死信、写满后拒绝、进程被强制杀死后已确认的数据不丢失，
+以及webhook端点经spool入库（无效数据返回400）
+使用DATABASE_URL指定的数据库，未设置时使用临时目录中的SQLite数据库
+"""
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from signal_fixtures import signal_payload, use_temp_database
+
+use_temp_database('test_ingest_spool.db')
+os.environ['INGEST_SPOOL_DIR'] = tempfile.mkdtemp()
+os.environ['INGEST_SPOOL_RETRY_BASE_SECONDS'] = '0.01'
+os.environ['INGEST_SPOOL_RETRY_MAX_SECONDS'] = '0.05'
+
+import aiohttp
+from aiohttp import web
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from ingest_spool import IngestSpool, SpoolFull, ingest_spool
+from models import is_transient_db_error
+
+# 子进程: 数据库写入前几条成功后"挂起"（模拟数据库中断），持续接收数据并打印已确认的序号，等待被杀死
+CRASH_SCRIPT = r'''
+import asyncio, os, sys
+from ingest_spool import IngestSpool
+
+async def main(directory, replayed_path, healthy):
+    done = 0
+    async def store(payload):
+        nonlocal done
+        if done >= healthy:
+            await asyncio.sleep(3600)
+        with open(replayed_path, 'a') as f:
+            f.write(f"{payload['n']}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        done += 1
+        return True
+
+    spool = IngestSpool(directory)
+    await spool.start(store)
+
+    async def send(n):
+        await spool.append({'symbol': 'ZZE', 'n': n})
+        print(n, flush=True)
+
+    n = 0
+    while True:
+        await asyncio.gather(*(send(n + i) for i in range(20)))
+        n += 20
+
+asyncio.run(main(sys.argv[1], sys.argv[2], int(sys.argv[3])))
+'''
+
+async def wait_drained(spool, timeout=10):
+    deadline = time.time() + timeout
+    while spool.depth and time.time() < deadline:
+        await asyncio.sleep(0.01)
+    assert spool.depth == 0, spool.get_stats()
+
+async def test_batching_and_order():
+    """并发请求合并fsync，回放保持接收顺序"""
+    print("=== 测试合并写入和顺序回放 ===")
+    with tempfile.TemporaryDirectory() as directory:
+        stored = []
+
+        async def store(payload):
+            await asyncio.sleep(0.0005)
+            stored.append(payload['n'])
+            return True
+
+        spool = IngestSpool(directory)
+        await spool.start(store)
+        started = time.perf_counter()
+        seqs = await asyncio.gather(*(spool.append({'n': n}) for n in range(500)))
+        accept_ms = (time.perf_counter() - started) * 1000
+        assert seqs == list(range(1, 501))
+        await wait_drained(spool)
+        stats = spool.get_stats()
+        print(f"  500条接收 {accept_ms:.1f}ms，{stats['flushes']} 次fsync（平均每次 {stats['avg_flush_batch']} 条），"
+              f"fsync p50 {stats['fsync_p50_ms']}ms")
+        assert stored == list(range(500))
+        assert stats['flushes'] < 50 and stats['replayed_seq'] == 500
+        await spool.stop()
+
+        # 重启后没有需要回放的数据，序号继续递增
+        spool = IngestSpool(directory)
+        await spool.start(store)
+        assert spool.depth == 0 and await spool.append({'n': 500}) == 501
+        await wait_drained(spool)
+        await spool.stop()
+        assert stored[-1] == 500
+    print("✅ 合并写入和顺序回放正确")
+
+async def test_outage_backpressure():
+    """数据库不可用时接收不受影响，恢复后按顺序写入；待入库数据达到上限时拒绝"""
+    print("\n=== 测试数据库中断和背压 ===")
+    with tempfile.TemporaryDirectory() as directory:
+        stored = []
+        database_up = asyncio.Event()
+
+        async def store(payload):
+            if not database_up.is_set():
+                raise ConnectionError("数据库连接失败")
+            stored.append(payload['n'])
+            return True
+
+        spool = IngestSpool(directory)
+        spool.max_depth = 50
+        await spool.start(store)
+        started = time.perf_counter()
+        await asyncio.gather(*(spool.append({'n': n}) for n in range(50)))
+        print(f"  数据库中断时接收50条: {(time.perf_counter() - started) * 1000:.1f}ms")
+        try:
+            await spool.append({'n': 50})
+            raise AssertionError('spool full')
+        except SpoolFull as e:
+            print(f"  第51条: {e}")
+        await asyncio.sleep(0.1)
+        health = spool.get_health()
+        print(f"  健康检查: {health}")
+        assert health['depth'] == 50 and health['oldest_age_seconds'] >= 0.1 and health['retrying_seconds'] is not None
+        assert '数据库连接失败' in health['last_error']
+
+        database_up.set()
+        await wait_drained(spool)
+        assert stored == list(range(50)) and spool.get_stats()['rejected'] == 1
+        assert spool.get_health()['retrying_seconds'] is None
+        await spool.stop()
+
+        # 写入返回失败或抛出非暂时性错误的数据第一次就移入死信文件，后面的数据继续写入
+        async def reject_bad(payload):
+            if payload['n'] == 'poison':
+                return False
+            if payload['n'] == 'broken':
+                raise ValueError("字段无效")
+            stored.append(payload['n'])
+            return True
+
+        spool = IngestSpool(directory)
+        await spool.start(reject_bad)
+        await spool.append({'n': 'poison'})
+        await spool.append({'n': 'broken'})
+        await spool.append({'n': 99})
+        await wait_drained(spool)
+        await spool.stop()
+        with open(os.path.join(directory, 'dead-letter.jsonl')) as f:
+            dead = [json.loads(line) for line in f]
+        assert [item['payload']['n'] for item in dead] == ['poison', 'broken'] and stored[-1] == 99
+        assert [item['attempts'] for item in dead] == [1, 1] and '字段无效' in dead[1]['error']
+        assert spool.get_stats()['retries'] == 0
+
+        # 数据库错误按is_transient判断：连接类错误重试，直到超过重试次数才移入死信；
+        # 未迁移的数据库缺少列（SQLite上同样是OperationalError）第一次就移入死信
+        failures = []
+        legacy = create_engine(f"sqlite:///{os.path.join(directory, 'legacy.db')}")
+        with legacy.begin() as conn:
+            conn.execute(text("CREATE TABLE tradingview_data (id INTEGER PRIMARY KEY, symbol VARCHAR(20))"))
+
+        async def flaky(payload):
+            if payload['n'] == 'unmigrated':
+                with legacy.begin() as conn:
+                    conn.execute(text("INSERT INTO tradingview_data (symbol, pma_state) VALUES ('ZZA', 1)"))
+            if payload['n'] == 'locked' and len(failures) < 2:
+                failures.append(payload['n'])
+                raise OperationalError('INSERT', {}, Exception('database is locked'))
+            if payload['n'] == 'down':
+                raise OperationalError('INSERT', {}, Exception('server closed the connection'))
+            stored.append(payload['n'])
+            return True
+
+        spool = IngestSpool(directory)
+        spool.max_attempts = 3
+        spool.retry_base = 0.01
+        await spool.start(flaky, is_transient=is_transient_db_error)
+        for n in ('locked', 'unmigrated', 'down', 100):
+            await spool.append({'n': n})
+        await wait_drained(spool)
+        await spool.stop()
+        legacy.dispose()
+        with open(os.path.join(directory, 'dead-letter.jsonl')) as f:
+            dead = {item['payload']['n']: item for item in map(json.loads, f)}
+        assert stored[-2:] == ['locked', 100] and dead['down']['attempts'] == 3
+        assert dead['unmigrated']['attempts'] == 1 and 'pma_state' in dead['unmigrated']['error']
+        assert spool.get_stats()['retries'] == 4
+    print("✅ 数据库中断时不丢数据，恢复后按顺序写入")
+
+async def test_crash_recovery():
+    """子进程被SIGKILL后，所有已确认的数据都能从spool中恢复（写了一半的最后一行被截掉）"""
+    print("\n=== 测试崩溃恢复 ===")
+    with tempfile.TemporaryDirectory() as directory:
+        spool_dir = os.path.join(directory, 'spool')
+        replayed_path = os.path.join(directory, 'replayed.txt')
+        child = subprocess.Popen(
+            [sys.executable, '-c', CRASH_SCRIPT, spool_dir, replayed_path, '37'],
+            stdout=subprocess.PIPE, text=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        )
+        acknowledged = []
+        while len(acknowledged) < 300:
+            line = child.stdout.readline()
+            assert line, "子进程提前退出"
+            acknowledged.append(int(line))
+        child.send_signal(signal.SIGKILL)
+        child.wait()
+        acknowledged.extend(int(line) for line in child.stdout.read().split())
+
+        with open(replayed_path) as f:
+            written_before_crash = [int(line) for line in f]
+        segments = sorted(name for name in os.listdir(spool_dir) if name.startswith('segment-'))
+        with open(os.path.join(spool_dir, segments[-1]), 'a') as f:
+            f.write('{"seq": 999999, "ts": 0, "payload": {"symbol": "ZZ')
+        print(f"  崩溃前确认 {len(acknowledged)} 条，已入库 {len(written_before_crash)} 条")
+
+        recovered = []
+
+        async def store(payload):
+            recovered.append(payload['n'])
+            return True
+
+        spool = IngestSpool(spool_dir)
+        await spool.start(store)
+        stats = spool.get_stats()
+        print(f"  恢复 {stats['recovered']} 条待入库数据，截掉 {stats['corrupt_lines']} 行半行数据")
+        await wait_drained(spool)
+        await spool.stop()
+
+        assert written_before_crash == list(range(37))
+        assert recovered == sorted(recovered) and recovered[0] >= 36
+        # 至少一次: 崩溃时正在写入的那一条可能重复
+        assert set(acknowledged) <= set(written_before_crash) | set(recovered)
+        assert len(set(written_before_crash) & set(recovered)) <= 1
+        assert stats['corrupt_lines'] == 1
+
+        # 回放完成后旧分段被删除，再次启动没有需要回放的数据
+        spool = IngestSpool(spool_dir)
+        await spool.start(store)
+        assert spool.depth == 0
+        await spool.stop()
+    print("✅ 已确认的数据没有丢失")
+
+async def test_webhook_endpoint():
+    """webhook写入spool后立即响应，回放任务写入数据库；健康检查包含spool深度"""
+    print("\n=== 测试webhook经spool入库 ===")
+    from api_server import DiscordAPIServer, screener
+    from models import TradingViewData, create_tables, get_db_session
+
+    create_tables()
+    server = DiscordAPIServer(None)
+    await ingest_spool.start(server.process_tradingview_data, is_transient=is_transient_db_error)
+    runner = web.AppRunner(server.app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    try:
+        async with aiohttp.ClientSession() as session:
+            payload = signal_payload('ZZF', pmaText='PMA Bullish', MAtrend='1')
+            async with session.post(f"{url}/webhook/tradingview", json=payload) as response:
+                body = await response.json()
+                assert response.status == 200 and body['spool_seq'] >= 1 and body['symbol'] == 'ZZF'
+            # 无效数据返回400，不写入spool
+            accepted = ingest_spool.accepted
+            async with session.post(f"{url}/webhook/tradingview", json={'pmaText': 'PMA Bullish'}) as response:
+                assert response.status == 400
+            bad_timeframe = signal_payload('ZZF', timeframe='1h')
+            async with session.post(f"{url}/webhook/tradingview", json=bad_timeframe) as response:
+                body = await response.json()
+                assert response.status == 400 and '时间框架' in body['message'], body
+            assert ingest_spool.accepted == accepted
+            # 交易数据入库但不建立选股行
+            trade = {'ticker': 'ZZG', 'action': 'buy', 'takeProfit': {'limitPrice': 200},
+                     'stopLoss': {'stopPrice': 170}, 'extras': {'timeframe': '1h'}}
+            async with session.post(f"{url}/webhook/tradingview", json=trade) as response:
+                assert response.status == 200
+            await wait_drained(ingest_spool)
+            assert [key for key in screener._rows if key[0] in ('ZZF', 'ZZG')] == [('ZZF', '1h')], screener._rows
+            async with session.get(f"{url}/api/health") as response:
+                health = (await response.json())['ingest_spool']
+                print(f"  健康检查: {health}")
+                assert health['running'] and health['depth'] == 0 and health['oldest_age_seconds'] is None
+    finally:
+        await runner.cleanup()
+        await ingest_spool.stop()
+
+    db = get_db_session()
+    try:
+        assert db.query(TradingViewData).filter(TradingViewData.symbol == 'ZZF').count() >= 1
+    finally:
+        db.close()
+
+    # 入库后通知订阅者失败只记录日志，仍返回成功（spool不会把已入库的数据移入死信）
+    class BrokenFanout:
+        def publish(self, *args):
+            raise RuntimeError('订阅通知不可用')
+
+    server.bot = SimpleNamespace(alert_fanout=BrokenFanout())
+    assert await server.process_tradingview_data(signal_payload('ZZH'))
+    print("✅ webhook经spool入库")
+
+if __name__ == "__main__":
+    asyncio.run(test_batching_and_order())
+    asyncio.run(test_outage_backpressure())
+    asyncio.run(test_crash_recovery())
+    asyncio.run(test_webhook_endpoint())
+    print("\n🎉 入库spool测试通过")
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+测试数据库延迟初始化
+导入依赖数据库的模块时不应建立连接，也不应因缺少DATABASE_URL而失败
+"""
+import os
+import time
+
+# 模拟未配置数据库的环境
+os.environ.pop('DATABASE_URL', None)
+
+def test_import_without_database():
+    """导入模块不触发数据库连接"""
+    print("=== 测试导入时不连接数据库 ===")
+
+    started = time.perf_counter()
+    import models
+    import rate_limiter
+    import tradingview_handler
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"模块导入耗时: {elapsed_ms:.0f}ms")
+
+    assert models._engine is None, "导入后不应创建引擎"
+    assert models.get_db_status()['status'] == 'pending'
+    assert models.get_pool_metrics()['checkouts'] == 0
+    print("✅ 导入时未建立数据库连接")
+
+def test_init_db_reports_failure():
+    """显式初始化失败时记录状态而不抛出异常"""
+    print("\n=== 测试init_db失败状态 ===")
+    import models
+
+    assert models.init_db() is False
+    status = models.get_db_status()
+    assert status['status'] == 'error'
+    assert 'DATABASE_URL' in status['error']
+    print(f"✅ 初始化失败已记录: {status['error']}")
+
+if __name__ == "__main__":
+    test_import_without_database()
+    test_init_db_reports_failure()
+    print("\n🎉 数据库延迟初始化测试通过")
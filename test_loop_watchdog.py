@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+测试事件循环卡顿监测
+验证延迟直方图、卡顿时抓取阻塞位置的调用栈，以及空闲时的开销
+"""
+import asyncio
+import time
+
+from loop_watchdog import LoopWatchdog
+
+def blocking_sync_call():
+    """模拟在事件循环中直接执行的同步数据库调用"""
+    time.sleep(0.4)
+
+async def handler_with_blocking_call():
+    blocking_sync_call()
+
+async def test_stall_captured():
+    """卡顿超过阈值时记录阻塞位置"""
+    print("=== 测试卡顿抓取 ===")
+    watchdog = LoopWatchdog(interval_ms=20, threshold_ms=150)
+    await watchdog.start()
+    await asyncio.sleep(0.2)
+
+    await handler_with_blocking_call()
+    await asyncio.sleep(0.1)
+    await watchdog.stop()
+
+    stats = watchdog.get_stats()
+    assert stats['stall_count'] == 1, stats['stall_count']
+    stall = stats['recent_stalls'][0]
+    print(f"  卡顿 {stall['lag_ms']}ms 位置: {stall['location']}")
+    assert stall['resolved'] and stall['lag_ms'] >= 350
+    assert 'test_loop_watchdog.py' in stall['location'] and 'blocking_sync_call' in stall['location']
+    assert any('handler_with_blocking_call' in line for line in stall['stack'])
+    assert stats['max_lag_ms'] >= 350
+    print("✅ 抓到阻塞事件循环的同步调用")
+
+async def test_histogram_and_overhead():
+    """空闲时延迟都落在低延迟桶，监测本身开销很小"""
+    print("\n=== 测试直方图和开销 ===")
+    watchdog = LoopWatchdog(interval_ms=20, threshold_ms=150)
+    cpu_started = time.process_time()
+    await watchdog.start()
+    await asyncio.sleep(1.0)
+    await watchdog.stop()
+    cpu_used = time.process_time() - cpu_started
+
+    stats = watchdog.get_stats()
+    assert stats['samples'] >= 40 and stats['stall_count'] == 0
+    assert sum(stats['histogram'].values()) == stats['samples']
+    assert stats['p99_lag_ms'] <= 25
+    print(f"  直方图: { {bucket: count for bucket, count in stats['histogram'].items() if count} }")
+    print(f"✅ 1秒内 {stats['samples']} 个样本，CPU耗时 {cpu_used * 1000:.1f}ms（20ms间隔，生产默认100ms）")
+
+if __name__ == "__main__":
+    asyncio.run(test_stall_captured())
+    asyncio.run(test_histogram_and_overhead())
+    print("\n🎉 事件循环监测测试通过")
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+测试消息路由
+验证各类消息的路由结果与原on_message的判断顺序一致
+"""
+from types import SimpleNamespace
+
+import message_router
+from message_router import MessageRouter
+
+BOT_ID = 1400000000000000001
+PREDICTION_KEYWORDS = ['预测', 'predict', '趋势', 'trend', '分析', 'analysis', '预测分析', '走势预测']
+ADMIN_COMMANDS = ['!vip_add', '!vip_remove', '!vip_list', '!quota', '!help_admin', '!loop_stats']
+
+class FakeMember(SimpleNamespace):
+    def get_role(self, role_id):
+        return next((role for role in self.roles if role.id == role_id), None)
+
+bot_member = FakeMember(id=BOT_ID, roles=[SimpleNamespace(id=77)])
+guild = SimpleNamespace(id=1, get_member=lambda user_id: bot_member if user_id == BOT_ID else None)
+monitor = SimpleNamespace(id=1404532905916760125, name='charts')
+report = SimpleNamespace(id=2, name='Daily-Report')
+general = SimpleNamespace(id=3, name='general')
+
+def make_message(content, channel=general, mentions=(), role_mentions=(), attachments=(), author_id=42, bot=False):
+    return SimpleNamespace(
+        author=SimpleNamespace(id=author_id, bot=bot), content=content, channel=channel, guild=guild,
+        mentions=list(mentions), role_mentions=list(role_mentions), attachments=list(attachments)
+    )
+
+def make_router(report_channel_ids=()):
+    config = SimpleNamespace(monitor_channel_ids=['1404532905916760125'], report_channel_ids=list(report_channel_ids))
+    router = MessageRouter(config, PREDICTION_KEYWORDS, ADMIN_COMMANDS)
+    router.bind_user(BOT_ID)
+    return router
+
+def test_routes():
+    """各类消息的路由结果"""
+    print("=== 测试路由结果 ===")
+    router = make_router()
+    bot_user = SimpleNamespace(id=BOT_ID)
+    image = SimpleNamespace(filename='chart.PNG', size=1024)
+    cases = [
+        (make_message("AAPL,15m", author_id=BOT_ID), message_router.IGNORE),            # 机器人自己的消息
+        (make_message("!QUOTA"), message_router.ADMIN_COMMAND),
+        (make_message("!cleanup_status"), message_router.COMMAND),
+        (make_message("AAPL,15m"), message_router.IGNORE),                               # 其他频道的普通消息
+        (make_message("AAPL,15m", channel=monitor), message_router.CHART),
+        (make_message("NVDA趋势", channel=monitor), message_router.PREDICTION),
+        (make_message("看图", channel=monitor, attachments=[image]), message_router.CHART_ANALYSIS),
+        (make_message("hello", channel=monitor), message_router.IGNORE),
+        (make_message("随便聊聊", channel=report), message_router.REPORT),
+        (make_message("随便聊聊", channel=report, bot=True), message_router.IGNORE),     # report频道的机器人消息
+        (make_message(f"<@!{BOT_ID}> TSLA,1h", channel=report, bot=True), message_router.MENTION),
+        (make_message(f"<@{BOT_ID}> TSLA,1h"), message_router.CHART),                    # 原始提及格式
+        (make_message("TSLA走势预测", mentions=[bot_user]), message_router.PREDICTION),
+        (make_message("看图", mentions=[bot_user], attachments=[image]), message_router.CHART_ANALYSIS),
+        (make_message("hi", role_mentions=[SimpleNamespace(id=77)]), message_router.MENTION),  # 提及机器人的角色
+        (make_message("hi", role_mentions=[SimpleNamespace(id=78)]), message_router.IGNORE),
+    ]
+    for message, expected in cases:
+        route, _ = router.route(message)
+        print(f"  {message.content!r} #{message.channel.name} -> {route}")
+        assert route == expected, (message.content, route, expected)
+
+    assert router.route(make_message("!cleanup_now 3"))[1] == 'cleanup_now'
+    print("✅ 路由结果正确")
+
+def test_report_channel_ids():
+    """配置了report频道ID时按ID判断，不再看频道名"""
+    print("\n=== 测试report频道ID ===")
+    router = make_router(report_channel_ids=['3'])
+    assert router.is_report_channel(general)
+    assert not router.is_report_channel(report)
+    # 私信频道没有名称
+    assert not make_router().is_report_channel(SimpleNamespace(id=4))
+    print("✅ report频道判断正确")
+
+if __name__ == "__main__":
+    test_routes()
+    test_report_channel_ids()
+    print("\n🎉 消息路由测试通过")
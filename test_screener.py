@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+测试跨股票选股
+验证位图增量维护、筛选条件、排序，以及启动时从数据库加载最新状态
+使用DATABASE_URL指定的数据库，未设置时使用临时目录中的SQLite数据库
+"""
+import asyncio
+import json
+import os
+import threading
+
+from signal_fixtures import signal_payload, use_temp_database
+
+use_temp_database('test_screener.db')
+
+from alert_rules import RuleSyntaxError
+from models import TradingViewData, create_tables, get_db_session
+from screener import SignalScreener, parse_screen_command
+
+def state_signal(symbol, ma=(1, 1, 1), sqz='no squeeze', pma='PMA Bullish', bull=(3, 3), **extra):
+    return signal_payload(
+        symbol, MAtrend=str(ma[0]), MAtrend_timeframe1=str(ma[1]), MAtrend_timeframe2=str(ma[2]),
+        SQZsignal=sqz, pmaText=pma, BullishTrendRating=bull[0], BullishOscRating=bull[1], **extra
+    )
+
+def build():
+    screener = SignalScreener()
+    screener.update('NVDA', '1h', state_signal('NVDA', bull=(5, 4), pma='PMA Strong Bullish'))
+    screener.update('AAPL', '1h', state_signal('AAPL', bull=(2, 3)))
+    screener.update('TSLA', '1h', state_signal('TSLA', sqz='squeeze', bull=(5, 5)))
+    screener.update('AMD', '1h', state_signal('AMD', ma=(1, -1, 1), bull=(4, 1)))
+    screener.update('NVDA', '15m', state_signal('NVDA', bull=(1, 1)))
+    screener.update('MSFT', '1h', state_signal('MSFT', bull=(3, 3)))
+    return screener
+
+def symbols(result):
+    return [item['symbol'] for item in result['results']]
+
+def test_filters():
+    """布尔筛选和排序"""
+    print("=== 测试筛选 ===")
+    screener = build()
+    query = "MAtrend=1 and MAtrend_timeframe1=1 and MAtrend_timeframe2=1 and SQZsignal!=squeeze"
+    result = screener.screen(query, timeframe='1h', sort_by='BullishTrendRating+BullishOscRating')
+    print(f"  {query} -> {symbols(result)}（{result['elapsed_us']}µs）")
+    assert symbols(result) == ['NVDA', 'MSFT', 'AAPL']
+    assert result['results'][0]['sort_value'] == 9 and result['results'][0]['values']['pmaText'] == 'pma strong bullish'
+
+    assert symbols(screener.screen("MAtrend_timeframe1 < 0")) == ['AMD']
+    assert symbols(screener.screen("PMA Strong Bullish or SQZsignal == 'squeeze'", sort_by='BullishOscRating')) == ['TSLA', 'NVDA']
+    assert symbols(screener.screen("not (BullishTrendRating >= 3)", sort_by='BullishTrendRating', ascending=True)) == ['NVDA', 'AAPL']
+    assert screener.screen("BullishTrendRating+BullishOscRating > 8")['matches'] == 2
+    assert screener.screen("", timeframe='15m')['matches'] == 1
+
+    for bad in ("MAtrend", "action == buy", "pmaText > 'x' and", "BullishTrendRating > BBPsignal"):
+        try:
+            screener.screen(bad)
+            raise AssertionError(bad)
+        except RuleSyntaxError as e:
+            print(f"  {bad!r} -> {e}")
+    try:
+        screener.screen("", sort_by='pmaText')
+        raise AssertionError('sort')
+    except RuleSyntaxError:
+        pass
+
+    assert parse_screen_command("1h MAtrend=1 sort=-BullishOscRating") == ('1h', 'MAtrend=1', 'BullishOscRating', True)
+    assert parse_screen_command("all PMA Bullish") == (None, 'PMA Bullish', None, False)
+    print("✅ 筛选和排序正确")
+
+def test_incremental_update():
+    """状态变化时位图移动到新取值，其他字段保持不变"""
+    print("\n=== 测试增量更新 ===")
+    screener = build()
+    assert screener.screen("SQZsignal == squeeze")['matches'] == 1
+    screener.update('TSLA', '1h', {'symbol': 'TSLA', 'SQZsignal': 'no squeeze'})
+    assert screener.screen("SQZsignal == squeeze")['matches'] == 0
+    assert 'squeeze' not in screener.bitsets['sqzsignal']
+    # 只带评级的交易数据不影响分类字段
+    screener.update('TSLA', '1h', {'ticker': 'TSLA', 'action': 'buy', 'BullishTrendRating': 1})
+    tsla = screener.screen("BullishTrendRating == 1 and MAtrend == 1", timeframe='1h')
+    assert symbols(tsla) == ['TSLA']
+    assert len(screener.keys) == 6
+    print("✅ 增量更新正确")
+
+async def test_load_from_database():
+    """启动时每个股票/时间框架只取最新一条信号"""
+    print("\n=== 测试从数据库加载 ===")
+    create_tables()
+    db = get_db_session()
+    try:
+        db.query(TradingViewData).filter(TradingViewData.symbol.in_(['ZZA', 'ZZB'])).delete(synchronize_session=False)
+        for symbol, payload in (('ZZA', state_signal('ZZA', sqz='squeeze')), ('ZZA', state_signal('ZZA')), ('ZZB', state_signal('ZZB', ma=(-1, -1, -1)))):
+            db.add(TradingViewData(symbol=symbol, timeframe='1h', data_type='signal', raw_data=json.dumps(payload)))
+        db.commit()
+    finally:
+        db.close()
+
+    screener = SignalScreener()
+    await screener.load()
+    result = screener.screen("MAtrend == 1 and SQZsignal != squeeze", timeframe='1h')
+    assert 'ZZA' in symbols(result) and 'ZZB' not in symbols(result)
+    print(f"  加载 {screener.get_stats()['rows']} 行")
+
+    # 数据库查询期间入库的新数据（直接更新索引）不被较旧的数据库行覆盖
+    screener = SignalScreener()
+    loop = asyncio.get_running_loop()
+    load_latest = screener._load_latest
+
+    def load_latest_with_live_update():
+        rows = load_latest()
+        applied = threading.Event()
+
+        def live_update():
+            screener.update('ZZB', '1h', state_signal('ZZB'))
+            applied.set()
+
+        loop.call_soon_threadsafe(live_update)
+        applied.wait(5)
+        return rows
+
+    screener._load_latest = load_latest_with_live_update
+    await screener.load()
+    result = screener.screen("MAtrend == 1 and SQZsignal != squeeze", timeframe='1h')
+    assert {'ZZA', 'ZZB'} <= set(symbols(result))
+    print("✅ 加载最新状态")
+
+if __name__ == "__main__":
+    test_filters()
+    test_incremental_update()
+    asyncio.run(test_load_from_database())
+    print("\n🎉 选股测试通过")
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+测试信号差量存储
+验证差量计算/应用、快照间隔、入库后重建完整数据、状态变化历史查询和订阅事件
+使用DATABASE_URL指定的数据库，未设置时使用临时目录中的SQLite数据库
+"""
+import asyncio
+import json
+import os
+
+from signal_fixtures import signal_payload, use_temp_database
+
+use_temp_database('test_signal_deltas.db')
+os.environ['SIGNAL_SNAPSHOT_INTERVAL'] = '3'
+
+from alert_subscriptions import AlertFanout, AlertSubscriptions, parse_subscription_args
+from models import TradingViewData, create_tables, get_db_session
+from screener import SignalScreener
+from signal_deltas import (SignalDeltaTracker, apply_delta, compute_delta, diff_fields, get_signal_changes,
+                           load_full_payloads, signal_deltas)
+from tradingview_handler import TradingViewHandler
+
+def tick_signal(index, **changes):
+    fields = {
+        'pmaText': 'PMA Bullish', 'SQZsignal': 'no squeeze',
+        'MAtrend': '1', 'MAtrend_timeframe1': '1', 'MAtrend_timeframe2': '0', 'CVDsignal': 'cvdAboveMA',
+        'BullishTrendRating': 3, 'BullishOscRating': 2, 'adxValue': f"{25 + index * 0.1:.2f}",
+        'trend_change_volatility_stop': '180.50', 'extras': {'oscrating': 1, 'trendrating': 2},
+        'timestamp': f"2025-01-15T14:{index:02d}:00Z"
+    }
+    fields.update(changes)
+    return signal_payload('ZZD', **fields)
+
+def test_delta_roundtrip():
+    """差量只包含变化和移除的字段，应用后还原"""
+    print("=== 测试差量计算 ===")
+    previous, current = tick_signal(0), tick_signal(1, pmaText='PMA Strong Bullish', CVDsignal=None)
+    delta = compute_delta(previous, current)
+    print(f"  {delta}")
+    assert set(delta['changed']) == {'pmaText', 'adxValue', 'timestamp'} and delta['removed'] == ['CVDsignal']
+    assert apply_delta(previous, delta) == current
+    assert compute_delta(current, current) == {'changed': {}}
+    assert diff_fields(previous, current) == {'pmaText': ('PMA Bullish', 'PMA Strong Bullish'), 'CVDsignal': ('cvdAboveMA', None)}
+    assert set(diff_fields(previous, current, None)) == {'pmaText', 'CVDsignal', 'adxValue', 'timestamp'}
+    print("✅ 差量计算正确")
+
+def test_snapshot_interval():
+    """每个快照后最多N条差量，差量过大时直接写快照"""
+    print("\n=== 测试快照间隔 ===")
+    tracker = SignalDeltaTracker(snapshot_interval=2)
+    kinds = []
+    for index in range(7):
+        payload = tick_signal(index) if index != 5 else {'symbol': 'ZZD', 'note': 'x' * 50}
+        entry = tracker.prepare('ZZD', '1h', payload)
+        tracker.stored(entry, 100 + index)
+        kinds.append('S' if entry['snapshot_id'] is None else f"D{entry['snapshot_id']}")
+    print(f"  {kinds}")
+    assert kinds == ['S', 'D100', 'D100', 'S', 'D103', 'S', 'S']
+    assert tracker.get_stats()['deltas'] == 3
+
+    disabled = SignalDeltaTracker(snapshot_interval=0)
+    for index in range(3):
+        entry = disabled.prepare('ZZD', '1h', tick_signal(index))
+        disabled.stored(entry, index + 1)
+        assert entry['snapshot_id'] is None
+    print("✅ 快照间隔正确")
+
+async def test_store_and_reconstruct():
+    """入库后差量行可以重建为完整数据，读取路径拿到的都是完整数据"""
+    print("\n=== 测试入库和重建 ===")
+    create_tables()
+    db = get_db_session()
+    try:
+        db.query(TradingViewData).filter(TradingViewData.symbol == 'ZZD').delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+    handler = TradingViewHandler()
+    assert handler.store_enhanced_data({'ticker': 'ZZD', 'action': 'buy', 'takeProfit': {'limitPrice': 200},
+                                        'stopLoss': {'stopPrice': 170}, 'extras': {'timeframe': '1h'}})
+    payloads = []
+    for index in range(10):
+        changes = {}
+        if index == 4:
+            changes = {'pmaText': 'PMA Strong Bullish'}
+        elif index >= 6:
+            changes = {'pmaText': 'PMA Strong Bullish', 'SQZsignal': 'squeeze', 'MAtrend_timeframe2': '1'}
+        payloads.append(tick_signal(index, **changes))
+        assert handler.store_enhanced_data(payloads[-1])
+        if index == 4:
+            assert handler.last_changes == {'pmaText': ('PMA Bullish', 'PMA Strong Bullish')}
+
+    db = get_db_session()
+    try:
+        rows = db.query(TradingViewData.id, TradingViewData.snapshot_id, TradingViewData.raw_data, TradingViewData.timeframe).filter(
+            TradingViewData.symbol == 'ZZD', TradingViewData.data_type == 'signal'
+        ).order_by(TradingViewData.id).all()
+        full = sum(len(json.dumps(payload, ensure_ascii=False)) for payload in payloads)
+        stored = sum(len(row.raw_data) for row in rows)
+        print(f"  {len(rows)} 条信号，完整 {full} 字节 -> 存储 {stored} 字节（快照 {sum(row.snapshot_id is None for row in rows)} 条）")
+        assert [row.snapshot_id is None for row in rows] == [True, False, False, False, True, False, False, False, True, False]
+        assert stored < full / 2
+        rebuilt = load_full_payloads(db, [(row.id, row.snapshot_id, row.raw_data) for row in rows])
+        assert [rebuilt[row.id] for row in rows] == payloads
+    finally:
+        db.close()
+
+    # 报告读取的最新数据是重建后的完整数据，数据库中仍是差量
+    timeframe = rows[-1].timeframe
+    latest = handler.get_latest_data('ZZD', timeframe)
+    assert json.loads(latest.raw_data) == payloads[-1] and latest.snapshot_id is None
+    db = get_db_session()
+    try:
+        assert db.query(TradingViewData.snapshot_id).filter(TradingViewData.id == rows[-1].id).scalar() == rows[-1].snapshot_id
+    finally:
+        db.close()
+
+    screener = SignalScreener()
+    await screener.load()
+    assert screener.screen("SQZsignal == squeeze and pmaText == 'PMA Strong Bullish'", timeframe=timeframe)['matches'] >= 1
+
+    history = get_signal_changes('zzd', timeframe)
+    print(f"  状态变化: {history}")
+    assert [set(item['changes']) for item in history] == [{'SQZsignal', 'MAtrend_timeframe2', 'pmaText'}, {'pmaText'}, {'pmaText'}]
+    assert history[2]['changes']['pmaText'] == ['PMA Bullish', 'PMA Strong Bullish']
+    assert get_signal_changes('ZZD', timeframe, limit=4) == history[:1]
+    assert len(get_signal_changes('ZZD', timeframe, fields=None)) == 9
+    print(f"  统计: {signal_deltas.get_stats()}")
+    print("✅ 入库和重建正确")
+
+def test_state_events():
+    """state事件需要显式订阅，私信列出变化的字段"""
+    print("\n=== 测试状态变化事件 ===")
+    assert 'state' not in parse_subscription_args(['NVDA'])[2]
+    assert parse_subscription_args(['NVDA', 'state']) == ('NVDA', '*', ['state'])
+    fanout = AlertFanout(AlertSubscriptions(), None)
+    events = fanout.extract_events(tick_signal(1), 'signal', 'nvda', '1h',
+                                   {'SQZsignal': ('no squeeze', 'squeeze'), 'MAtrend': ('0', '1')})
+    assert [event['event_type'] for event in events] == ['state']
+    print(f"  {events[0]['text']}")
+    assert 'SQZsignal: no squeeze → squeeze' in events[0]['text']
+    assert fanout.extract_events(tick_signal(2), 'signal', 'NVDA', '1h', {}) == []
+    print("✅ 状态变化事件正确")
+
+if __name__ == "__main__":
+    test_delta_roundtrip()
+    test_snapshot_interval()
+    asyncio.run(test_store_and_reconstruct())
+    test_state_events()
+    print("\n🎉 信号差量存储测试通过")
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+测试股票代码注册表
+验证代码规范化（别名、类别股）、校验结果、自由文本中的代码提取和图表命令中的代码校验
+"""
+from chart_service import ChartService
+from symbol_registry import symbol_registry, KNOWN, UNKNOWN, INVALID
+
+class MockConfig:
+    """最小化的配置对象"""
+    layout_id = "test_layout"
+    chart_img_api_key = "test_key"
+    tradingview_session_id = None
+    tradingview_session_id_sign = None
+
+def test_normalize_and_validate():
+    """规范化和校验"""
+    print("=== 测试代码规范化与校验 ===")
+    cases = [
+        ("aapl", KNOWN, "AAPL"),
+        ("NASDAQ:AAPL", KNOWN, "AAPL"),
+        ("BRK.B", KNOWN, "BRK.B"),
+        ("BRK-B", KNOWN, "BRK.B"),
+        ("BRK/B", KNOWN, "BRK.B"),
+        ("BRKB", KNOWN, "BRK.B"),
+        ("FB", KNOWN, "META"),
+        ("IQVIA", KNOWN, "IQV"),
+        ("ZZZZ", UNKNOWN, "ZZZZ"),
+        ("TOOLONG", INVALID, None),
+        ("A1B", INVALID, None),
+        ("FOO:AAPL", INVALID, None),
+    ]
+    for raw, expected_status, expected_symbol in cases:
+        status, symbol = symbol_registry.validate(raw)
+        print(f"  {raw!r} -> {status}, {symbol}")
+        assert (status, symbol) == (expected_status, expected_symbol), raw
+    print(f"✅ 注册表包含 {len(symbol_registry)} 个代码")
+
+def test_resolve():
+    """获取带交易所前缀的代码"""
+    print("\n=== 测试交易所解析 ===")
+    assert symbol_registry.resolve("JPM") == "NYSE:JPM"
+    assert symbol_registry.resolve("brk-b") == "NYSE:BRK.B"
+    assert symbol_registry.resolve("NYSE:AAPL") == "NYSE:AAPL", "用户显式指定的交易所应保留"
+    assert symbol_registry.resolve("ZZZZ") is None
+    print("✅ 交易所解析正确")
+
+def test_find_symbol():
+    """从消息中提取代码"""
+    print("\n=== 测试消息中的代码提取 ===")
+    exclude = {'H', 'M', 'MIN', 'HOUR', 'TREND', 'PREDICT'}
+    cases = [
+        ("AAPL 1h", "AAPL"),
+        ("please give me tsla 15m", "TSLA"),
+        ("<@123456> predict NVDA trend", "NVDA"),
+        ("<@123456> 预测 brk.b 走势", "BRK.B"),
+        ("give me a chart of AAPL", "AAPL"),  # a 也是已知代码（安捷伦），但小写书写
+        ("aapl 1h", "AAPL"),
+        ("SOFI 4h", "SOFI"),  # 不在注册表但以大写书写
+        ("hello there 1h", None),  # 没有代码
+        ("give me a chart", None),  # 单个小写字母不作为代码
+        ("A 1h", "A"),  # 大写书写的单字母已知代码
+    ]
+    for text, expected in cases:
+        result = symbol_registry.find_symbol(text, exclude=exclude)
+        print(f"  {text!r} -> {result}")
+        assert result == expected, text
+    print("✅ 代码提取正确")
+
+def test_chart_command_symbols():
+    """图表命令中的代码与find_symbol规则一致，普通单词在调用chart-img前被拒绝"""
+    print("\n=== 测试图表命令中的代码校验 ===")
+    service = ChartService(MockConfig())
+    cases = [
+        ("AAPL,1h", ("AAPL", ["1h"])),
+        ("nvda 4h", ("NVDA", ["4h"])),           # 小写书写的已知代码
+        ("brk-b,1d", ("BRK.B", ["1d"])),
+        ("SOFI 15m", ("SOFI", ["15m"])),         # 未知代码以大写书写，交由交易所探测
+        ("F 1h", ("F", ["1h"])),                 # 大写书写的单字母已知代码
+        ("give me a 1h chart", None),            # a 是已知代码（安捷伦），但小写书写
+        ("<@123456> a 1h", None),
+        ("wait 5m", None),                       # 小写的未知单词
+        ("meeting in 5m", None),
+        ("B 1h", None),                          # 不在注册表中的单字母
+        ("see you in 5m, AAPL 1h", ("AAPL", ["1h"])),  # 跳过前面的普通单词
+    ]
+    for text, expected in cases:
+        result = service.parse_chart_request(text)
+        print(f"  {text!r} -> {result}")
+        assert result == expected, text
+    print("✅ 图表命令代码校验正确")
+
+if __name__ == "__main__":
+    test_normalize_and_validate()
+    test_resolve()
+    test_find_symbol()
+    test_chart_command_symbols()
+    print("\n🎉 股票代码注册表测试通过")
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+测试webhook发件箱
+使用本地aiohttp服务模拟n8n：验证入队立即返回、失败重试、死信，以及进程重启后继续投递
+"""
+import asyncio
+import os
+import tempfile
+import time
+
+from aiohttp import web
+
+os.environ['WEBHOOK_RETRY_BASE_SECONDS'] = '0.05'
+os.environ['WEBHOOK_MAX_ATTEMPTS'] = '4'
+
+from http_client import http_client
+from webhook_outbox import WebhookOutbox
+
+class FakeN8N:
+    """前几次请求返回503，消息内容为reject时返回400"""
+    def __init__(self, failures):
+        self.failures = failures
+        self.received = []
+
+    async def handle(self, request):
+        body = await request.json()
+        if body.get('content') == 'reject':
+            return web.Response(status=400, text='bad payload')
+        if self.failures > 0:
+            self.failures -= 1
+            return web.Response(status=503, text='busy')
+        self.received.append(body)
+        return web.json_response({'ok': True})
+
+async def start_server(fake):
+    app = web.Application()
+    app.router.add_post('/webhook', fake.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/webhook"
+
+async def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        await asyncio.sleep(0.02)
+    return condition()
+
+async def test_retry_and_dead_letter():
+    """失败重试后投递成功；不可重试的响应移入死信表"""
+    print("=== 测试重试和死信 ===")
+    fake = FakeN8N(failures=2)
+    runner, url = await start_server(fake)
+    with tempfile.TemporaryDirectory() as tmp:
+        outbox = WebhookOutbox(url, path=os.path.join(tmp, 'outbox.db'))
+        settled = {}
+        outbox.on_settled = lambda ids, delivered: settled.update(dict.fromkeys(ids, delivered))
+        await outbox.start()
+
+        started = time.perf_counter()
+        hello_id = await outbox.enqueue({'content': 'hello'})
+        reject_id = await outbox.enqueue({'content': 'reject'})
+        enqueue_ms = (time.perf_counter() - started) * 1000
+        assert enqueue_ms < 200, f"入队应立即返回，实际 {enqueue_ms:.0f}ms"
+
+        assert await wait_until(lambda: outbox.delivered == 1 and outbox.dead_lettered == 1)
+        stats = outbox.get_stats()
+        print(f"  入队耗时 {enqueue_ms:.1f}ms, 统计: {stats}")
+        assert fake.received == [{'content': 'hello'}]
+        assert stats['depth'] == 0 and stats['dead_letters'] == 1 and stats['failed_attempts'] >= 3
+        assert stats['delivery_latency_p50_ms'] is not None
+        assert settled == {hello_id: True, reject_id: False}, settled
+
+        await outbox.stop()
+    await http_client.close()
+    await runner.cleanup()
+    print("✅ 503重试后投递成功，400移入死信表")
+
+async def test_survives_restart():
+    """投递前进程退出，重启后继续投递"""
+    print("\n=== 测试重启后继续投递 ===")
+    fake = FakeN8N(failures=0)
+    runner, url = await start_server(fake)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'outbox.db')
+
+        # 第一个进程：只入队，不启动投递任务
+        first = WebhookOutbox(url, path=path)
+        for index in range(3):
+            await first.enqueue({'content': f'message {index}'})
+        await first.stop()
+
+        # 重启后的进程
+        second = WebhookOutbox(url, path=path)
+        await second.start()
+        assert second.get_stats()['depth'] == 3
+        assert await wait_until(lambda: second.delivered == 3)
+        assert sorted(body['content'] for body in fake.received) == ['message 0', 'message 1', 'message 2']
+        await second.stop()
+    await http_client.close()
+    await runner.cleanup()
+    print("✅ 重启后未投递的3条消息全部送达")
+
+async def test_gzip_batch():
+    """批量投递并以gzip请求体发送"""
+    print("\n=== 测试gzip批量投递 ===")
+    fake = FakeN8N(failures=0)
+    runner, url = await start_server(fake)
+    with tempfile.TemporaryDirectory() as tmp:
+        outbox = WebhookOutbox(url, path=os.path.join(tmp, 'outbox.db'))
+        outbox.batch_size, outbox.workers = 10, 1
+        outbox.gzip_enabled, outbox.gzip_min_bytes = True, 0
+        for index in range(5):
+            await outbox.enqueue({'content': f'消息 {index} ' + 'x' * 500})
+        await outbox.start()
+        assert await wait_until(lambda: outbox.delivered == 5)
+
+        batch = fake.received[0]
+        stats = outbox.get_stats()
+        assert batch['event_type'] == 'discord_mention_batch' and batch['count'] == 5
+        assert [event['content'][:4] for event in batch['events']] == [f'消息 {index}' for index in range(5)]
+        assert stats['requests'] == 1 and stats['bytes_sent'] < 5 * 500
+        print(f"  1次请求投递5条，压缩后 {stats['bytes_sent']} 字节")
+        await outbox.stop()
+    await http_client.close()
+    await runner.cleanup()
+    print("✅ 服务端解压后得到完整的批量事件")
+
+if __name__ == "__main__":
+    asyncio.run(test_retry_and_dead_letter())
+    asyncio.run(test_survives_restart())
+    asyncio.run(test_gzip_batch())
+    print("\n🎉 webhook发件箱测试通过")
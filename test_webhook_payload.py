@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+测试webhook负载投影和静态部分引用
+"""
+from benchmark_webhook_payload import sample_message_data
+from webhook_handler import WebhookHandler
+
+def make_handler(profile, static_refs=False):
+    handler = WebhookHandler('http://localhost/webhook')
+    handler.profile, handler.static_refs = profile, static_refs
+    return handler
+
+def test_profiles():
+    """各档位保留的字段"""
+    print("=== 测试投影档位 ===")
+    message_data = sample_message_data()
+    full = make_handler('full').build_webhook_payload(message_data)
+    standard = make_handler('standard').build_webhook_payload(message_data)
+    minimal = make_handler('minimal').build_webhook_payload(message_data)
+
+    # full与原有负载一致
+    assert 'profile' not in full and full['data']['guild']['active_members']
+    assert full['data']['channel']['permissions']['send_messages'] is True
+
+    # standard去掉活跃成员、频道权限和角色权限
+    assert standard['profile'] == 'standard'
+    assert 'active_members' not in standard['data']['guild']
+    assert 'permissions' not in standard['data']['channel']
+    assert standard['data']['author']['server_info']['roles'][0] == {'id': 1200000000000000000, 'name': '角色0'}
+    assert standard['data']['message'] == full['data']['message']
+
+    # minimal只保留基本信息
+    assert set(minimal['data']['guild']) == {'basic'}
+    assert set(minimal['data']['message']) == {'id', 'content', 'created_at', 'jump_url'}
+    assert 'metadata' not in minimal
+    print("✅ 各档位字段正确")
+
+def test_static_refs():
+    """静态部分首次发送完整内容，投递成功后按版本号引用，版本变化时重新发送"""
+    print("\n=== 测试静态部分引用 ===")
+    handler = make_handler('full', static_refs=True)
+    message_data = sample_message_data()
+
+    full_sections = []
+    first = handler.build_webhook_payload(message_data, full_sections)['data']
+    assert first['guild']['ref'] == {'id': 1, 'version': 12} and 'settings' in first['guild']
+    assert first['channel']['ref'] == {'id': 1404532905916760125, 'version': 42}
+    assert full_sections == [('guild', 1, 12), ('channel', 1404532905916760125, 42)]
+
+    # 第一条还没投递成功（可能在重试或进入死信表），之后的事件仍发送完整内容
+    pending = handler.build_webhook_payload(message_data)['data']
+    assert 'settings' in pending['guild'] and 'details' in pending['channel']
+    handler._awaiting_delivery[7] = full_sections
+    handler._on_outbox_settled([7], False)
+    assert 'settings' in handler.build_webhook_payload(message_data)['data']['guild']
+
+    handler._awaiting_delivery[8] = full_sections
+    handler._on_outbox_settled([8], True)
+    second = handler.build_webhook_payload(message_data)['data']
+    assert second['channel'] == {'ref': {'id': 1404532905916760125, 'version': 42}}
+    assert 'settings' not in second['guild'] and second['guild']['member_stats']['online_members'] == 812
+    assert second['guild']['statistics'] == {'member_count': 5234}
+
+    message_data['guild']['static_version'] = 13
+    third = handler.build_webhook_payload(message_data)['data']
+    assert third['guild']['ref']['version'] == 13 and 'settings' in third['guild']
+    print("✅ 静态部分按版本号引用")
+
+if __name__ == "__main__":
+    test_profiles()
+    test_static_refs()
+    print("\n🎉 webhook负载测试通过")
@@ -7,13 +7,17 @@ import logging
 from datetime import datetime
 from typing import Dict, Any, Optional
 from sqlalchemy.orm import Session
-from models import TradingViewData, get_db_session
+from models import TradingViewData, get_db_session, is_transient_db_error
+from indicator_codes import encode_indicator_states
+from signal_deltas import expand_signal_row, signal_deltas
 
 class TradingViewHandler:
     """TradingView数据处理器类"""
     
     def __init__(self):
         self.logger = logging.getLogger(__name__)
+        # 最近一次存储的信号相对上一条信号变化的分类字段 {字段: (旧值, 新值)}
+        self.last_changes = None
     
     def parse_webhook_data(self, webhook_payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """解析webhook数据，提取TradingView信息"""
@@ -357,7 +361,11 @@ class TradingViewHandler:
         return signals
     
     def store_enhanced_data(self, raw_payload: Dict) -> bool:
-        """存储增强版TradingView数据到数据库 - 支持三种数据类型"""
+        """
+        存储增强版TradingView数据到数据库 - 支持三种数据类型
+
+        数据无效或写入失败时返回False；数据库暂时不可用（is_transient_db_error）时抛出原异常
+        """
         try:
             session = get_db_session()
             
@@ -389,8 +397,25 @@ class TradingViewHandler:
             # 所有数据类型都提取新增的评级字段
             self._extract_rating_fields(tv_data, raw_payload)
             
-            session.add(tv_data)
-            session.commit()
+            # 分类指标状态编码为小整数列
+            self._extract_indicator_states(tv_data, raw_payload)
+            
+            if data_type == 'signal':
+                # 信号数据与上一条比较，只存储变化的字段（定期写完整快照）
+                key = (symbol.upper(), timeframe)
+                with signal_deltas.lock(*key):
+                    entry = signal_deltas.prepare(*key, raw_payload)
+                    tv_data.raw_data = entry['raw_data']
+                    tv_data.snapshot_id = entry['snapshot_id']
+                    session.add(tv_data)
+                    session.flush()
+                    row_id = tv_data.id
+                    session.commit()
+                    signal_deltas.stored(entry, row_id)
+                self.last_changes = entry['changes']
+            else:
+                session.add(tv_data)
+                session.commit()
             session.close()
             
             self.logger.info(f"✅ 成功存储TradingView数据: {data_type}:{symbol}-{timeframe}")
@@ -401,8 +426,33 @@ class TradingViewHandler:
             if 'session' in locals():
                 session.rollback()
                 session.close()
+            # 数据库暂时不可用时抛出，由调用方（入库spool回放）重试；其他错误重试也不会成功
+            if is_transient_db_error(e):
+                raise
             return False
     
+    def validate_payload(self, data: Any) -> Optional[str]:
+        """
+        入库前校验数据（symbol、时间框架能否提取，长度是否符合数据库字段）
+
+        Returns:
+            错误信息，数据有效时返回None
+        """
+        if not isinstance(data, dict):
+            return '数据必须是JSON对象'
+        data_type = self._detect_data_type(data)
+        try:
+            symbol, timeframe = self._extract_basic_info(data, data_type)
+        except (ValueError, TypeError, AttributeError) as e:
+            return f'无效的时间框架: {e}'
+        if not symbol or not isinstance(symbol, str):
+            return '无法提取symbol信息'
+        if len(symbol) > TradingViewData.symbol.type.length:
+            return f'symbol过长: {symbol}'
+        if not isinstance(timeframe, str) or len(timeframe) > TradingViewData.timeframe.type.length:
+            return f'无效的时间框架: {timeframe}'
+        return None
+    
     def _detect_data_type(self, data: Dict) -> str:
         """自动检测数据类型"""
         # 检查是否是平仓数据 (有sentiment: flat)
@@ -498,6 +548,11 @@ class TradingViewHandler:
         tv_data.bearish_trend_rating = self._safe_float(data.get('BearishTrendRating'))
         tv_data.current_timeframe = data.get('Current_timeframe')
     
+    def _extract_indicator_states(self, tv_data, data: Dict):
+        """提取分类指标状态编码 - 只有信号数据包含这些字段，其他类型为空"""
+        for column, code in encode_indicator_states(data).items():
+            setattr(tv_data, column, code)
+    
     def save_to_database(self, parsed_data: Dict[str, Any]) -> bool:
         """保存数据到数据库"""
         db = None
@@ -547,7 +602,7 @@ class TradingViewHandler:
                 TradingViewData.timeframe == timeframe
             ).order_by(TradingViewData.received_at.desc()).first()
             
-            return latest_data
+            return expand_signal_row(db, latest_data)
             
         except Exception as e:
             self.logger.error(f"查询最新TradingView数据失败: {e}")
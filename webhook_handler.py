@@ -6,7 +6,68 @@ Webhook处理器
 import aiohttp
 import asyncio
 import logging
+import os
+import time
 from datetime import datetime
+from http_client import http_client
+from webhook_outbox import WebhookOutbox
+
+# 字段投影配置：True表示保留整个值，字典表示只保留其中的字段（列表按元素投影）
+# full为原有的完整负载
+PAYLOAD_PROFILES = {
+    'minimal': {
+        'timestamp': True,
+        'event_type': True,
+        'version': True,
+        'profile': True,
+        'data': {
+            'message': {'id': True, 'content': True, 'created_at': True, 'jump_url': True},
+            'channel': {'basic': True, 'ref': True},
+            'guild': {'basic': True, 'ref': True},
+            'author': {'basic': True},
+            'attachments': {'filename': True, 'url': True, 'content_type': True},
+            'mentions': {'id': True, 'name': True}
+        }
+    },
+    'standard': {
+        'timestamp': True,
+        'event_type': True,
+        'version': True,
+        'profile': True,
+        'data': {
+            'message': True,
+            'channel': {'basic': True, 'details': True, 'category': True, 'ref': True,
+                        'member_info': {'count': True}},
+            'guild': {'basic': True, 'statistics': True, 'member_stats': True, 'ref': True},
+            'author': {
+                'basic': True,
+                'profile': {'avatar_url': True},
+                'server_info': {'joined_server_at': True, 'roles': {'id': True, 'name': True}}
+            },
+            'attachments': True,
+            'embeds': True,
+            'mentions': True,
+            'stats': True
+        },
+        'metadata': {'version': True, 'processed_at': True}
+    },
+    'full': None
+}
+
+# 引用方式发送时服务器信息中仍需每次发送的动态字段
+GUILD_DYNAMIC_KEYS = ('active_members', 'member_stats')
+
+
+def project_payload(value, spec):
+    """按投影配置裁剪负载"""
+    if spec is True or spec is None:
+        return value
+    if isinstance(value, list):
+        return [project_payload(item, spec) for item in value]
+    if isinstance(value, dict):
+        return {key: project_payload(value[key], sub_spec) for key, sub_spec in spec.items() if key in value}
+    return value
+
 
 class WebhookHandler:
     """Webhook处理器类"""
@@ -18,31 +79,60 @@ class WebhookHandler:
         self.timeout = timeout
         self.logger = logging.getLogger(__name__)
         
+        # 负载配置：字段投影档位，以及服务器/频道静态部分是否按版本号引用发送
+        self.profile = os.getenv('WEBHOOK_PAYLOAD_PROFILE', 'full').lower()
+        if self.profile not in PAYLOAD_PROFILES:
+            self.logger.warning(f"未知的WEBHOOK_PAYLOAD_PROFILE: {self.profile}，使用full")
+            self.profile = 'full'
+        self.static_refs = os.getenv('WEBHOOK_STATIC_REFS', 'false').lower() in ('1', 'true', 'yes')
+        self.static_refresh_seconds = float(os.getenv('WEBHOOK_STATIC_REFRESH_SECONDS', '3600'))
+        # (类型, ID) -> (接收端已收到完整内容的版本, 投递时间)
+        self._sent_static_versions = {}
+        # 发件箱消息ID -> 该消息中以完整内容发送的静态部分 [(类型, ID, 版本)]，投递成功后才记为已发送
+        self._awaiting_delivery = {}
+        self.outbox = WebhookOutbox(webhook_url)  # 持久化发件箱，后台异步投递
+        self.outbox.on_settled = self._on_outbox_settled
+        
+    async def enqueue_message(self, message_data):
+        """写入发件箱后立即返回，由后台投递任务发送（失败重试、进程重启后继续投递）"""
+        try:
+            full_sections = []
+            message_id = await self.outbox.enqueue(self.build_webhook_payload(message_data, full_sections))
+            if full_sections:
+                self._awaiting_delivery[message_id] = full_sections
+            self.logger.info(f'消息已写入webhook发件箱: {message_id}')
+            return True
+        except Exception as e:
+            self.logger.error(f'写入webhook发件箱失败: {e}')
+            return False
+        
     async def send_message(self, message_data):
-        """发送消息到webhook"""
+        """直接发送消息到webhook（同步等待结果，含重试）"""
         for attempt in range(self.max_retries):
             try:
-                async with aiohttp.ClientSession() as session:
-                    # 构建webhook负载
-                    payload = self.build_webhook_payload(message_data)
+                # 构建webhook负载
+                full_sections = []
+                payload = self.build_webhook_payload(message_data, full_sections)
+                
+                # 发送请求（共享会话，重试时复用已建立的连接）
+                session = http_client.get_session()
+                async with session.post(
+                    self.webhook_url,
+                    json=payload,
+                    timeout=http_client.timeout('webhook', total=self.timeout)
+                ) as response:
                     
-                    # 发送请求
-                    async with session.post(
-                        self.webhook_url,
-                        json=payload,
-                        timeout=aiohttp.ClientTimeout(total=self.timeout)
-                    ) as response:
+                    if response.status == 200:
+                        self.logger.info(f'成功发送webhook消息 (尝试 {attempt + 1})')
+                        self.mark_static_delivered(full_sections)
+                        return True
+                    else:
+                        error_text = await response.text()
+                        self.logger.warning(
+                            f'Webhook请求失败 (尝试 {attempt + 1}): '
+                            f'状态码 {response.status}, 响应: {error_text}'
+                        )
                         
-                        if response.status == 200:
-                            self.logger.info(f'成功发送webhook消息 (尝试 {attempt + 1})')
-                            return True
-                        else:
-                            error_text = await response.text()
-                            self.logger.warning(
-                                f'Webhook请求失败 (尝试 {attempt + 1}): '
-                                f'状态码 {response.status}, 响应: {error_text}'
-                            )
-                            
             except asyncio.TimeoutError:
                 self.logger.warning(f'Webhook请求超时 (尝试 {attempt + 1})')
             except aiohttp.ClientError as e:
@@ -59,8 +149,13 @@ class WebhookHandler:
         self.logger.error(f'Webhook发送失败，已尝试 {self.max_retries} 次')
         return False
         
-    def build_webhook_payload(self, message_data):
-        """构建详细的webhook负载"""
+    def build_webhook_payload(self, message_data, full_sections=None):
+        """
+        构建详细的webhook负载
+        
+        Args:
+            full_sections: 开启静态引用时，以完整内容发送的静态部分追加到此列表（投递成功后传给mark_static_delivered）
+        """
         # 格式化消息内容
         content_preview = self.truncate_text(message_data.get('content', ''), 100)
         
@@ -101,8 +196,59 @@ class WebhookHandler:
             'mention_count': len(message_data.get('mentions', []))
         }
         
+        if self.static_refs:
+            self.apply_static_refs(payload['data'], message_data, full_sections)
+        
+        if self.profile != 'full':
+            payload['profile'] = self.profile
+            payload = project_payload(payload, PAYLOAD_PROFILES[self.profile])
+        
         return payload
     
+    def apply_static_refs(self, data, message_data, full_sections=None):
+        """
+        服务器/频道的静态部分按版本号引用发送
+        版本变化、首次发送或超过刷新间隔时发送完整内容并附带版本号，接收端按 (ID, 版本) 缓存；
+        接收端确认收到该版本的完整内容后（投递成功），其余情况只发送 {'ref': {'id', 'version'}} 和服务器的动态字段。
+        完整内容还在发件箱中重试时继续发送完整内容，接收端不会收到未见过的版本引用
+        """
+        guild_data = message_data.get('guild') or {}
+        channel_data = message_data.get('channel') or {}
+        sections = (
+            ('guild', guild_data.get('id'), guild_data.get('static_version'), GUILD_DYNAMIC_KEYS),
+            ('channel', channel_data.get('id'), channel_data.get('snapshot_version'), ())
+        )
+        now = time.monotonic()
+        for kind, section_id, version, dynamic_keys in sections:
+            if section_id is None or version is None or not data.get(kind):
+                continue
+            ref = {'id': section_id, 'version': version}
+            sent = self._sent_static_versions.get((kind, section_id))
+            if sent is None or sent[0] != version or now - sent[1] > self.static_refresh_seconds:
+                data[kind]['ref'] = ref
+                if full_sections is not None:
+                    full_sections.append((kind, section_id, version))
+                continue
+            section = {'ref': ref}
+            for key in dynamic_keys:
+                section[key] = data[kind].get(key)
+            if kind == 'guild':
+                section['statistics'] = {'member_count': data[kind].get('statistics', {}).get('member_count')}
+            data[kind] = section
+    
+    def mark_static_delivered(self, full_sections):
+        """记录接收端已收到这些静态部分的完整内容，之后的事件可以只发送引用"""
+        now = time.monotonic()
+        for kind, section_id, version in full_sections:
+            self._sent_static_versions[(kind, section_id)] = (version, now)
+    
+    def _on_outbox_settled(self, ids, delivered):
+        """发件箱投递结果：投递成功的消息中的完整静态部分记为已发送，移入死信表的丢弃"""
+        for message_id in ids:
+            full_sections = self._awaiting_delivery.pop(message_id, None)
+            if full_sections and delivered:
+                self.mark_static_delivered(full_sections)
+    
     def format_channel_info(self, channel_data):
         """格式化频道信息用于webhook"""
         if not channel_data:
@@ -212,21 +358,21 @@ class WebhookHandler:
         }
         
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    self.webhook_url,
-                    json=test_payload,
-                    timeout=aiohttp.ClientTimeout(total=self.timeout)
-                ) as response:
+            session = http_client.get_session()
+            async with session.post(
+                self.webhook_url,
+                json=test_payload,
+                timeout=http_client.timeout('webhook', total=self.timeout)
+            ) as response:
+                
+                if response.status == 200:
+                    self.logger.info('Webhook测试成功')
+                    return True
+                else:
+                    error_text = await response.text()
+                    self.logger.error(f'Webhook测试失败: {response.status} - {error_text}')
+                    return False
                     
-                    if response.status == 200:
-                        self.logger.info('Webhook测试成功')
-                        return True
-                    else:
-                        error_text = await response.text()
-                        self.logger.error(f'Webhook测试失败: {response.status} - {error_text}')
-                        return False
-                        
         except Exception as e:
             self.logger.error(f'Webhook测试异常: {e}')
             return False
@@ -0,0 +1,338 @@
+"""
+Webhook发件箱
+@提及转发先写入本地SQLite发件箱后立即返回，由后台投递任务通过共享HTTP会话发送到webhook（n8n）。
+发送失败按带抖动的指数退避重试，超过最大次数或遇到不可重试的响应时移入死信表；
+进程重启后未投递的消息会继续投递。投递任务领取消息时把下次尝试时间推后一个租期，
+投递中途进程退出的消息在租期到后重新投递
+"""
+
+import asyncio
+import gzip
+import json
+import logging
+import os
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import aiohttp
+
+from http_client import http_client
+from retry_backoff import backoff_delay
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_outbox_next_attempt ON outbox (next_attempt_at);
+CREATE TABLE IF NOT EXISTS dead_letter (
+    id INTEGER PRIMARY KEY,
+    payload TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_error TEXT,
+    failed_at REAL NOT NULL
+);
+"""
+
+# 这些4xx状态码表示请求本身有问题，重试也不会成功
+PERMANENT_STATUSES = frozenset({400, 401, 403, 404, 405, 410, 413, 422})
+
+
+class WebhookOutbox:
+    """持久化的webhook发件箱和投递任务"""
+
+    def __init__(self, webhook_url: str, path: Optional[str] = None):
+        """
+        Args:
+            webhook_url: 投递目标
+            path: SQLite文件路径，默认WEBHOOK_OUTBOX_PATH
+        """
+        self.webhook_url = webhook_url
+        self.logger = logging.getLogger(__name__)
+        self.path = path or os.getenv('WEBHOOK_OUTBOX_PATH', 'webhook_outbox.db')
+        self.workers = int(os.getenv('WEBHOOK_OUTBOX_WORKERS', '2'))
+        # n8n默认每次请求处理一条事件；接收端支持批量时可调大
+        self.batch_size = max(1, int(os.getenv('WEBHOOK_BATCH_SIZE', '1')))
+        self.max_attempts = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', '8'))
+        self.retry_base = float(os.getenv('WEBHOOK_RETRY_BASE_SECONDS', '2'))
+        self.retry_max = float(os.getenv('WEBHOOK_RETRY_MAX_SECONDS', '300'))
+        self.lease_seconds = float(os.getenv('WEBHOOK_LEASE_SECONDS', '120'))
+        # 接收端支持Content-Encoding: gzip时可开启
+        self.gzip_enabled = os.getenv('WEBHOOK_GZIP', 'false').lower() in ('1', 'true', 'yes')
+        self.gzip_min_bytes = int(os.getenv('WEBHOOK_GZIP_MIN_BYTES', '1024'))
+
+        # SQLite连接只在这一个线程中使用，所有读写串行执行
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='webhook-outbox')
+        self._conn = None
+        self._wakeup = None
+        self._tasks: List[asyncio.Task] = []
+        # 投递结果回调 (消息ID列表, 是否投递成功)；移入死信表时以False调用
+        self.on_settled: Optional[Callable[[List[int], bool], None]] = None
+
+        # 统计
+        self.depth = 0
+        self.dead_letters = 0
+        self.enqueued = 0
+        self.delivered = 0
+        self.failed_attempts = 0
+        self.dead_lettered = 0
+        self.requests = 0
+        self.bytes_sent = 0
+        self.latencies = deque(maxlen=500)          # 入队到投递成功（秒）
+        self.request_times = deque(maxlen=500)      # 单次HTTP请求耗时（秒）
+
+    # ---- SQLite（在发件箱线程中执行） ----
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _open(self):
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+        depth = self._conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        dead = self._conn.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+        return depth, dead
+
+    def _insert(self, payload_json: str, now: float) -> int:
+        cursor = self._conn.execute(
+            "INSERT INTO outbox (payload, created_at, next_attempt_at) VALUES (?, ?, ?)",
+            (payload_json, now, now)
+        )
+        return cursor.lastrowid
+
+    def _claim(self, limit: int, now: float) -> List[tuple]:
+        """领取到期的消息并把下次尝试时间推后一个租期（串行执行，不会被两个投递任务同时领取）"""
+        rows = self._conn.execute(
+            "SELECT id, payload, created_at, attempts FROM outbox WHERE next_attempt_at <= ? ORDER BY id LIMIT ?",
+            (now, limit)
+        ).fetchall()
+        if rows:
+            self._conn.executemany(
+                "UPDATE outbox SET next_attempt_at = ? WHERE id = ?",
+                [(now + self.lease_seconds, row[0]) for row in rows]
+            )
+        return rows
+
+    def _next_due(self) -> Optional[float]:
+        row = self._conn.execute("SELECT MIN(next_attempt_at) FROM outbox").fetchone()
+        return row[0] if row else None
+
+    def _delete(self, ids: List[int]):
+        self._conn.executemany("DELETE FROM outbox WHERE id = ?", [(message_id,) for message_id in ids])
+
+    def _reschedule(self, ids: List[int], attempts: List[int], next_attempts: List[float], error: str):
+        self._conn.executemany(
+            "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+            [(count, next_at, error, message_id) for message_id, count, next_at in zip(ids, attempts, next_attempts)]
+        )
+
+    def _move_to_dead_letter(self, rows: List[tuple], error: str, now: float):
+        self._conn.execute("BEGIN")
+        try:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO dead_letter (id, payload, created_at, attempts, last_error, failed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(message_id, payload, created_at, attempts, error, now)
+                 for message_id, payload, created_at, attempts in rows]
+            )
+            self._delete([row[0] for row in rows])
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # ---- 入队 ----
+
+    async def enqueue(self, payload: Dict[str, Any]) -> int:
+        """写入发件箱后立即返回消息ID，由投递任务异步发送"""
+        if self._conn is None:
+            self.depth, self.dead_letters = await self._run(self._open)
+        message_id = await self._run(self._insert, json.dumps(payload, ensure_ascii=False), time.time())
+        self.enqueued += 1
+        self.depth += 1
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return message_id
+
+    # ---- 投递 ----
+
+    async def start(self):
+        """打开发件箱并启动投递任务（上次未投递的消息会继续投递）"""
+        if self._tasks:
+            return
+        self.depth, self.dead_letters = await self._run(self._open)
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker(index)) for index in range(self.workers)]
+        self.logger.info(f"Webhook发件箱已启动: {self.path}, 待投递 {self.depth} 条, 死信 {self.dead_letters} 条")
+
+    async def stop(self):
+        """停止投递任务（未投递的消息保留在发件箱中）"""
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        await self._run(self._close)
+
+    async def _worker(self, index: int):
+        """投递任务：领取到期的消息，没有时等待新消息或下一条到期"""
+        while True:
+            try:
+                # 先清除唤醒标记再查询，查询期间入队的消息不会错过
+                self._wakeup.clear()
+                rows = await self._run(self._claim, self.batch_size, time.time())
+                if rows:
+                    await self._deliver(rows)
+                    continue
+
+                next_due = await self._run(self._next_due)
+                timeout = 5.0 if next_due is None else min(max(next_due - time.time(), 0.05), 5.0)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                self.logger.error(f"Webhook投递任务 {index} 发生错误: {e}")
+                await asyncio.sleep(1)
+
+    def _build_body(self, rows: List[tuple]) -> bytes:
+        """单条消息原样发送；批量时包装为一个事件列表（直接拼接已序列化的JSON，不重新编码）"""
+        if len(rows) == 1:
+            body = rows[0][1]
+        else:
+            body = (f'{{"event_type": "discord_mention_batch", "count": {len(rows)}, "events": ['
+                    + ', '.join(row[1] for row in rows) + ']}')
+        return body.encode('utf-8')
+
+    async def _post(self, body: bytes):
+        """
+        发送一次请求（开启压缩且超过阈值时以gzip请求体发送）
+
+        Returns:
+            (是否成功, 是否可重试, 错误描述)
+        """
+        headers = {'Content-Type': 'application/json'}
+        if self.gzip_enabled and len(body) >= self.gzip_min_bytes:
+            body = gzip.compress(body, compresslevel=6)
+            headers['Content-Encoding'] = 'gzip'
+        self.bytes_sent += len(body)
+
+        started = time.perf_counter()
+        self.requests += 1
+        try:
+            session = http_client.get_session()
+            async with session.post(self.webhook_url, data=body, headers=headers,
+                                    timeout=http_client.timeout('webhook')) as response:
+                if 200 <= response.status < 300:
+                    return True, False, None
+                error_text = (await response.text())[:200]
+                return False, response.status not in PERMANENT_STATUSES, f"状态码 {response.status}: {error_text}"
+        except asyncio.TimeoutError:
+            return False, True, "请求超时"
+        except aiohttp.ClientError as e:
+            return False, True, f"客户端错误: {e}"
+        except Exception as e:
+            return False, True, f"请求异常: {e}"
+        finally:
+            self.request_times.append(time.perf_counter() - started)
+
+    async def _deliver(self, rows: List[tuple]):
+        ok, retryable, error = await self._post(self._build_body(rows))
+        now = time.time()
+        ids = [row[0] for row in rows]
+
+        if ok:
+            await self._run(self._delete, ids)
+            self.delivered += len(rows)
+            self.depth -= len(rows)
+            self.latencies.extend(now - row[2] for row in rows)
+            self.logger.info(f"成功投递webhook消息 {len(rows)} 条")
+            self._notify_settled(ids, True)
+            return
+
+        self.failed_attempts += 1
+        attempts = [row[3] + 1 for row in rows]
+        if not retryable or max(attempts) >= self.max_attempts:
+            dead_rows = [(row[0], row[1], row[2], count) for row, count in zip(rows, attempts)]
+            await self._run(self._move_to_dead_letter, dead_rows, error, now)
+            self.dead_lettered += len(rows)
+            self.dead_letters += len(rows)
+            self.depth -= len(rows)
+            self.logger.error(f"Webhook消息投递失败，已移入死信表: {ids} ({error})")
+            self._notify_settled(ids, False)
+            return
+
+        next_attempts = [now + self._backoff(count) for count in attempts]
+        await self._run(self._reschedule, ids, attempts, next_attempts, error)
+        self.logger.warning(
+            f"Webhook投递失败 (第 {max(attempts)} 次): {error}，{next_attempts[0] - now:.1f} 秒后重试"
+        )
+
+    def _notify_settled(self, ids: List[int], delivered: bool):
+        if self.on_settled is None:
+            return
+        try:
+            self.on_settled(ids, delivered)
+        except Exception as e:
+            self.logger.error(f"Webhook投递结果回调失败: {e}")
+
+    def _backoff(self, attempts: int) -> float:
+        """带等抖动的指数退避"""
+        return backoff_delay(attempts, self.retry_base, self.retry_max)
+
+    # ---- 统计 ----
+
+    @staticmethod
+    def _percentile(values, fraction: float) -> Optional[float]:
+        if not values:
+            return None
+        ordered = sorted(values)
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] * 1000, 1)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取发件箱统计"""
+        return {
+            'running': bool(self._tasks),
+            'workers': self.workers,
+            'batch_size': self.batch_size,
+            'depth': self.depth,
+            'dead_letters': self.dead_letters,
+            'enqueued': self.enqueued,
+            'delivered': self.delivered,
+            'failed_attempts': self.failed_attempts,
+            'dead_lettered': self.dead_lettered,
+            'requests': self.requests,
+            'gzip': self.gzip_enabled,
+            'bytes_sent': self.bytes_sent,
+            'avg_request_bytes': round(self.bytes_sent / self.requests) if self.requests else 0,
+            'delivery_latency_p50_ms': self._percentile(self.latencies, 0.5),
+            'delivery_latency_p95_ms': self._percentile(self.latencies, 0.95),
+            'request_p50_ms': self._percentile(self.request_times, 0.5),
+            'request_p95_ms': self._percentile(self.request_times, 0.95)
+        }